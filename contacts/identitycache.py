@@ -56,6 +56,8 @@ from lib import net_misc
 
 from userid import identity
 
+from crypt import key
+
 from contacts import identitydb
 
 #------------------------------------------------------------------------------
@@ -78,11 +80,14 @@ def init():
         # TODO: added settings here
         identitydb.clear()
     identitydb.init()
+    identitydb.AddCacheUpdatedCallback(_on_identity_cache_updated)
 
 
 def shutdown():
     if _Debug:
         lg.out(4, 'identitycache.shutdown')
+    identitydb.RemoveCacheUpdatedCallback(_on_identity_cache_updated)
+    key.ForgetAllPublicKeys()
 
 #------------------------------------------------------------------------------
 
@@ -295,6 +300,25 @@ def ReadOverriddenIdentityXMLSource(idurl):
 #------------------------------------------------------------------------------
 
 
+def _on_identity_cache_updated(cache_ids, cache, single_item):
+    """
+    Parsed public keys are cached in ``crypt.key``, need to forget old key
+    when identity was changed or removed.
+    """
+    if single_item is None:
+        key.ForgetAllPublicKeys(exclude_idurls=cache.keys())
+        return
+    _, idurl, id_obj = single_item
+    if idurl is not None:
+        key.RememberPublicKey(idurl, id_obj.publickey)
+        return
+    for known_idurl in key.PublicKeysCacheIDURLs():
+        if known_idurl not in cache:
+            key.ForgetPublicKey(known_idurl)
+
+#------------------------------------------------------------------------------
+
+
 def getPageSuccess(src, idurl):
     """
     This is called when requested identity source gets received.
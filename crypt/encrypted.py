@@ -122,13 +122,21 @@ class Block:
             self.SessionKeyType = key.SessionKeyType()
         self.Length = len(Data)
         self.LastBlock = bool(LastBlock)
-        self.EncryptedData = key.EncryptWithSessionKey(SessionKey, Data)  # DataLonger
+        self.EncryptedData = key.EncryptWithSessionKey(SessionKey, Data, self.SessionKeyType)  # DataLonger
         self.Signature = None
         self.Sign()
         self.DecryptKey = DecryptKey
         if _Debug:
             lg.out(_DebugLevel, 'new data in %s' % self)
 
+    def __setattr__(self, name, value):
+        """
+        Any change of the data fields drops remembered hash.
+        """
+        self.__dict__[name] = value
+        if name not in ('_hash', 'Signature', 'DecryptKey', ):
+            self.__dict__['_hash'] = None
+
     def __repr__(self):
         return 'encrypted_block (BackupID=%s BlockNumber=%s Length=%s LastBlock=%s)' % (str(self.BackupID), str(self.BlockNumber), str(self.Length), self.LastBlock)
 
@@ -147,27 +155,40 @@ class Block:
             return my_keys.decrypt(self.DecryptKey, self.EncryptedSessionKey)
         return key.DecryptLocalPrivateKey(self.EncryptedSessionKey)
 
-    def GenerateHashBase(self):
-        """
-        Generate a single string with all data fields, used to create a hash
-        for that ``encrypted_block``.
+    def GenerateHashParts(self):
+        """
+        Return a list of strings with all data fields, used to create a hash
+        for that ``encrypted_block``, EncryptedData is not copied.
         """
         sep = "::::"
-        StringToHash = self.CreatorID
-        StringToHash += sep + self.BackupID
-        StringToHash += sep + str(self.BlockNumber)
-        StringToHash += sep + self.SessionKeyType
-        StringToHash += sep + self.EncryptedSessionKey
-        StringToHash += sep + str(self.Length)
-        StringToHash += sep + str(self.LastBlock)
-        StringToHash += sep + self.EncryptedData
-        return StringToHash
+        return [
+            self.CreatorID,
+            sep, self.BackupID,
+            sep, str(self.BlockNumber),
+            sep, self.SessionKeyType,
+            sep, self.EncryptedSessionKey,
+            sep, str(self.Length),
+            sep, str(self.LastBlock),
+            sep, self.EncryptedData,
+        ]
+
+    def GenerateHashBase(self):
+        """
+        Generate a single string with all data fields.
+        """
+        return ''.join(self.GenerateHashParts())
 
     def GenerateHash(self):
-        """
-        Create a hash for that ``encrypted_block`` using ``crypt.key.Hash()``.
         """
-        return key.Hash(self.GenerateHashBase())
+        Create a hash for that ``encrypted_block`` using ``crypt.key.HashParts()``.
+
+        Result is remembered until any of the fields is changed.
+        """
+        _hash = self.__dict__.get('_hash')
+        if _hash is None:
+            _hash = key.HashParts(self.GenerateHashParts())
+            self.__dict__['_hash'] = _hash
+        return _hash
 
     def Sign(self):
         """
@@ -209,19 +230,27 @@ class Block:
         Return an original data, decrypt using ``EnctryptedData`` and
         ``EncryptedSessionKey``.
         """
+        return ''.join(self.DataChunks())
+
+    def DataChunks(self, chunk_size=key.STREAM_CHUNK_SIZE):
+        """
+        Generator, same as ``Data()`` but yields decrypted data in pieces,
+        so only one piece is kept in memory at once.
+        """
         SessionKey = self.SessionKey()
-        ClearLongData = key.DecryptWithSessionKey(SessionKey, self.EncryptedData)
-        return ClearLongData[0:self.Length]    # remove padding
+        return key.DecryptWithSessionKeyChunks(
+            SessionKey, self.EncryptedData, self.SessionKeyType, length=int(self.Length), chunk_size=chunk_size)
 
     def Serialize(self):
         """
         Create a string that stores all data fields of that ``encrypted.Block``
         object.
         """
-        decrypt_key = getattr(self, 'DecryptKey')
-        delattr(self, 'DecryptKey')
+        decrypt_key = self.__dict__.pop('DecryptKey', None)
+        _hash = self.__dict__.pop('_hash', None)
         e = misc.ObjectToString(self)
-        setattr(self, 'DecryptKey', decrypt_key)
+        self.__dict__['DecryptKey'] = decrypt_key
+        self.__dict__['_hash'] = _hash
         return e
 
 #------------------------------------------------------------------------------
@@ -233,4 +262,6 @@ def Unserialize(data, decrypt_key=None):
     """
     newobject = misc.StringToObject(data)
     setattr(newobject, 'DecryptKey', decrypt_key)
+    # never trust a hash which came from outside
+    newobject.__dict__['_hash'] = None
     return newobject
@@ -47,11 +47,15 @@ import os
 import sys
 import random
 import hashlib
+import threading
+
+from collections import OrderedDict
 
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import DES3
 from Crypto.Cipher import AES
 from Crypto.Cipher import Blowfish
+from Crypto.Util import Counter
 
 import warnings
 warnings.filterwarnings('ignore', category=DeprecationWarning)
@@ -79,6 +83,19 @@ from main import settings
 _MyRsaKey = None
 _MyKeyObject = None
 
+_PublicKeysCache = OrderedDict()
+_PublicKeysByIDURL = {}
+_PublicKeysCacheLock = threading.Lock()
+_PublicKeysCacheStats = {'hits': 0, 'misses': 0, }
+
+PUBLIC_KEYS_CACHE_SIZE = 1000  # parsed public keys to keep in memory
+
+#------------------------------------------------------------------------------
+
+STREAM_SESSION_KEY_TYPE = 'AES-CTR-1'  # AES in counter mode, data is not padded
+STREAM_NONCE_SIZE = 8  # random nonce in front of encrypted data, other 8 bytes of the counter block are counting
+STREAM_CHUNK_SIZE = 1024 * 1024  # bytes encrypted or decrypted at once, must be a multiple of 16
+
 #------------------------------------------------------------------------------
 
 
@@ -233,7 +250,7 @@ def VerifySignature(pubkeystring, hashcode, signature):
     Return True if signature is correct, otherwise False.
     """
     # key is public key in string format
-    keyobj = keys.Key.fromString(pubkeystring).keyObject
+    keyobj = PublicKeyObject(pubkeystring)
     # needs to be a long in a list
     sig_long = long(signature),
     Result = bool(keyobj.verify(hashcode, sig_long))
@@ -247,12 +264,100 @@ def Verify(ConIdentity, hashcode, signature):
     :param ConIdentity: user's identity object'.
     """
     pubkey = ConIdentity.publickey
+    RememberPublicKey(ConIdentity.getIDURL(), pubkey)
     Result = VerifySignature(pubkey, hashcode, signature)
     return Result
 
 #------------------------------------------------------------------------------
 
 
+def PublicKeyObject(pubkeystring):
+    """
+    Return parsed public key object for given openssh string, recently used
+    keys are kept in the memory, so every packet do not need to parse it again.
+
+    Method is thread safe, see ``signed.ValidateMany()``.
+    """
+    global _PublicKeysCache
+    with _PublicKeysCacheLock:
+        keyobj = _PublicKeysCache.pop(pubkeystring, None)
+        if keyobj is not None:
+            _PublicKeysCache[pubkeystring] = keyobj
+            _PublicKeysCacheStats['hits'] += 1
+            return keyobj
+        _PublicKeysCacheStats['misses'] += 1
+    keyobj = keys.Key.fromString(pubkeystring).keyObject
+    with _PublicKeysCacheLock:
+        _PublicKeysCache[pubkeystring] = keyobj
+        while len(_PublicKeysCache) > PUBLIC_KEYS_CACHE_SIZE:
+            _PublicKeysCache.popitem(last=False)
+    return keyobj
+
+
+def RememberPublicKey(idurl, pubkeystring):
+    """
+    Keep track which public key belongs to given user, so it can be removed
+    from the cache when identity is changed, see ``ForgetPublicKey()``.
+    """
+    if not idurl:
+        return
+    with _PublicKeysCacheLock:
+        old_pubkey = _PublicKeysByIDURL.get(idurl)
+        _PublicKeysByIDURL[idurl] = pubkeystring
+        if old_pubkey is not None and old_pubkey != pubkeystring:
+            _PublicKeysCache.pop(old_pubkey, None)
+
+
+def ForgetPublicKey(idurl):
+    """
+    Remove public key of given user from the cache.
+    """
+    with _PublicKeysCacheLock:
+        pubkeystring = _PublicKeysByIDURL.pop(idurl, None)
+        if pubkeystring is not None:
+            _PublicKeysCache.pop(pubkeystring, None)
+    return pubkeystring is not None
+
+
+def ForgetAllPublicKeys(exclude_idurls=None):
+    """
+    Clear the cache, public keys of users from ``exclude_idurls`` are kept.
+    """
+    exclude_idurls = set(exclude_idurls or [])
+    for idurl in PublicKeysCacheIDURLs():
+        if idurl not in exclude_idurls:
+            ForgetPublicKey(idurl)
+    if not exclude_idurls:
+        with _PublicKeysCacheLock:
+            _PublicKeysCache.clear()
+
+
+def PublicKeysCacheIDURLs():
+    """
+    Return a list of users with public key in the cache.
+    """
+    with _PublicKeysCacheLock:
+        return list(_PublicKeysByIDURL.keys())
+
+
+def PublicKeysCacheStats():
+    """
+    Return a dictionary with size of the cache and number of hits and misses.
+    """
+    with _PublicKeysCacheLock:
+        hits = _PublicKeysCacheStats['hits']
+        misses = _PublicKeysCacheStats['misses']
+        size = len(_PublicKeysCache)
+    return {
+        'size': size,
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': (float(hits) / (hits + misses)) if (hits + misses) else 0.0,
+    }
+
+#------------------------------------------------------------------------------
+
+
 def HashMD5(inp, hexdigest=False):
     """
     Use MD5 method to calculate the hash of ``inp`` string.
@@ -292,17 +397,40 @@ def Hash(inp, hexdigest=False):
     # return HashMD5(inp)
     return HashSHA(inp, hexdigest=hexdigest)
 
+
+def HashParts(parts, hexdigest=False):
+    """
+    Same as ``Hash()`` but takes a sequence of strings and feed them one by one
+    into the hasher, so result is equal to ``Hash(''.join(parts))``
+    but no big string is created in memory.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(part)
+    if hexdigest:
+        return h.hexdigest()
+    return h.digest()
+
 #------------------------------------------------------------------------------
 
 
 def SessionKeyType():
-    """
-    Which crypto is used for session key.
+    """
+    Which crypto is used for session key, all nodes can decrypt that.
     """
     # return "AES"
     return 'DES3'
 
 
+def StreamSessionKeyType():
+    """
+    Faster crypto for session key which can process data in chunks, see
+    ``EncryptWithSessionKeyChunks()``. Nodes running older software
+    can not decrypt it, so it is used for our own data.
+    """
+    return STREAM_SESSION_KEY_TYPE
+
+
 def NewSessionKey():
     """
     Return really random string for making equivalent DES3 objects when needed.
@@ -313,14 +441,16 @@ def NewSessionKey():
 #------------------------------------------------------------------------------
 
 
-def DecryptWithSessionKey(rand24, inp, session_key_type=SessionKeyType()):
+def DecryptWithSessionKey(rand24, inp, session_key_type=SessionKeyType()):
     """
     Decrypt string with given session key.
 
     :param rand24: a session key comes with the message in encrypted form
     :param inp: input string to encrypt
-    """
-    if session_key_type == 'DES3':
+    """
+    if session_key_type == STREAM_SESSION_KEY_TYPE:
+        ret = ''.join(DecryptWithSessionKeyChunks(rand24, inp, session_key_type))
+    elif session_key_type == 'DES3':
         SessionKey = DES3.new(rand24)
         ret = SessionKey.decrypt(inp)
     elif session_key_type == 'AES':
@@ -336,8 +466,10 @@ def EncryptWithSessionKey(session_key, inp, session_key_type=SessionKeyType()):
 
     :param session_key: randomly generated session key
     :param inp: input string to encrypt
-    """
-    if session_key_type == 'DES3':
+    """
+    if session_key_type == STREAM_SESSION_KEY_TYPE:
+        ret = ''.join(EncryptWithSessionKeyChunks(session_key, inp, session_key_type))
+    elif session_key_type == 'DES3':
         SessionKey = DES3.new(session_key)
         from lib import misc
         data = misc.RoundupString(inp, 24)
@@ -356,6 +488,57 @@ def EncryptWithSessionKey(session_key, inp, session_key_type=SessionKeyType()):
         ret = ''
     return ret
 
+
+def _stream_cipher(session_key, nonce):
+    return AES.new(session_key, AES.MODE_CTR, counter=Counter.new(64, prefix=nonce, initial_value=0))
+
+
+def EncryptWithSessionKeyChunks(session_key, inp, session_key_type=StreamSessionKeyType(), chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generator, yields encrypted pieces of the input string, only one piece
+    is kept in memory at once. Joined together they are same as output of
+    ``EncryptWithSessionKey()``.
+
+    For "AES-CTR-1" the first piece is a random nonce and data is not padded.
+    """
+    if session_key_type != STREAM_SESSION_KEY_TYPE:
+        yield EncryptWithSessionKey(session_key, inp, session_key_type)
+        return
+    nonce = os.urandom(STREAM_NONCE_SIZE)
+    yield nonce
+    cipher = _stream_cipher(session_key, nonce)
+    for pos in xrange(0, len(inp), chunk_size):
+        yield cipher.encrypt(inp[pos:pos + chunk_size])
+
+
+def DecryptWithSessionKeyChunks(session_key, inp, session_key_type=StreamSessionKeyType(), length=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generator, yields decrypted pieces of the input string.
+
+    If ``length`` is given padding is not returned. Old "DES3" and "AES"
+    data is also decrypted in chunks, because those ciphers work in ECB mode.
+    """
+    if session_key_type == STREAM_SESSION_KEY_TYPE:
+        cipher = _stream_cipher(session_key, inp[:STREAM_NONCE_SIZE])
+        start = STREAM_NONCE_SIZE
+    elif session_key_type == 'DES3':
+        cipher = DES3.new(session_key)
+        start = 0
+    elif session_key_type == 'AES':
+        cipher = AES.new(session_key)
+        start = 0
+    else:
+        raise ValueError('unknown session key type: %r' % session_key_type)
+    left = length
+    for pos in xrange(start, len(inp), chunk_size):
+        if left is not None and left <= 0:
+            break
+        chunk = cipher.decrypt(inp[pos:pos + chunk_size])
+        if left is not None:
+            chunk = chunk[:left]
+            left -= len(chunk)
+        yield chunk
+
 #------------------------------------------------------------------------------
 
 def EncryptOpenSSHPublicKey(openssh_string_public, inp):
@@ -454,6 +637,21 @@ def SpeedTest():
         print '.',
     print time.time() - dt, 'seconds'
 
+    dataSZ = 1024 * 1024 * 16
+    Data = os.urandom(dataSZ)
+    SessionKey = NewSessionKey()
+    for session_key_type in (SessionKeyType(), StreamSessionKeyType(), ):
+        dt = time.time()
+        EncryptedData = ''.join(EncryptWithSessionKeyChunks(SessionKey, Data, session_key_type))
+        encrypt_time = time.time() - dt
+        dt = time.time()
+        newData = ''.join(DecryptWithSessionKeyChunks(SessionKey, EncryptedData, session_key_type, length=len(Data)))
+        decrypt_time = time.time() - dt
+        if newData != Data:
+            raise Exception
+        print '%s: encrypt %.1f MB/s, decrypt %.1f MB/s' % (
+            session_key_type, dataSZ / 1048576.0 / encrypt_time, dataSZ / 1048576.0 / decrypt_time)
+
 #------------------------------------------------------------------------------
 
 
@@ -40,6 +40,15 @@ Packet Fields are all strings (no integers, objects, etc)
     - RemoteID : want full IDURL for other party so troublemaker could not
                 use his packets to mess up other nodes by sending it to them
     - Signature : signature on Hash is always by CreatorID
+
+Binary wire format (version 1), all integers are 4 bytes big-endian:
+
+    "BDPK" | version (1 byte) | 8 x (length, field) | payload length | payload
+
+Header fields go in order: Command, OwnerID, CreatorID, PacketID, Date,
+RemoteID, KeyID, Signature. Payload is always the tail of the string, so
+headers can be parsed without touching the payload at all.
+Packets serialized with pickle by older versions are still accepted by ``Unserialize()``.
 """
 
 #------------------------------------------------------------------------------
@@ -52,11 +61,15 @@ _DebugLevel = 10
 import os
 import sys
 
+import new
 import types
+import time
+import struct
 import datetime
 
 from twisted.internet import threads
 from twisted.internet.defer import Deferred
+from twisted.internet.defer import DeferredList
 
 #------------------------------------------------------------------------------
 
@@ -80,6 +93,20 @@ from userid import my_id
 
 #------------------------------------------------------------------------------
 
+PACKET_MAGIC = 'BDPK'
+PACKET_VERSION = 1
+PACKET_HEADER_FIELDS = ('Command', 'OwnerID', 'CreatorID', 'PacketID', 'Date', 'RemoteID', 'KeyID', 'Signature', )
+
+_LengthFormat = '>I'
+_LengthSize = struct.calcsize(_LengthFormat)
+_PrefixSize = len(PACKET_MAGIC) + 1
+
+VALIDATE_BATCH_SIZE = 50  # packets verified in one thread of the pool, see ValidateMany()
+
+_VerifyStats = {'verified': 0, 'failed': 0, 'total_time': 0.0, 'max_time': 0.0, }
+
+#------------------------------------------------------------------------------
+
 
 class Packet:
     """
@@ -128,6 +155,17 @@ class Packet:
         # stores list of related objects packet_in() or packet_out()
         self.Packets = []
 
+    def __setattr__(self, name, value):
+        """
+        Any change of the packet fields drops cached serialized form.
+        """
+        self.__dict__[name] = value
+        if name in ('Packets', '_serialized', '_hash', ):
+            return
+        self.__dict__['_serialized'] = None
+        if name != 'Signature':
+            self.__dict__['_hash'] = None
+
     def __repr__(self):
         args = '%s(%s)' % (str(self.Command), str(self.PacketID))
         if _Debug:
@@ -147,42 +185,51 @@ class Packet:
         self.Signature = self.GenerateSignature()
         return self
 
-    def GenerateHashBase(self):
-        """
-        This make a long string containing all needed fields of ``packet``
-        (without Signature).
-
-        Just to be able to generate a hash of the whole packet .
+    def GenerateHashParts(self):
+        """
+        Return a list of strings with all needed fields of ``packet``
+        (without Signature), Payload is not copied.
+
+        Just to be able to generate a hash of the whole packet .
         """
         sep = "-"
-        stufftosum = ""
-        try:
-            stufftosum += str(self.Command)
-            stufftosum += sep
-            stufftosum += str(self.OwnerID)
-            stufftosum += sep
-            stufftosum += str(self.CreatorID)
-            stufftosum += sep
-            stufftosum += str(self.PacketID)
-            stufftosum += sep
-            stufftosum += str(self.Date)
-            stufftosum += sep
-            stufftosum += self.Payload
-            stufftosum += sep
-            stufftosum += str(self.RemoteID)
-            if self.KeyID:
-                stufftosum += sep
-                stufftosum += str(self.KeyID)
-        except Exception as exc:
-            lg.exc()
-            raise exc
-        return stufftosum
+        parts = [
+            str(self.Command), sep,
+            str(self.OwnerID), sep,
+            str(self.CreatorID), sep,
+            str(self.PacketID), sep,
+            str(self.Date), sep,
+            self.Payload, sep,
+            str(self.RemoteID),
+        ]
+        if self.KeyID:
+            parts.append(sep)
+            parts.append(str(self.KeyID))
+        return parts
+
+    def GenerateHashBase(self):
+        """
+        This make a long string containing all needed fields of ``packet``
+        (without Signature).
+        """
+        return ''.join(self.GenerateHashParts())
 
     def GenerateHash(self):
-        """
-        Call ``crypt.key.Hash`` to create a hash code for that ``packet``.
         """
-        return key.Hash(self.GenerateHashBase())
+        Call ``crypt.key.HashParts`` to create a hash code for that ``packet``.
+
+        Result is remembered until any of the fields is changed, so sign and
+        verify of same packet do not read the Payload twice.
+        """
+        _hash = self.__dict__.get('_hash')
+        if _hash is None:
+            try:
+                _hash = key.HashParts(self.GenerateHashParts())
+            except Exception as exc:
+                lg.exc()
+                raise exc
+            self.__dict__['_hash'] = _hash
+        return _hash
 
     def GenerateSignature(self):
         """
@@ -206,7 +253,9 @@ class Packet:
         if ConIdentity is None:
             lg.out(1, "signed.SignatureChecksOut ERROR could not get Identity for " + self.CreatorID + " so returning False")
             return False
+        dt = time.time()
         Result = key.Verify(ConIdentity, self.GenerateHash(), self.Signature)
+        _count_verify(Result, time.time() - dt)
         return Result
 
     def Ready(self):
@@ -261,24 +310,26 @@ class Packet:
         return packetid.SupplierNumber(self.PacketID)
 
     def Serialize(self):
-        """
-        Create a string from packet object using ``lib.misc.ObjectToString``.
-
-        This is useful when need to save the packet on disk.
         """
-        if hasattr(self, 'Packets'):
-            currentPackets = getattr(self, 'Packets')
-            delattr(self, 'Packets')
-        else:
-            currentPackets = []
-        src = misc.ObjectToString(self)
-        setattr(self, 'Packets', currentPackets)
-        # lg.out(10, 'signed.Serialize %d bytes, type is %s' % (len(src), str(type(src))))
+        Create a string from packet object in binary format, see ``SerializeHeaders()``.
+
+        Result is cached until any of the packet fields is changed.
+        This is useful when need to save the packet on disk.
+        """
+        src = self.__dict__.get('_serialized')
+        if src is None:
+            payload = self.Payload or ''
+            src = ''.join((
+                SerializeHeaders(self),
+                struct.pack(_LengthFormat, len(payload)),
+                payload,
+            ))
+            self.__dict__['_serialized'] = src
         return src
 
     def __len__(self):
-        """
-        Return a length of serialized packet .
+        """
+        Return a length of serialized packet .
         """
         return len(self.Serialize())
 
@@ -292,18 +343,95 @@ class PacketZeroSigned(Packet):
         return '0'
 
 
-def Unserialize(data):
+def SerializeHeaders(packet):
+    """
+    Return binary header of the packet: magic, version and all fields except Payload.
+    """
+    out = [PACKET_MAGIC, chr(PACKET_VERSION), ]
+    for field in PACKET_HEADER_FIELDS:
+        value = getattr(packet, field, None)
+        value = '' if value is None else str(value)
+        out.append(struct.pack(_LengthFormat, len(value)))
+        out.append(value)
+    return ''.join(out)
+
+
+def IsBinaryPacket(data):
+    """
+    Return True if given string starts with binary packet signature.
+    """
+    return data[:len(PACKET_MAGIC)] == PACKET_MAGIC
+
+
+def UnserializeHeaders(data):
+    """
+    Parse only header fields of binary packet, payload is not copied.
+
+    Return tuple (fields, payload_offset, payload_length) or None if packet is
+    not valid, ``fields`` is a dictionary with all fields except Payload.
+    """
+    try:
+        if not IsBinaryPacket(data):
+            return None
+        version = ord(data[len(PACKET_MAGIC)])
+        if version != PACKET_VERSION:
+            lg.warn('unknown packet version: %d' % version)
+            return None
+        pos = _PrefixSize
+        fields = {}
+        for field in PACKET_HEADER_FIELDS:
+            length = struct.unpack_from(_LengthFormat, data, pos)[0]
+            pos += _LengthSize
+            if pos + length > len(data):
+                lg.warn('packet is too short, field %s truncated' % field)
+                return None
+            fields[field] = data[pos:pos + length]
+            pos += length
+        payload_length = struct.unpack_from(_LengthFormat, data, pos)[0]
+        pos += _LengthSize
+        if pos + payload_length != len(data):
+            lg.warn('payload length do not match: %d != %d' % (payload_length, len(data) - pos))
+            return None
+    except:
+        lg.exc()
+        return None
+    if not fields['KeyID']:
+        fields['KeyID'] = None
+    if not fields['Signature']:
+        fields['Signature'] = None
+    return fields, pos, payload_length
+
+
+def Unserialize(data):
     """
-    We expect here a string containing a whole packet object in text form. Here
-    is used a special libraries in ``twisted.spread``: ``banana`` and ``jelly``
-    to do that work. This stuff is placed in the ``lib.misc.StringToObject``.
+    We expect here a string containing a whole packet in binary form, see ``Packet.Serialize()``.
+    Packets in old format are passed to ``Unserialize_old()``.
     So return a real object in the memory from given string.
 
     All class fields are loaded, signature can be verified to be sure - it was  truly original string.
-    """
-    if data is None:
-        return None
-    # lg.out(10, 'signed.Unserialize %d bytes, type is %s' % (len(data), str(type(data))))
+    """
+    if data is None:
+        return None
+    if not IsBinaryPacket(data):
+        return Unserialize_old(data)
+    result = UnserializeHeaders(data)
+    if result is None:
+        return None
+    fields, payload_offset, _ = result
+    fields['Payload'] = data[payload_offset:]
+    fields['Packets'] = []
+    fields['_serialized'] = data
+    return new.instance(Packet, fields)
+
+
+def Unserialize_old(data):
+    """
+    Read packet serialized with ``lib.misc.ObjectToString``, older software
+    versions were using that method.
+    """
+    if data is None:
+        return None
+    # lg.out(10, 'signed.Unserialize %d bytes, type is %s' % (len(data), str(type(data))))
     newobject = misc.StringToObject(data)
     if newobject is None:
         lg.warn("result is None")
@@ -318,9 +446,104 @@ def Unserialize(data):
         setattr(newobject, 'KeyID', None)
     if not hasattr(newobject, 'Packets'):
         setattr(newobject, 'Packets', [])
+    newobject.__dict__['_serialized'] = None
+    # never trust a hash which came from outside
+    newobject.__dict__['_hash'] = None
     return newobject
 
 
+def ValidateMany(packets, batch_size=VALIDATE_BATCH_SIZE):
+    """
+    Same as ``Packet.Valid()`` for many packets at once, signatures are
+    verified in the threads pool, ``batch_size`` packets per thread.
+
+    Identities are taken from ``contactsdb`` here in the main thread.
+    Return Deferred object, it will be fired with a list of True/False values,
+    one for every packet in ``packets``.
+    """
+    results = [False, ] * len(packets)
+    jobs = []
+    for pos, packet in enumerate(packets):
+        if not packet.Ready():
+            lg.out(4, "signed.ValidateMany packet is not ready yet " + str(packet))
+            continue
+        if not commands.IsCommand(packet.Command):
+            lg.warn("signed.ValidateMany bad Command " + str(packet.Command))
+            continue
+        ConIdentity = contactsdb.get_contact_identity(packet.CreatorID)
+        if ConIdentity is None:
+            lg.out(1, "signed.ValidateMany ERROR could not get Identity for " + packet.CreatorID)
+            continue
+        key.RememberPublicKey(ConIdentity.getIDURL(), ConIdentity.publickey)
+        jobs.append((pos, packet, ConIdentity.publickey, ))
+    dl = []
+    for i in xrange(0, len(jobs), batch_size):
+        dl.append(threads.deferToThread(_verify_batch, jobs[i:i + batch_size]))
+    result = Deferred()
+
+    def _on_done(batches):
+        for success, batch_results in batches:
+            if not success:
+                lg.warn('failed to verify packets: %r' % batch_results)
+                continue
+            for pos, ok, verify_time in batch_results:
+                results[pos] = ok
+                _count_verify(ok, verify_time)
+        invalid = results.count(False)
+        if invalid:
+            lg.warn("signed.ValidateMany %d of %d packets are NOT VALID" % (invalid, len(results)))
+        if _Debug:
+            lg.out(_DebugLevel, 'signed.ValidateMany %d packets in %d batches, %r' % (len(packets), len(dl), VerifyStats()))
+        result.callback(results)
+        return None
+
+    DeferredList(dl, consumeErrors=True).addCallback(_on_done)
+    return result
+
+
+def _verify_batch(jobs):
+    """
+    Executed in a separate thread, see ``ValidateMany()``.
+    """
+    out = []
+    for pos, packet, pubkey in jobs:
+        dt = time.time()
+        try:
+            ok = key.VerifySignature(pubkey, packet.GenerateHash(), packet.Signature)
+        except:
+            lg.exc()
+            ok = False
+        out.append((pos, ok, time.time() - dt, ))
+    return out
+
+
+def _count_verify(ok, verify_time):
+    global _VerifyStats
+    if ok:
+        _VerifyStats['verified'] += 1
+    else:
+        _VerifyStats['failed'] += 1
+    _VerifyStats['total_time'] += verify_time
+    _VerifyStats['max_time'] = max(_VerifyStats['max_time'], verify_time)
+
+
+def VerifyStats():
+    """
+    Return a dictionary with number of verified signatures, average and max
+    verify time in seconds and info about parsed public keys cache.
+    """
+    total = _VerifyStats['verified'] + _VerifyStats['failed']
+    return {
+        'verified': _VerifyStats['verified'],
+        'failed': _VerifyStats['failed'],
+        'avg_time': (_VerifyStats['total_time'] / total) if total else 0.0,
+        'max_time': _VerifyStats['max_time'],
+        'keys_cache': key.PublicKeysCacheStats(),
+    }
+
+#------------------------------------------------------------------------------
+
+
 def MakePacket(Command, OwnerID, CreatorID, PacketID, Payload, RemoteID):
     """
     Just calls the constructor of packet class.
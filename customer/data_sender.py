@@ -36,7 +36,8 @@
 A state machine to manage data sending process, acts very simple:
     1) when new local data is created it tries to send it to the correct supplier
     2) wait while ``p2p.io_throttle`` is doing some data transmission to remote suppliers
-    3) calls ``p2p.backup_matrix.ScanBlocksToSend()`` to get a list of pieces needs to be send
+    3) calls ``storage.backup_matrix.GetBlocksToSend()`` to get a list of pieces needs to be send,
+       those are updated incrementally, so only pending pieces are checked during every scan
     4) this machine is restarted every minute to check if some more data needs to be send
     5) also can be restarted at any time when it is needed
 
@@ -102,6 +103,14 @@ def A(event=None, arg=None):
     return _DataSender
 
 
+def scan_statistic():
+    """
+    Return a dictionary with number of scans, total time spent and number of
+    queued packets, also values for the latest scan.
+    """
+    return dict(A().scanStatistic)
+
+
 def Destroy():
     """
     Destroy the state machine and remove the instance from memory.
@@ -127,6 +136,14 @@ class DataSender(automat.Automat):
 
     def init(self):
         self.log_transitions = _Debug
+        self.scanStatistic = {
+            'scans': 0,
+            'time': 0.0,
+            'queued': 0,
+            'last_time': 0.0,
+            'last_checked': 0,
+            'last_queued': 0,
+        }
 
     def state_changed(self, oldstate, newstate, event, arg):
         global_state.set_global_state('DATASEND ' + newstate)
@@ -174,12 +191,15 @@ class DataSender(automat.Automat):
                 log.flush()
                 log.close()
             return
+        scan_started = time.time()
+        checked = 0
+        queued = 0
         for customer_idurl in contactsdb.known_customers():
             if '' not in contactsdb.suppliers(customer_idurl):
                 from storage import backup_matrix
                 for backupID in misc.sorted_backup_ids(
                         backup_matrix.local_files().keys(), True):
-                    packetsBySupplier = backup_matrix.ScanBlocksToSend(backupID)
+                    packetsBySupplier = backup_matrix.GetBlocksToSend(backupID)
                     if _Debug:
                         log.write('%s\n' % packetsBySupplier)
                     for supplierNum in packetsBySupplier.keys():
@@ -188,6 +208,7 @@ class DataSender(automat.Automat):
                             lg.warn('?supplierNum? %s for %s' % (supplierNum, backupID))
                             continue
                         for packetID in packetsBySupplier[supplierNum]:
+                            checked += 1
                             backupID_, _, supplierNum_, _ = packetid.BidBnSnDp(packetID)
                             if backupID_ != backupID:
                                 lg.warn('?backupID? %s for %s' % (packetID, backupID))
@@ -227,6 +248,7 @@ class DataSender(automat.Automat):
                                 self._packetAcked,
                                 self._packetFailed,
                             ):
+                                queued += 1
                                 if _Debug:
                                     log.write('io_throttle.QueueSendFile %s\n' % packetID)
                             else:
@@ -236,6 +258,7 @@ class DataSender(automat.Automat):
                             # DEBUG
                             # break
 
+        self._count_scan(time.time() - scan_started, checked, queued)
         self.automat('scan-done')
         if _Debug:
             log.flush()
@@ -315,6 +338,17 @@ class DataSender(automat.Automat):
             lg.out(_DebugLevel, '    %d files were removed' % count)
         backup_matrix.ReadLocalFiles()
 
+    def _count_scan(self, dt, checked, queued):
+        self.scanStatistic['scans'] += 1
+        self.scanStatistic['time'] += dt
+        self.scanStatistic['queued'] += queued
+        self.scanStatistic['last_time'] = dt
+        self.scanStatistic['last_checked'] = checked
+        self.scanStatistic['last_queued'] = queued
+        if _Debug:
+            lg.out(_DebugLevel, 'data_sender.doScanAndQueue finished in %.4f sec, %d packets checked, %d queued' % (
+                dt, checked, queued))
+
     def _packetAcked(self, packet, ownerID, packetID):
         from storage import backup_matrix
         backupID, blockNum, supplierNum, dataORparity = packetid.BidBnSnDp(packetID)
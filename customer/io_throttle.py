@@ -191,6 +191,13 @@ def DeleteBackupRequests(backupName):
     return throttle().DeleteBackupRequests(backupName)
 
 
+def DeleteRequests(packetIDs):
+    """
+    Remove given packets from all request queues and cancel outgoing "Retrieve" packets.
+    """
+    throttle().DeleteRequests(packetIDs)
+
+
 def DeleteSuppliers(suppliers_IDURLs):
     """
     Erase the whole queue with this peer and remove him from throttle()
@@ -255,6 +262,14 @@ def GetSendQueueLength(supplierIDURL):
 def GetRequestQueueLength(supplierIDURL):
     return throttle().GetRequestQueueLength(supplierIDURL)
 
+
+def GetRequestStats(supplierIDURL):
+    """
+    Return info about requests made to given supplier: average response time,
+    number of received and failed packets and current queue length.
+    """
+    return throttle().GetRequestStats(supplierIDURL)
+
 #------------------------------------------------------------------------------
 
 
@@ -359,6 +374,12 @@ class SupplierQueue:
         self.ackedCount = 0
         self.failedCount = 0
 
+        # history of requests to that supplier, used to plan restores
+        self.requestLatency = None
+        self.requestBytesPerSec = None
+        self.requestReceivedCount = 0
+        self.requestFailedCount = 0
+
         self.sendFailedPacketIDs = []
         self.requestFailedPacketIDs = []
 
@@ -764,6 +785,51 @@ class SupplierQueue:
     def GetRequestQueueLength(self):
         return len(self.fileRequestQueue)
 
+    def GetRequestStats(self):
+        return {
+            'latency': self.requestLatency,
+            'bps': self.requestBytesPerSec,
+            'received': self.requestReceivedCount,
+            'failed': self.requestFailedCount,
+            'queue': len(self.fileRequestQueue),
+        }
+
+    def CountRequestResult(self, fileRequest, newpacket=None):
+        if newpacket is None:
+            self.requestFailedCount += 1
+            return
+        self.requestReceivedCount += 1
+        if fileRequest.requestTime is None:
+            return
+        dt = max(0.001, fileRequest.fileReceivedTime - fileRequest.requestTime)
+        bps = len(newpacket.Payload) / dt
+        if self.requestLatency is None:
+            self.requestLatency = dt
+            self.requestBytesPerSec = bps
+        else:
+            self.requestLatency = 0.8 * self.requestLatency + 0.2 * dt
+            self.requestBytesPerSec = 0.8 * self.requestBytesPerSec + 0.2 * bps
+
+    def DeleteRequests(self, packetIDs):
+        if self.shutdown:
+            return
+        packetsToRemove = set()
+        for packetID in packetIDs:
+            if packetID in self.fileRequestDict:
+                packetsToRemove.add(packetID)
+        for packetID in packetsToRemove:
+            if packetID in self.fileRequestQueue:
+                self.fileRequestQueue.remove(packetID)
+            del self.fileRequestDict[packetID]
+            for pkt_out, _ in packet_out.search_many(command=commands.Retrieve(), packet_id=packetID):
+                lg.warn('sending "cancel" to %s' % pkt_out)
+                pkt_out.automat('cancel')
+            if _Debug:
+                lg.out(_DebugLevel, "io_throttle.DeleteRequests removed %s from %s receiving queue, %d more items" % (
+                    packetID, self.remoteName, len(self.fileRequestQueue)))
+        if packetsToRemove and len(self.fileRequestQueue) > 0:
+            reactor.callLater(0, self.DoRequest)
+
     def OnFileSendAckReceived(self, newpacket, info):
         if self.shutdown:
             if _Debug:
@@ -861,12 +927,14 @@ class SupplierQueue:
             if packetID in self.fileRequestDict:
                 self.fileRequestDict[packetID].fileReceivedTime = time.time()
                 self.fileRequestDict[packetID].result = 'received'
+                self.CountRequestResult(self.fileRequestDict[packetID], newpacket)
                 for callBack in self.fileRequestDict[packetID].callOnReceived:
                     callBack(newpacket, 'received')
         elif newpacket.Command == commands.Fail():
             if packetID in self.fileRequestDict:
                 self.fileRequestDict[packetID].fileReceivedTime = time.time()
                 self.fileRequestDict[packetID].result = 'failed'
+                self.CountRequestResult(self.fileRequestDict[packetID])
                 for callBack in self.fileRequestDict[packetID].callOnReceived:
                     callBack(newpacket, 'failed')
         else:
@@ -899,6 +967,8 @@ class SupplierQueue:
         if packetID in self.fileRequestDict:
             self.fileRequestDict[packetID].fileReceivedTime = time.time()
             self.fileRequestDict[packetID].result = why or 'failed'
+            if why != 'exist':
+                self.CountRequestResult(self.fileRequestDict[packetID])
             for callBack in self.fileRequestDict[packetID].callOnReceived:
                 callBack(packetID, why or 'failed')
             del self.fileRequestDict[packetID]
@@ -945,6 +1015,10 @@ class IOThrottle:
         for supplierIdentity in self.supplierQueues.keys():
             self.supplierQueues[supplierIdentity].DeleteBackupRequests(backupName)
 
+    def DeleteRequests(self, packetIDs):
+        for supplierIdentity in self.supplierQueues.keys():
+            self.supplierQueues[supplierIdentity].DeleteRequests(packetIDs)
+
     def QueueSendFile(self, fileName, packetID, remoteID, ownerID, callOnAck=None, callOnFail=None):
         #out(10, "io_throttle.QueueSendFile %s to %s" % (packetID, nameurl.GetName(remoteID)))
         if not os.path.exists(fileName):
@@ -1092,6 +1166,14 @@ class IOThrottle:
             return 0
         return self.supplierQueues[supplierIDURL].GetRequestQueueLength()
 
+    def GetRequestStats(self, supplierIDURL):
+        """
+        Return history of requests to given user, None if we did not request anything yet.
+        """
+        if supplierIDURL not in self.supplierQueues:
+            return None
+        return self.supplierQueues[supplierIDURL].GetRequestStats()
+
     def GetSendQueueLength(self, supplierIDURL):
         """
         Return number of packets sent to this guy.
@@ -168,12 +168,18 @@ class ListFilesOrator(automat.Automat):
     def doRequestRemoteFiles(self, arg):
         global _RequestedListFilesCounter
         global _RequestedListFilesPacketIDs
+        from main import settings
+        from storage import backup_matrix
+        from supplier import list_files
         _RequestedListFilesCounter = 0
         _RequestedListFilesPacketIDs.clear()
         for idurl in contactsdb.suppliers():
             if idurl:
                 if contact_status.isOnline(idurl):
-                    p2p_service.SendListFiles(idurl)
+                    since = None
+                    if settings.getListFilesRevisionsEnabled():
+                        since = list_files.RequestSince(backup_matrix.ReadLatestRawListFile(idurl)) or list_files.REVISION_TOKEN
+                    p2p_service.SendListFiles(idurl, since=since)
                     _RequestedListFilesPacketIDs.add(idurl)
                 else:
                     lg.out(6, 'list_files_orator.doRequestRemoteFiles SKIP %s is not online' % idurl)
@@ -355,6 +355,7 @@ class KademliaProtocolConveyor(KademliaProtocol):
         KademliaProtocol.__init__(self, node, msgEncoder, msgTranslator)
         self.datagrams_queue = []
         self.worker = None
+        self.enableCompactEncoding(settings.enableDHTcompactEncoding())
 
     def datagramReceived(self, datagram, address):
         if len(self.datagrams_queue) > 10:
@@ -65,3 +65,6 @@ checkRefreshInterval = refreshTimeout / 5
 #: Max size of a single UDP datagram, in bytes. If a message is larger than this, it will
 #: be spread accross several UDP packets.
 udpDatagramMaxSize = 8192  # 8 KB
+
+#: How many addresses of nodes which support compact encoding to remember
+compactEncodingMaxPeers = 10000
@@ -27,6 +27,8 @@
 # The docstrings in this module contain epytext markup; API documentation
 # may be created by processing this file with epydoc: http://epydoc.sf.net
 
+import struct
+
 
 class Encoding(object):
     """
@@ -82,27 +84,37 @@ class Bencode(Encoding):
         @return: The encoded data
         @rtype: str
         """
+        result = []
+        self._encodeRecursive(data, result)
+        return ''.join(result)
+
+    def _encodeRecursive(self, data, result):
+        """
+        Append encoded pieces of C{data} to the C{result} list, they are
+        joined only once at the end.
+
+        Do not call this; use C{encode()} instead
+        """
         if type(data) in (int, long):
-            return 'i%de' % data
+            result.append('i%de' % data)
         elif isinstance(data, str):
-            return '%d:%s' % (len(data), data)
+            result.append('%d:' % len(data))
+            result.append(data)
         elif type(data) in (list, tuple):
-            encodedListItems = ''
+            result.append('l')
             for item in data:
-                encodedListItems += self.encode(item)
-            return 'l%se' % encodedListItems
+                self._encodeRecursive(item, result)
+            result.append('e')
         elif isinstance(data, dict):
-            encodedDictItems = ''
-            keys = sorted(data.keys())
-            for key in keys:
-                encodedDictItems += self.encode(key)
-                encodedDictItems += self.encode(data[key])
-            return 'd%se' % encodedDictItems
-        elif type(data == float):
-            # This (float data type) is a non-standard extension to the original Bencode algorithm
-            return 'f%fe' % data
+            result.append('d')
+            for key in sorted(data.keys()):
+                self._encodeRecursive(key, result)
+                self._encodeRecursive(data[key], result)
+            result.append('e')
         else:
-            raise TypeError("Cannot bencode '%s' object" % type(data))
+            # This (float data type) is a non-standard extension to the original Bencode algorithm,
+            # all other types are also encoded as floats or raise TypeError here
+            result.append('f%fe' % data)
 
     def decode(self, data):
         """
@@ -124,34 +136,232 @@ class Bencode(Encoding):
         """
         Actual implementation of the recursive Bencode algorithm.
 
+        Input string is never copied, only positions are moved,
+        so decoding time is linear to the message size.
+
         Do not call this; use C{decode()} instead
         """
-        if data[startIndex] == 'i':
-            endPos = data[startIndex:].find('e') + startIndex
+        token = data[startIndex]
+        if token == 'i':
+            endPos = data.index('e', startIndex)
             return (int(data[startIndex + 1:endPos]), endPos + 1)
-        elif data[startIndex] == 'l':
+        elif token == 'l':
             startIndex += 1
             decodedList = []
             while data[startIndex] != 'e':
                 listData, startIndex = Bencode._decodeRecursive(data, startIndex)
                 decodedList.append(listData)
             return (decodedList, startIndex + 1)
-        elif data[startIndex] == 'd':
+        elif token == 'd':
             startIndex += 1
             decodedDict = {}
             while data[startIndex] != 'e':
                 key, startIndex = Bencode._decodeRecursive(data, startIndex)
                 value, startIndex = Bencode._decodeRecursive(data, startIndex)
                 decodedDict[key] = value
-            return (decodedDict, startIndex)
-        elif data[startIndex] == 'f':
+            return (decodedDict, startIndex + 1)
+        elif token == 'f':
             # This (float data type) is a non-standard extension to the original Bencode algorithm
-            endPos = data[startIndex:].find('e') + startIndex
+            endPos = data.index('e', startIndex)
             return (float(data[startIndex + 1:endPos]), endPos + 1)
         else:
-            splitPos = data[startIndex:].find(':') + startIndex
+            splitPos = data.index(':', startIndex)
             length = int(data[startIndex:splitPos])
             startIndex = splitPos + 1
             endPos = startIndex + length
-            bytes = data[startIndex:endPos]
-            return (bytes, endPos)
+            if endPos > len(data):
+                raise ValueError('string is longer than the data')
+            return (data[startIndex:endPos], endPos)
+
+
+class Compact(Encoding):
+    """
+    Binary encoding of same data types as C{Bencode}: every value starts
+    with a single byte tag followed by fixed size numbers in network byte
+    order. Messages are smaller because integers and lengths are not
+    written as text.
+
+    Encoded data always starts with C{MAGIC} byte, so it can not be
+    mixed up with Bencode (starts with a letter or a digit) or with a part
+    of a multi-packet message (starts with 0x00).
+
+    It is used only with nodes which announced support of it,
+    see C{KademliaProtocol}.
+    """
+
+    MAGIC = '\xbc'
+    #: Announced by nodes which can decode C{Compact} messages
+    NAME = 'c1'
+
+    def encode(self, data):
+        """
+        Encode the specified data.
+
+        @param data: The data to encode
+        @type data: int, long, tuple, list, dict or str
+
+        @return: The encoded data
+        @rtype: str
+        """
+        result = [self.MAGIC, ]
+        self._encodeRecursive(data, result)
+        return ''.join(result)
+
+    def _encodeRecursive(self, data, result):
+        if type(data) in (int, long):
+            if 0 <= data <= 0xff:
+                result.append(struct.pack('!cB', 'b', data))
+            elif 0 <= data <= 0xffff:
+                result.append(struct.pack('!cH', 'h', data))
+            elif -0x80000000 <= data <= 0x7fffffff:
+                result.append(struct.pack('!ci', 'i', data))
+            elif -0x8000000000000000 <= data <= 0x7fffffffffffffff:
+                result.append(struct.pack('!cq', 'q', data))
+            else:
+                digits = str(data)
+                result.append(struct.pack('!cB', 'n', len(digits)))
+                result.append(digits)
+        elif isinstance(data, str):
+            if len(data) <= 0xff:
+                result.append(struct.pack('!cB', 's', len(data)))
+            else:
+                result.append(struct.pack('!cI', 'S', len(data)))
+            result.append(data)
+        elif type(data) in (list, tuple):
+            if len(data) <= 0xffff:
+                result.append(struct.pack('!cH', 'l', len(data)))
+            else:
+                result.append(struct.pack('!cI', 'L', len(data)))
+            for item in data:
+                self._encodeRecursive(item, result)
+        elif isinstance(data, dict):
+            if len(data) <= 0xffff:
+                result.append(struct.pack('!cH', 'd', len(data)))
+            else:
+                result.append(struct.pack('!cI', 'D', len(data)))
+            for key in sorted(data.keys()):
+                self._encodeRecursive(key, result)
+                self._encodeRecursive(data[key], result)
+        else:
+            # same as in Bencode: all other types are floats or not supported
+            result.append(struct.pack('!cd', 'f', data))
+
+    def decode(self, data):
+        """
+        Decode the specified data string.
+
+        @param data: The data (byte string) to decode.
+        @type data: str
+
+        @return: The decoded data (in its correct type)
+        """
+        if data[0] != self.MAGIC:
+            raise ValueError('not a compact encoded data')
+        value, endPos = self._decodeRecursive(data, 1)
+        if endPos != len(data):
+            raise ValueError('unexpected data after the end of message')
+        return value
+
+    @staticmethod
+    def _decodeRecursive(data, startIndex):
+        token = data[startIndex]
+        startIndex += 1
+        if token == 's':
+            length = ord(data[startIndex])
+            startIndex += 1
+        elif token == 'S':
+            length = struct.unpack_from('!I', data, startIndex)[0]
+            startIndex += 4
+        elif token == 'b':
+            return (ord(data[startIndex]), startIndex + 1)
+        elif token == 'h':
+            return (struct.unpack_from('!H', data, startIndex)[0], startIndex + 2)
+        elif token == 'i':
+            return (struct.unpack_from('!i', data, startIndex)[0], startIndex + 4)
+        elif token == 'q':
+            return (struct.unpack_from('!q', data, startIndex)[0], startIndex + 8)
+        elif token == 'l' or token == 'L':
+            if token == 'l':
+                count = struct.unpack_from('!H', data, startIndex)[0]
+                startIndex += 2
+            else:
+                count = struct.unpack_from('!I', data, startIndex)[0]
+                startIndex += 4
+            decodedList = []
+            for _ in xrange(count):
+                item, startIndex = Compact._decodeRecursive(data, startIndex)
+                decodedList.append(item)
+            return (decodedList, startIndex)
+        elif token == 'd' or token == 'D':
+            if token == 'd':
+                count = struct.unpack_from('!H', data, startIndex)[0]
+                startIndex += 2
+            else:
+                count = struct.unpack_from('!I', data, startIndex)[0]
+                startIndex += 4
+            decodedDict = {}
+            for _ in xrange(count):
+                key, startIndex = Compact._decodeRecursive(data, startIndex)
+                value, startIndex = Compact._decodeRecursive(data, startIndex)
+                decodedDict[key] = value
+            return (decodedDict, startIndex)
+        elif token == 'f':
+            return (struct.unpack_from('!d', data, startIndex)[0], startIndex + 8)
+        elif token == 'n':
+            length = ord(data[startIndex])
+            startIndex += 1
+            return (long(data[startIndex:startIndex + length]), startIndex + length)
+        else:
+            raise ValueError('unknown type %r at position %d' % (token, startIndex - 1))
+        endPos = startIndex + length
+        if endPos > len(data):
+            raise ValueError('string is longer than the data')
+        return (data[startIndex:endPos], endPos)
+
+
+def _bench(count=2000):
+    """
+    Compare encoders on typical C{store}/C{findValue}/C{findNode} messages
+    and on big messages to see how time grows with message size.
+    """
+    import os
+    import time
+    import msgtypes
+    import msgformat
+    translator = msgformat.DefaultFormat()
+
+    def _id():
+        return os.urandom(20)
+
+    contacts = [(_id(), '%d.%d.%d.%d' % tuple(ord(c) for c in os.urandom(4)), 14441, ) for _ in range(8)]
+    messages = {
+        'store': msgtypes.RequestMessage(_id(), 'store', (_id(), 'http://127.0.0.1/alice.xml 1.2.3.4:7771 ' * 3, _id(), 0, )),
+        'store-response': msgtypes.ResponseMessage(_id(), _id(), 'OK'),
+        'findValue': msgtypes.RequestMessage(_id(), 'findValue', (_id(), )),
+        'findValue-response': msgtypes.ResponseMessage(_id(), _id(), {_id(): '1.2.3.4:7771'}),
+        'findNode-response': msgtypes.ResponseMessage(_id(), _id(), contacts),
+        'big-64KB': msgtypes.ResponseMessage(_id(), _id(), contacts * 200),
+        'big-512KB': msgtypes.ResponseMessage(_id(), _id(), contacts * 1600),
+    }
+    for name, encoder in (('bencode', Bencode()), ('compact', Compact()), ):
+        for msgname in sorted(messages.keys()):
+            primitive = translator.toPrimitive(messages[msgname])
+            data = encoder.encode(primitive)
+            assert encoder.decode(data) == Bencode().decode(Bencode().encode(primitive))
+            loops = max(1, count * 256 / len(data))
+            t = time.time()
+            for _ in xrange(loops):
+                encoder.encode(primitive)
+            dt_encode = (time.time() - t) / loops
+            t = time.time()
+            for _ in xrange(loops):
+                encoder.decode(data)
+            dt_decode = (time.time() - t) / loops
+            print '%-8s %-20s %7d bytes  encode %8.1f us (%5.1f MB/s)  decode %8.1f us (%5.1f MB/s)' % (
+                name, msgname, len(data),
+                dt_encode * 1000000.0, len(data) / dt_encode / 1048576.0,
+                dt_decode * 1000000.0, len(data) / dt_decode / 1048576.0, )
+
+
+if __name__ == '__main__':
+    _bench()
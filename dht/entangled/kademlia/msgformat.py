@@ -69,6 +69,8 @@ class DefaultFormat(MessageTranslator):
     """
     typeRequest, typeResponse, typeError = range(3)
     headerType, headerMsgID, headerNodeID, headerPayload, headerArgs = range(5)
+    #: Names of supported encodings, see C{KademliaProtocol.enableCompactEncoding()}
+    headerEncodings = 5
 
     def fromPrimitive(self, msgPrimitive):
         msgType = msgPrimitive[self.headerType]
@@ -63,6 +63,58 @@ class KademliaProtocol(protocol.DatagramProtocol):
         self._sentMessages = {}
         self._partialMessages = {}
         self._partialMessagesProgress = {}
+        self._compactEncoder = None
+        self._compactDecoder = encoding.Compact()
+        self._compactPeers = {}
+        self._compactRequests = {}
+
+    def enableCompactEncoding(self, enable=True):
+        """
+        Send messages with C{encoding.Compact} to nodes which support it.
+
+        Support is announced in every message encoded with the default
+        encoder, nodes which do not know about that just ignore the extra
+        field. Incoming compact messages are always accepted.
+        """
+        if enable:
+            self._compactEncoder = encoding.Compact()
+        else:
+            self._compactEncoder = None
+            self._compactPeers.clear()
+
+    def _encode(self, msgPrimitive, address):
+        """
+        Encode message for the remote node at C{address}.
+        """
+        if self._compactEncoder is not None:
+            if address in self._compactPeers:
+                return self._compactEncoder.encode(msgPrimitive)
+            header = getattr(self._translator, 'headerEncodings', None)
+            if header is not None and isinstance(msgPrimitive, dict):
+                msgPrimitive[header] = encoding.Compact.NAME
+        return self._encoder.encode(msgPrimitive)
+
+    def _decode(self, datagram, address):
+        """
+        Decode incoming message and remember if remote node supports
+        compact encoding.
+        """
+        if datagram[0] == encoding.Compact.MAGIC:
+            msgPrimitive = self._compactDecoder.decode(datagram)
+            compact = True
+        else:
+            msgPrimitive = self._encoder.decode(datagram)
+            header = getattr(self._translator, 'headerEncodings', None)
+            announced = msgPrimitive.get(header) if isinstance(msgPrimitive, dict) else None
+            compact = isinstance(announced, str) and encoding.Compact.NAME in announced.split(',')
+        if compact and self._compactEncoder is not None:
+            if address not in self._compactPeers and len(self._compactPeers) >= constants.compactEncodingMaxPeers:
+                self._compactPeers.popitem()
+            self._compactPeers[address] = True
+        elif not compact and address in self._compactPeers:
+            # remote node was restarted without compact encoding
+            del self._compactPeers[address]
+        return msgPrimitive
 
     def sendRPC(self, contact, method, args, rawResponse=False):
         """
@@ -94,7 +146,9 @@ class KademliaProtocol(protocol.DatagramProtocol):
         """
         msg = msgtypes.RequestMessage(self._node.id, method, args)
         msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        encodedMsg = self._encode(msgPrimitive, (contact.address, contact.port))
+        if encodedMsg[0] == encoding.Compact.MAGIC:
+            self._compactRequests[msg.id] = (contact.address, contact.port)
 
         df = defer.Deferred()
         if rawResponse:
@@ -138,7 +192,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
                     del self._partialMessages[msgID]
                 else:
                     return
-            msgPrimitive = self._encoder.decode(datagram)
+            msgPrimitive = self._decode(datagram, address)
             message = self._translator.fromPrimitive(msgPrimitive)
 
             remoteContact = Contact(message.nodeID, address[0], address[1], self)
@@ -159,6 +213,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
                     df, timeoutCall = self._sentMessages[message.id][1:3]
                     timeoutCall.cancel()
                     del self._sentMessages[message.id]
+                    self._compactRequests.pop(message.id, None)
 
                     if hasattr(df, '_rpcRawResponse'):
                         # The RPC requested that the raw response message and originating address be returned; do not interpret it
@@ -249,7 +304,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
         """
         msg = msgtypes.ResponseMessage(rpcID, self._node.id, response)
         msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        encodedMsg = self._encode(msgPrimitive, (contact.address, contact.port))
         if _Debug:
             print '                sendResponse', (contact.address, contact.port)
         self._send(encodedMsg, rpcID, (contact.address, contact.port))
@@ -260,7 +315,7 @@ class KademliaProtocol(protocol.DatagramProtocol):
         """
         msg = msgtypes.ErrorMessage(rpcID, self._node.id, exceptionType, exceptionMessage)
         msgPrimitive = self._translator.toPrimitive(msg)
-        encodedMsg = self._encoder.encode(msgPrimitive)
+        encodedMsg = self._encode(msgPrimitive, (contact.address, contact.port))
         if _Debug:
             print '                sendError', (contact.address, contact.port)
         self._send(encodedMsg, rpcID, (contact.address, contact.port))
@@ -325,6 +380,11 @@ class KademliaProtocol(protocol.DatagramProtocol):
                 self._sentMessages[messageID] = (remoteContactID, df, timeoutCall)
                 return
             del self._sentMessages[messageID]
+            compactAddress = self._compactRequests.pop(messageID, None)
+            if compactAddress is not None:
+                # may be remote node can not decode compact messages any more,
+                # next time default encoder will be used
+                self._compactPeers.pop(compactAddress, None)
             # The message's destination node is now considered to be dead;
             # raise an (asynchronous) TimeoutError exception and update the host node
             self._node.removeContact(remoteContactID)
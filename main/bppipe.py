@@ -40,6 +40,13 @@ Inspired from examples here:
 * `http://docs.python.org/lib/tar-examples.html`
 * `http://code.activestate.com/recipes/299412`
 
+Compression is given as "<codec>[:<level>[:<workers>]]", for example "gz:1:4".
+With a level other than 9 or more than one worker the ".tar" stream is split into
+blocks and every block is compressed separately, in a pool of worker processes,
+into a complete bz2 or gzip stream. Concatenated streams are still
+a standard ".tar.bz2" or ".tar.gz" file. With "gz" codec blocks which
+can not be compressed (detected by compressing small samples) are just stored.
+
 TODO:
 If we kept track of how far we were through a list of files, and broke off
 new blocks at file boundaries, we could restart a backup and continue
@@ -53,12 +60,22 @@ import platform
 import tarfile
 import traceback
 import locale
+import zlib
+import bz2
+import gzip
+import cStringIO
+import collections
+import multiprocessing
 
 #------------------------------------------------------------------------------
 
 AppData = ''
 _ExcludeFunction = None
 
+COMPRESS_BLOCK_SIZE = 1024 * 1024
+SAMPLE_SIZE = 16 * 1024
+INCOMPRESSIBLE_RATIO = 0.95
+
 #------------------------------------------------------------------------------
 
 
@@ -168,6 +185,145 @@ if platform.uname()[0] == 'Windows':
 
 #------------------------------------------------------------------------------
 
+def parse_compression(compression):
+    """
+    Return a tuple (codec, level, workers) from a string like "bz2:9:4".
+    """
+    parts = (compression or 'none').split(':')
+    codec = parts[0].strip().lower() or 'none'
+    level = 9
+    workers = 1
+    try:
+        if len(parts) > 1:
+            level = max(1, min(9, int(parts[1])))
+        if len(parts) > 2:
+            workers = int(parts[2])
+    except:
+        printexc()
+    if workers <= 0:
+        workers = max(1, multiprocessing.cpu_count() / 2)
+    return codec, level, workers
+
+
+def incompressible(data):
+    """
+    Compress few small pieces of ``data`` with fastest zlib level to check if it is worth compressing at all.
+    """
+    if len(data) <= SAMPLE_SIZE * 3:
+        samples = [data, ]
+    else:
+        middle = len(data) / 2
+        samples = [data[:SAMPLE_SIZE], data[middle:middle + SAMPLE_SIZE], data[-SAMPLE_SIZE:], ]
+    for sample in samples:
+        if len(zlib.compress(sample, 1)) < len(sample) * INCOMPRESSIBLE_RATIO:
+            return False
+    return True
+
+
+def compress_block(data, codec, level):
+    """
+    Return ``data`` compressed into a complete bz2 or gzip stream, runs in a worker process.
+    """
+    if codec == 'bz2':
+        return bz2.compress(data, level)
+    if incompressible(data):
+        level = 0
+    out = cStringIO.StringIO()
+    gz = gzip.GzipFile(filename='', mode='wb', compresslevel=level, fileobj=out, mtime=0)
+    gz.write(data)
+    gz.close()
+    return out.getvalue()
+
+
+class BlockCompressor(object):
+    """
+    File-like object, ".tar" data written here is split into blocks, compressed
+    in worker processes and written to ``fileobj`` in same order.
+    """
+
+    def __init__(self, fileobj, codec, level, workers, blocksize=COMPRESS_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.codec = codec
+        self.level = level
+        self.blocksize = blocksize
+        self.pool = None
+        if workers > 1:
+            self.pool = multiprocessing.Pool(workers)
+        self.maxpending = workers * 2
+        self.pending = collections.deque()
+        self.buffer = []
+        self.buffersize = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffersize += len(data)
+        if self.buffersize >= self.blocksize:
+            self._flush_block()
+
+    def _flush_block(self):
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.buffersize = 0
+        if self.pool is None:
+            self.fileobj.write(compress_block(data, self.codec, self.level))
+            return
+        self.pending.append(self.pool.apply_async(compress_block, (data, self.codec, self.level, )))
+        while len(self.pending) > self.maxpending:
+            self.fileobj.write(self.pending.popleft().get())
+
+    def close(self):
+        if self.buffersize:
+            self._flush_block()
+        while self.pending:
+            self.fileobj.write(self.pending.popleft().get())
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.fileobj.flush()
+
+
+class MultiStreamBZ2Reader(object):
+    """
+    Python 2 can not read concatenated bz2 streams with ``bz2.BZ2File``,
+    here all of them are decompressed one by one.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.decompressor = bz2.BZ2Decompressor()
+        self.buffer = ''
+
+    def _feed(self, raw):
+        out = []
+        while raw:
+            try:
+                out.append(self.decompressor.decompress(raw))
+            except EOFError:
+                # previous stream was finished exactly at the end of previous piece
+                self.decompressor = bz2.BZ2Decompressor()
+                continue
+            raw = self.decompressor.unused_data
+            if raw:
+                self.decompressor = bz2.BZ2Decompressor()
+        return ''.join(out)
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            raw = self.fileobj.read(COMPRESS_BLOCK_SIZE)
+            if not raw:
+                break
+            self.buffer += self._feed(raw)
+        if size < 0:
+            size = len(self.buffer)
+        result = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return result
+
+    def close(self):
+        self.fileobj.close()
+
+
 def writetar_filter(tarinfo, sourcepath):
     global _ExcludeFunction
     if _ExcludeFunction(sourcepath, tarinfo.name):
@@ -183,16 +339,21 @@ def writetar(sourcepath, arcname=None, subdirs=True, compression='none', encodin
     global _ExcludeFunction
     printlog('WRITE: %s arcname=%s, subdirs=%s, compression=%s, encoding=%s\n' % (
         sourcepath, arcname, subdirs, compression, encoding))
+    codec, level, workers = parse_compression(compression)
     mode = 'w|'
-    if compression != 'none':
-        mode += compression
+    fileobj = sys.stdout
+    if codec != 'none':
+        if level == 9 and workers == 1:
+            mode += codec
+        else:
+            fileobj = BlockCompressor(sys.stdout, codec, level, workers)
     basedir, filename = os.path.split(sourcepath)
     if arcname is None:
         arcname = unicode(filename)
     else:
         arcname = unicode(arcname)
     # DEBUG: tar = tarfile.open('', mode, fileobj=open('out.tar', 'wb'), encoding=encoding)
-    tar = tarfile.open('', mode, fileobj=sys.stdout, encoding=encoding)
+    tar = tarfile.open('', mode, fileobj=fileobj, encoding=encoding)
     # if we have python 2.6 then we can use an exclude function, filter parameter is not available
     if sys.version_info[:2] == (2, 6):
         tar.add(
@@ -249,6 +410,8 @@ def writetar(sourcepath, arcname=None, subdirs=True, compression='none', encodin
                         recursive=False,
                     )
     tar.close()
+    if fileobj is not sys.stdout:
+        fileobj.close()
 
 #------------------------------------------------------------------------------
 
@@ -261,9 +424,19 @@ def readtar(archivepath, outputdir, encoding=None):
     printlog('READ: %s to %s, encoding=%s\n' % (
         archivepath, outputdir, encoding))
     mode = 'r:*'
-    tar = tarfile.open(archivepath, mode, encoding=encoding)
+    fileobj = None
+    with open(archivepath, 'rb') as f:
+        magic = f.read(3)
+    if sys.version_info[:2] < (3, 3) and magic == 'BZh':
+        # archive can be made of many bz2 streams, see ``BlockCompressor``
+        fileobj = MultiStreamBZ2Reader(open(archivepath, 'rb'))
+        tar = tarfile.open(mode='r|', fileobj=fileobj, encoding=encoding)
+    else:
+        tar = tarfile.open(archivepath, mode, encoding=encoding)
     tar.extractall(outputdir)
     tar.close()
+    if fileobj is not None:
+        fileobj.close()
 
 #------------------------------------------------------------------------------
 
@@ -280,6 +453,8 @@ def main():
     except:
         pass
 
+    multiprocessing.freeze_support()
+
     try:
         reload(sys)
         if hasattr(sys, "setdefaultencoding"):
@@ -291,7 +466,7 @@ def main():
 
     if len(sys.argv) < 4:
         printlog('bppipe extract <archive path> <output dir>\n')
-        printlog('bppipe <subdirs / nosubdirs> <"none" / "bz2"/"gz"> <folder/file path> [archive filename]\n')
+        printlog('bppipe <subdirs / nosubdirs> <"none" / "bz2"/"gz">[:<level>[:<workers>]] <folder/file path> [archive filename]\n')
         return 2
 
     try:
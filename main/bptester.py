@@ -105,6 +105,7 @@ try:
     from contacts import contactsdb
     from p2p import commands
     from crypt import signed
+    from supplier import segment_store
 except:
     import traceback
     printlog(traceback.format_exc())
@@ -152,6 +153,13 @@ def SpaceTime():
             continue
         timedict = {}
         sizedict = {}
+        # packs of the segment store can not be removed partially, but they are
+        # counted first, so loose files are removed if customer is over his quota
+        segments_size = 0
+        segments_dir = os.path.join(onecustdir, segment_store.STORE_DIR_NAME)
+        if os.path.isdir(segments_dir):
+            segments_size = bpio.getDirectorySize(segments_dir)
+        currentV = segments_size
 
         def cb(path, subpath, name):
             if not os.path.isfile(path):
@@ -161,12 +169,14 @@ def SpaceTime():
             sizedict[path] = stats.st_size
 
         for key_alias in os.listdir(onecustdir):
+            if key_alias == segment_store.STORE_DIR_NAME:
+                continue
             if not misc.ValidKeyAlias(key_alias):
                 remove_list[onecustdir] = 'invalid key alias'
                 continue
             okekeydir = os.path.join(onecustdir, key_alias)
             bpio.traverse_dir_recursive(cb, okekeydir)
-            currentV = 0
+            currentV = segments_size
             for path in sorted(timedict.keys(), key=lambda x: timedict[x], reverse=True):
                 filesize = sizedict.get(path, 0)
                 currentV += filesize
@@ -276,6 +286,8 @@ def Validate():
         if not os.path.isdir(onecustdir):
             continue
         for key_alias_filename in os.listdir(onecustdir):
+            if key_alias_filename == segment_store.STORE_DIR_NAME:
+                continue
             onekeydir = os.path.join(onecustdir, key_alias_filename)
             if not os.path.isdir(onekeydir):
                 continue
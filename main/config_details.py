@@ -102,11 +102,51 @@ def raw():
 {services/backups/wait-suppliers-enabled} wait suppliers 24 hours
     If you disabled storing of local data of your backups but one day a critical amount of your suppliers become unreliable - your data may be lost completely.
     Enable this option to wait for 24 hours after finishing any backup and perform a check all of your suppliers before removing the locally backed up data for this copy.
+{services/backups/raid-fast-engine-enabled} fast RAID engine
+    Enable this to calculate "Parity" pieces over the whole segments at once, this is much faster and produce exactly same pieces.
+    Disable to use the legacy engine.
+{services/backups/raid-in-memory-enabled} in-memory RAID
+    Enable this to pass every block to the RAID worker via shared memory, so the block is not written and read back from the disk.
+    Works together with fast RAID engine only.
+{services/backups/pipeline-enabled} pipelined backup
+    Enable this to read, encrypt and split several blocks at same time, encryption is done in a separate thread.
+{services/backups/pipeline-blocks} blocks in flight
+    Maximum number of blocks processed at same time when pipelined backup is enabled.
+{services/backups/raid-workers-number} RAID workers
+    Number of processes to prepare "Data" and "Parity" pieces and rebuild or restore your data.
+    A "0" value means to use half of available CPU cores.
+{services/backups/raid-queue-size} RAID queue size
+    How many blocks can wait for the RAID workers, reading of the new data is paused when queue is full.
+{services/backups/raid-batch-size} RAID batch size
+    Maximum number of blocks passed to a single RAID worker at once.
+{services/backups/dedup-enabled} incremental backups
+    Enable this to split your data into chunks depending on the content and upload only chunks which were not stored yet.
+    Blocks of older versions are kept while newer versions are using them.
+{services/backups/compression} compression
+    Compression method for new backups: "bz2", "gz" or "none".
+{services/backups/compression-level} compression level
+    From 1 (fastest) to 9 (smallest archive).
+{services/backups/compression-workers} compression processes
+    Number of processes to compress data in parallel, set to 0 to use half of CPU cores.
+
+{services/restores} restores settings
+    Restores setting.
+{services/restores/read-ahead-blocks} restore read-ahead
+    How many blocks are requested, reconstructed and decrypted at same time during restore, "1" means one block at a time.
+{services/restores/minimal-fetch-enabled} request only needed pieces
+    Request from suppliers only pieces needed to rebuild a block, preferring the fastest suppliers, other requests are cancelled as soon as block can be rebuilt.
+
+{services/list-files} list files service
+    "List files" service settings.
+{services/list-files/revisions-enabled} request only changes of stored files
+    Ask suppliers to send only changes in the list of stored files since the previous request, all your suppliers must run a recent version.
 
 {services/supplier} supplier service
     "Supplier" service settings.
 {services/supplier/donated} donated space
     How many megabytes you ready to donate to other users?
+{services/supplier/segment-store-enabled} store customers data in pack files
+    Append pieces of customers backups to a few big files instead of keeping every piece in a separate file.
 
 {services/identity-server} own identity server
     You can start own Identity server and store identity files of other users on your machine to support the BitDustwork.
@@ -146,6 +186,14 @@ def raw():
 {services/entangled-dht/udp-port} udp port number for distributed hash table
     This is a UDP port number for Distributed Hash Table communications.
     BitDust uses <a href="http://entangled.sourceforge.net/">Entangled Project</a> to implement DHT functionality.
+{services/entangled-dht/compact-encoding-enabled} enable compact encoding
+    Use binary encoding for DHT messages with nodes which also support it, messages are smaller and faster to process.
+
+{services/gateway} gateway service
+    "Gateway" service settings.
+{services/gateway/memory-inbox-max-size} in-memory packets size limit
+    Incoming packets up to that size in bytes are not written to disk, but passed to the gateway in memory.
+    A value of "0" means all packets are written to disk.
 
 {services/tcp-connections/tcp-port} tcp port number
     Enter the TCP port number, it will be used to connect with your machine by other users.
@@ -161,6 +209,8 @@ def raw():
     Disable this if you do not want to use TCP-transport for receiving packets from other users.
 {services/tcp-transport/sending-enabled} enable tcp sending
     Disable this if you do not want to use TCP-transport for sending packets to other users.
+{services/tcp-transport/multiplexing-enabled} enable tcp multiplexing
+    Send many files at once over a single TCP connection, small packets will not wait behind a big one. Used only if remote peer supports it as well.
 
 {services/udp-datagrams/udp-port} udp port number
     Set a UDP port for sending and receiving UDP datagrams.
@@ -176,4 +226,7 @@ def raw():
     Disable this if you do not want to use UDP-transport for receiving packets from other users.
 {services/udp-transport/sending-enabled} enable udp sending
     Disable this if you do not want to use UDP-transport for sending packets to other users.
+{services/udp-transport/congestion-control-enabled} enable udp congestion control
+    Every stream adjusts own sending speed to the network and uses bigger datagrams if possible.
+    Used only if remote peer supports it as well, disable this to always use the old sending algorithm.
 """
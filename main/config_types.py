@@ -97,6 +97,17 @@ def defaults():
         'services/backups/keep-local-copies-enabled': TYPE_BOOLEAN,
         'services/backups/max-block-size': TYPE_DISK_SPACE,
         'services/backups/max-copies': TYPE_POSITIVE_INTEGER,
+        'services/backups/raid-fast-engine-enabled': TYPE_BOOLEAN,
+        'services/backups/raid-in-memory-enabled': TYPE_BOOLEAN,
+        'services/backups/pipeline-enabled': TYPE_BOOLEAN,
+        'services/backups/pipeline-blocks': TYPE_NON_ZERO_POSITIVE_INTEGER,
+        'services/backups/dedup-enabled': TYPE_BOOLEAN,
+        'services/backups/compression': TYPE_STRING,
+        'services/backups/compression-level': TYPE_NON_ZERO_POSITIVE_INTEGER,
+        'services/backups/compression-workers': TYPE_POSITIVE_INTEGER,
+        'services/backups/raid-workers-number': TYPE_POSITIVE_INTEGER,
+        'services/backups/raid-queue-size': TYPE_NON_ZERO_POSITIVE_INTEGER,
+        'services/backups/raid-batch-size': TYPE_NON_ZERO_POSITIVE_INTEGER,
         'services/backups/wait-suppliers-enabled': TYPE_BOOLEAN,
         'services/blockchain/enabled': TYPE_BOOLEAN,
         'services/blockchain/host': TYPE_STRING,
@@ -120,8 +131,10 @@ def defaults():
         'services/entangled-dht/enabled': TYPE_BOOLEAN,
         'services/entangled-dht/udp-port': TYPE_POSITIVE_INTEGER,
         'services/entangled-dht/known-nodes': TYPE_STRING,
+        'services/entangled-dht/compact-encoding-enabled': TYPE_BOOLEAN,
         'services/employer/enabled': TYPE_BOOLEAN,
         'services/gateway/enabled': TYPE_BOOLEAN,
+        'services/gateway/memory-inbox-max-size': TYPE_POSITIVE_INTEGER,
         'services/http-connections/enabled': TYPE_BOOLEAN,
         'services/http-connections/http-port': TYPE_POSITIVE_INTEGER,
         'services/http-transport/enabled': TYPE_BOOLEAN,
@@ -141,6 +154,7 @@ def defaults():
         'services/ip-port-responder/enabled': TYPE_BOOLEAN,
         'services/keys-registry/enabled': TYPE_BOOLEAN,
         'services/list-files/enabled': TYPE_BOOLEAN,
+        'services/list-files/revisions-enabled': TYPE_BOOLEAN,
         'services/miner/enabled': TYPE_BOOLEAN,
         'services/my-ip-port/enabled': TYPE_BOOLEAN,
         'services/network/enabled': TYPE_BOOLEAN,
@@ -169,9 +183,12 @@ def defaults():
         'services/proxy-transport/router-lifetime-seconds': TYPE_POSITIVE_INTEGER,
         'services/rebuilding/enabled': TYPE_BOOLEAN,
         'services/restores/enabled': TYPE_BOOLEAN,
+        'services/restores/read-ahead-blocks': TYPE_NON_ZERO_POSITIVE_INTEGER,
+        'services/restores/minimal-fetch-enabled': TYPE_BOOLEAN,
         'services/shared-data/enabled': TYPE_BOOLEAN,
         'services/supplier/donated-space': TYPE_DISK_SPACE,
         'services/supplier/enabled': TYPE_BOOLEAN,
+        'services/supplier/segment-store-enabled': TYPE_BOOLEAN,
         'services/supplier-contracts/enabled': TYPE_BOOLEAN,
         'services/supplier-relations/enabled': TYPE_BOOLEAN,
         'services/tcp-connections/enabled': TYPE_BOOLEAN,
@@ -180,11 +197,13 @@ def defaults():
         'services/tcp-transport/enabled': TYPE_BOOLEAN,
         'services/tcp-transport/receiving-enabled': TYPE_BOOLEAN,
         'services/tcp-transport/sending-enabled': TYPE_BOOLEAN,
+        'services/tcp-transport/multiplexing-enabled': TYPE_BOOLEAN,
         'services/tcp-transport/priority': TYPE_POSITIVE_INTEGER,
         'services/udp-datagrams/enabled': TYPE_BOOLEAN,
         'services/udp-datagrams/udp-port': TYPE_POSITIVE_INTEGER,
         'services/udp-transport/enabled': TYPE_BOOLEAN,
         'services/udp-transport/receiving-enabled': TYPE_BOOLEAN,
         'services/udp-transport/sending-enabled': TYPE_BOOLEAN,
+        'services/udp-transport/congestion-control-enabled': TYPE_BOOLEAN,
         'services/udp-transport/priority': TYPE_POSITIVE_INTEGER,
     }
@@ -1091,12 +1091,41 @@ def BackupInfoFileFullPathOld():
 
 
 def BackupIndexFilePath():
-    """
-    A full local path for ``BackupIndexFileName`` file.
+    """
+    A full local path for ``BackupIndexFileName`` file.
     """
     return os.path.join(MetaDataDir(), BackupIndexFileName())
 
 
+def BackupIndexDeltaFileName():
+    """
+    Recent changes of the index, this file is saved on suppliers together with
+    ``BackupIndexFileName`` so full index do not need to be sent after every change.
+    """
+    return 'index.delta'
+
+
+def BackupIndexSnapshotFilePath():
+    """
+    A compact binary copy of the index, see ``storage.index_journal``.
+    """
+    return os.path.join(MetaDataDir(), 'index.snapshot')
+
+
+def BackupIndexJournalFilePath():
+    """
+    Changes of the index made after ``BackupIndexSnapshotFilePath`` was written.
+    """
+    return os.path.join(MetaDataDir(), 'index.journal')
+
+
+def BackupDedupIndexFilePath():
+    """
+    A local index of chunks stored in the incremental backups, see ``storage.dedup``.
+    """
+    return os.path.join(MetaDataDir(), 'dedup')
+
+
 def SupplierPath(supplier_idurl, customer_idurl, filename=None):
     """
     A location to given supplier's data.
@@ -1594,6 +1623,14 @@ def getBandInLimit():
     return config.conf().getInt('services/network/receive-limit', DefaultBandwidthInLimit())
 
 
+def getMemoryInboxMaxSize():
+    """
+    Incoming packets up to that size in bytes are passed from transports to
+    the gateway in memory, bigger packets are written to temporary files.
+    """
+    return config.conf().getInt('services/gateway/memory-inbox-max-size', 64 * 1024)
+
+
 def enableIdServer(enable=None):
     """
     """
@@ -1732,6 +1769,16 @@ def enableTCPsending(enable=None):
     config.conf().setData('services/tcp-transport/sending-enabled', str(enable))
 
 
+def enableTCPmultiplexing(enable=None):
+    """
+    Switch on/off sending of many files at once over single TCP connection
+    in the settings or get current state.
+    """
+    if enable is None:
+        return config.conf().getBool('services/tcp-transport/multiplexing-enabled')
+    config.conf().setData('services/tcp-transport/multiplexing-enabled', str(enable))
+
+
 def enableTCPreceiving(enable=None):
     """
     Switch on/off receiving over transport_tcp in the settings or get current
@@ -1783,6 +1830,16 @@ def enableUDPreceiving(enable=None):
     config.conf().setData('services/udp-transport/receiving-enabled', str(enable))
 
 
+def enableUDPcongestionControl(enable=None):
+    """
+    Switch on/off "adaptive" profile for udp streams in the settings or get
+    current state, "legacy" profile is used if it is off.
+    """
+    if enable is None:
+        return config.conf().getBool('services/udp-transport/congestion-control-enabled')
+    config.conf().setData('services/udp-transport/congestion-control-enabled', str(enable))
+
+
 def getUDPPort():
     """
     Get a port number for tranport_udp from user config.
@@ -1804,6 +1861,16 @@ def getDHTPort():
     return config.conf().getInt("services/entangled-dht/udp-port", DefaultDHTPort())
 
 
+def enableDHTcompactEncoding(enable=None):
+    """
+    Switch on/off binary encoding of DHT messages with nodes which support it
+    in the settings or get current state.
+    """
+    if enable is None:
+        return config.conf().getBool('services/entangled-dht/compact-encoding-enabled')
+    config.conf().setData('services/entangled-dht/compact-encoding-enabled', str(enable))
+
+
 def enablePROXY(enable=None):
     """
     Switch on/off transport_proxy in the settings or get its current state.
@@ -2267,6 +2334,136 @@ def setBackupMaxBlockSize(block_size):
     return config.conf().setData('services/backups/max-block-size', diskspace.MakeStringFromBytes(block_size))
 
 
+def getBackupRaidFastEngine():
+    """
+    Return True if "Data" and "Parity" pieces must be prepared with the
+    buffers based XOR engine, otherwise the legacy per-word engine is used.
+    """
+    return config.conf().getBool('services/backups/raid-fast-engine-enabled', True)
+
+
+def getBackupRaidInMemory():
+    """
+    Return True if blocks must be passed to the RAID worker in the shared
+    memory and memory mapped there instead of a temporary file on the disk.
+    """
+    return config.conf().getBool('services/backups/raid-in-memory-enabled', True)
+
+
+def getBackupPipelineEnabled():
+    """
+    Return True if reading, encryption and RAID of different blocks must run
+    at same time during backup, encryption is done out of the main thread.
+    """
+    return config.conf().getBool('services/backups/pipeline-enabled', False)
+
+
+def getBackupPipelineBlocks():
+    """
+    Return maximum number of blocks processed at same time in the pipelined mode.
+    """
+    return max(1, config.conf().getInt('services/backups/pipeline-blocks', 4))
+
+
+def getBackupDedupEnabled():
+    """
+    Return True if backups must be split into content-defined chunks
+    and only new chunks are uploaded, see ``storage.dedup``.
+    """
+    return config.conf().getBool('services/backups/dedup-enabled', False)
+
+
+def getBackupCompression():
+    """
+    Return compression codec for new backups: "bz2", "gz" or "none".
+    """
+    codec = config.conf().getString('services/backups/compression', 'bz2').strip().lower()
+    if codec not in ['none', 'gz', 'bz2', ]:
+        codec = 'bz2'
+    return codec
+
+
+def getBackupCompressionLevel():
+    """
+    Return compression level from 1 (fastest) to 9 (smallest).
+    """
+    return max(1, min(9, config.conf().getInt('services/backups/compression-level', 9)))
+
+
+def getBackupCompressionWorkers():
+    """
+    Number of processes to compress data in parallel, 0 means half of CPU cores.
+    """
+    return max(0, config.conf().getInt('services/backups/compression-workers', 1))
+
+
+def getRestoreReadAheadBlocks():
+    """
+    Return number of blocks processed at same time during restore,
+    "1" means no read-ahead: blocks are requested and restored one by one.
+    """
+    return max(1, config.conf().getInt('services/restores/read-ahead-blocks', 1))
+
+
+def getRestoreMinimalFetchEnabled():
+    """
+    If True, only pieces needed to rebuild a block are requested during restore,
+    pieces from slow suppliers are hedged with extra requests.
+    """
+    return config.conf().getBool('services/restores/minimal-fetch-enabled', True)
+
+
+def getSupplierSegmentStoreEnabled():
+    """
+    If True, pieces of customers backups are appended to pack files on this
+    supplier instead of writing every packet to a separate file.
+    """
+    return config.conf().getBool('services/supplier/segment-store-enabled', False)
+
+
+def getListFilesRevisionsEnabled():
+    """
+    If True, customer asks suppliers for revision of the list of stored files
+    to receive only changes next time. Suppliers running older versions do not
+    answer to such requests.
+    """
+    return config.conf().getBool('services/list-files/revisions-enabled', False)
+
+
+def getRaidWorkersNumber():
+    """
+    Return number of RAID worker processes, "0" means half of CPU cores.
+    """
+    return config.conf().getInt('services/backups/raid-workers-number', 0)
+
+
+def getRaidWorkerQueueSize():
+    """
+    Return maximum number of blocks waiting for the RAID workers, after that
+    reading of the new blocks will be paused.
+    """
+    return max(1, config.conf().getInt('services/backups/raid-queue-size', 8))
+
+
+def getRaidWorkerBatchSize():
+    """
+    Return maximum number of RAID tasks which can be passed to one worker
+    process at once.
+    """
+    return max(1, config.conf().getInt('services/backups/raid-batch-size', 4))
+
+
+def getBackupRaidMakeCommand():
+    """
+    Return the name of ``raid.raid_worker`` task to be used to split blocks.
+    """
+    if not getBackupRaidFastEngine():
+        return 'make'
+    if getBackupRaidInMemory():
+        return 'make-mmap'
+    return 'make-xor'
+
+
 def getPrivateKeySize():
     """
     Return Private Key size from settings, but typically Private Key is
@@ -2509,6 +2706,17 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/backups/max-copies', '2')
     config.conf().setDefaultValue('services/backups/keep-local-copies-enabled', 'false')
     config.conf().setDefaultValue('services/backups/wait-suppliers-enabled', 'false')
+    config.conf().setDefaultValue('services/backups/raid-fast-engine-enabled', 'true')
+    config.conf().setDefaultValue('services/backups/raid-in-memory-enabled', 'true')
+    config.conf().setDefaultValue('services/backups/pipeline-enabled', 'false')
+    config.conf().setDefaultValue('services/backups/pipeline-blocks', '4')
+    config.conf().setDefaultValue('services/backups/dedup-enabled', 'false')
+    config.conf().setDefaultValue('services/backups/compression', 'bz2')
+    config.conf().setDefaultValue('services/backups/compression-level', '9')
+    config.conf().setDefaultValue('services/backups/compression-workers', '1')
+    config.conf().setDefaultValue('services/backups/raid-workers-number', '0')
+    config.conf().setDefaultValue('services/backups/raid-queue-size', '8')
+    config.conf().setDefaultValue('services/backups/raid-batch-size', '4')
 
     config.conf().setDefaultValue('services/blockchain/enabled', 'false')
     config.conf().setDefaultValue('services/blockchain/host', '127.0.0.1')
@@ -2542,10 +2750,12 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/entangled-dht/enabled', 'true')
     config.conf().setDefaultValue('services/entangled-dht/udp-port', DefaultDHTPort())
     config.conf().setDefaultValue('services/entangled-dht/known-nodes', '')
+    config.conf().setDefaultValue('services/entangled-dht/compact-encoding-enabled', 'true')
 
     config.conf().setDefaultValue('services/employer/enabled', 'true')
 
     config.conf().setDefaultValue('services/gateway/enabled', 'true')
+    config.conf().setDefaultValue('services/gateway/memory-inbox-max-size', str(64 * 1024))
 
     config.conf().setDefaultValue('services/http-connections/enabled', 'false')
     config.conf().setDefaultValue('services/http-connections/http-port', DefaultHTTPPort())
@@ -2571,6 +2781,7 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/keys-registry/enabled', 'true')
 
     config.conf().setDefaultValue('services/list-files/enabled', 'true')
+    config.conf().setDefaultValue('services/list-files/revisions-enabled', 'false')
 
     config.conf().setDefaultValue('services/miner/enabled', 'false')
 
@@ -2610,12 +2821,15 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/rebuilding/enabled', 'true')
 
     config.conf().setDefaultValue('services/restores/enabled', 'true')
+    config.conf().setDefaultValue('services/restores/read-ahead-blocks', '1')
+    config.conf().setDefaultValue('services/restores/minimal-fetch-enabled', 'true')
 
     config.conf().setDefaultValue('services/shared-data/enabled', 'true')
 
     config.conf().setDefaultValue('services/supplier/enabled', 'true')
     config.conf().setDefaultValue('services/supplier/donated-space',
                                   diskspace.MakeStringFromBytes(DefaultDonatedBytes()))
+    config.conf().setDefaultValue('services/supplier/segment-store-enabled', 'false')
 
     config.conf().setDefaultValue('services/supplier-contracts/enabled', 'false')
 
@@ -2628,6 +2842,7 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/tcp-transport/enabled', 'true')
     config.conf().setDefaultValue('services/tcp-transport/receiving-enabled', 'true')
     config.conf().setDefaultValue('services/tcp-transport/sending-enabled', 'true')
+    config.conf().setDefaultValue('services/tcp-transport/multiplexing-enabled', 'true')
     config.conf().setDefaultValue('services/tcp-transport/priority', 10)
 
     config.conf().setDefaultValue('services/udp-datagrams/enabled', 'true')
@@ -2636,6 +2851,7 @@ def _setUpDefaultSettings():
     config.conf().setDefaultValue('services/udp-transport/enabled', 'true')
     config.conf().setDefaultValue('services/udp-transport/receiving-enabled', 'true')
     config.conf().setDefaultValue('services/udp-transport/sending-enabled', 'true')
+    config.conf().setDefaultValue('services/udp-transport/congestion-control-enabled', 'true')
     config.conf().setDefaultValue('services/udp-transport/priority', 20)
 
 
@@ -395,10 +395,13 @@ def ListFiles(request, info):
             request.RemoteID, request.OwnerID, request.CreatorID))
 
 
-def SendListFiles(supplierNumORidurl, customer_idurl=None, wide=False, callbacks={}):
+def SendListFiles(supplierNumORidurl, customer_idurl=None, wide=False, callbacks={}, since=None):
     """
     This is used as a request method from your supplier : if you send him a ListFiles() packet
     he will reply you with a list of stored files in a Files() packet.
+
+    If ``since`` is set supplier can reply with only changes made after that revision,
+    see ``supplier.list_files``.
     """
     MyID = my_id.getLocalID()
     if not customer_idurl:
@@ -414,6 +417,8 @@ def SendListFiles(supplierNumORidurl, customer_idurl=None, wide=False, callbacks
         lg.out(_DebugLevel, "p2p_service.SendListFiles to %s" % nameurl.GetName(RemoteID))
     PacketID = "%s:%s" % (global_id.UrlToGlobalID(customer_idurl), packetid.UniqueID())
     Payload = settings.ListFilesFormat()
+    if since:
+        Payload += ' ' + since
     result = signed.Packet(
         Command=commands.ListFiles(),
         OwnerID=MyID,
@@ -52,6 +52,8 @@ import os
 import sys
 import struct
 import time
+import mmap
+import binascii
 import cStringIO
 import platform
 
@@ -83,6 +85,16 @@ def shutdown():
     global _ECCMAP
     _ECCMAP.clear()
 
+
+def preload(eccmapnames):
+    """
+    Executed once in every RAID worker process to create all ecc maps in
+    advance, so later tasks will find them in the ``geteccmap()`` cache.
+    """
+    for name in eccmapnames:
+        raid.make.geteccmap(name)
+    return len(eccmapnames)
+
 #------------------------------------------------------------------------------
 
 
@@ -127,6 +139,38 @@ def WriteFile(filename, data):
     f.write(data)
     f.close()
 
+
+def XorBuffers(buffers, size):
+    """
+    Returns a string of ``size`` bytes which is a bytewise XOR of all given
+    buffers, every buffer must be exactly ``size`` bytes long.
+
+    Uses NumPy arrays when available and falls back to Python long integers
+    otherwise - both are doing XOR over the whole buffer at once instead of
+    a Python loop over every 4 bytes word.
+    """
+    if not buffers or size == 0:
+        return '\x00' * size
+    try:
+        import numpy
+    except:
+        numpy = None
+    if numpy is not None:
+        if size % 8 == 0:
+            dtype = numpy.uint64
+        elif size % 4 == 0:
+            dtype = numpy.uint32
+        else:
+            dtype = numpy.uint8
+        result = numpy.frombuffer(buffers[0], dtype=dtype).copy()
+        for buf in buffers[1:]:
+            numpy.bitwise_xor(result, numpy.frombuffer(buf, dtype=dtype), result)
+        return result.tostring()
+    result = long(binascii.hexlify(buffers[0]), 16)
+    for buf in buffers[1:]:
+        result ^= long(binascii.hexlify(buf), 16)
+    return binascii.unhexlify('%0*x' % (size * 2, result))
+
 #------------------------------------------------------------------------------
 
 # def raidmake(filename, eccmapname, backupId, blockNumber, targetDir=None, in_memory=True):
@@ -143,7 +187,7 @@ def WriteFile(filename, data):
 
 def do_in_memory(filename, eccmapname, version, blockNumber, targetDir):
     INTSIZE = 4
-    myeccmap = raid.eccmap.eccmap(eccmapname)
+    myeccmap = raid.make.geteccmap(eccmapname)
     # any padding at end and block.Length fixes
     RoundupFile(filename, myeccmap.datasegments * INTSIZE)
     wholefile = ReadBinaryFile(filename)
@@ -237,9 +281,129 @@ def do_in_memory(filename, eccmapname, version, blockNumber, targetDir):
     #     return None
 
 
+def do_with_buffers(filename, eccmapname, version, blockNumber, targetDir):
+    """
+    Same as ``do_in_memory()`` and produces byte-identical "Data" and "Parity"
+    files, but every data segment is written with a single slice and every
+    parity segment is calculated with ``XorBuffers()`` over whole segments.
+    """
+    INTSIZE = 4
+    myeccmap = raid.make.geteccmap(eccmapname)
+    # any padding at end and block.Length fixes
+    RoundupFile(filename, myeccmap.datasegments * INTSIZE)
+    wholefile = ReadBinaryFile(filename)
+    length = len(wholefile)
+    seglength = (length + myeccmap.datasegments - 1) / myeccmap.datasegments
+    if seglength % INTSIZE != 0:
+        raise Exception('segment length %d is not a multiple of %d bytes' % (seglength, INTSIZE))
+    padding = seglength * myeccmap.datasegments - length
+    if padding > 0:
+        # any padding should go at the end of last seg
+        # and block.Length fixes
+        wholefile += ' ' * padding
+
+    segments = []
+    for DSegNum in xrange(myeccmap.datasegments):
+        segment = wholefile[DSegNum * seglength:(DSegNum + 1) * seglength]
+        FileName = targetDir + '/' + str(blockNumber) + '-' + str(DSegNum) + '-Data'
+        WriteFile(FileName, segment)
+        segments.append(segment)
+    del wholefile
+
+    paritymembers = [[] for _ in xrange(myeccmap.paritysegments)]
+    for DSegNum in xrange(myeccmap.datasegments):
+        for PSegNum in myeccmap.DataToParity[DSegNum]:
+            if PSegNum >= myeccmap.paritysegments:
+                myeccmap.check()
+                raise Exception("eccmap error")
+            paritymembers[PSegNum].append(segments[DSegNum])
+
+    for PSegNum in xrange(myeccmap.paritysegments):
+        FileName = targetDir + '/' + str(blockNumber) + '-' + str(PSegNum) + '-Parity'
+        WriteFile(FileName, XorBuffers(paritymembers[PSegNum], seglength))
+
+    dataNum = len(segments)
+    parityNum = len(paritymembers)
+    del segments
+    del paritymembers
+    del myeccmap
+    return dataNum, parityNum
+
+
+def do_mapped(filename, eccmapname, version, blockNumber, targetDir):
+    """
+    In-memory mode: input file (typically placed in the shared memory by
+    ``system.tmpfile``) is memory mapped and never modified or read back.
+    Padding is added virtually, every "Data" and "Parity" file is written
+    exactly once and result is byte-identical to ``do_in_memory()``.
+
+    Returns a tuple ``(dataNum, parityNum, timings)`` where ``timings`` is a
+    dictionary with time spent on every stage.
+    """
+    INTSIZE = 4
+    timings = {}
+    tm = time.time()
+    myeccmap = raid.make.geteccmap(eccmapname)
+    infile = open(filename, "rb")
+    length = os.fstat(infile.fileno()).st_size
+    if length == 0:
+        infile.close()
+        raise Exception('input file %s is empty' % filename)
+    mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    stepsize = myeccmap.datasegments * INTSIZE
+    roundedlength = ((length + stepsize - 1) / stepsize) * stepsize
+    seglength = roundedlength / myeccmap.datasegments
+    timings['map'] = time.time() - tm
+
+    tm = time.time()
+    segments = []
+    for DSegNum in xrange(myeccmap.datasegments):
+        segoffset = DSegNum * seglength
+        if segoffset + seglength <= length:
+            segment = buffer(mapped, segoffset, seglength)
+        else:
+            # any padding should go at the end of last seg
+            # and block.Length fixes
+            tail = max(0, length - segoffset)
+            segment = buffer(mapped, segoffset, tail) + ' ' * (seglength - tail)
+        FileName = targetDir + '/' + str(blockNumber) + '-' + str(DSegNum) + '-Data'
+        WriteFile(FileName, segment)
+        segments.append(segment)
+    timings['data'] = time.time() - tm
+
+    tm = time.time()
+    paritymembers = [[] for _ in xrange(myeccmap.paritysegments)]
+    for DSegNum in xrange(myeccmap.datasegments):
+        for PSegNum in myeccmap.DataToParity[DSegNum]:
+            if PSegNum >= myeccmap.paritysegments:
+                myeccmap.check()
+                raise Exception("eccmap error")
+            paritymembers[PSegNum].append(segments[DSegNum])
+    parities = []
+    for PSegNum in xrange(myeccmap.paritysegments):
+        parities.append(XorBuffers(paritymembers[PSegNum], seglength))
+    timings['parity'] = time.time() - tm
+
+    tm = time.time()
+    for PSegNum in xrange(myeccmap.paritysegments):
+        FileName = targetDir + '/' + str(blockNumber) + '-' + str(PSegNum) + '-Parity'
+        WriteFile(FileName, parities[PSegNum])
+    timings['write'] = time.time() - tm
+
+    dataNum = len(segments)
+    parityNum = len(parities)
+    del segments
+    del paritymembers
+    del parities
+    mapped.close()
+    infile.close()
+    del myeccmap
+    return dataNum, parityNum, timings
+
+
 def do_with_files(filename, eccmapname, version, blockNumber, targetDir):
     INTSIZE = 4
-    myeccmap = raid.eccmap.eccmap(eccmapname)
+    myeccmap = raid.make.geteccmap(eccmapname)
     RoundupFile(filename, myeccmap.datasegments * INTSIZE)      # any padding at end and block.Length fixes
     wholefile = ReadBinaryFile(filename)
     length = len(wholefile)
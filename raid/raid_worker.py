@@ -32,6 +32,14 @@
 
 BitDust raid_worker Automat
 
+Keeps a long-lived pool of ``pp`` worker processes.
+Every worker is warmed up with all ecc maps right after the start
+and the code of the tasks is cached there by ``pp`` as well,
+so the pool is never stopped until shutdown.
+Tasks of the same kind waiting in the queue are dispatched in batches.
+Number of workers, queue size and batch size are taken from the settings,
+use ``is_busy()`` to check if the pool is saturated.
+
 .. raw:: html
 
     <a href="raid_worker.png" target="_blank">
@@ -45,7 +53,6 @@ EVENTS:
     * :red:`shutdown`
     * :red:`task-done`
     * :red:`task-started`
-    * :red:`timer-1min`
 """
 
 import os
@@ -64,8 +71,12 @@ from logs import lg
 
 from system import bpio
 
+from main import settings
+
 from automats import automat
 
+from raid import eccmap
+
 import read
 import make
 import rebuild
@@ -74,6 +85,9 @@ import rebuild
 
 _MODULES = (
     'os',
+    'time',
+    'mmap',
+    'binascii',
     'cStringIO',
     'struct',
     'logs.lg',
@@ -90,8 +104,12 @@ _MODULES = (
 _VALID_TASKS = {
     'make': (make.do_in_memory,
              (make.RoundupFile, make.ReadBinaryFile, make.WriteFile)),
+    'make-xor': (make.do_with_buffers,
+                 (make.RoundupFile, make.ReadBinaryFile, make.WriteFile, make.XorBuffers)),
+    'make-mmap': (make.do_mapped,
+                  (make.WriteFile, make.XorBuffers)),
     'read': (read.raidread,
-             (read.RebuildOne, read.ReadBinaryFile,)),
+             (read.RebuildOne, read.RebuildMany, read.ReadBinaryFile,)),
     'rebuild': (rebuild.rebuild,
                 ()),
 }
@@ -108,6 +126,31 @@ def add_task(cmd, params, callback):
     A('new-task', (cmd, params, callback))
 
 
+def is_busy():
+    """
+    Return True if the pool is saturated: too many tasks are waiting in the
+    queue and the caller should stop producing new tasks for awhile.
+    """
+    if not A():
+        return False
+    return len(A().tasks) >= settings.getRaidWorkerQueueSize()
+
+
+def run_batch(funcname, params_list):
+    """
+    Executed inside of a ``pp`` worker process where all task functions are
+    defined globally. Runs several tasks of the same kind one by one and
+    returns a list of results.
+    """
+    results = []
+    for params in params_list:
+        try:
+            results.append(globals()[funcname](*params))
+        except:
+            results.append(None)
+    return results
+
+
 def cancel_task(cmd, first_parameter):
     if not A():
         lg.out(10, 'raid_worker.cancel_task SKIP _RaidWorker is not started')
@@ -117,7 +160,7 @@ def cancel_task(cmd, first_parameter):
     for t_id, t_cmd, t_params in A().tasks:
         if cmd == t_cmd and first_parameter == t_params[0]:
             try:
-                A().tasks.remove(t_id, t_cmd, t_params)
+                A().tasks.remove((t_id, t_cmd, t_params, ))
                 lg.out(10, 'raid_worker.cancel_task found pending task %d, canceling %s' % (t_id, first_parameter))
             except:
                 lg.warn('failed removing pending task %d, %s' % (t_id, first_parameter))
@@ -166,10 +209,6 @@ class RaidWorker(automat.Automat):
     machine.
     """
 
-    timers = {
-        'timer-1min': (60, ['READY']),
-    }
-
     def init(self):
         """
         Method to initialize additional variables and flags at creation of the
@@ -211,9 +250,6 @@ class RaidWorker(automat.Automat):
                 self.state = 'CLOSED'
                 self.doKillProcess(arg)
                 self.doDestroyMe(arg)
-            elif event == 'timer-1min':
-                self.state = 'OFF'
-                self.doKillProcess(arg)
         #---WORK---
         elif self.state == 'WORK':
             if event == 'new-task':
@@ -272,15 +308,20 @@ class RaidWorker(automat.Automat):
         Action method.
         """
         os.environ['PYTHONUNBUFFERED'] = '1'
-        ncpus = bpio.detect_number_of_cpu_cores()
-        if ncpus > 1:
-            # do not use all CPU cors at once
-            # need to keep at least one for all other operations
-            # even decided to use only half of CPUs at the moment
-            # TODO: make an option in the software settings
-            ncpus = int(ncpus / 2.0)
+        ncpus = settings.getRaidWorkersNumber()
+        if ncpus <= 0:
+            ncpus = bpio.detect_number_of_cpu_cores()
+            if ncpus > 1:
+                # do not use all CPU cors at once
+                # need to keep at least one for all other operations
+                # by default use only half of CPUs
+                ncpus = int(ncpus / 2.0)
         self.processor = pp.Server(secret='bitdust', ncpus=ncpus,
                                    loglevel=lg.get_loging_level())
+        # every worker will create all ecc maps in advance and keep them in memory
+        for _ in xrange(ncpus):
+            self.processor.submit(make.preload, (eccmap.EccMapNames(), ),
+                                  modules=_MODULES, depfuncs=())
         self.automat('process-started')
 
     def doKillProcess(self, arg):
@@ -306,9 +347,10 @@ class RaidWorker(automat.Automat):
         """
         global _VALID_TASKS
         global _MODULES
-        if len(self.activetasks) >= self.processor.get_ncpus():
+        active_jobs = self._active_jobs()
+        if active_jobs >= self.processor.get_ncpus():
             lg.out(12, 'raid_worker.doStartTask SKIP active=%d cpus=%d' % (
-                len(self.activetasks), self.processor.get_ncpus()))
+                active_jobs, self.processor.get_ncpus()))
             return
         try:
             task_id, cmd, params = self.tasks.pop(0)
@@ -316,12 +358,25 @@ class RaidWorker(automat.Automat):
         except:
             lg.exc()
             return
-        proc = self.processor.submit(func, params,
-                                     modules=_MODULES, depfuncs=depfuncs,
-                                     callback=lambda result: self._job_done(task_id, cmd, params, result))
-        self.activetasks[task_id] = (proc, cmd, params)
-        lg.out(12, 'raid_worker.doStartTask %r active=%d cpus=%d' % (
-            task_id, len(self.activetasks), self.processor.get_ncpus()))
+        # take more tasks of same kind from the queue, but share them evenly between free workers
+        free_cpus = max(1, self.processor.get_ncpus() - active_jobs)
+        batch_size = min(settings.getRaidWorkerBatchSize(), max(1, (len(self.tasks) + free_cpus) / free_cpus))
+        batch = [(task_id, params), ]
+        while len(batch) < batch_size and self.tasks and self.tasks[0][1] == cmd:
+            t_id, _, t_params = self.tasks.pop(0)
+            batch.append((t_id, t_params, ))
+        if len(batch) == 1:
+            proc = self.processor.submit(func, params,
+                                         modules=_MODULES, depfuncs=depfuncs,
+                                         callback=lambda result: self._job_done(task_id, cmd, params, result))
+        else:
+            proc = self.processor.submit(run_batch, (func.func_name, [batch_params for batch_task_id, batch_params in batch], ),
+                                         modules=_MODULES, depfuncs=(func, ) + depfuncs,
+                                         callback=lambda results: self._batch_done(cmd, batch, results))
+        for t_id, t_params in batch:
+            self.activetasks[t_id] = (proc, cmd, t_params)
+        lg.out(12, 'raid_worker.doStartTask %r batch=%d active=%d cpus=%d' % (
+            task_id, len(batch), len(self.activetasks), self.processor.get_ncpus()))
         reactor.callLater(0.01, self.automat, 'task-started', task_id)
 
     def doReportTaskDone(self, arg):
@@ -368,6 +423,17 @@ class RaidWorker(automat.Automat):
             task_id, result, self.activetasks.keys()))
         self.automat('task-done', (task_id, cmd, params, result))
 
+    def _batch_done(self, cmd, batch, results):
+        if not isinstance(results, list) or len(results) != len(batch):
+            lg.warn('batch of %d tasks failed: %r' % (len(batch), results))
+            results = [None, ] * len(batch)
+        for i in xrange(len(batch)):
+            task_id, params = batch[i]
+            self._job_done(task_id, cmd, params, results[i])
+
+    def _active_jobs(self):
+        return len(set([id(task_data[0]) for task_data in self.activetasks.values()]))
+
     def _kill_processor(self):
         if self.processor:
             self.processor.destroy()
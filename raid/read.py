@@ -61,6 +61,7 @@ import struct
 #------------------------------------------------------------------------------
 
 import raid.eccmap
+import raid.make
 
 #------------------------------------------------------------------------------
 
@@ -98,44 +99,78 @@ def ReadBinaryFile(filename):
     except:
         return ''
 
-# RebuildOne_new and RebuildOne_orig are just for debugging purposes
 
+def RebuildMany(tasks, windowsize=1024 * 1024):
+    """
+    Streaming reconstruction of one or several segments in a single pass.
 
-def RebuildOne(inlist, listlen, outfilename):
-    readsize = 1  # vary from 1 byte to 4 bytes
-    # range(listlen)   # just need a list of this size
-    raidfiles = [''] * listlen
-    raidreads = [''] * listlen  # range(listlen)
-    for filenum in xrange(listlen):
+    Every item in ``tasks`` is a tuple ``(inlist, outfilename)``: all files
+    from ``inlist`` are XOR-ed together and result is written to
+    ``outfilename``, output length is taken from the first input file.
+    Every input file is opened and read only once even if it is used by
+    several tasks, reading is done in ``windowsize`` chunks into the same
+    pre-allocated buffers and XOR is done with ``raid.make.XorBuffers()``.
+    """
+    filenames = []
+    for inlist, _ in tasks:
+        for filename in inlist:
+            if filename not in filenames:
+                filenames.append(filename)
+    infiles = {}
+    for filename in filenames:
         try:
-            raidfiles[filenum] = open(inlist[filenum], "rb")
+            infiles[filename] = open(filename, "rb")
         except:
-            for f in raidfiles:
+            for f in infiles.values():
                 try:
                     f.close()
                 except:
                     pass
             return False
-    rebuildfile = open(outfilename, "wb")
-    while True:
-        for k in xrange(listlen):
-            raidreads[k] = raidfiles[k].read(2048)
-        if not raidreads[0]:
-            break
-        i = 0
-        while i < len(raidreads[0]):
-            xor = 0
-            for j in xrange(listlen):
-                b1 = ord(raidreads[j][i])
-                xor = xor ^ b1
-            rebuildfile.write(chr(xor))
-            i += readsize
-    for filenum in xrange(listlen):
-        raidfiles[filenum].close()
-    rebuildfile.close()
+    buffers = {}
+    for filename in filenames:
+        buffers[filename] = bytearray(windowsize)
+    sizes = {}
+    outfiles = []
+    for _, outfilename in tasks:
+        outfiles.append(open(outfilename, "wb"))
+    finished = [False, ] * len(tasks)
+    while not all(finished):
+        for filename in filenames:
+            sizes[filename] = infiles[filename].readinto(buffers[filename])
+        for tasknum in xrange(len(tasks)):
+            if finished[tasknum]:
+                continue
+            inlist = tasks[tasknum][0]
+            size = sizes[inlist[0]]
+            if not size:
+                finished[tasknum] = True
+                continue
+            chunks = []
+            for filename in inlist:
+                if sizes[filename] >= size:
+                    chunks.append(buffer(buffers[filename], 0, size))
+                else:
+                    # shorter input files are treated as padded with zeros
+                    chunks.append(buffer(buffers[filename], 0, sizes[filename]) + '\x00' * (size - sizes[filename]))
+            outfiles[tasknum].write(raid.make.XorBuffers(chunks, size))
+    for f in infiles.values():
+        f.close()
+    for f in outfiles:
+        f.close()
     return True
 
 
+def RebuildOne(inlist, listlen, outfilename):
+    """
+    XOR first ``listlen`` files from ``inlist`` and write result to
+    ``outfilename``, this is a wrapper around ``RebuildMany()``.
+    """
+    return RebuildMany([(inlist[:listlen], outfilename), ])
+
+# RebuildOne_new and RebuildOne_orig are just for debugging purposes
+
+
 def RebuildOne_new(inlist, listlen, outfilename):
     fds = range(0, listlen)   # just need a list of this size
     wholefile = ReadBinaryFile(inlist[0])
@@ -190,11 +225,14 @@ def raidread(
         version,
         blockNumber,
         data_parity_dir):
-    myeccmap = raid.eccmap.eccmap(eccmapname)
-    GoodFiles = range(0, 200)
+    myeccmap = raid.make.geteccmap(eccmapname)
     MakingProgress = 1
     while MakingProgress == 1:
         MakingProgress = 0
+        # all segments which can be fixed at this step are rebuilt together
+        # in one pass over the files, next step may fix more using them
+        RebuildTasks = []
+        BadNames = set()
         for PSegNum in xrange(myeccmap.paritysegments):
             PFileName = os.path.join(
                 data_parity_dir,
@@ -207,6 +245,7 @@ def raidread(
                 Map = myeccmap.ParityToData[PSegNum]
                 TotalDSegs = 0
                 GoodDSegs = 0
+                GoodFiles = []
                 for DSegNum in Map:
                     TotalDSegs += 1
                     FileName = os.path.join(
@@ -217,15 +256,16 @@ def raidread(
                         str(DSegNum) +
                         '-Data')
                     if os.path.exists(FileName):
-                        GoodFiles[GoodDSegs] = FileName
+                        GoodFiles.append(FileName)
                         GoodDSegs += 1
                     else:
                         BadName = FileName
-                if GoodDSegs == TotalDSegs - 1:
-                    MakingProgress = 1
-                    GoodFiles[GoodDSegs] = PFileName
-                    GoodDSegs += 1
-                    RebuildOne(GoodFiles, GoodDSegs, BadName)
+                if GoodDSegs == TotalDSegs - 1 and BadName not in BadNames:
+                    GoodFiles.append(PFileName)
+                    RebuildTasks.append((GoodFiles, BadName))
+                    BadNames.add(BadName)
+        if RebuildTasks and RebuildMany(RebuildTasks):
+            MakingProgress = 1
     #  Count up the good segments and combine
     GoodDSegs = 0
     output = open(OutputFileName, "wb")
@@ -73,8 +73,9 @@ def rebuild(backupID, blockNum, eccMap, availableSuppliers, remoteMatrix, localM
     while madeProgress:
         madeProgress = False
         # will check all data packets we have
+        # and rebuild all of the missing which can be fixed right now in a single pass
+        rebuildTasks = []
         for supplierNum in xrange(supplierCount):
-            dataFileName = _build_raid_file_name(supplierNum, 'Data')
             # if we do not have this item on hands - we will reconstruct it from other items
             if localData[supplierNum] == 0:
                 parityNum, parityMap = eccMap.GetDataFixPath(localData, localParity, supplierNum)
@@ -87,7 +88,12 @@ def rebuild(backupID, blockNum, eccMap, availableSuppliers, remoteMatrix, localM
                             if os.path.isfile(filename):
                                 rebuildFileList.append(filename)
                     # lg.out(10, '    rebuilding file %s from %d files' % (os.path.basename(dataFileName), len(rebuildFileList)))
-                    raid.read.RebuildOne(rebuildFileList, len(rebuildFileList), dataFileName)
+                    rebuildTasks.append((rebuildFileList, _build_raid_file_name(supplierNum, 'Data')))
+        if rebuildTasks:
+            raid.read.RebuildMany(rebuildTasks)
+        for supplierNum in xrange(supplierCount):
+            dataFileName = _build_raid_file_name(supplierNum, 'Data')
+            if localData[supplierNum] == 0:
                 if os.path.exists(dataFileName):
                     localData[supplierNum] = 1
                     madeProgress = True
@@ -102,8 +108,10 @@ def rebuild(backupID, blockNum, eccMap, availableSuppliers, remoteMatrix, localM
                 # self.outstandingFilesList.append((dataFileName, self.BuildFileName(supplierNum, 'Data'), supplierNum))
                 # self.dataSent[supplierNum] = 1
     # now with parities ...
+    # all Data segments are known at that point, so every Parity can be rebuilt in one pass
+    rebuildTasks = []
+    rebuildParities = []
     for supplierNum in xrange(supplierCount):
-        parityFileName = _build_raid_file_name(supplierNum, 'Parity')
         if localParity[supplierNum] == 0:
             parityMap = eccMap.ParityToData[supplierNum]
             HaveAllData = True
@@ -118,10 +126,16 @@ def rebuild(backupID, blockNum, eccMap, availableSuppliers, remoteMatrix, localM
                     if os.path.isfile(filename):
                         rebuildFileList.append(filename)
                 # lg.out(10, '    rebuilding file %s from %d files' % (os.path.basename(parityFileName), len(rebuildFileList)))
-                raid.read.RebuildOne(rebuildFileList, len(rebuildFileList), parityFileName)
-                if os.path.exists(parityFileName):
-                    # lg.out(10, '        Parity file %s found after rebuilding for supplier %d' % (os.path.basename(parityFileName), supplierNum))
-                    localParity[supplierNum] = 1
+                rebuildTasks.append((rebuildFileList, _build_raid_file_name(supplierNum, 'Parity')))
+                rebuildParities.append(supplierNum)
+    if rebuildTasks:
+        raid.read.RebuildMany(rebuildTasks)
+    for supplierNum in xrange(supplierCount):
+        parityFileName = _build_raid_file_name(supplierNum, 'Parity')
+        if localParity[supplierNum] == 0 and supplierNum in rebuildParities:
+            if os.path.exists(parityFileName):
+                # lg.out(10, '        Parity file %s found after rebuilding for supplier %d' % (os.path.basename(parityFileName), supplierNum))
+                localParity[supplierNum] = 1
         # so we have the parity on hand and it is missing - send it
         if localParity[supplierNum] == 1 and missingParity[supplierNum] == 1:  # and self.paritySent[supplierNum] == 0:
             # lg.out(10, '            rebuilt a new Parity for supplier %d' % supplierNum)
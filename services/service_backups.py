@@ -128,6 +128,12 @@ class BackupsService(LocalService):
                 # TODO: move to service_backup_db
                 backup_control.IncomingSupplierBackupIndex(newpacket)
                 return True
+            if newpacket.PacketID == global_id.MakeGlobalID(
+                idurl=my_id.getLocalID(),
+                path=settings.BackupIndexDeltaFileName(),
+            ):
+                backup_control.IncomingSupplierBackupIndexDelta(newpacket)
+                return True
         if newpacket.Command == commands.Files():
             if not newpacket.PacketID.startswith(my_id.getGlobalID() + ':'):
                 # skip Files() which are from another customer
@@ -77,6 +77,10 @@ class SupplierService(LocalService):
         events.remove_subscriber(self._on_customer_terminated, 'existing-customer-denied')
         events.remove_subscriber(self._on_customer_terminated, 'existing-customer-terminated')
         callback.remove_inbox_callback(self._on_inbox_packet_received)
+        from supplier import segment_store
+        segment_store.shutdown()
+        from supplier import list_files
+        list_files.shutdown()
         return True
 
     def request(self, json_payload, newpacket, info):
@@ -241,7 +245,8 @@ class SupplierService(LocalService):
             if packetID not in [settings.BackupInfoFileName(),
                                 settings.BackupInfoFileNameOld(),
                                 settings.BackupInfoEncryptedFileName(),
-                                settings.BackupIndexFileName()]:
+                                settings.BackupIndexFileName(),
+                                settings.BackupIndexDeltaFileName()]:
                 lg.warn('invalid file path')
                 return ''
         if not contactsdb.is_customer(customerIDURL):  # SECURITY
@@ -254,6 +259,41 @@ class SupplierService(LocalService):
         filename = self._do_construct_filename(customerGlobID, packetID, keyAlias)
         return filename
 
+    def _do_segment_key(self, glob_path):
+        """
+        Return a key for ``supplier.segment_store`` if this packet must be stored there
+        or None if it must be written to a separate file.
+        """
+        from lib import packetid
+        from main import settings
+        from supplier import segment_store
+        if not settings.getSupplierSegmentStoreEnabled():
+            return None
+        if not packetid.IsPacketNameCorrect(glob_path['path'].rpartition('/')[2]):
+            return None
+        return segment_store.make_key(glob_path['key_alias'], glob_path['path'])
+
+    def _do_read_segment(self, glob_path):
+        from supplier import segment_store
+        s = segment_store.existing_store(glob_path['customer'])
+        if s is None:
+            return None
+        return s.read(segment_store.make_key(glob_path['key_alias'], glob_path['path']))
+
+    def _do_delete_segments(self, glob_path):
+        """
+        Remove a packet or all packets in given folder from ``supplier.segment_store``.
+        """
+        from supplier import segment_store
+        s = segment_store.existing_store(glob_path['customer'])
+        if s is None:
+            return 0
+        key = segment_store.make_key(glob_path['key_alias'], glob_path['path'])
+        count = s.delete_prefix(key + '/')
+        if s.delete(key):
+            count += 1
+        return count
+
     def _on_inbox_packet_received(self, newpacket, info, status, error_message):
         from p2p import commands
         if newpacket.Command == commands.DeleteFile():
@@ -273,6 +313,7 @@ class SupplierService(LocalService):
         from userid import global_id
         from p2p import p2p_service
         from main import events
+        from supplier import list_files
         if newpacket.Payload == '':
             ids = [newpacket.PacketID, ]
         else:
@@ -299,6 +340,8 @@ class SupplierService(LocalService):
                 lg.warn("got empty filename, bad customer or wrong packetID?")
                 p2p_service.SendFail(newpacket, 'not a customer, or file not found')
                 return False
+            segments = self._do_delete_segments(glob_path)
+            filescount += segments
             if os.path.isfile(filename):
                 try:
                     os.remove(filename)
@@ -311,8 +354,9 @@ class SupplierService(LocalService):
                     dirscount += 1
                 except:
                     lg.exc()
-            else:
+            elif not segments:
                 lg.warn("path not found %s" % filename)
+            list_files.update(newpacket.OwnerID, glob_path['key_alias'], glob_path['path'])
             events.send('supplier-file-modified', data=dict(
                 action='delete',
                 glob_path=glob_path['path'],
@@ -330,6 +374,7 @@ class SupplierService(LocalService):
         from userid import global_id
         from p2p import p2p_service
         from main import events
+        from supplier import list_files
         if newpacket.Payload == '':
             ids = [newpacket.PacketID, ]
         else:
@@ -355,6 +400,7 @@ class SupplierService(LocalService):
                 lg.warn("got empty filename, bad customer or wrong packetID?")
                 p2p_service.SendFail(newpacket, 'not a customer, or file not found')
                 return False
+            segments = self._do_delete_segments(glob_path)
             if os.path.isdir(filename):
                 try:
                     bpio._dir_remove(filename)
@@ -367,8 +413,11 @@ class SupplierService(LocalService):
                     count += 1
                 except:
                     lg.exc()
+            elif segments:
+                count += 1
             else:
                 lg.warn("path not found %s" % filename)
+            list_files.update(newpacket.OwnerID, glob_path['key_alias'], glob_path['path'])
             events.send('supplier-file-modified', data=dict(
                 action='delete',
                 glob_path=glob_path['path'],
@@ -420,15 +469,18 @@ class SupplierService(LocalService):
             lg.warn("had empty filename")
             p2p_service.SendFail(newpacket, 'empty filename')
             return False
-        if not os.path.exists(filename):
-            lg.warn("did not find requested file locally : %s" % filename)
-            p2p_service.SendFail(newpacket, 'did not find requested file locally')
-            return False
-        if not os.access(filename, os.R_OK):
-            lg.warn("no read access to requested packet %s" % filename)
-            p2p_service.SendFail(newpacket, 'no read access to requested packet')
-            return False
-        data = bpio.ReadBinaryFile(filename)
+        if os.path.exists(filename):
+            if not os.access(filename, os.R_OK):
+                lg.warn("no read access to requested packet %s" % filename)
+                p2p_service.SendFail(newpacket, 'no read access to requested packet')
+                return False
+            data = bpio.ReadBinaryFile(filename)
+        else:
+            data = self._do_read_segment(glob_path)
+            if data is None:
+                lg.warn("did not find requested file locally : %s" % filename)
+                p2p_service.SendFail(newpacket, 'did not find requested file locally')
+                return False
         if not data:
             lg.warn("empty data on disk %s" % filename)
             p2p_service.SendFail(newpacket, 'empty data on disk')
@@ -484,8 +536,9 @@ class SupplierService(LocalService):
             lg.warn("got empty filename, bad customer or wrong packetID?")
             p2p_service.SendFail(newpacket, 'empty filename')
             return False
+        segment_key = self._do_segment_key(glob_path)
         dirname = os.path.dirname(filename)
-        if not os.path.exists(dirname):
+        if not segment_key and not os.path.exists(dirname):
             try:
                 bpio._dirs_make(dirname)
             except:
@@ -513,13 +566,27 @@ class SupplierService(LocalService):
                     return False
             except:
                 lg.exc()
-        if not bpio.WriteFile(filename, data):
+        if segment_key:
+            from supplier import segment_store
+            if not segment_store.store(glob_path['customer']).write(segment_key, data):
+                lg.err("can not write %s to the segment store" % segment_key)
+                p2p_service.SendFail(newpacket, 'write error')
+                return False
+            if os.path.isfile(filename):
+                # older copy of that packet was stored in a separate file
+                try:
+                    os.remove(filename)
+                except:
+                    lg.exc()
+        elif not bpio.WriteFile(filename, data):
             lg.err("can not write to %s" % str(filename))
             p2p_service.SendFail(newpacket, 'write error')
             return False
         # Here Data() packet was stored as it is on supplier node (current machine)
         sz = len(data)
         del data
+        from supplier import list_files
+        list_files.update(newpacket.OwnerID, glob_path['key_alias'], glob_path['path'])
         lg.out(self.debug_level, "service_supplier._on_data %r saved from [%s | %s] to %s with %d bytes" % (
             newpacket, newpacket.OwnerID, newpacket.CreatorID, filename, sz, ))
         p2p_service.SendAck(newpacket, str(len(newpacket.Payload)))
@@ -536,11 +603,13 @@ class SupplierService(LocalService):
 
     def _on_list_files(self, newpacket):
         from main import settings
-        if newpacket.Payload != settings.ListFilesFormat():
+        # customer can add a revision of the list he already have to receive only changes
+        format_type, _, since = newpacket.Payload.partition(' ')
+        if format_type != settings.ListFilesFormat():
             return False
         # TODO: perform validations before sending back list of files
         from supplier import list_files
-        list_files.send(newpacket.OwnerID, newpacket.PacketID, settings.ListFilesFormat())
+        list_files.send(newpacket.OwnerID, newpacket.PacketID, settings.ListFilesFormat(), since=since or None)
         return True
 
     def _on_customer_accepted(self, e):
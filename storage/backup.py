@@ -56,6 +56,19 @@ block encryption using the private key and the transfer of units to the supplier
 
 Reading is performed from the opened ".tar" pipe and must be finished
 as soon as empty chunk of data were read from the pipe.
+
+In the pipelined mode (see ``settings.getBackupPipelineEnabled()``) blocks are
+encrypted in a thread pool, out of the main reactor thread,
+and reading of the next block starts right after the previous block was passed
+for encryption. So reading, encryption and RAID are running at same time
+for different blocks, number of blocks in flight is limited
+by ``settings.getBackupPipelineBlocks()`` and also paused if RAID workers are busy.
+Throughput of every stage is counted and reported at the end.
+
+In the incremental mode (see ``storage.dedup``) the data is split into
+content-defined chunks instead of equal blocks, every block keeps one new chunk
+and references to chunks already stored in this or previous versions,
+so not changed data is not encrypted and uploaded again.
 The encrypted data blocks are stored in a temporary folder on the HDD
 and deleted (user configurable) as soon as the suppliers have them.
 
@@ -93,6 +106,7 @@ try:
 except:
     sys.exit('Error initializing twisted.internet.reactor in backup.py')
 
+from twisted.internet import threads
 from twisted.internet.defer import maybeDeferred
 
 #------------------------------------------------------------------------------
@@ -124,6 +138,8 @@ from raid import raid_worker
 from crypt import encrypted
 from crypt import key
 
+from storage import dedup
+
 #-------------------------------------------------------------------------------
 
 
@@ -144,7 +160,8 @@ class backup(automat.Automat):
                  blockResultCallback=None,
                  blockSize=None,
                  sourcePath=None,
-                 keyID=None, ):
+                 keyID=None,
+                 deduplicate=False, ):
         self.backupID = backupID
         _parts = packetid.SplitBackupID(self.backupID)
         self.customerGlobalID = _parts[0]
@@ -154,6 +171,16 @@ class backup(automat.Automat):
         self.sourcePath = sourcePath
         self.keyID = keyID
         self.eccmap = eccmap.Current()
+        self.raidCommand = settings.getBackupRaidMakeCommand()
+        self.raidTimings = {}
+        self.pipelined = settings.getBackupPipelineEnabled()
+        self.blocksInFlight = settings.getBackupPipelineBlocks()
+        self.encryptingBlocks = set()
+        self.stageStats = {
+            'read': [0, 0.0],
+            'encrypt': [0, 0.0],
+            'raid': [0, 0.0],
+        }
         self.pipe = pipe
         self.blockSize = blockSize
         if self.blockSize is None:
@@ -165,6 +192,18 @@ class backup(automat.Automat):
         self.closed = False
         self.currentBlockData = cStringIO.StringIO()
         self.currentBlockSize = 0
+        self.deduplicate = deduplicate
+        self.dedupPieces = []
+        self.dedupSize = 0
+        self.dedupRefs = []
+        self.dedupReady = False
+        self.dedupPending = {}
+        self.dedupStats = {
+            'chunks': 0,
+            'bytes': 0,
+            'new_chunks': 0,
+            'new_bytes': 0,
+        }
         self.workBlocks = {}
         self.blockNumber = 0
         self.dataSent = 0
@@ -189,9 +228,18 @@ class backup(automat.Automat):
                 self.doFirstBlock(arg)
         #---READ---
         elif self.state == 'READ':
-            if event == 'read-success' and not self.isReadingNow(arg) and ( self.isBlockReady(arg) or self.isEOF(arg) ):
+            if event == 'read-success' and not self.isReadingNow(arg) and self.isEOF(arg) and self.isPipelined(arg):
+                self.state = 'RAID'
+                self.doEncryptBlock(arg)
+            elif ( event == 'read-success' or event == 'timer-001sec' ) and not self.isAborted(arg) and not self.isReadingNow(arg) and not self.isEOF(arg) and self.isBlockReady(arg) and self.isPipelined(arg) and not self.isPipelineFull(arg):
+                self.doEncryptBlock(arg)
+                self.doNextBlock(arg)
+                self.doRead(arg)
+            elif event == 'read-success' and not self.isReadingNow(arg) and ( self.isBlockReady(arg) or self.isEOF(arg) ) and not self.isPipelined(arg):
                 self.state = 'ENCRYPT'
                 self.doEncryptBlock(arg)
+            elif event == 'block-encrypted':
+                self.doBlockPushAndRaid(arg)
             elif event == 'fail' or ( ( event == 'read-success' or event == 'timer-001sec' ) and self.isAborted(arg) ):
                 self.state = 'ABORTED'
                 self.doClose(arg)
@@ -205,7 +253,7 @@ class backup(automat.Automat):
                 data_sender.A('new-data')
         #---RAID---
         elif self.state == 'RAID':
-            if event == 'block-raid-done' and not self.isMoreBlocks(arg) and not self.isAborted(arg):
+            if event == 'block-raid-done' and not self.isMoreBlocks(arg) and not self.isAborted(arg) and self.isEOF(arg):
                 self.state = 'DONE'
                 self.doPopBlock(arg)
                 self.doBlockReport(arg)
@@ -213,14 +261,21 @@ class backup(automat.Automat):
                 self.doClose(arg)
                 self.doReport(arg)
                 self.doDestroyMe(arg)
-            elif event == 'block-raid-started' and not self.isEOF(arg) and not self.isAborted(arg):
+            elif event == 'block-raid-started' and not self.isEOF(arg) and not self.isAborted(arg) and not self.isRaidBusy(arg):
                 self.state = 'READ'
                 self.doNextBlock(arg)
                 self.doRead(arg)
-            elif event == 'block-raid-done' and self.isMoreBlocks(arg) and not self.isAborted(arg):
+            elif event == 'block-raid-started' and not self.isEOF(arg) and not self.isAborted(arg) and self.isRaidBusy(arg):
+                self.doNextBlock(arg)
+            elif event == 'block-raid-done' and ( self.isMoreBlocks(arg) or not self.isEOF(arg) ) and not self.isAborted(arg):
                 self.doPopBlock(arg)
                 self.doBlockReport(arg)
                 data_sender.A('new-data')
+            elif event == 'timer-01sec' and not self.isEOF(arg) and not self.isAborted(arg) and not self.isRaidBusy(arg):
+                self.state = 'READ'
+                self.doRead(arg)
+            elif event == 'block-encrypted':
+                self.doBlockPushAndRaid(arg)
             elif event == 'fail' or ( ( event == 'timer-01sec' or event == 'block-raid-done' or event == 'block-raid-started' ) and self.isAborted(arg) ):
                 self.state = 'ABORTED'
                 self.doClose(arg)
@@ -262,6 +317,8 @@ class backup(automat.Automat):
         return self.pipe is not None and self.pipe.state() in [nonblocking.PIPE_CLOSED, nonblocking.PIPE_READY2READ]
 
     def isBlockReady(self, arg):
+        if self.deduplicate:
+            return self.dedupReady
         return self.currentBlockSize >= self.blockSize
 
     def isEOF(self, arg):
@@ -274,7 +331,33 @@ class backup(automat.Automat):
         """
         Condition method.
         """
-        return len(self.workBlocks) > 1
+        return len(self.workBlocks) + len(self.encryptingBlocks) > 1
+
+    def isPipelined(self, arg):
+        """
+        Condition method.
+        """
+        return self.pipelined
+
+    def isPipelineFull(self, arg):
+        """
+        Condition method.
+
+        Return True if enough blocks are already in flight and reading of a
+        new block must wait.
+        """
+        if len(self.workBlocks) + len(self.encryptingBlocks) >= self.blocksInFlight:
+            return True
+        return raid_worker.is_busy()
+
+    def isRaidBusy(self, arg):
+        """
+        Condition method.
+
+        Return True if RAID workers are saturated, reading is paused until
+        they catch up.
+        """
+        return raid_worker.is_busy()
 
     def doInit(self, arg):
         """
@@ -283,8 +366,16 @@ class backup(automat.Automat):
         events.send('backup-started', dict(backup_id=self.backupID))
 
     def doRead(self, arg):
+        started = time.time()
+
         def readChunk():
-            size = self.blockSize - self.currentBlockSize
+            if self.deduplicate:
+                size = self.blockSize - self.dedupSize
+                if size <= 0 or self.dedupReady:
+                    # enough data in the buffer already
+                    return None
+            else:
+                size = self.blockSize - self.currentBlockSize
             if size < 0:
                 lg.out(1, "backup.readChunk ERROR eccmap.nodes=" + str(self.eccmap.nodes()))
                 lg.out(1, "backup.readChunk ERROR blockSize=" + str(self.blockSize))
@@ -311,11 +402,20 @@ class backup(automat.Automat):
             return ''
 
         def readDone(data):
-            self.currentBlockData.write(data)
-            self.currentBlockSize += len(data)
             self.stateReading = False
+            if data is None:
+                reactor.callLater(0, self.automat, 'read-success')
+                return
+            self._count_stage('read', len(data), time.time() - started)
             if data == '':
                 self.stateEOF = True
+            if self.deduplicate:
+                self.dedupPieces.append(data)
+                self.dedupSize += len(data)
+                self._dedup_cut()
+            else:
+                self.currentBlockData.write(data)
+                self.currentBlockSize += len(data)
             reactor.callLater(0, self.automat, 'read-success')
             #out(12, 'backup.readDone %d bytes' % len(data))
 
@@ -325,26 +425,46 @@ class backup(automat.Automat):
         d.addErrback(lambda err: self.automat('fail', err))
 
     def doEncryptBlock(self, arg):
+        # all values are taken here because in pipelined mode
+        # next block will be already reading while this one is encrypting
+        src = self.currentBlockData.getvalue()
+        blockNumber = self.blockNumber
+        atEOF = self.stateEOF
+        if not self.keyID or packetid.KeyAlias(self.keyID) == 'master':
+            sessionKeyType = key.StreamSessionKeyType()
+        else:
+            # shared data must be readable by other users running older versions
+            sessionKeyType = key.SessionKeyType()
+
         def _doBlock():
             dt = time.time()
-            src = self.currentBlockData.getvalue()
             block = encrypted.Block(
                 my_id.getLocalID(),
                 self.backupID,
-                self.blockNumber,
+                blockNumber,
                 key.NewSessionKey(),
-                key.SessionKeyType(),
-                self.stateEOF,
+                sessionKeyType,
+                atEOF,
                 src,
                 EncryptKey=self.keyID,
             )
-            del src
             if _Debug:
                 lg.out(_DebugLevel, 'backup.doEncryptBlock blockNumber=%d size=%d atEOF=%s dt=%s EncryptKey=%s' % (
-                    self.blockNumber, self.currentBlockSize, self.stateEOF, str(time.time() - dt), self.keyID))
-            return block
-        d = maybeDeferred(_doBlock)
-        d.addCallback(lambda block: self.automat('block-encrypted', block))
+                    blockNumber, len(src), atEOF, str(time.time() - dt), self.keyID))
+            return block, time.time() - dt
+
+        def _blockDone(result):
+            block, dt = result
+            self.encryptingBlocks.discard(blockNumber)
+            self._count_stage('encrypt', len(src), dt)
+            self.automat('block-encrypted', block)
+
+        if self.pipelined:
+            self.encryptingBlocks.add(blockNumber)
+            d = threads.deferToThread(_doBlock)
+        else:
+            d = maybeDeferred(_doBlock)
+        d.addCallback(_blockDone)
         d.addErrback(lambda err: self.automat('fail', err))
 
     def doBlockPushAndRaid(self, arg):
@@ -362,22 +482,24 @@ class backup(automat.Automat):
             self.automat('block-raid-done', (newblock.BlockNumber, None))
             lg.out(_DebugLevel, 'backup.doBlockPushAndRaid SKIP, terminating=True')
             return
-        fileno, filename = tmpfile.make('raid')
+        dt = time.time()
+        fileno, filename = tmpfile.make('raid', shared=(self.raidCommand == 'make-mmap'))
         serializedblock = newblock.Serialize()
         blocklen = len(serializedblock)
-        os.write(fileno, str(blocklen) + ":" + serializedblock)
+        os.write(fileno, str(blocklen) + ":")
+        os.write(fileno, serializedblock)
         os.close(fileno)
         self.workBlocks[newblock.BlockNumber] = filename
+        prepare_time = time.time() - dt
         # key_alias = 'master'
         # if self.keyID:
         #     key_alias = packetid.KeyAlias(self.keyID)
-        dt = time.time()
         customer_dir = self.customerGlobalID  # global_id.MakeGlobalID(customer=self.customerGlobalID, key_alias=key_alias)
         outputpath = os.path.join(
             settings.getLocalBackupsDir(), customer_dir, self.pathID, self.version)
         task_params = (filename, self.eccmap.name, self.version, newblock.BlockNumber, outputpath)
-        raid_worker.add_task('make', task_params,
-                             lambda cmd, params, result: self._raidmakeCallback(params, result, dt),)
+        raid_worker.add_task(self.raidCommand, task_params,
+                             lambda cmd, params, result: self._raidmakeCallback(params, result, dt, prepare_time, blocklen),)
         self.automat('block-raid-started', newblock)
         del serializedblock
         if _Debug:
@@ -389,8 +511,9 @@ class backup(automat.Automat):
         Action method.
         """
         blockNumber, _ = arg
-        filename = self.workBlocks.pop(blockNumber)
-        tmpfile.throw_out(filename, 'block raid done')
+        filename = self.workBlocks.pop(blockNumber, None)
+        if filename:
+            tmpfile.throw_out(filename, 'block raid done')
 
     def doFirstBlock(self, arg):
         """
@@ -412,11 +535,14 @@ class backup(automat.Automat):
         self.currentBlockData.close()
         self.currentBlockSize = 0
         self.currentBlockData = cStringIO.StringIO()
+        self.dedupReady = False
 
     def doBlockReport(self, arg):
         """
         """
         BlockNumber, result = arg
+        if result:
+            self._dedup_commit(BlockNumber)
         if self.blockResultCallback:
             self.blockResultCallback(self.backupID, BlockNumber, result)
 
@@ -435,9 +561,21 @@ class backup(automat.Automat):
                 self.finishCallback(self.backupID, 'abort')
             events.send('backup-aborted', dict(backup_id=self.backupID))
         else:
+            if _Debug:
+                lg.out(_DebugLevel, 'backup.doReport %s RAID timings: %s' % (
+                    self.backupID, ', '.join(['%s=%.3f' % (k, v) for k, v in sorted(self.raidTimings.items())])))
+                lg.out(_DebugLevel, 'backup.doReport %s stages: %s' % (
+                    self.backupID, ', '.join(['%s=%d bytes/sec' % (k, v['bps']) for k, v in sorted(self.stages().items())])))
             if self.finishCallback:
                 self.finishCallback(self.backupID, 'done')
-            events.send('backup-done', dict(backup_id=self.backupID))
+            if _Debug and self.deduplicate:
+                lg.out(_DebugLevel, 'backup.doReport %s chunks: %s' % (self.backupID, self.dedupStats))
+            events.send('backup-done', dict(
+                backup_id=self.backupID,
+                raid_timings=dict(self.raidTimings),
+                stages=self.stages(),
+                dedup=dict(self.dedupStats) if self.deduplicate else None,
+            ))
 
     def doDestroyMe(self, arg):
         """
@@ -458,10 +596,25 @@ class backup(automat.Automat):
         self.terminating = True
         for blockNumber, filename in self.workBlocks.items():
             lg.warn('aborting raid make worker for block %d in %s' % (blockNumber, filename))
-            raid_worker.cancel_task('make', filename)
+            raid_worker.cancel_task(self.raidCommand, filename)
         lg.warn('killing backup pipe')
         self._kill_pipe()
 
+    def stages(self):
+        """
+        Return throughput counters for every stage of the process: number of
+        bytes processed, total time spent and average bytes per second.
+        """
+        result = {}
+        for stage, counters in self.stageStats.items():
+            bytes_count, seconds = counters
+            result[stage] = {
+                'bytes': bytes_count,
+                'seconds': seconds,
+                'bps': int(bytes_count / seconds) if seconds > 0 else 0,
+            }
+        return result
+
     def progress(self):
         """
         """
@@ -470,8 +623,94 @@ class backup(automat.Automat):
         percent = min(100.0, 100.0 * self.dataSent / self.totalSize)
         return percent
 
-    def _raidmakeCallback(self, params, result, dt):
+    def _dedup_cut(self):
+        """
+        Split buffered data into chunks, chunks which were stored already
+        become references and first new chunk is packed into the current block.
+        At the end of the stream all remaining data goes to the last block.
+        """
+        if self.dedupReady:
+            return
+        if self.dedupSize < self.blockSize and not self.stateEOF:
+            return
+        data = ''.join(self.dedupPieces)
+        min_size, max_size, mask = dedup.chunk_sizes(self.blockSize)
+        pos = 0
+        chunk = None
+        while chunk is None:
+            if self.stateEOF:
+                chunk = data[pos:]
+                pos = len(data)
+                break
+            cut = dedup.find_cut(data, pos, min_size, max_size, mask)
+            if cut is None:
+                break
+            piece = data[pos:pos + cut]
+            pos += cut
+            self.dedupStats['chunks'] += 1
+            self.dedupStats['bytes'] += len(piece)
+            ref = dedup.Lookup(self.backupID, dedup.chunk_hash(piece))
+            if ref is None:
+                chunk = piece
+                break
+            self.dedupRefs.append(ref)
+            if len(self.dedupRefs) >= dedup.MAX_REFS and not self.stateEOF:
+                chunk = ''
+        self.dedupPieces = [data[pos:], ]
+        self.dedupSize = len(data) - pos
+        del data
+        if chunk is None:
+            return
+        if chunk:
+            if self.stateEOF:
+                self.dedupStats['chunks'] += 1
+                self.dedupStats['bytes'] += len(chunk)
+            self.dedupStats['new_chunks'] += 1
+            self.dedupStats['new_bytes'] += len(chunk)
+        # chunks are recorded only when the block was created, see _dedup_commit()
+        self.dedupPending[self.blockNumber] = (
+            dedup.chunk_hash(chunk) if chunk else None,
+            len(chunk),
+            [refBackupID for refBackupID, _, _ in self.dedupRefs],
+        )
+        self.currentBlockData.write(dedup.PackBlock(self.dedupRefs, chunk))
+        self.currentBlockSize = len(chunk) + sum([length for _, _, length in self.dedupRefs])
+        self.dedupRefs = []
+        self.dedupReady = True
+
+    def _dedup_commit(self, blockNumber):
+        """
+        Block was processed, so its new chunk can be used by the next backups.
+        """
+        pending = self.dedupPending.pop(blockNumber, None)
+        if pending is None:
+            return
+        chunkHash, length, refBackupIDs = pending
+        if chunkHash:
+            dedup.AddChunk(chunkHash, self.backupID, blockNumber, length)
+        for refBackupID in refBackupIDs:
+            dedup.AddReference(self.backupID, refBackupID)
+
+    def _count_stage(self, stage, bytes_count, seconds):
+        self.stageStats[stage][0] += bytes_count
+        self.stageStats[stage][1] += seconds
+
+    def _raidmakeCallback(self, params, result, dt, prepare_time=None, blocklen=0):
         filename, eccmapname, backupID, blockNumber, targetDir = params
+        if result is not None:
+            self._count_stage('raid', blocklen, time.time() - dt)
+        if result is not None and len(result) > 2:
+            # in-memory mode also reports time spent on every stage
+            timings = dict(result[2])
+            result = result[:2]
+            if prepare_time is not None:
+                timings['prepare'] = prepare_time
+            timings['total'] = time.time() - dt
+            for stage, value in timings.items():
+                self.raidTimings[stage] = self.raidTimings.get(stage, 0.0) + value
+            if _Debug:
+                lg.out(_DebugLevel, 'backup._raidmakeCallback %r timings: %s' % (
+                    blockNumber, ', '.join(['%s=%.3f' % (k, v) for k, v in sorted(timings.items())])))
         if result is None:
             if _Debug:
                 lg.out(_DebugLevel, 'backup._raidmakeCallback WARNING - result is None :  %r eof=%s dt=%s' % (
@@ -89,16 +89,24 @@ from storage import backup_fs
 from storage import backup_matrix
 from storage import backup_tar
 from storage import backup
+from storage import dedup
+from storage import index_journal
 
 #------------------------------------------------------------------------------
 
 MAXIMUM_JOBS_STARTED = 1  # let's do only one backup at once for now
+JOURNAL_MIN_ITEMS = 1000  # write a new snapshot of the index when journal have more items than that
 
 _Jobs = {}   # here are already started backups ( by backupID )
 _Tasks = []  # here are tasks to start backups in the future ( pathID )
 _LastTaskNumber = 0
 _RevisionNumber = 0
 _LoadingFlag = False
+_SnapshotRevision = -1
+_SnapshotItems = 0
+_JournalItems = 0
+_PushedRevision = None
+_PendingDelta = None
 _TaskStartedCallbacks = {}
 _TaskFinishedCallbacks = {}
 
@@ -156,22 +164,33 @@ def init():
 
 def shutdown():
     """
-    Called for the correct completion of all things.
+    Called for the correct completion of all things.
     """
     lg.out(4, 'backup_control.shutdown')
+    if _JournalItems > 0:
+        WriteSnapshot()
 
 #------------------------------------------------------------------------------
 
 
 def WriteIndex(filepath=None, encoding='utf-8'):
-    """
-    Write index data base to the local file .bitdust/metadata/index.
+    """
+    Write index data base to the local file .bitdust/metadata/index.
     """
     global _LoadingFlag
     if _LoadingFlag:
         return
     if filepath is None:
         filepath = settings.BackupIndexFilePath()
+    return bpio.AtomicWriteFile(filepath, SerializeIndex(encoding=encoding))
+
+
+def SerializeIndex(encoding='utf-8'):
+    """
+    Return the whole index data base in JSON format, the first line keeps revision number.
+
+    This format is used to store the index on suppliers.
+    """
     json_data = {}
     # json_data = backup_fs.Serialize(to_json=True, encoding=encoding)
     for customer_idurl in backup_fs.known_customers():
@@ -186,7 +205,7 @@ def WriteIndex(filepath=None, encoding='utf-8'):
     if _Debug:
         import pprint
         lg.out(_DebugLevel, pprint.pformat(json_data))
-    return bpio.AtomicWriteFile(filepath, src)
+    return src
 
 
 def ReadIndex(raw_data, encoding='utf-8'):
@@ -201,6 +220,7 @@ def ReadIndex(raw_data, encoding='utf-8'):
     if _LoadingFlag:
         return False
     _LoadingFlag = True
+    backup_fs.track_changes(False)
     backup_fs.Clear()
     try:
         json_data = json.loads(raw_data, encoding=encoding)
@@ -216,6 +236,8 @@ def ReadIndex(raw_data, encoding='utf-8'):
                 count = backup_fs.Unserialize(json_data, from_json=True, decoding=encoding)
             except:
                 lg.exc()
+                backup_fs.track_changes(True)
+                _LoadingFlag = False
                 return False
         else:
             customer_idurl = global_id.GlobalUserToIDURL(customer_id)
@@ -229,24 +251,107 @@ def ReadIndex(raw_data, encoding='utf-8'):
                 )
             except:
                 lg.exc()
+                backup_fs.track_changes(True)
+                _LoadingFlag = False
                 return False
     if _Debug:
         lg.out(_DebugLevel, 'backup_control.ReadIndex %d items loaded' % count)
     # local_site.update_backup_fs(backup_fs.ListAllBackupIDsSQL())
     # commit(new_revision)
+    backup_fs.track_changes(True)
     _LoadingFlag = False
     return True
 
 
+def ReadSnapshot():
+    """
+    Load the index from local snapshot file and replay changes from the journal
+    made after the snapshot was written, see ``storage.index_journal``.
+    """
+    global _LoadingFlag
+    global _SnapshotRevision
+    global _SnapshotItems
+    global _JournalItems
+    if _LoadingFlag:
+        return False
+    _LoadingFlag = True
+    backup_fs.track_changes(False)
+    backup_fs.Clear()
+    result = index_journal.ReadSnapshot(settings.BackupIndexSnapshotFilePath())
+    if result is None:
+        backup_fs.track_changes(True)
+        _LoadingFlag = False
+        return False
+    known_revision, count = result
+    _SnapshotRevision = known_revision
+    _SnapshotItems = count
+    _JournalItems = 0
+    for record in index_journal.ReadRecords(settings.BackupIndexJournalFilePath(), known_revision):
+        known_revision = index_journal.ApplyRecord(record)
+        _JournalItems += len(record.get('d', [])) + len(record.get('u', []))
+    backup_fs.track_changes(True)
+    _LoadingFlag = False
+    commit(known_revision)
+    lg.out(4, 'backup_control.ReadSnapshot %d items at revision %d, %d changes replayed, current revision is %d' % (
+        count, _SnapshotRevision, _JournalItems, revision()))
+    return True
+
+
+def WriteSnapshot():
+    """
+    Save the whole index to local snapshot file and start the journal again.
+    """
+    global _SnapshotRevision
+    global _SnapshotItems
+    global _JournalItems
+    # all changes are inside the snapshot now
+    backup_fs.PopChanges()
+    count = index_journal.WriteSnapshot(settings.BackupIndexSnapshotFilePath(), revision())
+    if count < 0:
+        return False
+    index_journal.Erase(settings.BackupIndexJournalFilePath())
+    _SnapshotRevision = revision()
+    _SnapshotItems = count
+    _JournalItems = 0
+    return True
+
+
+def WriteJournal():
+    """
+    Append changes made in the index since last call to the local journal,
+    a new snapshot is written instead when journal becomes too long.
+    """
+    global _JournalItems
+    deleted, changed, complete = backup_fs.PopChanges()
+    if not complete:
+        return WriteSnapshot()
+    if _JournalItems + len(deleted) + len(changed) > max(JOURNAL_MIN_ITEMS, _SnapshotItems / 4):
+        return WriteSnapshot()
+    record = index_journal.MakeRecord(revision(), deleted, changed)
+    if not index_journal.AppendRecord(settings.BackupIndexJournalFilePath(), record):
+        return WriteSnapshot()
+    _JournalItems += len(deleted) + len(changed)
+    return True
+
+
 def Load(filepath=None):
-    """
-    This load the data from local file and call ``ReadIndex()`` method.
+    """
+    This load the data from local snapshot file, see ``ReadSnapshot()``.
+
+    If snapshot not exist yet the index is read from the old file
+    .bitdust/metadata/index with ``ReadIndex()`` method.
     """
     global _LoadingFlag
     if _LoadingFlag:
         return False
     if filepath is None:
         filepath = settings.BackupIndexFilePath()
+    if os.path.isfile(settings.BackupIndexSnapshotFilePath()):
+        if ReadSnapshot():
+            backup_fs.Scan()
+            backup_fs.Calculate()
+            return True
+        lg.warn('catalog index snapshot reading failed')
     if not os.path.isfile(filepath):
         lg.warn('file %s not exist' % filepath)
         WriteIndex(filepath)
@@ -266,6 +371,7 @@ def Load(filepath=None):
     ret = ReadIndex(raw_data)
     if ret:
         commit(known_revision)
+        WriteSnapshot()
         backup_fs.Scan()
         backup_fs.Calculate()
     else:
@@ -274,19 +380,40 @@ def Load(filepath=None):
 
 
 def Save(filepath=None):
-    """
-    Save index data base to local file ( call ``WriteIndex()`` ) and notify
-    "index_synchronizer()" state machine.
+    """
+    Save changes of the index data base to local journal ( call ``WriteJournal()`` )
+    and notify "index_synchronizer()" state machine.
     """
     global _LoadingFlag
     if _LoadingFlag:
         return False
     commit()
-    WriteIndex(filepath)
+    WriteJournal()
+    if filepath is not None:
+        WriteIndex(filepath)
     if driver.is_on('service_backup_db'):
         from storage import index_synchronizer
         index_synchronizer.A('push')
 
+
+def PrepareIndexPush(supplier_revision=-1):
+    """
+    Return a tuple (file name, data) to be sent to suppliers.
+
+    Suppliers keep the full index and "index.delta" file with changes made
+    after it. Only the delta is prepared if suppliers already have full index
+    sent before (``supplier_revision`` is the latest revision they reported)
+    and local journal still keeps all changes made after it.
+    """
+    global _PushedRevision
+    if _PushedRevision is not None and _SnapshotRevision <= _PushedRevision <= supplier_revision:
+        lines = index_journal.ReadRecords(settings.BackupIndexJournalFilePath(), _PushedRevision, raw=True)
+        src = '%d\n%d\n' % (revision(), _PushedRevision)
+        src += ''.join([line + '\n' for _, line in lines])
+        return settings.BackupIndexDeltaFileName(), src
+    _PushedRevision = revision()
+    return settings.BackupIndexFileName(), SerializeIndex()
+
 #------------------------------------------------------------------------------
 
 def IncomingSupplierListFiles(newpacket):
@@ -312,6 +439,13 @@ def IncomingSupplierListFiles(newpacket):
     from supplier import list_files
     from customer import list_files_orator
     src = list_files.UnpackListFiles(newpacket.Payload, settings.ListFilesFormat())
+    if list_files.IsDelta(src):
+        # only changes since the previous list were sent, build the whole list again
+        src = list_files.MergeListFiles(backup_matrix.ReadLatestRawListFile(supplier_idurl), src)
+        if src is None:
+            lg.warn('ListFiles delta from %s does not match the latest list' % supplier_idurl)
+            list_files_orator.IncomingListFiles(newpacket)
+            return False
     backups2remove, paths2remove, missed_backups = backup_matrix.ReadRawListFiles(num, src)
     list_files_orator.IncomingListFiles(newpacket)
     backup_matrix.SaveLatestRawListFiles(supplier_idurl, src)
@@ -343,31 +477,13 @@ def IncomingSupplierBackupIndex(newpacket):
     Called by ``p2p.p2p_service`` when a remote copy of our local index data
     base ( in the "Data" packet ) is received from one of our suppliers.
 
-    The index is also stored on suppliers to be able to restore it.
+    The index is also stored on suppliers to be able to restore it.
     """
-    b = encrypted.Unserialize(newpacket.Payload)
-    if b is None:
-        lg.out(2, 'backup_control.IncomingSupplierBackupIndex ERROR reading data from %s' % newpacket.RemoteID)
-        return
-    try:
-        session_key = key.DecryptLocalPrivateKey(b.EncryptedSessionKey)
-        padded_data = key.DecryptWithSessionKey(session_key, b.EncryptedData)
-        inpt = cStringIO.StringIO(padded_data[:int(b.Length)])
-        supplier_revision = inpt.readline().rstrip('\n')
-        if supplier_revision:
-            supplier_revision = int(supplier_revision)
-        else:
-            supplier_revision = -1
-        # inpt.seek(0)
-    except:
-        lg.out(2, 'backup_control.IncomingSupplierBackupIndex ERROR reading data from %s' % newpacket.RemoteID)
-        lg.out(2, '\n' + padded_data)
-        lg.exc()
-        try:
-            inpt.close()
-        except:
-            pass
+    global _PushedRevision
+    result = _read_index_packet(newpacket)
+    if result is None:
         return
+    supplier_revision, inpt = result
     if driver.is_on('service_backup_db'):
         from storage import index_synchronizer
         index_synchronizer.A('index-file-received', (newpacket, supplier_revision))
@@ -380,15 +496,120 @@ def IncomingSupplierBackupIndex(newpacket):
     inpt.close()
     if ReadIndex(raw_data):
         commit(supplier_revision)
+        WriteSnapshot()
+        _PushedRevision = supplier_revision
         backup_fs.Scan()
         backup_fs.Calculate()
-        WriteIndex()
         control.request_update()
         lg.out(4, 'backup_control.IncomingSupplierBackupIndex updated to revision %d from %s' % (
             revision(), newpacket.RemoteID))
+        if _PendingDelta:
+            ApplyIndexDelta(*_PendingDelta)
     else:
         lg.warn('failed to read catalog index from supplier')
 
+
+def IncomingSupplierBackupIndexDelta(newpacket):
+    """
+    Called by ``p2p.p2p_service`` when "index.delta" file ( in the "Data" packet )
+    is received from one of our suppliers.
+
+    This is a list of changes made after supplier received full index,
+    see ``PrepareIndexPush()``.
+    """
+    global _PendingDelta
+    result = _read_index_packet(newpacket)
+    if result is None:
+        return
+    supplier_revision, inpt = result
+    try:
+        base_revision = int(inpt.readline().rstrip('\n'))
+    except:
+        lg.exc()
+        inpt.close()
+        return
+    src = inpt.read()
+    inpt.close()
+    if driver.is_on('service_backup_db'):
+        from storage import index_synchronizer
+        index_synchronizer.A('index-file-received', (newpacket, supplier_revision))
+    if revision() >= supplier_revision:
+        lg.out(4, 'backup_control.IncomingSupplierBackupIndexDelta SKIP, supplier %s revision=%d, local revision=%d' % (
+            newpacket.RemoteID, supplier_revision, revision(), ))
+        return
+    if revision() < base_revision:
+        # full index from that supplier is needed first
+        if not _PendingDelta or _PendingDelta[1] < supplier_revision:
+            _PendingDelta = (base_revision, supplier_revision, src, )
+        lg.out(4, 'backup_control.IncomingSupplierBackupIndexDelta WAIT, delta from %s starts at revision %d, local revision=%d' % (
+            newpacket.RemoteID, base_revision, revision(), ))
+        return
+    ApplyIndexDelta(base_revision, supplier_revision, src)
+
+
+def ApplyIndexDelta(base_revision, supplier_revision, src):
+    """
+    Make changes from "index.delta" file received from supplier and also
+    append them to the local journal.
+    """
+    global _LoadingFlag
+    global _JournalItems
+    global _PendingDelta
+    if _PendingDelta and _PendingDelta[1] <= supplier_revision:
+        _PendingDelta = None
+    if revision() < base_revision or revision() >= supplier_revision:
+        return False
+    if _LoadingFlag:
+        return False
+    _LoadingFlag = True
+    backup_fs.track_changes(False)
+    count = 0
+    for known_revision, line in index_journal.ParseRecords(src, revision(), raw=True):
+        record = json.loads(line)
+        index_journal.ApplyRecord(record)
+        index_journal.AppendRecord(settings.BackupIndexJournalFilePath(), record)
+        count += len(record.get('d', [])) + len(record.get('u', []))
+    _JournalItems += count
+    backup_fs.track_changes(True)
+    _LoadingFlag = False
+    commit(supplier_revision)
+    backup_fs.Scan()
+    backup_fs.Calculate()
+    control.request_update()
+    lg.out(4, 'backup_control.ApplyIndexDelta updated to revision %d, %d items changed' % (revision(), count, ))
+    return True
+
+
+def _read_index_packet(newpacket):
+    """
+    Decrypt index file received from supplier, return a tuple (revision, ``cStringIO`` object)
+    positioned after the first line, or None.
+    """
+    b = encrypted.Unserialize(newpacket.Payload)
+    if b is None:
+        lg.out(2, 'backup_control._read_index_packet ERROR reading data from %s' % newpacket.RemoteID)
+        return None
+    try:
+        session_key = key.DecryptLocalPrivateKey(b.EncryptedSessionKey)
+        padded_data = key.DecryptWithSessionKey(session_key, b.EncryptedData, b.SessionKeyType)
+        inpt = cStringIO.StringIO(padded_data[:int(b.Length)])
+        supplier_revision = inpt.readline().rstrip('\n')
+        if supplier_revision:
+            supplier_revision = int(supplier_revision)
+        else:
+            supplier_revision = -1
+        # inpt.seek(0)
+    except:
+        lg.out(2, 'backup_control._read_index_packet ERROR reading data from %s' % newpacket.RemoteID)
+        lg.out(2, '\n' + padded_data)
+        lg.exc()
+        try:
+            inpt.close()
+        except:
+            pass
+        return None
+    return supplier_revision, inpt
+
 #------------------------------------------------------------------------------
 
 
@@ -400,6 +621,9 @@ def DeleteAllBackups():
     all_ids = set(backup_fs.ListAllBackupIDs())
     all_ids.update(backup_matrix.GetBackupIDs(remote=True, local=True))
     lg.out(4, 'backup_control.DeleteAllBackups %d ID\'s to kill' % len(all_ids))
+    # all of them will be removed, so references between backups do not matter
+    for backupID in all_ids:
+        dedup.ForgetBackup(backupID)
     # delete one by one
     for backupID in all_ids:
         DeleteBackup(backupID, saveDB=False, calculate=False)
@@ -434,6 +658,10 @@ def DeleteBackup(backupID, removeLocalFilesToo=True, saveDB=True, calculate=True
     if AbortRunningBackup(backupID):
         lg.out(8, 'backup_control.DeleteBackup %s is in process, stopping' % backupID)
         return True
+    referenced = dedup.IsReferenced(backupID)
+    if referenced:
+        lg.warn('backup %s is used by %d other backups and can not be removed' % (backupID, len(referenced)))
+        return False
     from customer import io_throttle
     import backup_rebuilder
     lg.out(8, 'backup_control.DeleteBackup ' + backupID)
@@ -445,6 +673,8 @@ def DeleteBackup(backupID, removeLocalFilesToo=True, saveDB=True, calculate=True
     # mark it as being deleted in the db, well... just remove it from the index now
     if not backup_fs.DeleteBackupID(backupID):
         return False
+    # chunks stored in this backup can not be used anymore
+    dedup.ForgetBackup(backupID)
     # finally remove local files for this backupID
     if removeLocalFilesToo:
         backup_fs.DeleteLocalBackup(settings.getLocalBackupsDir(), backupID)
@@ -502,6 +732,7 @@ def DeletePathBackups(pathID, removeLocalFilesToo=True, saveDB=True, calculate=T
         backup_matrix.EraseBackupLocalInfo(backupID)
         # finally remove this backup from the index
         item.delete_version(version)
+        dedup.ForgetBackup(backupID)
         # lg.out(8, 'backup_control.DeletePathBackups ' + backupID)
     # stop any rebuilding, we will restart it soon
     backup_rebuilder.RemoveAllBackupsToWork()
@@ -690,7 +921,16 @@ class Task():
             # self._on_job_failed(self.backupID)
             err = 'failed creating destination folder for "%s"' % self.backupID
             return OnTaskFailed(self.backupID, err)
-        compress_mode = 'bz2'  # 'none' # 'gz'
+        deduplicate = settings.getBackupDedupEnabled()
+        # compressed stream will be different after any change, so in the incremental mode
+        # tar stream is not compressed and every chunk is compressed separately
+        compress_mode = 'none'
+        if not deduplicate:
+            compress_mode = backup_tar.compress_mode(
+                settings.getBackupCompression(),
+                settings.getBackupCompressionLevel(),
+                settings.getBackupCompressionWorkers(),
+            )
         arcname = os.path.basename(sourcePath)
         if bpio.pathIsDir(self.localPath):
             backupPipe = backup_tar.backuptardir(self.localPath, arcname=arcname, compress=compress_mode)
@@ -705,6 +945,7 @@ class Task():
             blockSize=settings.getBackupBlockSize(),
             sourcePath=self.localPath,
             keyID=self.keyID or itemInfo.key_id,
+            deduplicate=deduplicate,
         )
         jobs()[self.backupID] = job
         itemInfo.add_version(dataID)
@@ -858,8 +1099,12 @@ def OnJobDone(backupID, result):
                 versions = item.list_versions(sorted=True, reverse=True)
                 if len(versions) > maxBackupsNum:
                     for version in versions[maxBackupsNum:]:
-                        item.delete_version(version)
                         backupID = packetid.MakeBackupID(customerGlobalID, remotePath, version)
+                        if dedup.IsReferenced(backupID):
+                            # newer versions are using blocks of that backup
+                            continue
+                        item.delete_version(version)
+                        dedup.ForgetBackup(backupID)
                         backup_rebuilder.RemoveBackupToWork(backupID)
                         io_throttle.DeleteBackupRequests(backupID)
                         io_throttle.DeleteBackupSendings(backupID)
@@ -874,6 +1119,8 @@ def OnJobDone(backupID, result):
         # TODO: check used space, if we have over use - stop all tasks immediately
         backup_matrix.RepaintBackup(backupID)
     elif result == 'abort':
+        # blocks of that backup were not all created, chunks can not be used
+        dedup.ForgetBackup(backupID)
         DeleteBackup(backupID)
     if len(tasks()) == 0:
         # do we really need to restart backup_monitor after each backup?
@@ -892,6 +1139,7 @@ def OnJobFailed(backupID, err):
     lg.out(4, '!!!!!!!!!!!!!!! ERROR !!!!!!!!!!!!!!!!')
     lg.out(4, 'backup_control.OnJobFailed [%s] : %s' % (backupID, err))
     jobs().pop(backupID)
+    dedup.ForgetBackup(backupID)
 
 
 def OnTaskFailed(pathID, result):
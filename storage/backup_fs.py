@@ -106,6 +106,10 @@ _DirsCount = 0
 _SizeFiles = 0
 _SizeFolders = 0
 _SizeBackups = 0
+_ChangedItems = {}
+_DeletedItems = []
+_TrackChanges = True
+_FolderNames = {}
 
 #------------------------------------------------------------------------------
 
@@ -235,21 +239,62 @@ def shutdown():
 #------------------------------------------------------------------------------
 
 
-class FSItemInfo():
+def track_changes(enabled):
+    """
+    Turn on/off tracking of changed items, it is off while the index is loading.
+    """
+    global _TrackChanges
+    _TrackChanges = enabled
+
+
+def item_changed(item):
+    """
+    Remember that ``item`` was added or modified, see ``PopChanges()``.
+    """
+    if _TrackChanges:
+        _ChangedItems[id(item)] = item
+
+
+def item_deleted(path_id, iterID):
+    """
+    Remember that item with ``path_id`` was removed from ``iterID`` tree.
+    """
+    if _TrackChanges:
+        _DeletedItems.append((iterID, path_id, ))
+
+#------------------------------------------------------------------------------
+
+
+def intern_name(name):
+    """
+    Same folder names are repeated many times in the index, keep only one copy of every name.
+    """
+    return _FolderNames.setdefault(name, name)
+
+
+class FSItemInfo(object):
     """
     A class to represent a remote file or folder.
+
+    Index can keep millions of items, so fields are listed in ``__slots__``
+    and ``versions`` is a tuple of tuples (version, maxblocknum, sizebytes)
+    which takes much less memory than a dictionary - items usually have
+    only one or two versions.
     """
 
+    __slots__ = ('unicodename', 'path_id', 'type', 'size', 'key_id', 'versions', )
+
     def __init__(self, name='', path_id='', typ=UNKNOWN, key_id=None):
-        if isinstance(name, unicode):
-            self.unicodename = name
-        else:
-            self.unicodename = unicode(name)
+        if not isinstance(name, unicode):
+            name = unicode(name)
+        if typ == DIR:
+            name = intern_name(name)
+        self.unicodename = name
         self.path_id = path_id
         self.type = typ
         self.size = -1
         self.key_id = key_id
-        self.versions = {}
+        self.versions = ()
 
     def __repr__(self):
         return '<%s %s %d %s>' % (TYPES[self.type], misc.unicode_to_str_safe(self.name()), self.size, self.key_id)
@@ -326,33 +371,49 @@ class FSItemInfo():
         return totalSize
 
     def add_version(self, version):
-        self.versions[version] = [-1, -1]
+        self.set_version_info(version, -1, -1)
 
     def set_version_info(self, version, maxblocknum, sizebytes):
-        self.versions[version] = [maxblocknum, sizebytes]
+        self.versions = tuple([v for v in self.versions if v[0] != version]) + ((version, maxblocknum, sizebytes, ), )
+        item_changed(self)
 
     def get_version_info(self, version):
-        return self.versions.get(version, [-1, -1])
+        for v, maxblocknum, sizebytes in self.versions:
+            if v == version:
+                return (maxblocknum, sizebytes, )
+        return (-1, -1, )
 
     def get_version_size(self, version):
-        return self.versions.get(version, [-1, -1])[1]
+        return self.get_version_info(version)[1]
 
     def delete_version(self, version):
-        self.versions.pop(version, None)
+        if self.has_version(version):
+            self.versions = tuple([v for v in self.versions if v[0] != version])
+            item_changed(self)
 
     def has_version(self, version):
-        return version in self.versions
+        for v in self.versions:
+            if v[0] == version:
+                return True
+        return False
 
     def any_version(self):
         return len(self.versions) > 0
 
     def list_versions(self, sorted=False, reverse=False):
+        versions = [v[0] for v in self.versions]
         if sorted:
-            return misc.sorted_versions(self.versions.keys(), reverse)
-        return self.versions.keys()
+            return misc.sorted_versions(versions, reverse)
+        return versions
 
     def get_versions(self):
-        return self.versions
+        return {v[0]: [v[1], v[2], ] for v in self.versions}
+
+    def set_versions(self, versions):
+        """
+        Replace all versions at once, ``versions`` is a list of tuples (version, maxblocknum, sizebytes).
+        """
+        self.versions = tuple([tuple(v) for v in versions])
 
     def get_latest_version(self):
         if len(self.versions) == 0:
@@ -362,7 +423,7 @@ class FSItemInfo():
     def pack_versions(self):
         out = []
         for version in self.list_versions(True):
-            info = self.versions[version]
+            info = self.get_version_info(version)
             out.append(version + ':' + str(info[0]) + ':' + str(info[1]))
         return ' '.join(out)
 
@@ -387,8 +448,8 @@ class FSItemInfo():
                 'k': self.key_id,
                 'v': [{
                     'n': v,
-                    'b': self.versions[v][0],
-                    's': self.versions[v][1],
+                    'b': self.get_version_info(v)[0],
+                    's': self.get_version_info(v)[1],
                 } for v in self.list_versions(sorted=True)]
             }
         e = self.unicodename.encode(encoding)
@@ -398,12 +459,12 @@ class FSItemInfo():
     def unserialize(self, src, decoding='utf-8', from_json=False):
         if from_json:
             try:
-                self.unicodename = src['n']
-                self.path_id = str(src['i'])
                 self.type = src['t']
+                self.unicodename = intern_name(src['n']) if self.type == DIR else src['n']
+                self.path_id = str(src['i'])
                 self.size = src['s']
                 self.key_id = src['k']
-                self.versions = {v['n']: [v['b'], v['s'], ] for v in src['v']}
+                self.set_versions([(v['n'], v['b'], v['s'], ) for v in src['v']])
             except:
                 lg.exc()
                 raise KeyError('Incorrect item format:\n%s' % src)
@@ -415,10 +476,12 @@ class FSItemInfo():
         if details == '' or name == '':
             raise Exception('Incorrect item format:\n%s' % src)
         try:
-            self.unicodename = name.decode(decoding)
             details = details.split(' ')
             self.path_id, self.type, self.size = details[:3]
             self.type, self.size = int(self.type), int(self.size)
+            self.unicodename = name.decode(decoding)
+            if self.type == DIR:
+                self.unicodename = intern_name(self.unicodename)
             self.unpack_versions(' '.join(details[3:]))
         except:
             lg.exc()
@@ -433,7 +496,7 @@ def MakeID(itr, randomized=True):
 
     Parameter ``itrID`` is a reference for a single item in the ``fs()``.
     """
-    current_ids = []
+    current_ids = set()
     for k in itr.keys():
         if k == 0:
             continue
@@ -441,9 +504,9 @@ def MakeID(itr, randomized=True):
             continue
         try:
             if isinstance(itr[k], int):
-                current_ids.append(int(itr[k]))
+                current_ids.add(int(itr[k]))
             elif isinstance(itr[k], dict) and 0 in itr[k]:
-                current_ids.append(int(itr[k][0]))
+                current_ids.add(int(itr[k][0]))
             else:
                 continue
         except:
@@ -512,6 +575,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
             iter[ii.name()] = {0: id}
             # also save index from opposite side
             iterID[id] = {INFO_KEY: ii}
+            item_changed(ii)
         else:
             # get an existing ID from the index
             id = iter[name][0]
@@ -532,6 +596,7 @@ def AddFile(path, read_stats=False, iter=None, iterID=None, key_id=None):
         ii.read_stats(path)
     iter[ii.name()] = id
     iterID[id] = ii
+    item_changed(ii)
     # finally make a complete backup id - this a relative path to the backed up file
     return resultID, iter, iterID
 
@@ -576,6 +641,7 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None):
                 ii.read_stats(p)
             iter[ii.name()] = {0: id}
             iterID[id] = {INFO_KEY: ii}
+            item_changed(ii)
         else:
             id = iter[name][0]
             resultID += '/' + str(id)
@@ -585,7 +651,8 @@ def AddDir(path, read_stats=False, iter=None, iterID=None, key_id=None):
         if i == len(parts) - 1:
             if iterID[INFO_KEY].type != DIR:
                 lg.warn('not a dir: %s' % iterID[INFO_KEY])
-            iterID[INFO_KEY].type = DIR
+                iterID[INFO_KEY].type = DIR
+                item_changed(iterID[INFO_KEY])
     return resultID.lstrip('/'), iter, iterID
 
 
@@ -634,6 +701,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     if read_stats:
                         ii.read_stats(p)
                     iterID[id] = {INFO_KEY: ii}
+                    item_changed(ii)
                     lastID = id
                 else:
                     id = iter[name][0]
@@ -645,6 +713,7 @@ def AddLocalPath(localpath, read_stats=False, iter=None, iterID=None, key_id=Non
                     ii.read_stats(p)
                 iter[ii.name()] = id
                 iterID[id] = ii
+                item_changed(ii)
                 c += 1
                 lastID = id
         return c
@@ -680,6 +749,7 @@ def PutItem(name, parent_path_id, as_folder=False, iter=None, iterID=None, key_i
     ii = FSItemInfo(name=remote_path, path_id=resultID, typ=typ, key_id=key_id)
     iter[ii.name()] = newItemID
     iterID[newItemID] = ii
+    item_changed(ii)
     return resultID, iter, iterID
 
 #------------------------------------------------------------------------------
@@ -704,20 +774,12 @@ def SetFile(item, iter=None, iterID=None):
             if item.name() not in iter:
                 iter[item.name()] = id
                 iterID[id] = item
+                item_changed(item)
             return True
-        found = False
-        for name in iter.keys():
-            if name == 0:
-                continue
-            if isinstance(iter[name], dict):
-                if iter[name][0] == id:
-                    iter = iter[name]
-                    iterID = iterID[id]
-                    found = True
-                    break
-                continue
-        if not found:
+        sub = _find_folder(iter, iterID, id)
+        if sub is None:
             return False
+        iter, iterID = sub
     return False
 
 
@@ -741,32 +803,92 @@ def SetDir(item, iter=None, iterID=None):
             if id not in iterID:
                 iterID[id] = {}
             iterID[id][INFO_KEY] = item
+            item_changed(item)
             return True
-        found = False
-        for name in iter.keys():
-            if name == 0:
-                continue
-            if isinstance(iter[name], int):
-                continue
-            if isinstance(iter[name], dict):
-                if iter[name][0] == id:
-                    iter = iter[name]
-                    iterID = iterID[id]
-                    found = True
-                    break
-                continue
-            if isinstance(iter[name], str):
-                if iter[name] == itemname:
-                    iter = iter[name]
-                    iterID = iterID[id]
-                    found = True
-                    break
-                continue
-            raise Exception('Wrong data type in the index')
-        if not found:
+        sub = _find_folder(iter, iterID, id)
+        if sub is None:
             return False
+        iter, iterID = sub
     return False
 
+
+def _find_folder(iter, iterID, id):
+    """
+    Return a tuple (iter, iterID) for sub folder with given ``id`` or None.
+
+    Folder name is taken from ``iterID`` side, so this do not need to check all items in the folder.
+    """
+    sub = iterID.get(id)
+    if isinstance(sub, dict) and INFO_KEY in sub:
+        name = sub[INFO_KEY].name()
+        if isinstance(iter.get(name), dict) and iter[name].get(0) == id:
+            return iter[name], sub
+    for name in iter.keys():
+        if name == 0:
+            continue
+        if isinstance(iter[name], dict) and iter[name].get(0) == id and id in iterID:
+            return iter[name], iterID[id]
+    return None
+
+
+def UpdateItem(item, iter=None, iterID=None):
+    """
+    Put ``item`` into the index, existing file with same path ID is replaced,
+    existing folder keeps its content.
+    """
+    if iter is None:
+        iter = fs()
+    if iterID is None:
+        iterID = fsID()
+    if item.type == DIR:
+        return SetDir(item, iter=iter, iterID=iterID)
+    if WalkByID(item.path_id, iterID=iterID) is not None:
+        DeleteByID(item.path_id, iter=iter, iterID=iterID)
+    return SetFile(item, iter=iter, iterID=iterID)
+
+
+def SetItems(items, iter=None, iterID=None):
+    """
+    Put a list of items into the index, parent folders must be listed before
+    their content, like in ``Serialize()`` output. Return number of added items.
+
+    Folders are remembered by path ID here, so this works much faster than
+    calling ``SetFile()`` and ``SetDir()`` for every item.
+    """
+    if iter is None:
+        iter = fs()
+    if iterID is None:
+        iterID = fsID()
+    folders = {'': (iter, iterID, ), }
+    count = 0
+    for item in items:
+        parent_path_id, _, part = item.path_id.strip('/').rpartition('/')
+        if parent_path_id not in folders:
+            if item.type == DIR:
+                ok = SetDir(item, iter=iter, iterID=iterID)
+            else:
+                ok = SetFile(item, iter=iter, iterID=iterID)
+            if not ok:
+                lg.warn('Can not put item into the tree: %s' % str(item))
+                continue
+            count += 1
+            continue
+        parent_iter, parent_iterID = folders[parent_path_id]
+        id = misc.ToInt(part, part)
+        if item.type == DIR:
+            if item.name() not in parent_iter:
+                parent_iter[item.name()] = {}
+            parent_iter[item.name()][0] = id
+            if id not in parent_iterID:
+                parent_iterID[id] = {}
+            parent_iterID[id][INFO_KEY] = item
+            folders[item.path_id.strip('/')] = (parent_iter[item.name()], parent_iterID[id], )
+        else:
+            parent_iter[item.name()] = id
+            parent_iterID[id] = item
+        count += 1
+    return count
+
 #------------------------------------------------------------------------------
 
 
@@ -865,6 +987,7 @@ def DeleteByID(pathID, iter=None, iterID=None):
         iter = fs()
     if iterID is None:
         iterID = fsID()
+    rootID = iterID
     path = ''
     parts = pathID.strip('/').split('/')
     for j in range(len(parts)):
@@ -892,6 +1015,7 @@ def DeleteByID(pathID, iter=None, iterID=None):
         if j == len(parts) - 1:
             iterID.pop(id)
             iter.pop(name)
+            item_deleted(pathID.strip('/'), rootID)
             return path
         iterID = iterID[id]
         iter = iter[name]
@@ -906,6 +1030,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         iter = fs()
     if iterID is None:
         iterID = fsID()
+    rootID = iterID
     path_id = ''
     ppath = bpio.remotePath(path)
     parts = ppath.lstrip('/').split('/')
@@ -913,6 +1038,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         path_id = iter[ppath]
         iter.pop(ppath)
         iterID.pop(path_id)
+        item_deleted(str(path_id), iterID)
         return str(path_id)
     for j in range(len(parts)):
         name = parts[j]  # .encode('utf-8') # parts[j]
@@ -935,6 +1061,7 @@ def DeleteByPath(path, iter=None, iterID=None):
         if j == len(parts) - 1:
             iter.pop(name)
             iterID.pop(id)
+            item_deleted(path_id.lstrip('/'), rootID)
             return path_id.lstrip('/')
         iter = iter[name]
         iterID = iterID[id]
@@ -1419,7 +1546,7 @@ def ExtractVersions(pathID, item_info, path_exist=None, customer_id=None):
     item_time = 0
     # item_status = ''
     versions = []
-    for version, version_info in item_info.versions.items():
+    for version, version_info in item_info.get_versions().items():
         backupID = packetid.MakeBackupID(customer_id, pathID, version)
         version_time = misc.TimeFromBackupID(version)
         if version_time and version_time > item_time:
@@ -1777,7 +1904,7 @@ def ListAllBackupIDsAdvanced(sorted=False, reverse=False, iterID=None):
     result = []
 
     def visitor(path_id, path, info, num_childs):
-        if (len(info.versions) == 0):
+        if not info.any_version():
             return
         dirpath = os.path.dirname(path)
         (item_size, item_time, versions) = ExtractVersions(path_id, info, dirpath)  # , customer_id)
@@ -2010,6 +2137,52 @@ def Clear(customer_idurl=None):
     """
     fs(customer_idurl=customer_idurl).clear()
     fsID(customer_idurl=customer_idurl).clear()
+    # removed items are not listed one by one, so the whole index must be saved
+    item_deleted(None, None)
+
+
+def PopChanges():
+    """
+    Return a tuple (deleted, changed, complete) with changes made since last call.
+
+    Here ``deleted`` is a list of tuples (customer_idurl, path_id) and
+    ``changed`` is a list of tuples (customer_idurl, item), parent folders
+    are listed before their content. If ``complete`` is False some changes
+    can not be listed and the whole index must be saved.
+    """
+    global _ChangedItems
+    global _DeletedItems
+    complete = True
+    roots = {}
+    for customer_idurl in known_customers():
+        roots[id(fsID(customer_idurl))] = customer_idurl
+    deleted = []
+    for iterID, path_id in _DeletedItems:
+        if iterID is None or id(iterID) not in roots:
+            complete = False
+            continue
+        deleted.append((roots[id(iterID)], path_id, ))
+    changed = []
+    for item in _ChangedItems.values():
+        for customer_idurl in known_customers():
+            try:
+                iter_and_path = WalkByID(item.path_id, iterID=fsID(customer_idurl))
+            except:
+                lg.exc()
+                complete = False
+                continue
+            if iter_and_path is None:
+                continue
+            found = iter_and_path[0]
+            if isinstance(found, dict):
+                found = found.get(INFO_KEY)
+            if found is item:
+                changed.append((customer_idurl, item, ))
+                break
+    changed.sort(key=lambda i: i[1].path_id.count('/'))
+    _ChangedItems = {}
+    _DeletedItems = []
+    return deleted, changed, complete
 
 
 def Serialize(iterID=None, to_json=False, encoding='utf-8', filter_cb=None):
@@ -2244,5 +2417,74 @@ def _test():
     # print ListLocalFolder(sys.argv[1])
 
 
+def _bench(count=1000000, lookups=100000):
+    """
+    Build a catalog with ``count`` files in memory and print memory usage and
+    lookup speed::
+
+        python storage/backup_fs.py bench 1000000
+    """
+    import gc
+
+    def rss():
+        try:
+            return int(open('/proc/self/statm').read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except:
+            pass
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except:
+            return -1
+
+    customer_idurl = 'http://localhost/bench.xml'
+    gc.collect()
+    rss_before = rss()
+    t = time.time()
+    items = []
+    folders = set()
+    for i in xrange(count):
+        leaf = i / 100
+        parts = [leaf / 10000, (leaf / 100) % 100, leaf % 100, ]
+        for depth in range(1, 4):
+            path_id = '/'.join(map(str, parts[:depth]))
+            if path_id not in folders:
+                folders.add(path_id)
+                items.append(FSItemInfo(name=u'folder%d' % parts[depth - 1], path_id=path_id, typ=DIR))
+        item = FSItemInfo(name=u'file%d.dat' % (i % 100), path_id='%s/%d' % (path_id, i % 100), typ=FILE)
+        item.size = i
+        item.set_versions([('F20180101120000AM', 0, 1024 + i, ), ])
+        items.append(item)
+    track_changes(False)
+    SetItems(items, iter=fs(customer_idurl), iterID=fsID(customer_idurl))
+    track_changes(True)
+    del items
+    gc.collect()
+    load_time = time.time() - t
+    rss_after = rss()
+    print '%d items (%d folders) loaded in %.2f sec' % (count + len(folders), len(folders), load_time)
+    print 'memory: %d bytes total, %.1f bytes per item' % (rss_after - rss_before, float(rss_after - rss_before) / (count + len(folders)))
+    samples = []
+    for _ in xrange(lookups):
+        i = random.randrange(count)
+        leaf = i / 100
+        samples.append((
+            '%d/%d/%d/%d' % (leaf / 10000, (leaf / 100) % 100, leaf % 100, i % 100),
+            '/folder%d/folder%d/folder%d/file%d.dat' % (leaf / 10000, (leaf / 100) % 100, leaf % 100, i % 100),
+        ))
+    t = time.time()
+    for path_id, _ in samples:
+        WalkByID(path_id, iterID=fsID(customer_idurl))
+    print 'WalkByID: %.2f microseconds per lookup' % ((time.time() - t) * 1000000.0 / lookups)
+    t = time.time()
+    for _, path in samples:
+        WalkByPath(path, iter=fs(customer_idurl))
+    print 'WalkByPath: %.2f microseconds per lookup' % ((time.time() - t) * 1000000.0 / lookups)
+    Clear(customer_idurl)
+
+
 if __name__ == '__main__':
-    _test()
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        _bench(int(sys.argv[2]) if len(sys.argv) > 2 else 1000000)
+    else:
+        _test()
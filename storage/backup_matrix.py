@@ -48,6 +48,14 @@ The local and remote copies of your data is absolutely equal, have same structur
 Local files can be removed as soon as corresponding remote files gets delivered to suppliers.
 But local files is needed to rebuild the data - the "Parity" pieces is used in the RAID code
 to reconstruct "Data" pieces. So need to keep track of both "surfaces".
+
+Every matrix is stored in a compact ``storage.blocks_array.BlocksArray`` object per backup,
+scan methods here are processing whole backup at once, see ``GetMemoryUsage()``
+to check how much memory is used.
+
+A set of pieces which needs to be sent is kept for every backup and supplier,
+it is updated in ``LocalFileReport()``, ``LocalBlockReport()`` and ``RemoteFileReport()``
+and read with ``GetBlocksToSend()``, so no need to scan all blocks every time.
 """
 
 #------------------------------------------------------------------------------
@@ -83,6 +91,7 @@ from contacts import contactsdb
 from services import driver
 
 from storage import backup_fs
+from storage import blocks_array
 
 from userid import my_id
 from userid import global_id
@@ -94,6 +103,7 @@ _LocalFiles = {}
 _RemoteMaxBlockNumbers = {}
 _LocalMaxBlockNumbers = {}
 _LocalBackupSize = {}
+_BlocksToSend = {}
 _BackupsInProcess = []
 _BackupStatusNotifyCallback = None
 _StatusCallBackForGuiBackup = None
@@ -138,11 +148,13 @@ def remote_files():
       0  : no info comes yet
       1  : this file exist on given remote machine
 
-    This is a dictionary of dictionaries of dictionaries of lists. :-)))
-    Values can be accessed this way::
+    This is a dictionary of ``storage.blocks_array.BlocksArray`` objects.
+    Values can be read this way::
 
       remote_files()[backupID][blockNumber][dataORparity][supplierNumber]
 
+    To change values use ``BlocksArray.set()``, see ``RemoteFileReport()``.
+
     Here the keys are:
 
     - backupID - a unique identifier of that backup, see ``lib.packetid`` module
@@ -192,6 +204,42 @@ def local_backup_size():
     global _LocalBackupSize
     return _LocalBackupSize
 
+
+def blocks_to_send():
+    """
+    Pieces which exist locally but not delivered to suppliers yet::
+
+      blocks_to_send()[backupID][supplierNumber] = set([packetID, ...])
+
+    Backups not present here will be scanned fully in ``GetBlocksToSend()``.
+    """
+    global _BlocksToSend
+    return _BlocksToSend
+
+#------------------------------------------------------------------------------
+
+
+def remote_array(backupID, width=None):
+    """
+    Return "remote" info for given backup, create new ``BlocksArray`` if not exist yet.
+    """
+    if backupID not in remote_files():
+        if width is None:
+            width = contactsdb.num_suppliers(customer_idurl=packetid.CustomerIDURL(backupID))
+        remote_files()[backupID] = blocks_array.BlocksArray(width)
+    return remote_files()[backupID]
+
+
+def local_array(backupID, width=None):
+    """
+    Return "local" info for given backup, create new ``BlocksArray`` if not exist yet.
+    """
+    if backupID not in local_files():
+        if width is None:
+            width = contactsdb.num_suppliers(customer_idurl=packetid.CustomerIDURL(backupID))
+        local_files()[backupID] = blocks_array.BlocksArray(width)
+    return local_files()[backupID]
+
 #------------------------------------------------------------------------------
 
 
@@ -248,6 +296,15 @@ def SaveLatestRawListFiles(idurl, listFileText, customer_idurl=None):
     bpio.WriteFile(settings.SupplierListFilesFilename(idurl, customer_idurl), listFileText)
 
 
+def ReadLatestRawListFile(idurl, customer_idurl=None):
+    """
+    Return ListFiles text saved with ``SaveLatestRawListFiles()`` or empty string.
+    """
+    if not customer_idurl:
+        customer_idurl = my_id.getLocalID()
+    return bpio.ReadTextFile(settings.SupplierListFilesFilename(idurl, customer_idurl))
+
+
 def ReadRawListFiles(supplierNum, listFileText, customer_idurl=None):
     """
     Read ListFiles packet for given supplier and build a "remote" matrix. All
@@ -273,6 +330,7 @@ def ReadRawListFiles(supplierNum, listFileText, customer_idurl=None):
       "F" for files
       "D" for folders
       "V" for stored data
+      "R" for revision of the list, see ``supplier.list_files``
     """
     from storage import backup_control
     if not customer_idurl:
@@ -333,7 +391,7 @@ def ReadRawListFiles(supplierNum, listFileText, customer_idurl=None):
                 filesz = -1
             if not backup_fs.IsFileID(pth, iterID=backup_fs.fsID(customer_idurl)):
                 # remote supplier have some file - but we don't have it in the index
-                if pth.strip('/') in [settings.BackupIndexFileName(), ]:
+                if pth.strip('/') in [settings.BackupIndexFileName(), settings.BackupIndexDeltaFileName(), ]:
                     # this is the index file saved on remote supplier
                     # let's remember its size and put it in the backup_fs
                     item = backup_fs.FSItemInfo(
@@ -453,19 +511,14 @@ def ReadRawListFiles(supplierNum, listFileText, customer_idurl=None):
                     except:
                         lg.exc()
                         break
-            if backupID not in remote_files():
-                remote_files()[backupID] = {}
-                # lg.out(6, 'backup_matrix.ReadRawListFiles new remote entry for %s created in the memory' % backupID)
+            remote = remote_array(backupID, width=contactsdb.num_suppliers())
+            _reset_blocks_to_send(backupID)
             # +1 because range(2) give us [0,1] but we want [0,1,2]
             for blockNum in xrange(maxBlockNum + 1):
-                if blockNum not in remote_files()[backupID]:
-                    remote_files()[backupID][blockNum] = {
-                        'D': [0] * contactsdb.num_suppliers(),
-                        'P': [0] * contactsdb.num_suppliers(), }
                 for dataORparity in ['Data', 'Parity', ]:
                     # we set -1 if the file is missing and 1 if exist, so 0 mean "no info yet" ... smart!
                     bit = -1 if str(blockNum) in missingBlocksSet[dataORparity] else 1
-                    remote_files()[backupID][blockNum][dataORparity[0]][supplierNum] = bit
+                    remote.set(blockNum, dataORparity[0], supplierNum, bit)
                     newfiles += int((bit + 1) / 2)  # this should switch -1 or 1 to 0 or 1
             # save max block number for this backup
             if backupID not in remote_max_block_numbers():
@@ -512,6 +565,7 @@ def ReadLocalFiles():
     local_files().clear()
     local_max_block_numbers().clear()
     local_backup_size().clear()
+    _reset_blocks_to_send()
     _counter = [0, ]
 
     def visit(customer, realpath, subpath, name):
@@ -520,7 +574,7 @@ def ReadLocalFiles():
             return True
         if realpath.startswith('newblock-'):
             return False
-        if subpath in [settings.BackupIndexFileName(), settings.BackupInfoFileName(), settings.BackupInfoFileNameOld(), settings.BackupInfoEncryptedFileName()]:
+        if subpath in [settings.BackupIndexFileName(), settings.BackupIndexDeltaFileName(), settings.BackupInfoFileName(), settings.BackupInfoFileNameOld(), settings.BackupInfoEncryptedFileName()]:
             return False
         try:
             version = subpath.split('/')[-2]
@@ -550,8 +604,8 @@ def ReadLocalFiles():
                 #localSZ = sys.getsizeof(local_files())
                 #remoteSZ = sys.getsizeof(remote_files())
                 import lib.getsizeof
-                localSZ = lib.getsizeof.total_size(local_files())
-                remoteSZ = lib.getsizeof.total_size(remote_files())
+                localSZ = sum([v['local'] for v in GetMemoryUsage().values()])
+                remoteSZ = sum([v['remote'] for v in GetMemoryUsage().values()])
                 indexByName = lib.getsizeof.total_size(backup_fs.fs())
                 indexByID = lib.getsizeof.total_size(backup_fs.fsID())
                 lg.out(10, '    all local info uses %d bytes in the memory' % localSZ)
@@ -580,23 +634,21 @@ def RemoteFileReport(backupID, blockNum, supplierNum, dataORparity, result):
         lg.out(4, 'backup_matrix.RemoteFileReport got too big supplier number, possible this is an old packet')
         return
     if backupID not in remote_files():
-        remote_files()[backupID] = {}
         lg.info('new remote entry for %s created in the memory' % backupID)
-    if blockNum not in remote_files()[backupID]:
-        remote_files()[backupID][blockNum] = {
-            'D': [0] * contactsdb.num_suppliers(),
-            'P': [0] * contactsdb.num_suppliers(), }
+    remote = remote_array(backupID)
+    remote.add_block(blockNum)
     # save backed up block info into remote info structure, synchronize on hand info
     flag = 1 if result else 0
     if dataORparity == 'Data':
-        remote_files()[backupID][blockNum]['D'][supplierNum] = flag
+        remote.set(blockNum, 'D', supplierNum, flag)
     elif dataORparity == 'Parity':
-        remote_files()[backupID][blockNum]['P'][supplierNum] = flag
+        remote.set(blockNum, 'P', supplierNum, flag)
     else:
         lg.warn('incorrect backup ID: %s' % backupID)
     # if we know only 5 blocks stored on remote machine
     # but we have backed up 6th block - remember this
     remote_max_block_numbers()[backupID] = max(remote_max_block_numbers().get(backupID, -1), blockNum)
+    _update_block_to_send(backupID, blockNum, supplierNum, dataORparity)
     # mark to repaint this backup in gui
     RepaintBackup(backupID)
 
@@ -631,16 +683,13 @@ def LocalFileReport(packetID=None, backupID=None, blockNum=None, supplierNum=Non
         # lg.warn('supplier number? %d > %d : %s' % (supplierNum, contactsdb.num_suppliers(), filename))
         return
     localDest = os.path.join(settings.getLocalBackupsDir(), customer, filename)
-    if backupID not in local_files():
-        local_files()[backupID] = {}
-    if blockNum not in local_files()[backupID]:
-        local_files()[backupID][blockNum] = {
-            'D': [0] * contactsdb.num_suppliers(),
-            'P': [0] * contactsdb.num_suppliers(), }
+    local = local_array(backupID, width=contactsdb.num_suppliers())
     if not os.path.isfile(localDest):
-        local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 0
+        local.set(blockNum, dataORparity[0], supplierNum, 0)
+        _update_block_to_send(backupID, blockNum, supplierNum, dataORparity)
         return
-    local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 1
+    local.set(blockNum, dataORparity[0], supplierNum, 1)
+    _update_block_to_send(backupID, blockNum, supplierNum, dataORparity)
     if backupID not in local_max_block_numbers():
         local_max_block_numbers()[backupID] = -1
     if local_max_block_numbers()[backupID] < blockNum:
@@ -679,19 +728,18 @@ def LocalBlockReport(backupID, blockNumber, result):
             packetID = packetid.MakePacketID(remotePath, blockNum, supplierNum, dataORparity)
             local_file = os.path.join(settings.getLocalBackupsDir(), customer, packetID)
             if backupID not in local_files():
-                local_files()[backupID] = {}
                 repaint_flag = True
                 # lg.out(14, 'backup_matrix.LocalFileReport new local entry for %s created in the memory' % backupID)
-            if blockNum not in local_files()[backupID]:
-                local_files()[backupID][blockNum] = {
-                    'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
-                    'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)}
+            local = local_array(backupID, width=contactsdb.num_suppliers(customer_idurl=customer_idurl))
+            if local.add_block(blockNum):
                 repaint_flag = True
             if not os.path.isfile(local_file):
-                local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 0
+                local.set(blockNum, dataORparity[0], supplierNum, 0)
+                _update_block_to_send(backupID, blockNum, supplierNum, dataORparity)
                 repaint_flag = True
                 continue
-            local_files()[backupID][blockNum][dataORparity[0]][supplierNum] = 1
+            local.set(blockNum, dataORparity[0], supplierNum, 1)
+            _update_block_to_send(backupID, blockNum, supplierNum, dataORparity)
             if backupID not in local_backup_size():
                 local_backup_size()[backupID] = 0
                 repaint_flag = True
@@ -742,19 +790,11 @@ def ScanMissingBlocks(backupID):
             # need to scan all block numbers
             if _Debug:
                 lg.out(_DebugLevel, '    no remote info but found local info, maxBlockNum=%d' % localMaxBlockNum)
-            for blockNum in xrange(localMaxBlockNum + 1):
-                # we check for Data and Parity packets
-                localData = GetLocalDataArray(backupID, blockNum)
-                localParity = GetLocalParityArray(backupID, blockNum)
-                for supplierNum in xrange(len(supplierActiveArray)):
-                    # if supplier is not alive we can not send to him
-                    # so no need to scan for missing blocks
-                    if supplierActiveArray[supplierNum] != 1:
-                        continue
-                    if localData[supplierNum] == 1:
-                        missingBlocks.add(blockNum)
-                    if localParity[supplierNum] == 1:
-                        missingBlocks.add(blockNum)
+            # we check for Data and Parity packets,
+            # if supplier is not alive we can not send to him
+            # so no need to scan for missing blocks
+            missingBlocks.update(local_files()[backupID].blocks_with_pieces(
+                localMaxBlockNum + 1, _active_suppliers(supplierActiveArray)))
     else:
         # now we have some remote info
         # we take max block number from local and remote
@@ -762,27 +802,11 @@ def ScanMissingBlocks(backupID):
         if _Debug:
             lg.out(_DebugLevel, '    found remote info, maxBlockNum=%d' % maxBlockNum)
         # and increase by one because range(3) give us [0, 1, 2], but we want [0, 1, 2, 3]
-        for blockNum in xrange(maxBlockNum + 1):
-            # if we have few remote files, but many locals - we want to send all missed
-            if blockNum not in remote_files()[backupID]:
-                missingBlocks.add(blockNum)
-                continue
-            # take remote info for this block
-            remoteData = GetRemoteDataArray(backupID, blockNum)
-            remoteParity = GetRemoteParityArray(backupID, blockNum)
-            # now check every our supplier for every block
-            for supplierNum in xrange(len(supplierActiveArray)):
-                # if supplier is not alive we can not send to him
-                # so no need to scan for missing blocks
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if supplierNum >= len(remoteData) or supplierNum >= len(remoteParity):
-                    missingBlocks.add(blockNum)
-                    continue
-                if remoteData[supplierNum] != 1:    # -1 means missing
-                    missingBlocks.add(blockNum)     # 0 - no info yet
-                if remoteParity[supplierNum] != 1:  # 1 - file exist on remote supplier
-                    missingBlocks.add(blockNum)
+        # if we have few remote files, but many locals - we want to send all missed,
+        # otherwise check every alive supplier for every block:
+        #     -1 means missing, 0 - no info yet, 1 - file exist on remote supplier
+        missingBlocks.update(remote_files()[backupID].missing_blocks(
+            maxBlockNum + 1, _active_suppliers(supplierActiveArray)))
 
     if _Debug:
         lg.out(_DebugLevel, '    missingBlocks=%s' % missingBlocks)
@@ -805,18 +829,11 @@ def ScanBlocksToRemove(backupID, check_all_suppliers=True):
     if backupID not in remote_files() or backupID not in local_files():
         # no info about this backup yet - skip
         return packets
-    for blockNum in xrange(localMaxBlockNum + 1):
-        localArray = {'Data': GetLocalDataArray(backupID, blockNum),
-                      'Parity': GetLocalParityArray(backupID, blockNum)}
-        remoteArray = {'Data': GetRemoteDataArray(backupID, blockNum),
-                       'Parity': GetRemoteParityArray(backupID, blockNum)}
-        if (0 in remoteArray['Data']) or (0 in remoteArray['Parity']):
-            # if some supplier do not have some data for that block - do not remove any local files for that block!
-            # we do remove the local files only when we sure all suppliers got the all data pieces
-            continue
-        if (-1 in remoteArray['Data']) or (-1 in remoteArray['Parity']):
-            # also if we do not have any info about this block for some supplier do not remove other local pieces
-            continue
+    local = local_files()[backupID]
+    # if some supplier do not have some data for that block - do not remove any local files for that block!
+    # we do remove the local files only when we sure all suppliers got the all data pieces
+    # also if we do not have any info about this block for some supplier do not remove other local pieces
+    for blockNum in remote_files()[backupID].complete_blocks(localMaxBlockNum + 1):
         for supplierNum in xrange(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
             supplierIDURL = contactsdb.supplier(supplierNum, customer_idurl=customer_idurl)
             if not supplierIDURL:
@@ -827,7 +844,7 @@ def ScanBlocksToRemove(backupID, check_all_suppliers=True):
                 if io_throttle.HasPacketInSendQueue(supplierIDURL, packetID):
                     # if we do sending the packet at the moment - skip
                     continue
-                if localArray[dataORparity][supplierNum] == 1:
+                if local.get(blockNum, dataORparity[0], supplierNum) == 1:
                     packets.append(packetID)
                     # lg.out(10, '    mark to remove %s, blockNum:%d remote:%s local:%s' % (packetID, blockNum, str(remoteArray), str(localArray)))
 #                if check_all_suppliers:
@@ -851,34 +868,81 @@ def ScanBlocksToSend(backupID):
     bySupplier = {}
     for supplierNum in xrange(len(supplierActiveArray)):
         bySupplier[supplierNum] = set()
-    if backupID not in remote_files():
-        for blockNum in xrange(localMaxBlockNum + 1):
-            localData = GetLocalDataArray(backupID, blockNum)
-            localParity = GetLocalParityArray(backupID, blockNum)
-            for supplierNum in xrange(len(supplierActiveArray)):
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if localData[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Data'))
-                if localParity[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Parity'))
-    else:
-        for blockNum in xrange(localMaxBlockNum + 1):
-            remoteData = GetRemoteDataArray(backupID, blockNum)
-            remoteParity = GetRemoteParityArray(backupID, blockNum)
-            localData = GetLocalDataArray(backupID, blockNum)
-            localParity = GetLocalParityArray(backupID, blockNum)
-            for supplierNum in xrange(len(supplierActiveArray)):
-                if supplierActiveArray[supplierNum] != 1:
-                    continue
-                if supplierNum >= len(remoteData) or supplierNum >= len(remoteParity):
-                    continue
-                if remoteData[supplierNum] != 1 and localData[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Data'))
-                if remoteParity[supplierNum] != 1 and localParity[supplierNum] == 1:
-                    bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, 'Parity'))
+    if backupID not in local_files():
+        return bySupplier
+    pieces = local_files()[backupID].pieces_to_send(
+        localMaxBlockNum + 1,
+        _active_suppliers(supplierActiveArray),
+        remote=remote_files().get(backupID, None),
+    )
+    for blockNum, supplierNum, dataORparity in pieces:
+        bySupplier[supplierNum].add(packetid.MakePacketID(backupID, blockNum, supplierNum, dataORparity))
     return bySupplier
 
+
+def GetBlocksToSend(backupID):
+    """
+    Same result as ``ScanBlocksToSend()`` but pieces are taken from ``blocks_to_send()``,
+    only first call for given backup will do a full scan.
+    """
+    customer_idurl = packetid.CustomerIDURL(backupID)
+    if '' in contactsdb.suppliers(customer_idurl=customer_idurl):
+        return {}
+    supplierActiveArray = GetActiveArray(customer_idurl=customer_idurl)
+    if backupID not in blocks_to_send():
+        pending = {}
+        if backupID in local_files():
+            local = local_files()[backupID]
+            pieces = local.pieces_to_send(
+                local_max_block_numbers().get(backupID, -1) + 1,
+                range(local.width),
+                remote=remote_files().get(backupID, None),
+            )
+            for blockNum, supplierNum, dataORparity in pieces:
+                pending.setdefault(supplierNum, set()).add(
+                    packetid.MakePacketID(backupID, blockNum, supplierNum, dataORparity))
+        blocks_to_send()[backupID] = pending
+    bySupplier = {}
+    for supplierNum in xrange(len(supplierActiveArray)):
+        if supplierActiveArray[supplierNum] != 1:
+            bySupplier[supplierNum] = set()
+            continue
+        bySupplier[supplierNum] = set(blocks_to_send()[backupID].get(supplierNum, set()))
+    return bySupplier
+
+
+def _update_block_to_send(backupID, blockNum, supplierNum, dataORparity):
+    """
+    Check single piece and add it to ``blocks_to_send()`` or remove from there.
+    """
+    if backupID not in blocks_to_send():
+        # will be scanned fully when needed
+        return
+    local = local_files().get(backupID, None)
+    remote = remote_files().get(backupID, None)
+    packetID = packetid.MakePacketID(backupID, blockNum, supplierNum, dataORparity)
+    pending = blocks_to_send()[backupID]
+    if local is not None and local.get(blockNum, dataORparity[0], supplierNum) == 1 and (
+            remote is None or remote.get(blockNum, dataORparity[0], supplierNum) != 1):
+        pending.setdefault(supplierNum, set()).add(packetID)
+    elif supplierNum in pending:
+        pending[supplierNum].discard(packetID)
+
+
+def _reset_blocks_to_send(backupID=None):
+    """
+    Forget pieces to be sent for given backup or for all backups,
+    they will be scanned again in ``GetBlocksToSend()``.
+    """
+    if backupID is None:
+        blocks_to_send().clear()
+    else:
+        blocks_to_send().pop(backupID, None)
+
+
+def _active_suppliers(activeArray):
+    return [supplierNum for supplierNum in xrange(len(activeArray)) if activeArray[supplierNum] == 1]
+
 #------------------------------------------------------------------------------
 
 def RepaintBackup(backupID):
@@ -930,6 +994,7 @@ def EraseBackupRemoteInfo(backupID):
         del remote_files()[backupID]  # remote_files().pop(backupID)
     if backupID in remote_max_block_numbers():
         del remote_max_block_numbers()[backupID]
+    _reset_blocks_to_send(backupID)
 
 
 def EraseBackupLocalInfo(backupID):
@@ -942,6 +1007,7 @@ def EraseBackupLocalInfo(backupID):
         del local_max_block_numbers()[backupID]
     if backupID in local_backup_size():
         del local_backup_size()[backupID]
+    _reset_blocks_to_send(backupID)
 
 #------------------------------------------------------------------------------
 
@@ -953,6 +1019,7 @@ def ClearLocalInfo():
     local_files().clear()
     local_max_block_numbers().clear()
     local_backup_size().clear()
+    _reset_blocks_to_send()
 
 
 def ClearRemoteInfo():
@@ -961,6 +1028,7 @@ def ClearRemoteInfo():
     """
     remote_files().clear()
     remote_max_block_numbers().clear()
+    _reset_blocks_to_send()
 
 
 def ClearSupplierRemoteInfo(supplierNum, customer_idurl=None):
@@ -974,19 +1042,8 @@ def ClearSupplierRemoteInfo(supplierNum, customer_idurl=None):
     for backupID in remote_files().keys():
         _customer_idurl = packetid.CustomerIDURL(backupID)
         if _customer_idurl == customer_idurl:
-            for blockNum in remote_files()[backupID].keys():
-                try:
-                    if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                        files += 1
-                        remote_files()[backupID][blockNum]['D'][supplierNum] = 0
-                except:
-                    pass
-                try:
-                    if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                        files += 1
-                        remote_files()[backupID][blockNum]['P'][supplierNum] = 0
-                except:
-                    pass
+            files += remote_files()[backupID].clear_supplier(supplierNum)
+            _reset_blocks_to_send(backupID)
     return files
 
 #------------------------------------------------------------------------------
@@ -1003,17 +1060,8 @@ def GetBackupStats(backupID):
     percentPerSupplier = 100.0 / contactsdb.num_suppliers(customer_idurl=customer_idurl)
     # ??? maxBlockNum = remote_max_block_numbers().get(backupID, -1)
     maxBlockNum = GetKnownMaxBlockNum(backupID)
-    fileNumbers = [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    totalNumberOfFiles = 0
-    for blockNum in remote_files()[backupID].keys():
-        for supplierNum in xrange(len(fileNumbers)):
-            if supplierNum < contactsdb.num_suppliers(customer_idurl=customer_idurl):
-                if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
-                if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
+    fileNumbers = _count_pieces(remote_files()[backupID], contactsdb.num_suppliers(customer_idurl=customer_idurl))
+    totalNumberOfFiles = sum(fileNumbers)
     statsArray = []
     for supplierNum in xrange(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
         if maxBlockNum > -1:
@@ -1039,20 +1087,8 @@ def GetBackupLocalStats(backupID):
     if backupID not in local_files():
         return 0, 0, 0, maxBlockNum, [(0, 0)] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     percentPerSupplier = 100.0 / contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    totalNumberOfFiles = 0
-    fileNumbers = [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    for blockNum in xrange(maxBlockNum + 1):
-        if blockNum not in local_files()[backupID].keys():
-            continue
-#    for blockNum in local_files()[backupID].keys():
-        for supplierNum in xrange(len(fileNumbers)):
-            if supplierNum < contactsdb.num_suppliers(customer_idurl=customer_idurl):
-                if local_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
-                if local_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                    fileNumbers[supplierNum] += 1
-                    totalNumberOfFiles += 1
+    fileNumbers = _count_pieces(local_files()[backupID], contactsdb.num_suppliers(customer_idurl=customer_idurl), maxBlockNum + 1)
+    totalNumberOfFiles = sum(fileNumbers)
     statsArray = []
     for supplierNum in xrange(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
         if maxBlockNum > -1:
@@ -1079,13 +1115,7 @@ def GetBackupBlocksAndPercent(backupID):
         return 0, 0
     customer_idurl = packetid.CustomerIDURL(backupID)
     # we count all remote files for this backup
-    fileCounter = 0
-    for blockNum in remote_files()[backupID].keys():
-        for supplierNum in xrange(contactsdb.num_suppliers(customer_idurl=customer_idurl)):
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                fileCounter += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                fileCounter += 1
+    fileCounter = sum(_count_pieces(remote_files()[backupID], contactsdb.num_suppliers(customer_idurl=customer_idurl)))
     # +1 since zero based and *0.5 because Data and Parity
     return maxBlockNum + 1, 100.0 * 0.5 * fileCounter / ((maxBlockNum + 1) * contactsdb.num_suppliers(customer_idurl=customer_idurl))
 
@@ -1112,33 +1142,23 @@ def GetBackupRemoteStats(backupID, only_available_files=True):
         return -1, 0, -1, 0
     customer_idurl = packetid.CustomerIDURL(backupID)
     supplierCount = contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    fileCounter = 0
     weakBlockNum = -1
     lessSuppliers = supplierCount
     activeArray = GetActiveArray(customer_idurl=customer_idurl)
+    if only_available_files:
+        suppliers = _active_suppliers(activeArray)
+    else:
+        suppliers = range(supplierCount)
+    remote = remote_files()[backupID]
     # we count all remote files for this backup - scan all blocks
+    fileCounter = sum(remote.count_pieces(maxBlockNum + 1, suppliers))
+    goodSuppliersList = remote.good_suppliers(maxBlockNum + 1, suppliers)
     for blockNum in xrange(maxBlockNum + 1):
-        if blockNum not in remote_files()[backupID].keys():
+        goodSuppliers = goodSuppliersList[blockNum]
+        if goodSuppliers < 0:
             lessSuppliers = 0
             weakBlockNum = blockNum
             continue
-        goodSuppliers = supplierCount
-        for supplierNum in xrange(supplierCount):
-            if activeArray[supplierNum] != 1 and only_available_files:
-                goodSuppliers -= 1
-                continue
-            try:
-                remote_files()[backupID][blockNum]['D'][supplierNum]
-                remote_files()[backupID][blockNum]['D'][supplierNum]
-            except:
-                goodSuppliers -= 1
-                continue
-            if remote_files()[backupID][blockNum]['D'][supplierNum] != 1 or remote_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                fileCounter += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                fileCounter += 1
         if goodSuppliers < lessSuppliers:
             lessSuppliers = goodSuppliers
             weakBlockNum = blockNum
@@ -1151,6 +1171,33 @@ def GetBackupRemoteStats(backupID, only_available_files=True):
     )
 
 
+def _count_pieces(blocks, supplierCount, count=None):
+    """
+    Return a list of length ``supplierCount`` with number of existing pieces for every supplier.
+    """
+    counts = blocks.count_pieces(count, range(supplierCount))
+    return (counts + [0] * supplierCount)[:supplierCount]
+
+
+def GetMemoryUsage():
+    """
+    Return a dictionary with number of bytes used in the memory to store "remote"
+    and "local" info for every known backup::
+
+      {backupID: {'remote': bytes, 'local': bytes, 'blocks': blocks}, ...}
+    """
+    result = {}
+    for backupID in GetBackupIDs(remote=True, local=True):
+        remote = remote_files().get(backupID)
+        local = local_files().get(backupID)
+        result[backupID] = {
+            'remote': remote.memory() if remote is not None else 0,
+            'local': local.memory() if local is not None else 0,
+            'blocks': GetKnownMaxBlockNum(backupID) + 1,
+        }
+    return result
+
+
 def GetBackupRemoteArray(backupID):
     """
     Get info for given backup from "remote" matrix.
@@ -1200,7 +1247,7 @@ def GetKnownMaxBlockNum(backupID):
 
 
 def GetLocalMatrix(backupID, blockNum):
-    """
+    """
     """
     customer_idurl = packetid.CustomerIDURL(backupID)
     if backupID not in local_files():
@@ -1209,7 +1256,7 @@ def GetLocalMatrix(backupID, blockNum):
     if blockNum not in local_files()[backupID]:
         return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
                 'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    return local_files()[backupID][blockNum]
+    return local_files()[backupID].matrix(blockNum)
 
 
 def GetLocalDataArray(backupID, blockNum):
@@ -1222,7 +1269,7 @@ def GetLocalDataArray(backupID, blockNum):
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     if blockNum not in local_files()[backupID]:
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return local_files()[backupID][blockNum]['D']
+    return local_files()[backupID].row(blockNum, 'D')
 
 
 def GetLocalParityArray(backupID, blockNum):
@@ -1235,11 +1282,11 @@ def GetLocalParityArray(backupID, blockNum):
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     if blockNum not in local_files()[backupID]:
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return local_files()[backupID][blockNum]['P']
+    return local_files()[backupID].row(blockNum, 'P')
 
 
 def GetRemoteMatrix(backupID, blockNum):
-    """
+    """
     """
     customer_idurl = packetid.CustomerIDURL(backupID)
     if backupID not in remote_files():
@@ -1248,7 +1295,7 @@ def GetRemoteMatrix(backupID, blockNum):
     if blockNum not in remote_files()[backupID]:
         return {'D': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl),
                 'P': [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl), }
-    return remote_files()[backupID][blockNum]
+    return remote_files()[backupID].matrix(blockNum)
 
 
 def GetRemoteDataArray(backupID, blockNum):
@@ -1261,7 +1308,7 @@ def GetRemoteDataArray(backupID, blockNum):
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     if blockNum not in remote_files()[backupID]:
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return remote_files()[backupID][blockNum]['D']
+    return remote_files()[backupID].row(blockNum, 'D')
 
 
 def GetRemoteParityArray(backupID, blockNum):
@@ -1274,7 +1321,7 @@ def GetRemoteParityArray(backupID, blockNum):
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
     if blockNum not in remote_files()[backupID]:
         return [0] * contactsdb.num_suppliers(customer_idurl=customer_idurl)
-    return remote_files()[backupID][blockNum]['P']
+    return remote_files()[backupID].row(blockNum, 'P')
 
 
 def GetSupplierStats(supplierNum, customer_idurl=None):
@@ -1286,16 +1333,12 @@ def GetSupplierStats(supplierNum, customer_idurl=None):
     for backupID in remote_files().keys():
         if customer_idurl != packetid.CustomerIDURL(backupID):
             continue
-        result[backupID] = [0, 0]
-        for blockNum in remote_files()[backupID].keys():
-            if remote_files()[backupID][blockNum]['D'][supplierNum] == 1:
-                result[backupID][0] += 1
-                files += 1
-            if remote_files()[backupID][blockNum]['P'][supplierNum] == 1:
-                result[backupID][0] += 1
-                files += 1
-            result[backupID][1] += 2
-            total += 2
+        remote = remote_files()[backupID]
+        counts = remote.count_pieces(None, [supplierNum, ])
+        backupFiles = counts[supplierNum] if supplierNum < len(counts) else 0
+        result[backupID] = [backupFiles, 2 * len(remote)]
+        files += backupFiles
+        total += 2 * len(remote)
     return files, total, result
 
 
@@ -1310,13 +1353,11 @@ def GetWeakLocalBlock(backupID):
     maxBlockNum = GetKnownMaxBlockNum(backupID)
     weakBlockNum = -1
     lessSuppliers = supplierCount
+    goodSuppliersList = local_files()[backupID].good_suppliers(maxBlockNum + 1, range(supplierCount))
     for blockNum in xrange(maxBlockNum + 1):
-        if blockNum not in local_files()[backupID].keys():
+        goodSuppliers = goodSuppliersList[blockNum]
+        if goodSuppliers < 0:
             return blockNum, 0, supplierCount
-        goodSuppliers = supplierCount
-        for supplierNum in xrange(supplierCount):
-            if local_files()[backupID][blockNum]['D'][supplierNum] != 1 or local_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
         if goodSuppliers < lessSuppliers:
             lessSuppliers = goodSuppliers
             weakBlockNum = blockNum
@@ -1336,16 +1377,12 @@ def GetWeakRemoteBlock(backupID):
     weakBlockNum = -1
     lessSuppliers = supplierCount
     activeArray = GetActiveArray(customer_idurl=customer_idurl)
+    suppliers = [s for s in _active_suppliers(activeArray) if s < supplierCount]
+    goodSuppliersList = remote_files()[backupID].good_suppliers(maxBlockNum + 1, suppliers)
     for blockNum in xrange(maxBlockNum + 1):
-        if blockNum not in remote_files()[backupID].keys():
+        goodSuppliers = goodSuppliersList[blockNum]
+        if goodSuppliers < 0:
             return blockNum, 0, supplierCount
-        goodSuppliers = supplierCount
-        for supplierNum in xrange(supplierCount):
-            if activeArray[supplierNum] != 1:
-                goodSuppliers -= 1
-                continue
-            if remote_files()[backupID][blockNum]['D'][supplierNum] != 1 or remote_files()[backupID][blockNum]['P'][supplierNum] != 1:
-                goodSuppliers -= 1
         if goodSuppliers < lessSuppliers:
             lessSuppliers = goodSuppliers
             weakBlockNum = blockNum
@@ -351,16 +351,13 @@ class BackupRebuilder(automat.Automat):
         # this mean this is only local backup!
         from storage import backup_matrix
         if self.currentBackupID not in backup_matrix.remote_files():
-            backup_matrix.remote_files()[self.currentBackupID] = {}
+            remote = backup_matrix.remote_array(self.currentBackupID, width=contactsdb.num_suppliers())
             # we create empty remote info for every local block
             # range(0) should return []
             for blockNum in range(
                 backup_matrix.local_max_block_numbers().get(
                     self.currentBackupID, -1) + 1):
-                backup_matrix.remote_files()[
-                    self.currentBackupID][blockNum] = {
-                    'D': [0] * contactsdb.num_suppliers(),
-                    'P': [0] * contactsdb.num_suppliers()}
+                remote.add_block(blockNum)
         # detect missing blocks from remote info
         self.workingBlocksQueue = backup_matrix.ScanMissingBlocks(self.currentBackupID)
         # find the correct max block number for this backup
@@ -373,12 +370,9 @@ class BackupRebuilder(automat.Automat):
         # now need to remember this biggest block number
         # remote info may have less blocks - need to create empty info for
         # missing blocks
+        remote = backup_matrix.remote_array(self.currentBackupID, width=contactsdb.num_suppliers())
         for blockNum in range(backupMaxBlock + 1):
-            if blockNum in backup_matrix.remote_files()[self.currentBackupID]:
-                continue
-            backup_matrix.remote_files()[self.currentBackupID][blockNum] = {
-                'D': [0] * contactsdb.num_suppliers(),
-                'P': [0] * contactsdb.num_suppliers()}
+            remote.add_block(blockNum)
         # clear requesting queue, remove old packets for this backup, we will
         # send them again
         from customer import io_throttle
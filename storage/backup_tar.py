@@ -59,6 +59,15 @@ from system import child_process
 #------------------------------------------------------------------------------
 
 
+def compress_mode(codec, level=9, workers=1):
+    """
+    Return compression argument for "bppipe", like "bz2" or "gz:1:4".
+    """
+    if codec == 'none' or (level == 9 and workers == 1):
+        return codec
+    return '%s:%d:%d' % (codec, level, workers)
+
+
 def backuptardir(directorypath, arcname=None, recursive_subfolders=True, compress=None):
     """
     Returns file descriptor for process that makes tar archive.
@@ -0,0 +1,368 @@
+#!/usr/bin/python
+# blocks_array.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (blocks_array.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: blocks_array.
+
+Compact storage for a single backup in the "remote" or "local" matrix,
+see ``storage.backup_matrix``.
+
+All cells are kept in one flat ``array.array('b')`` - a row per block,
+first ``width`` cells of the row are "Data" pieces and next ``width``
+cells are "Parity" pieces, one cell per supplier. Values are same as before::
+
+    -1 : file is missing
+    0  : no info yet
+    1  : file exist
+
+A ``bytearray`` marks which blocks are known at all.
+
+Object also behaves like a read-only dictionary of blocks
+used before: ``blocks[blockNumber]['D'][supplierNumber]``.
+
+If ``numpy`` is installed scan methods process the whole array at once,
+otherwise same results are calculated with plain loops.
+"""
+
+#------------------------------------------------------------------------------
+
+import array
+
+try:
+    import numpy
+except:
+    numpy = None
+
+#------------------------------------------------------------------------------
+
+
+class BlocksArray(object):
+    """
+    Blocks by suppliers matrix of a single backup.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.cells = array.array('b')
+        self.known = bytearray()
+
+    def __repr__(self):
+        return 'BlocksArray(%d blocks, %d suppliers)' % (len(self.known), self.width)
+
+    #------------------------------------------------------------------------------
+
+    def __contains__(self, blockNum):
+        return self.has_block(blockNum)
+
+    def __getitem__(self, blockNum):
+        if not self.has_block(blockNum):
+            raise KeyError(blockNum)
+        return self.matrix(blockNum)
+
+    def __setitem__(self, blockNum, matrix):
+        self.add_block(blockNum)
+        for dataORparity in ('D', 'P', ):
+            for supplierNum, value in enumerate(matrix.get(dataORparity, [])):
+                self.set(blockNum, dataORparity, supplierNum, value)
+
+    def __len__(self):
+        return self.known.count('\x01')
+
+    def keys(self):
+        return [blockNum for blockNum in xrange(len(self.known)) if self.known[blockNum]]
+
+    #------------------------------------------------------------------------------
+
+    def has_block(self, blockNum):
+        return 0 <= blockNum < len(self.known) and self.known[blockNum] != 0
+
+    def size(self):
+        """
+        Return number of rows allocated, this is max known block number + 1.
+        """
+        return len(self.known)
+
+    def memory(self):
+        """
+        Return number of bytes used to store the cells.
+        """
+        return len(self.cells) * self.cells.itemsize + len(self.known)
+
+    def offset(self, blockNum, dataORparity):
+        return blockNum * 2 * self.width + (0 if dataORparity == 'D' else self.width)
+
+    def grow(self, count):
+        """
+        Allocate rows for blocks up to ``count - 1``.
+        """
+        if count <= len(self.known):
+            return
+        self.cells.extend(array.array('b', [0, ]) * ((count - len(self.known)) * 2 * self.width))
+        self.known.extend('\x00' * (count - len(self.known)))
+
+    def widen(self, width):
+        """
+        Make rows wider, if number of suppliers was increased.
+        """
+        if width <= self.width:
+            return
+        if self.width == 0:
+            self.cells = array.array('b', [0, ]) * (len(self.known) * 2 * width)
+            self.width = width
+            return
+        cells = array.array('b')
+        pad = array.array('b', [0, ]) * (width - self.width)
+        for pos in xrange(0, len(self.cells), self.width):
+            cells.extend(self.cells[pos:pos + self.width])
+            cells.extend(pad)
+        self.cells = cells
+        self.width = width
+
+    def add_block(self, blockNum):
+        """
+        Mark block as known, return True if it was not known before.
+        """
+        self.grow(blockNum + 1)
+        if self.known[blockNum]:
+            return False
+        self.known[blockNum] = 1
+        return True
+
+    def get(self, blockNum, dataORparity, supplierNum):
+        if not self.has_block(blockNum) or supplierNum >= self.width:
+            return 0
+        return self.cells[self.offset(blockNum, dataORparity) + supplierNum]
+
+    def set(self, blockNum, dataORparity, supplierNum, value):
+        self.add_block(blockNum)
+        if supplierNum >= self.width:
+            self.widen(supplierNum + 1)
+        self.cells[self.offset(blockNum, dataORparity) + supplierNum] = value
+
+    def row(self, blockNum, dataORparity):
+        """
+        Return a list of values for single block, zeros if block is unknown.
+        """
+        if not self.has_block(blockNum):
+            return [0] * self.width
+        pos = self.offset(blockNum, dataORparity)
+        return self.cells[pos:pos + self.width].tolist()
+
+    def matrix(self, blockNum):
+        return {'D': self.row(blockNum, 'D'), 'P': self.row(blockNum, 'P'), }
+
+    def clear_supplier(self, supplierNum):
+        """
+        Set all cells of given supplier to 0 and return number of existing files.
+        """
+        files = 0
+        if supplierNum >= self.width:
+            return files
+        for pos in xrange(supplierNum, len(self.cells), self.width):
+            if self.cells[pos] == 1:
+                files += 1
+            self.cells[pos] = 0
+        return files
+
+    #------------------------------------------------------------------------------
+
+    def to_numpy(self, count):
+        """
+        Return a tuple (known, cells) of numpy arrays for blocks in range(count),
+        shape of ``cells`` is (count, 2, width).
+        """
+        rows = min(count, len(self.known))
+        known = numpy.zeros(count, dtype=numpy.bool_)
+        cells = numpy.zeros((count, 2, self.width), dtype=numpy.int8)
+        if rows > 0 and self.width > 0:
+            known[:rows] = numpy.frombuffer(self.known, dtype=numpy.uint8, count=rows) != 0
+            cells[:rows] = numpy.frombuffer(self.cells, dtype=numpy.int8, count=rows * 2 * self.width).reshape((rows, 2, self.width))
+        elif rows > 0:
+            known[:rows] = numpy.frombuffer(self.known, dtype=numpy.uint8, count=rows) != 0
+        return known, cells
+
+    def missing_blocks(self, count, suppliers):
+        """
+        Return a list of block numbers in range(count) which are not known or
+        have a piece not equal to 1 for one of given suppliers.
+        """
+        inside = [s for s in suppliers if s < self.width]
+        outside = len(inside) < len(suppliers)
+        if numpy is not None:
+            known, cells = self.to_numpy(count)
+            missing = ~known
+            if outside:
+                missing[:] = True
+            elif inside:
+                missing |= (cells[:, :, inside] != 1).any(axis=2).any(axis=1)
+            return numpy.flatnonzero(missing).tolist()
+        result = []
+        for blockNum in xrange(count):
+            if not self.has_block(blockNum) or outside:
+                result.append(blockNum)
+                continue
+            posD = self.offset(blockNum, 'D')
+            posP = posD + self.width
+            for s in inside:
+                if self.cells[posD + s] != 1 or self.cells[posP + s] != 1:
+                    result.append(blockNum)
+                    break
+        return result
+
+    def blocks_with_pieces(self, count, suppliers):
+        """
+        Return a list of block numbers in range(count) which have a piece equal
+        to 1 for one of given suppliers.
+        """
+        inside = [s for s in suppliers if s < self.width]
+        if not inside:
+            return []
+        if numpy is not None:
+            _, cells = self.to_numpy(count)
+            return numpy.flatnonzero((cells[:, :, inside] == 1).any(axis=2).any(axis=1)).tolist()
+        result = []
+        for blockNum in xrange(min(count, len(self.known))):
+            if not self.known[blockNum]:
+                continue
+            posD = self.offset(blockNum, 'D')
+            posP = posD + self.width
+            for s in inside:
+                if self.cells[posD + s] == 1 or self.cells[posP + s] == 1:
+                    result.append(blockNum)
+                    break
+        return result
+
+    def complete_blocks(self, count):
+        """
+        Return a list of known block numbers in range(count) where all pieces
+        are equal to 1.
+        """
+        if numpy is not None:
+            known, cells = self.to_numpy(count)
+            return numpy.flatnonzero(known & (cells == 1).all(axis=2).all(axis=1)).tolist()
+        result = []
+        rowsize = 2 * self.width
+        for blockNum in xrange(min(count, len(self.known))):
+            if not self.known[blockNum]:
+                continue
+            pos = blockNum * rowsize
+            if self.cells[pos:pos + rowsize].count(1) == rowsize:
+                result.append(blockNum)
+        return result
+
+    def pieces_to_send(self, count, suppliers, remote=None):
+        """
+        Return a list of tuples (blockNum, supplierNum, dataORparity) for
+        pieces in range(count) which are equal to 1 here but not equal to 1 in
+        ``remote`` array. If ``remote`` is None all pieces equal to 1 are returned.
+        """
+        inside = [s for s in suppliers if s < self.width]
+        if remote is not None:
+            inside = [s for s in inside if s < remote.width]
+        if not inside:
+            return []
+        result = []
+        if numpy is not None:
+            _, cells = self.to_numpy(count)
+            mask = cells[:, :, inside] == 1
+            if remote is not None:
+                _, remote_cells = remote.to_numpy(count)
+                mask &= remote_cells[:, :, inside] != 1
+            for blockNum, dp, pos in zip(*numpy.nonzero(mask)):
+                result.append((int(blockNum), inside[pos], 'Data' if dp == 0 else 'Parity', ))
+            return result
+        for blockNum in xrange(min(count, len(self.known))):
+            if not self.known[blockNum]:
+                continue
+            for dp, dataORparity in enumerate(('Data', 'Parity', )):
+                pos = self.offset(blockNum, dataORparity[0])
+                for s in inside:
+                    if self.cells[pos + s] != 1:
+                        continue
+                    if remote is not None and remote.get(blockNum, dataORparity[0], s) == 1:
+                        continue
+                    result.append((blockNum, s, dataORparity, ))
+        return result
+
+    def good_suppliers(self, count, suppliers):
+        """
+        Return a list with number of given suppliers which have both Data and
+        Parity pieces for every block in range(count), -1 for unknown blocks.
+        """
+        inside = [s for s in suppliers if s < self.width]
+        if numpy is not None:
+            known, cells = self.to_numpy(count)
+            if inside:
+                good = (cells[:, :, inside] == 1).all(axis=1).sum(axis=1)
+            else:
+                good = numpy.zeros(count, dtype=numpy.int64)
+            good[~known] = -1
+            return good.tolist()
+        result = []
+        for blockNum in xrange(count):
+            if not self.has_block(blockNum):
+                result.append(-1)
+                continue
+            posD = self.offset(blockNum, 'D')
+            posP = posD + self.width
+            good = 0
+            for s in inside:
+                if self.cells[posD + s] == 1 and self.cells[posP + s] == 1:
+                    good += 1
+            result.append(good)
+        return result
+
+    def count_pieces(self, count=None, suppliers=None):
+        """
+        Return a list with number of pieces equal to 1 (Data and Parity) for
+        every supplier in range(width), only blocks in range(count) are counted
+        and only given suppliers, others will have 0.
+        """
+        if count is None:
+            count = len(self.known)
+        if suppliers is None:
+            suppliers = range(self.width)
+        result = [0] * self.width
+        inside = [s for s in suppliers if s < self.width]
+        if not inside:
+            return result
+        if numpy is not None:
+            known, cells = self.to_numpy(count)
+            totals = (cells[known] == 1).sum(axis=1).sum(axis=0)
+            for s in inside:
+                result[s] = int(totals[s])
+            return result
+        for blockNum in xrange(min(count, len(self.known))):
+            if not self.known[blockNum]:
+                continue
+            posD = self.offset(blockNum, 'D')
+            posP = posD + self.width
+            for s in inside:
+                if self.cells[posD + s] == 1:
+                    result[s] += 1
+                if self.cells[posP + s] == 1:
+                    result[s] += 1
+        return result
@@ -0,0 +1,313 @@
+#!/usr/bin/python
+# dedup.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (dedup.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: dedup.
+
+Content-defined chunking and local index of chunks for incremental backups,
+see ``settings.getBackupDedupEnabled()``.
+
+The ".tar" stream is split into chunks where the content says so:
+a "gear" rolling hash is calculated over last 32 bytes and a chunk ends
+where top bits of the hash are zero, so after a change in the middle of
+the stream next boundaries are found at same places and other chunks
+stay the same as in the previous version.
+
+Every block of such backup keeps one chunk, compressed with zlib, and a list
+of references to chunks which were already stored before::
+
+    MAGIC
+    <number of references>
+    <backupID> <blockNumber> <length>
+    ...
+    <"z" or "-">
+    <chunk data>
+
+During restore references are written as gaps in the output file and filled
+later from blocks of other versions, see ``restore_monitor``.
+
+Local index is a journal file in the "metadata" folder with lines::
+
+    c <hash> <backupID> <blockNumber> <length>    : chunk was stored in the block
+    r <backupID> <referencedBackupID>            : backup refers to another backup
+    d <backupID>                                  : backup was removed
+
+A backup which is referenced by another one should not be removed,
+see ``IsReferenced()``.
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import zlib
+import hashlib
+
+try:
+    import numpy
+except:
+    numpy = None
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from system import bpio
+
+from lib import packetid
+
+from main import settings
+
+#------------------------------------------------------------------------------
+
+MAGIC = '\x00BitDustDedup1\n'
+MAX_REFS = 4096
+WINDOW = 32
+
+_GearTable = None
+_GearArray = None
+_Chunks = None
+_Refs = None
+
+#------------------------------------------------------------------------------
+
+
+def gear_table():
+    """
+    Return 256 "random" 32 bits values, same on every machine.
+    """
+    global _GearTable
+    global _GearArray
+    if _GearTable is None:
+        _GearTable = [int(hashlib.md5(str(i)).hexdigest()[:8], 16) for i in range(256)]
+        if numpy is not None:
+            _GearArray = numpy.array(_GearTable, dtype=numpy.uint32)
+    return _GearTable
+
+
+def chunk_sizes(block_size):
+    """
+    Return a tuple (min_size, max_size, mask) for given block size,
+    chunks are about 3/8 of the block size on average.
+    """
+    max_size = max(WINDOW * 4, block_size)
+    min_size = max(WINDOW, max_size / 8)
+    bits = 1
+    while (1 << (bits + 1)) <= max_size / 4:
+        bits += 1
+    mask = ((1 << bits) - 1) << (32 - bits)
+    return min_size, max_size, mask
+
+
+def find_cut(data, offset, min_size, max_size, mask):
+    """
+    Return length of the first chunk in ``data`` starting from ``offset``,
+    None if more data is needed to decide.
+    """
+    size = len(data) - offset
+    limit = min(size, max_size)
+    start = max(0, min_size - WINDOW)
+    table = gear_table()
+    if start < limit:
+        if numpy is not None:
+            values = _GearArray[numpy.frombuffer(data, dtype=numpy.uint8, count=limit - start, offset=offset + start)]
+            h = values.copy()
+            for j in xrange(1, WINDOW):
+                h[j:] += values[:len(values) - j] << j
+            positions = numpy.flatnonzero((h & mask) == 0)
+            positions = positions[positions + start >= min_size - 1]
+            if len(positions):
+                return int(positions[0]) + start + 1
+        else:
+            h = 0
+            for pos in xrange(offset + start, offset + limit):
+                h = ((h << 1) + table[ord(data[pos])]) & 0xFFFFFFFF
+                if not h & mask and pos - offset >= min_size - 1:
+                    return pos - offset + 1
+    if size >= max_size:
+        return max_size
+    return None
+
+
+def chunk_hash(chunk):
+    return hashlib.sha1(chunk).hexdigest()
+
+#------------------------------------------------------------------------------
+
+
+def IsDedupBlock(data):
+    return data.startswith(MAGIC)
+
+
+def PackBlock(refs, chunk, compress=True):
+    """
+    Return block data with given references and chunk.
+    """
+    out = [MAGIC, '%d\n' % len(refs), ]
+    for refBackupID, blockNum, length in refs:
+        out.append('%s %d %d\n' % (refBackupID, blockNum, length))
+    if compress and chunk:
+        compressed = zlib.compress(chunk, 6)
+        if len(compressed) < len(chunk):
+            out.append('z\n')
+            out.append(compressed)
+            return ''.join(out)
+    out.append('-\n')
+    out.append(chunk)
+    return ''.join(out)
+
+
+def UnpackBlock(data):
+    """
+    Opposite to ``PackBlock()``, return a tuple (refs, chunk).
+    """
+    pos = len(MAGIC)
+    end = data.index('\n', pos)
+    count = int(data[pos:end])
+    pos = end + 1
+    refs = []
+    for _ in xrange(count):
+        end = data.index('\n', pos)
+        refBackupID, blockNum, length = data[pos:end].split(' ')
+        refs.append((refBackupID, int(blockNum), int(length), ))
+        pos = end + 1
+    flag = data[pos]
+    chunk = data[pos + 2:]
+    if flag == 'z':
+        chunk = zlib.decompress(chunk)
+    return refs, chunk
+
+#------------------------------------------------------------------------------
+
+
+def _path_key(backupID):
+    customerGlobalID, pathID, _ = packetid.SplitBackupID(backupID)
+    return customerGlobalID + ':' + pathID
+
+
+def _journal(line):
+    if not bpio.AtomicAppendFile(settings.BackupDedupIndexFilePath(), line + '\n'):
+        lg.warn('failed to write dedup index')
+
+
+def _load():
+    global _Chunks
+    global _Refs
+    if _Chunks is not None:
+        return
+    _Chunks = {}
+    _Refs = {}
+    src = bpio.ReadTextFile(settings.BackupDedupIndexFilePath())
+    if not src:
+        return
+    removed = 0
+    for line in src.splitlines():
+        words = line.split(' ')
+        try:
+            if words[0] == 'c':
+                chunkHash, backupID, blockNum, length = words[1:]
+                _Chunks.setdefault((_path_key(backupID), chunkHash), (backupID, int(blockNum), int(length), ))
+            elif words[0] == 'r':
+                _Refs.setdefault(words[1], set()).add(words[2])
+            elif words[0] == 'd':
+                _forget(words[1])
+                removed += 1
+        except:
+            lg.warn('wrong line in dedup index: %r' % line)
+    if removed:
+        _save()
+    if _Debug:
+        lg.out(_DebugLevel, 'dedup._load %d chunks, %d backups with references' % (len(_Chunks), len(_Refs)))
+
+
+def _save():
+    lines = []
+    for (_, chunkHash), (backupID, blockNum, length) in _Chunks.items():
+        lines.append('c %s %s %d %d' % (chunkHash, backupID, blockNum, length))
+    for backupID, refs in _Refs.items():
+        for refBackupID in refs:
+            lines.append('r %s %s' % (backupID, refBackupID))
+    if not bpio.WriteFile(settings.BackupDedupIndexFilePath(), '\n'.join(lines) + '\n'):
+        lg.warn('failed to write dedup index')
+
+
+def _forget(backupID):
+    for key, value in _Chunks.items():
+        if value[0] == backupID:
+            _Chunks.pop(key)
+    _Refs.pop(backupID, None)
+
+#------------------------------------------------------------------------------
+
+
+def Lookup(backupID, chunkHash):
+    """
+    Return a tuple (backupID, blockNumber, length) if same chunk was already
+    stored for that path, otherwise None.
+    """
+    _load()
+    return _Chunks.get((_path_key(backupID), chunkHash))
+
+
+def AddChunk(chunkHash, backupID, blockNum, length):
+    _load()
+    key = (_path_key(backupID), chunkHash)
+    if key in _Chunks:
+        return False
+    _Chunks[key] = (backupID, blockNum, length, )
+    _journal('c %s %s %d %d' % (chunkHash, backupID, blockNum, length))
+    return True
+
+
+def AddReference(backupID, refBackupID):
+    _load()
+    if backupID == refBackupID:
+        return False
+    if refBackupID in _Refs.get(backupID, set()):
+        return False
+    _Refs.setdefault(backupID, set()).add(refBackupID)
+    _journal('r %s %s' % (backupID, refBackupID))
+    return True
+
+
+def IsReferenced(backupID):
+    """
+    Return a list of other backups which are using chunks stored in given backup.
+    """
+    _load()
+    return [b for b, refs in _Refs.items() if backupID in refs]
+
+
+def ForgetBackup(backupID):
+    """
+    Backup was removed, its chunks can not be used anymore.
+    """
+    _load()
+    _forget(backupID)
+    _journal('d %s' % backupID)
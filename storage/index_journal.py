@@ -0,0 +1,248 @@
+#!/usr/bin/python
+# index_journal.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (index_journal.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: index_journal.
+
+Local storage of the catalog index, see ``storage.backup_fs``.
+
+Index is kept in two files in the "metadata" folder:
+
+    index.snapshot : compact binary copy of the whole index at some revision
+    index.journal  : changes made after the snapshot, one line per revision
+
+Every line of the journal is a JSON record::
+
+    {"r": <revision>,
+     "d": [[<customer ID>, <path ID>], ...],   : removed items
+     "u": [[<customer ID>, <item>], ...]}      : added or modified items
+
+Items are in same format as in the JSON index, see ``FSItemInfo.serialize()``.
+On startup the snapshot is loaded and records after its revision are
+replayed. When the journal grows too big a new snapshot is written and
+the journal is started again, see ``backup_control.Save()``.
+
+Same records are sent to suppliers in the "index.delta" file,
+so they do not need the full index after every change.
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import json
+import zlib
+import marshal
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from system import bpio
+
+from userid import global_id
+
+from storage import backup_fs
+
+#------------------------------------------------------------------------------
+
+MAGIC = 'BitDustIndex1\n'
+
+#------------------------------------------------------------------------------
+
+
+def pack_item(item):
+    """
+    Return a tuple with all fields of ``FSItemInfo`` to be stored with ``marshal``.
+    """
+    return (
+        item.name(),
+        item.path_id,
+        item.type,
+        item.size,
+        item.key_id,
+        item.versions,
+    )
+
+
+def unpack_item(src):
+    """
+    Create ``FSItemInfo`` from tuple made by ``pack_item()``.
+    """
+    name, path_id, typ, size, key_id, versions = src
+    item = backup_fs.FSItemInfo(name=name, path_id=path_id, typ=typ, key_id=key_id)
+    item.size = size
+    item.set_versions(versions)
+    return item
+
+
+def list_items(iterID, result):
+    """
+    Append all items of ``iterID`` tree to ``result`` list, folders goes before their content.
+    """
+    for key, value in iterID.iteritems():
+        if key == backup_fs.INFO_KEY:
+            continue
+        if isinstance(value, dict):
+            if backup_fs.INFO_KEY in value:
+                result.append(value[backup_fs.INFO_KEY])
+            list_items(value, result)
+        else:
+            result.append(value)
+    return result
+
+#------------------------------------------------------------------------------
+
+
+def WriteSnapshot(filepath, revision):
+    """
+    Save the whole index in binary format, return number of written items or -1.
+    """
+    customers = {}
+    count = 0
+    for customer_idurl in backup_fs.known_customers():
+        items = list_items(backup_fs.fsID(customer_idurl), [])
+        customers[global_id.UrlToGlobalID(customer_idurl)] = [pack_item(item) for item in items]
+        count += len(items)
+    src = MAGIC + zlib.compress(marshal.dumps((revision, customers, ), 2), 1)
+    if not bpio.AtomicWriteFile(filepath, src):
+        return -1
+    if _Debug:
+        lg.out(_DebugLevel, 'index_journal.WriteSnapshot %d items, %d bytes, revision %d' % (count, len(src), revision))
+    return count
+
+
+def ReadSnapshot(filepath):
+    """
+    Load index from the snapshot file, return a tuple (revision, number of items)
+    or None if file not exist or not readable.
+    """
+    src = bpio.ReadBinaryFile(filepath)
+    if not src or not src.startswith(MAGIC):
+        return None
+    try:
+        revision, customers = marshal.loads(zlib.decompress(src[len(MAGIC):]))
+    except:
+        lg.exc()
+        return None
+    count = 0
+    for customer_id, items in customers.items():
+        customer_idurl = global_id.GlobalUserToIDURL(customer_id)
+        count += backup_fs.SetItems(
+            [unpack_item(item) for item in items],
+            iter=backup_fs.fs(customer_idurl),
+            iterID=backup_fs.fsID(customer_idurl),
+        )
+    if _Debug:
+        lg.out(_DebugLevel, 'index_journal.ReadSnapshot %d items, revision %d' % (count, revision))
+    return revision, count
+
+#------------------------------------------------------------------------------
+
+
+def MakeRecord(revision, deleted, changed, encoding='utf-8'):
+    """
+    Create journal record from output of ``backup_fs.PopChanges()``.
+    """
+    return {
+        'r': revision,
+        'd': [[global_id.UrlToGlobalID(customer_idurl), path_id, ] for customer_idurl, path_id in deleted],
+        'u': [[global_id.UrlToGlobalID(customer_idurl), item.serialize(encoding=encoding, to_json=True), ] for customer_idurl, item in changed],
+    }
+
+
+def AppendRecord(filepath, record, encoding='utf-8'):
+    """
+    Write one more line to the journal file.
+    """
+    return bpio.AtomicAppendFile(filepath, json.dumps(record, encoding=encoding) + '\n', 'ab')
+
+
+def ReadRecords(filepath, after_revision=-1, raw=False):
+    """
+    Return a list of records from the journal with revision greater than ``after_revision``.
+    Last line can be broken if program was stopped while writing - it is skipped.
+    If ``raw`` is True lines are not parsed, a list of tuples (revision, line) is returned.
+    """
+    src = bpio.ReadBinaryFile(filepath)
+    return ParseRecords(src, after_revision, raw)
+
+
+def ParseRecords(src, after_revision=-1, raw=False):
+    """
+    Same as ``ReadRecords()`` but ``src`` is a text with journal lines.
+    """
+    result = []
+    for line in src.splitlines():
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            revision = int(record['r'])
+        except:
+            lg.warn('skip broken line in the index journal')
+            continue
+        if revision <= after_revision:
+            continue
+        result.append((revision, line, ) if raw else record)
+    return result
+
+
+def ApplyRecord(record, decoding='utf-8'):
+    """
+    Make changes in the index listed in the journal record.
+    """
+    for customer_id, path_id in record.get('d', []):
+        customer_idurl = global_id.GlobalUserToIDURL(customer_id)
+        try:
+            backup_fs.DeleteByID(path_id, iter=backup_fs.fs(customer_idurl), iterID=backup_fs.fsID(customer_idurl))
+        except:
+            lg.exc()
+    for customer_id, json_item in record.get('u', []):
+        customer_idurl = global_id.GlobalUserToIDURL(customer_id)
+        item = backup_fs.FSItemInfo()
+        try:
+            item.unserialize(json_item, decoding=decoding, from_json=True)
+            ok = backup_fs.UpdateItem(item, iter=backup_fs.fs(customer_idurl), iterID=backup_fs.fsID(customer_idurl))
+        except:
+            lg.exc()
+            continue
+        if not ok:
+            lg.warn('can not put item into the tree: %s' % str(item))
+    return int(record['r'])
+
+
+def Erase(filepath):
+    """
+    Start the journal again, called after a new snapshot was written.
+    """
+    if os.path.isfile(filepath):
+        return bpio.AtomicWriteFile(filepath, '')
+    return True
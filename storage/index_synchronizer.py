@@ -57,6 +57,8 @@ At first step, index_synchronizer() requests all remote copies of the database f
 When new file arrives from supplier, "backup_control" starts a validation against
 current local index file and update local copy if required.
 On next step index_synchronizer() sends a latest version of index file to all suppliers to hold.
+If suppliers already have the full index only recent changes are sent in the "index.delta" file,
+see ``backup_control.PrepareIndexPush()``.
 
 The backup_monitor() machine should be restarted every one hour
 or every time when your backups is changed.
@@ -169,6 +171,7 @@ class IndexSynchronizer(automat.Automat):
         self.requested_suppliers_number = 0
         self.sending_suppliers = set()
         self.sent_suppliers_number = 0
+        self.sending_revision = -1
 
     def state_changed(self, oldstate, newstate, event, arg):
         """
@@ -291,6 +294,10 @@ class IndexSynchronizer(automat.Automat):
             path=settings.BackupIndexFileName(),
         )
         # packetID = settings.BackupIndexFileName()
+        deltaPacketID = global_id.MakeGlobalID(
+            customer=my_id.getGlobalID(key_alias='master'),
+            path=settings.BackupIndexDeltaFileName(),
+        )
         localID = my_id.getLocalID()
         for supplierId in contactsdb.suppliers():
             if not supplierId:
@@ -320,6 +327,8 @@ class IndexSynchronizer(automat.Automat):
             if pkt_out:
                 self.requesting_suppliers.add(supplierId)
                 self.requested_suppliers_number += 1
+                # also changes made after full index was stored, answer is processed by backup_control
+                p2p_service.SendRetreive(localID, localID, deltaPacketID, supplierId)
             if _Debug:
                 lg.out(_DebugLevel, '    %s sending to %s' %
                        (pkt_out, nameurl.GetName(supplierId)))
@@ -328,22 +337,29 @@ class IndexSynchronizer(automat.Automat):
         """
         Action method.
         """
+        if driver.is_on('service_backups'):
+            from storage import backup_control
+            filename, src = backup_control.PrepareIndexPush(self.latest_supplier_revision)
+            self.sending_revision = backup_control.revision()
+        else:
+            filename = settings.BackupIndexFileName()
+            src = bpio.ReadBinaryFile(settings.BackupIndexFilePath())
+            self.sending_revision = -1
         if _Debug:
-            lg.out(_DebugLevel, 'index_synchronizer.doSuppliersSendIndexFile')
+            lg.out(_DebugLevel, 'index_synchronizer.doSuppliersSendIndexFile %s with %d bytes' % (filename, len(src)))
         packetID = global_id.MakeGlobalID(
             customer=my_id.getGlobalID(key_alias='master'),
-            path=settings.BackupIndexFileName(),
+            path=filename,
         )
         self.sending_suppliers.clear()
         self.sent_suppliers_number = 0
-        src = bpio.ReadBinaryFile(settings.BackupIndexFilePath())
         localID = my_id.getLocalID()
         b = encrypted.Block(
             localID,
             packetID,
             0,
             key.NewSessionKey(),
-            key.SessionKeyType(),
+            key.StreamSessionKeyType(),
             True,
             src,
         )
@@ -370,11 +386,13 @@ class IndexSynchronizer(automat.Automat):
         """
         Action method.
         """
-        packetID = global_id.MakeGlobalID(
-            customer=my_id.getGlobalID(key_alias='master'),
-            path=settings.BackupIndexFileName(),
-        )
-        packetsToCancel = packet_out.search_by_backup_id(packetID)
+        packetsToCancel = []
+        for filename in [settings.BackupIndexFileName(), settings.BackupIndexDeltaFileName(), ]:
+            packetID = global_id.MakeGlobalID(
+                customer=my_id.getGlobalID(key_alias='master'),
+                path=filename,
+            )
+            packetsToCancel.extend(packet_out.search_by_backup_id(packetID))
         for pkt_out in packetsToCancel:
             if pkt_out.outpacket.Command == commands.Retrieve():
                 lg.warn('sending "cancel" to %s' % pkt_out)
@@ -422,6 +440,9 @@ class IndexSynchronizer(automat.Automat):
         else:
             raise Exception('not found supplier connector')
         self.sending_suppliers.discard(newpacket.OwnerID)
+        if newpacket.Command == commands.Ack() and self.sending_revision > self.latest_supplier_revision:
+            # now supplier keeps that revision, next time only delta can be sent
+            self.latest_supplier_revision = self.sending_revision
         if _Debug:
             lg.out(_DebugLevel, 'index_synchronizer._on_supplier_acked %s, pending: %d, total: %d' % (
                 newpacket, len(self.sending_suppliers), self.sent_suppliers_number))
@@ -26,6 +26,9 @@
 
 Manages currently restoring backups.
 
+If restored backup was incremental, chunks it refers to are restored
+after that from blocks of other versions, before extracting the ".tar" file.
+
 """
 
 #------------------------------------------------------------------------------
@@ -125,12 +128,40 @@ def extract_failed(err, backupID, callback_method):
     return err
 
 
-def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_method):
+def restore_references(references, backupID, outfd, tarfilename, outputlocation, callback_method, keyID=None):
+    """
+    Restore chunks referenced from incremental backup, one worker per every other backup ID.
+    """
+    from storage import restore_worker
+    blocks = {}
+    for refBackupID, blockNum, offset in references:
+        blocks.setdefault(refBackupID, {}).setdefault(blockNum, []).append(offset)
+    pending = [(refBackupID, sorted(blocks[refBackupID].items()), ) for refBackupID in sorted(blocks.keys())]
+    lg.out(4, 'restore_monitor.restore_references for %s : %d references in %d backups' % (
+        backupID, len(references), len(pending)))
+
+    def _next(result):
+        if result != 'done' or not pending:
+            return restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_method)
+        refBackupID, refBlocks = pending.pop(0)
+        r = restore_worker.RestoreWorker(refBackupID, outfd, KeyID=keyID, Blocks=refBlocks)
+        r.MyDeferred.addCallback(_next)
+        r.set_packet_in_callback(lambda _, newpacket: packet_in_callback(backupID, newpacket))
+        _WorkingBackupIDs[backupID] = r
+        r.automat('init')
+        return r.MyDeferred
+
+    return _next('done')
+
+
+def restore_done(result, backupID, outfd, tarfilename, outputlocation, callback_method, worker=None):
     lg.out(4, '!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
     lg.out(4, 'restore_monitor.restore_done for %s with result=%s' % (backupID, result))
     global _WorkingBackupIDs
     global _WorkingRestoreProgress
     global OnRestoreDoneFunc
+    if result == 'done' and worker is not None and worker.References:
+        return restore_references(worker.References, backupID, outfd, tarfilename, outputlocation, callback_method, worker.KeyID)
     try:
         os.close(outfd)
     except:
@@ -197,7 +228,7 @@ def Start(backupID, outputLocation, callback=None, keyID=None):
     else:
         from storage import restore_worker
         r = restore_worker.RestoreWorker(backupID, outfd, KeyID=keyID)
-    r.MyDeferred.addCallback(restore_done, backupID, outfd, outfilename, outputLocation, callback)
+    r.MyDeferred.addCallback(restore_done, backupID, outfd, outfilename, outputLocation, callback, r)
     # r.MyDeferred.addErrback(restore_failed, outfilename, callback)
     r.set_block_restored_callback(block_restored_callback)
     r.set_packet_in_callback(packet_in_callback)
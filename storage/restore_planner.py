@@ -0,0 +1,132 @@
+#!/usr/bin/python
+# restore_planner.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (restore_planner.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: restore_planner.
+
+Decide which pieces of a single block to request from suppliers during restore.
+
+Every missing "Data" or "Parity" piece has a cost - how long we expect to wait
+for that supplier, see ``supplier_cost()``. Pieces are taken from cheapest
+to most expensive until ``eccmap.Fixable()`` says the block can be rebuilt,
+after that not needed pieces are dropped starting from the most expensive.
+
+Pieces of slow suppliers in the result are "hedged" - same number of
+other cheapest pieces is requested as well (but not more than number of
+correctable errors for that eccmap), so we do not wait for
+a slow supplier if another one can answer faster. When block become
+fixable all other requests should be cancelled.
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 14
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from raid import eccmap
+
+#------------------------------------------------------------------------------
+
+DEFAULT_LATENCY = 1.0
+FAIL_PENALTY = 5.0
+SLOW_FACTOR = 2.0
+
+#------------------------------------------------------------------------------
+
+
+def supplier_cost(stats):
+    """
+    Return expected time to receive a piece from supplier with given
+    history, see ``io_throttle.GetRequestStats()``.
+    """
+    if not stats:
+        return DEFAULT_LATENCY
+    latency = stats.get('latency')
+    if latency is None:
+        latency = DEFAULT_LATENCY
+    cost = latency * (1 + stats.get('queue', 0))
+    total = stats.get('received', 0) + stats.get('failed', 0)
+    if total:
+        cost += FAIL_PENALTY * stats.get('failed', 0) / float(total)
+    return cost
+
+
+def _fixable(ecc_map, data, parity):
+    # eccmap.Fixable() modifies the list
+    return ecc_map.Fixable(list(data), parity)
+
+
+def plan(ecc_map, on_hand_data, on_hand_parity, data_costs, parity_costs, slow_factor=SLOW_FACTOR):
+    """
+    Return a tuple of two lists (needed, hedges) with pieces to request,
+    every item is a tuple (dataORparity, supplierNumber).
+
+    Costs are lists with a value per supplier, None means piece can not be requested.
+    If block can not be fixed with pieces we can request - all of them are returned as needed.
+    """
+    data = [1 if x else 0 for x in on_hand_data]
+    parity = [1 if x else 0 for x in on_hand_parity]
+    candidates = []
+    for supplierNum in range(ecc_map.datasegments):
+        if not data[supplierNum] and data_costs[supplierNum] is not None:
+            candidates.append((data_costs[supplierNum], 0, supplierNum, 'Data', ))
+    for supplierNum in range(ecc_map.paritysegments):
+        if not parity[supplierNum] and parity_costs[supplierNum] is not None:
+            candidates.append((parity_costs[supplierNum], 1, supplierNum, 'Parity', ))
+    # with same cost "Data" pieces are better - less work for RAID
+    candidates.sort()
+    chosen = []
+    for candidate in candidates:
+        if _fixable(ecc_map, data, parity):
+            break
+        chosen.append(candidate)
+        (data if candidate[1] == 0 else parity)[candidate[2]] = 1
+    if not _fixable(ecc_map, data, parity):
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_planner.plan block is not fixable, request all %d pieces' % len(candidates))
+        return [(c[3], c[2], ) for c in candidates], []
+    for candidate in reversed(chosen[:]):
+        bits = data if candidate[1] == 0 else parity
+        bits[candidate[2]] = 0
+        if _fixable(ecc_map, data, parity):
+            chosen.remove(candidate)
+        else:
+            bits[candidate[2]] = 1
+    rest = [c for c in candidates if c not in chosen]
+    slow = 0
+    if candidates:
+        threshold = slow_factor * max(candidates[0][0], 0.001)
+        slow = len([c for c in chosen if c[0] > threshold])
+        slow = min(slow, eccmap.GetCorrectableErrors(ecc_map.NumSuppliers()))
+    needed = [(c[3], c[2], ) for c in chosen]
+    hedges = [(c[3], c[2], ) for c in rest[:slow]]
+    if _Debug:
+        lg.out(_DebugLevel, 'restore_planner.plan needed=%s hedges=%s' % (needed, hedges))
+    return needed, hedges
@@ -68,6 +68,18 @@ on USB, in safe or deposit box (encrypted with passphrase or clear text).
 
 The other thing we need is the backupIDs which we can get from our suppliers with the ListFiles command.
 
+Read-ahead: if ``settings.getRestoreReadAheadBlocks()`` is bigger than 1, next blocks
+are requested together with the current one. As soon as enough pieces of such block
+are received it is passed to the RAID workers and decrypted in a thread.
+The state machine still works with one "current" block and writes
+blocks to the output in order, but usually finds next block already restored.
+
+Blocks of incremental backups (see ``storage.dedup``) may refer to chunks stored
+in other blocks. Such references are written as gaps in the output file and
+collected in ``References`` list, ``restore_monitor`` fills them later by running
+another worker with ``Blocks`` parameter: only given blocks are restored and
+every chunk is written at given positions in the file.
+
 """
 
 
@@ -87,6 +99,7 @@ try:
 except:
     sys.exit('Error initializing twisted.internet.reactor in restore.py')
 
+from twisted.internet import threads
 from twisted.internet.defer import Deferred
 
 #------------------------------------------------------------------------------
@@ -118,6 +131,9 @@ from customer import data_receiver
 from raid import raid_worker
 from raid import eccmap
 
+from storage import restore_planner
+from storage import dedup
+
 #------------------------------------------------------------------------------
 
 class RestoreWorker(automat.Automat):
@@ -133,6 +149,7 @@ class RestoreWorker(automat.Automat):
                  BackupID,
                  OutputFile,
                  KeyID=None,
+                 Blocks=None,
                  debug_level=_DebugLevel,
                  log_events=_Debug,
                  log_transitions=_Debug,
@@ -152,6 +169,11 @@ class RestoreWorker(automat.Automat):
         self.KeyID = KeyID
         # is current active block - so when add 1 we get to first, which is 0
         self.BlockNumber = -1
+        # list of tuples (BlockNumber, [offsets]) if only some blocks must be restored
+        self.Blocks = Blocks
+        self.BlockIndex = -1
+        # chunks from other blocks to be written later: (BackupID, BlockNumber, offset)
+        self.References = []
         self.BytesWritten = 0
         self.OnHandData = []
         self.OnHandParity = []
@@ -165,6 +187,12 @@ class RestoreWorker(automat.Automat):
         self.MyDeferred = Deferred()
         self.packetInCallback = None
         self.blockRestoredCallback = None
+        # blocks processed ahead of the current one: {BlockNumber: info}
+        self.ReadAhead = settings.getRestoreReadAheadBlocks()
+        self.AheadBlocks = {}
+        self.WindowStarted = time.time()
+        self.WindowBytes = 0
+        self.WindowBlocks = 0
 
         super(RestoreWorker, self).__init__(
             name='restore_worker_%s' % self.Version,
@@ -183,6 +211,25 @@ class RestoreWorker(automat.Automat):
     def set_block_restored_callback(self, cb):
         self.blockRestoredCallback = cb
 
+    def progress(self):
+        """
+        Return a dictionary with info about restore progress and current read-ahead window.
+        """
+        in_flight = {}
+        for info in self.AheadBlocks.values():
+            in_flight[info['state']] = in_flight.get(info['state'], 0) + 1
+        dt = time.time() - self.WindowStarted
+        return {
+            'block_number': self.BlockNumber,
+            'bytes_written': self.BytesWritten,
+            'read_ahead': self.ReadAhead,
+            'in_flight': in_flight,
+            'window_blocks': self.WindowBlocks,
+            'window_bytes': self.WindowBytes,
+            'window_bps': int(self.WindowBytes / dt) if dt > 0 else 0,
+            'total_bps': int(self.BytesWritten / (time.time() - self.Started)) if time.time() > self.Started else 0,
+        }
+
     def state_changed(self, oldstate, newstate, event, arg):
         """
         Method to catch the moment when `restore_worker()` state were changed.
@@ -293,6 +340,8 @@ class RestoreWorker(automat.Automat):
         """
         Condition method.
         """
+        if self.Blocks is not None:
+            return self.BlockIndex >= len(self.Blocks) - 1
         NewBlock = arg[0]
         return NewBlock.LastBlock
 
@@ -330,7 +379,11 @@ class RestoreWorker(automat.Automat):
         Action method.
         """
         self.LastAction = time.time()
-        self.BlockNumber += 1
+        if self.Blocks is not None:
+            self.BlockIndex += 1
+            self.BlockNumber = self.Blocks[self.BlockIndex][0]
+        else:
+            self.BlockNumber += 1
         if _Debug:
             lg.out(_DebugLevel, "restore_worker.doStartNewBlock " + str(self.BlockNumber))
         self.OnHandData = [False, ] * self.EccMap.datasegments
@@ -363,6 +416,10 @@ class RestoreWorker(automat.Automat):
         Action method.
         """
         filename = arg
+        info = self.AheadBlocks.get(self.BlockNumber)
+        if info and info['state'] == 'ready' and info['filename'] == filename:
+            self.automat('block-restored', (info['block'], filename, ))
+            return
         blockbits = bpio.ReadBinaryFile(filename)
         if not blockbits:
             self.automat('block-failed')
@@ -385,34 +442,13 @@ class RestoreWorker(automat.Automat):
         """
         if _Debug:
             lg.out(_DebugLevel, 'restore_worker.doRequestPackets for %s at block %d' % (self.BackupID, self.BlockNumber, ))
+        self._read_ahead()
+        if self.EccMap.Fixable(list(self.OnHandData), self.OnHandParity):
+            # all needed pieces are on hands already, for example received during read-ahead
+            reactor.callLater(0, self.automat, 'instant')
+            return
         from customer import io_throttle
-        packetsToRequest = []
-        for SupplierNumber in range(self.EccMap.datasegments):
-            SupplierID = contactsdb.supplier(SupplierNumber, customer_idurl=self.CustomerIDURL)
-            if not SupplierID:
-                lg.warn('bad supplier at position %s' % SupplierNumber)
-                continue
-            if contact_status.isOffline(SupplierID):
-                lg.warn('offline supplier: %s' % SupplierID)
-                continue
-            if self.OnHandData[SupplierNumber]:
-                if _Debug:
-                    lg.out(_DebugLevel, '        OnHandData is True for supplier %d' % SupplierNumber)
-                continue
-            packetsToRequest.append((SupplierID, packetid.MakePacketID(self.BackupID, self.BlockNumber, SupplierNumber, 'Data')))
-        for SupplierNumber in range(self.EccMap.paritysegments):
-            SupplierID = contactsdb.supplier(SupplierNumber, customer_idurl=self.CustomerIDURL)
-            if not SupplierID:
-                lg.warn('bad supplier at position %s' % SupplierNumber)
-                continue
-            if contact_status.isOffline(SupplierID):
-                lg.warn('offline supplier: %s' % SupplierID)
-                continue
-            if self.OnHandParity[SupplierNumber]:
-                if _Debug:
-                    lg.out(_DebugLevel, '        OnHandParity is True for supplier %d' % SupplierNumber)
-                continue
-            packetsToRequest.append((SupplierID, packetid.MakePacketID(self.BackupID, self.BlockNumber, SupplierNumber, 'Parity')))
+        packetsToRequest = self._plan_requests(self.BlockNumber, self.OnHandData, self.OnHandParity)
         if _Debug:
             lg.out(_DebugLevel, '        packets to request: %s' % packetsToRequest)
         requests_made = 0
@@ -451,13 +487,16 @@ class RestoreWorker(automat.Automat):
         if not arg:
             return
         NewPacket, PacketID = arg
+        self._save_packet(NewPacket, PacketID, self.OnHandData, self.OnHandParity)
+
+    def _save_packet(self, NewPacket, PacketID, OnHandData, OnHandParity):
         glob_path = global_id.ParseGlobalID(PacketID, detect_version=True)
         packetID = global_id.CanonicalID(PacketID)
         customer_id, _, _, _, SupplierNumber, dataORparity = packetid.SplitFull(packetID)
         if dataORparity == 'Data':
-            self.OnHandData[SupplierNumber] = True
+            OnHandData[SupplierNumber] = True
         elif dataORparity == 'Parity':
-            self.OnHandParity[SupplierNumber] = True
+            OnHandParity[SupplierNumber] = True
         if NewPacket:
             filename = os.path.join(settings.getLocalBackupsDir(), customer_id, glob_path['path'])
             dirpath = os.path.dirname(filename)
@@ -481,6 +520,17 @@ class RestoreWorker(automat.Automat):
         """
         Action method.
         """
+        info = self.AheadBlocks.get(self.BlockNumber)
+        if info and info['state'] in ('raid', 'decrypting', ):
+            # block is in progress already, wait for the result
+            info['waiting'] = True
+            return
+        if info and info['state'] == 'ready':
+            reactor.callLater(0, self._on_block_restored, True, info['filename'])
+            return
+        if info:
+            info['state'] = 'current'
+        self._cancel_requests(self.BlockNumber)
         fd, outfilename = tmpfile.make(
             'restore',
             prefix=self.BackupID.replace(':', '_').replace('@', '_').replace('/', '_') + '_' + str(self.BlockNumber) + '_',
@@ -536,15 +586,19 @@ class RestoreWorker(automat.Automat):
         Action method.
         """
         NewBlock = arg[0]
-        data = NewBlock.Data()
+        info = self.AheadBlocks.pop(self.BlockNumber, None)
+        if info and info['state'] == 'ready':
+            data = info['data']
+        else:
+            data = NewBlock.Data()
         # Add to the file where all the data is going
         try:
-            os.write(self.File, data)
-            self.BytesWritten += len(data)
+            written = self._write_data(data)
         except:
             lg.exc()
             # TODO Error handling...
             return
+        self._count_window(written)
         if self.blockRestoredCallback is not None:
             self.blockRestoredCallback(self.BackupID, NewBlock)
 
@@ -581,6 +635,10 @@ class RestoreWorker(automat.Automat):
         """
         if data_receiver.A():
             data_receiver.A().removeStateChangedCallback(self._on_data_receiver_state_changed)
+        for info in self.AheadBlocks.values():
+            if info.get('filename'):
+                tmpfile.throw_out(info['filename'], 'restore finished')
+        self.AheadBlocks = None
         self.OnHandData = None
         self.OnHandParity = None
         self.EccMap = None
@@ -598,9 +656,238 @@ class RestoreWorker(automat.Automat):
         else:
             self.automat('raid-done', filename)
 
+    def _write_data(self, data):
+        if not dedup.IsDedupBlock(data):
+            os.write(self.File, data)
+            self.BytesWritten += len(data)
+            return len(data)
+        refs, chunk = dedup.UnpackBlock(data)
+        if self.Blocks is not None:
+            # only the chunk is needed here, it goes to the gaps left before
+            for offset in self.Blocks[self.BlockIndex][1]:
+                os.lseek(self.File, offset, os.SEEK_SET)
+                os.write(self.File, chunk)
+                self.BytesWritten += len(chunk)
+            return len(chunk) * len(self.Blocks[self.BlockIndex][1])
+        for refBackupID, blockNum, length in refs:
+            self.References.append((refBackupID, blockNum, os.lseek(self.File, 0, os.SEEK_CUR), ))
+            os.lseek(self.File, length, os.SEEK_CUR)
+        os.write(self.File, chunk)
+        self.BytesWritten += len(chunk)
+        return len(chunk)
+
+    def _next_blocks(self, count):
+        """
+        Return numbers of blocks going after the current one.
+        """
+        if self.Blocks is not None:
+            return [b[0] for b in self.Blocks[self.BlockIndex + 1:self.BlockIndex + 1 + count]]
+        from storage import backup_matrix
+        maxBlockNum = backup_matrix.GetKnownMaxBlockNum(self.BackupID)
+        return range(self.BlockNumber + 1, min(self.BlockNumber + 1 + count, maxBlockNum + 1))
+
+    def _read_ahead(self):
+        """
+        Request pieces for next blocks, up to ``self.ReadAhead`` blocks in flight.
+        """
+        if self.ReadAhead <= 1 or self.AheadBlocks is None:
+            return
+        for blockNum in self._next_blocks(self.ReadAhead - 1):
+            if blockNum in self.AheadBlocks:
+                continue
+            info = {
+                'state': 'requested',
+                'data': None,
+                'block': None,
+                'filename': None,
+                'waiting': False,
+                'OnHandData': [False, ] * self.EccMap.datasegments,
+                'OnHandParity': [False, ] * self.EccMap.paritysegments,
+            }
+            self.AheadBlocks[blockNum] = info
+            self._request_ahead(blockNum, info)
+            self._check_ahead(blockNum, info)
+
+    def _request_ahead(self, blockNum, info):
+        from customer import io_throttle
+        for dataORparity, onhand, count in (
+            ('Data', info['OnHandData'], self.EccMap.datasegments),
+            ('Parity', info['OnHandParity'], self.EccMap.paritysegments),
+        ):
+            for SupplierNumber in range(count):
+                packetID = packetid.MakePacketID(self.BackupID, blockNum, SupplierNumber, dataORparity)
+                customer, remotePath = packetid.SplitPacketID(packetID)
+                if os.path.exists(os.path.join(settings.getLocalBackupsDir(), customer, remotePath)):
+                    onhand[SupplierNumber] = True
+        for SupplierID, packetID in self._plan_requests(blockNum, info['OnHandData'], info['OnHandParity'], verbose=False):
+            if io_throttle.HasPacketInRequestQueue(SupplierID, packetID):
+                continue
+            io_throttle.QueueRequestFile(
+                self._on_packet_request_result,
+                self.CreatorID,
+                packetID,
+                self.CreatorID,
+                SupplierID)
+
+    def _plan_requests(self, blockNum, OnHandData, OnHandParity, verbose=True):
+        """
+        Return a list of (SupplierID, packetID) to request for given block.
+        """
+        from customer import io_throttle
+        suppliers = {}
+        costs = {'Data': [], 'Parity': [], }
+        for dataORparity, onhand, count in (
+            ('Data', OnHandData, self.EccMap.datasegments),
+            ('Parity', OnHandParity, self.EccMap.paritysegments),
+        ):
+            for SupplierNumber in range(count):
+                costs[dataORparity].append(None)
+                SupplierID = contactsdb.supplier(SupplierNumber, customer_idurl=self.CustomerIDURL)
+                if not SupplierID:
+                    if verbose:
+                        lg.warn('bad supplier at position %s' % SupplierNumber)
+                    continue
+                if contact_status.isOffline(SupplierID):
+                    if verbose:
+                        lg.warn('offline supplier: %s' % SupplierID)
+                    continue
+                if onhand[SupplierNumber]:
+                    if _Debug and verbose:
+                        lg.out(_DebugLevel, '        OnHand%s is True for supplier %d' % (dataORparity, SupplierNumber))
+                    continue
+                packetID = packetid.MakePacketID(self.BackupID, blockNum, SupplierNumber, dataORparity)
+                if packetID in self.RequestFails:
+                    continue
+                suppliers[(dataORparity, SupplierNumber)] = (SupplierID, packetID, )
+                costs[dataORparity][-1] = restore_planner.supplier_cost(io_throttle.GetRequestStats(SupplierID))
+        if not settings.getRestoreMinimalFetchEnabled():
+            pieces = sorted(suppliers.keys(), key=lambda piece: (piece[0] != 'Data', piece[1]))
+        else:
+            needed, hedges = restore_planner.plan(self.EccMap, OnHandData, OnHandParity, costs['Data'], costs['Parity'])
+            pieces = needed + hedges
+        return [suppliers[piece] for piece in pieces]
+
+    def _cancel_requests(self, blockNum):
+        """
+        Block can be rebuilt already, other pieces are not needed anymore.
+        """
+        from customer import io_throttle
+        packetIDs = []
+        for SupplierNumber in range(self.EccMap.datasegments):
+            packetIDs.append(packetid.MakePacketID(self.BackupID, blockNum, SupplierNumber, 'Data'))
+        for SupplierNumber in range(self.EccMap.paritysegments):
+            packetIDs.append(packetid.MakePacketID(self.BackupID, blockNum, SupplierNumber, 'Parity'))
+        io_throttle.DeleteRequests(packetIDs)
+
+    def _check_ahead(self, blockNum, info):
+        """
+        Start RAID reading of a block ahead when enough pieces are on hands.
+        """
+        if info['state'] != 'requested':
+            return
+        if not self.EccMap.Fixable(info['OnHandData'], info['OnHandParity']):
+            return
+        info['state'] = 'raid'
+        self._cancel_requests(blockNum)
+        fd, outfilename = tmpfile.make(
+            'restore',
+            prefix=self.BackupID.replace(':', '_').replace('@', '_').replace('/', '_') + '_' + str(blockNum) + '_',
+        )
+        os.close(fd)
+        info['filename'] = outfilename
+        inputpath = os.path.join(settings.getLocalBackupsDir(), self.CustomerGlobalID, self.PathID)
+        task_params = (outfilename, eccmap.CurrentName(), self.Version, blockNum, inputpath)
+        raid_worker.add_task('read', task_params,
+                             lambda cmd, params, result: self._on_ahead_raid_done(blockNum, result))
+
+    def _on_ahead_raid_done(self, blockNum, result):
+        if self.AheadBlocks is None or blockNum not in self.AheadBlocks:
+            return
+        info = self.AheadBlocks[blockNum]
+        if result is None:
+            info['state'] = 'raid-failed'
+            self._on_ahead_finished(blockNum, info)
+            return
+        info['state'] = 'decrypting'
+        d = threads.deferToThread(self._decrypt_block, info['filename'])
+        d.addCallback(lambda result: self._on_ahead_decrypted(blockNum, result))
+        d.addErrback(lambda err: self._on_ahead_decrypted(blockNum, None))
+
+    def _decrypt_block(self, filename):
+        blockbits = bpio.ReadBinaryFile(filename)
+        splitindex = blockbits.index(":")
+        datalength = int(blockbits[0:splitindex])
+        blockdata = blockbits[splitindex + 1:splitindex + 1 + datalength]
+        newblock = encrypted.Unserialize(blockdata, decrypt_key=self.KeyID)
+        return newblock, newblock.Data()
+
+    def _on_ahead_decrypted(self, blockNum, result):
+        if self.AheadBlocks is None or blockNum not in self.AheadBlocks:
+            return
+        info = self.AheadBlocks[blockNum]
+        if result is None:
+            # will be processed again in the main flow to report the error
+            info['state'] = 'decrypt-failed'
+        else:
+            info['block'], info['data'] = result
+            info['state'] = 'ready'
+        self._on_ahead_finished(blockNum, info)
+
+    def _on_ahead_finished(self, blockNum, info):
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_worker._on_ahead_finished block %d : %s' % (blockNum, info['state']))
+        if not info['waiting'] or blockNum != self.BlockNumber:
+            return
+        info['waiting'] = False
+        if info['state'] == 'raid-failed':
+            self._on_block_restored(None, info['filename'])
+        else:
+            self._on_block_restored(True, info['filename'])
+
+    def _on_ahead_packet(self, blockNum, NewPacketOrPacketID, result):
+        info = self.AheadBlocks[blockNum]
+        if result == 'received':
+            self._save_packet(NewPacketOrPacketID, NewPacketOrPacketID.PacketID, info['OnHandData'], info['OnHandParity'])
+        elif result == 'exist':
+            self._save_packet(None, NewPacketOrPacketID, info['OnHandData'], info['OnHandParity'])
+        else:
+            # the main flow will request failed pieces again when reach that block
+            return
+        self._check_ahead(blockNum, info)
+
+    def _count_window(self, length):
+        self.WindowBytes += length
+        self.WindowBlocks += 1
+        if self.WindowBlocks < self.ReadAhead:
+            return
+        stats = self.progress()
+        if _Debug:
+            lg.out(_DebugLevel, 'restore_worker._count_window %s : %d blocks, %d bytes, %d bytes/sec, in flight: %s' % (
+                self.BackupID, stats['window_blocks'], stats['window_bytes'], stats['window_bps'], stats['in_flight']))
+        events.send('restore-progress', dict(backup_id=self.BackupID, **stats))
+        self.WindowStarted = time.time()
+        self.WindowBytes = 0
+        self.WindowBlocks = 0
+
+    def _packet_block_number(self, NewPacketOrPacketID):
+        packetID = NewPacketOrPacketID
+        if not isinstance(packetID, basestring):
+            packetID = getattr(NewPacketOrPacketID, 'PacketID', None)
+        if not packetID:
+            return None
+        try:
+            return int(packetid.BlockNumber(global_id.CanonicalID(packetID)))
+        except:
+            return None
+
     def _on_packet_request_result(self, NewPacketOrPacketID, result):
         if _Debug:
             lg.out(_DebugLevel, 'restore_worker._on_packet_request_result %s : %s' % (result, NewPacketOrPacketID))
+        if self.AheadBlocks:
+            blockNum = self._packet_block_number(NewPacketOrPacketID)
+            if blockNum is not None and blockNum != self.BlockNumber and blockNum in self.AheadBlocks:
+                self._on_ahead_packet(blockNum, NewPacketOrPacketID, result)
+                return
         if result == 'received':
             self.automat('data-received', (NewPacketOrPacketID, NewPacketOrPacketID.PacketID, ))
         elif result == 'exist':
@@ -20,6 +20,35 @@
 #
 # Please contact us if you have any questions at bitdust.io@gmail.com
 
+"""
+.. module:: list_files.
+
+Supplier answers to the "ListFiles" request of the customer with a text
+summary of all his stored data, see ``storage.backup_matrix.ReadRawListFiles()``.
+
+Summary is built by scanning the customer folder only once and kept in memory,
+``service_supplier`` calls ``update()`` every time a file was written or removed
+and only that part of the summary is built again. Lines are sorted, so the text
+is always the same as ``TreeSummary()`` would return after a full scan.
+
+Customer which understands revisions adds ``REVISION_TOKEN`` to the "ListFiles"
+request and first line of the text is a revision of the summary::
+
+    R<epoch> <revision>
+
+Customer can send it back with the next "ListFiles" request and receive only
+a delta - changed paths since that revision::
+
+    R<epoch> <revision> <since revision>
+    K<key alias>
+    X<path>     : remove that path and everything inside, lines below are new
+    ...
+
+Customers which do not ask for revisions receive the list without "R" line.
+Old suppliers do not answer if anything is added to the request, so customer
+asks for revisions only if ``settings.getListFilesRevisionsEnabled()`` is True.
+"""
+
 #------------------------------------------------------------------------------
 
 _Debug = True
@@ -28,6 +57,7 @@ _DebugLevel = 6
 #------------------------------------------------------------------------------
 
 import os
+import time
 import zlib
 import cStringIO
 
@@ -51,30 +81,94 @@ from contacts import contactsdb
 from userid import my_id
 from userid import global_id
 
+from supplier import segment_store
+
+#------------------------------------------------------------------------------
+
+MAX_DELTA_CHANGES = 1000  # changes remembered for every customer to be able to send a delta
+REVISION_TOKEN = 'R'  # customer understands revisions, but do not have any yet
+
 #------------------------------------------------------------------------------
 
-def send(customer_idurl, packet_id, format_type):
+_Summaries = {}
+
+#------------------------------------------------------------------------------
+
+def send(customer_idurl, packet_id, format_type, since=None):
     customer_name = nameurl.GetName(customer_idurl)
     if _Debug:
-        lg.out(_DebugLevel, "list_files.send to %s, format is '%s'" % (customer_name, format_type))
+        lg.out(_DebugLevel, "list_files.send to %s, format is '%s', since %r" % (customer_name, format_type, since))
     ownerdir = settings.getCustomerFilesDir(customer_idurl)
-    plaintext = ''
     if os.path.isdir(ownerdir):
-        for key_alias in os.listdir(ownerdir):
-            if not misc.ValidKeyAlias(str(key_alias)):
-                continue
-            key_alias_dir = os.path.join(ownerdir, key_alias)
-            plaintext += TreeSummary(key_alias_dir, key_alias)
+        summary = customer_summary(customer_idurl)
+        revision = bool(since)
+        payload = None
+        if since and since != REVISION_TOKEN:
+            plaintext = summary.delta(since)
+            if plaintext is not None and len(plaintext) < len(summary.text(revision)):
+                payload = PackListFiles(plaintext, format_type)
+        if payload is None:
+            plaintext = summary.text(revision)
+            payload = summary.packed(format_type, revision)
     else:
         lg.warn('did not found customer dir: %s' % ownerdir)
+        forget(customer_idurl)
+        plaintext = ''
+        payload = PackListFiles(plaintext, format_type)
     if _Debug:
         lg.out(_DebugLevel + 8, '\n%s' % plaintext)
     return p2p_service.SendFiles(
         idurl=customer_idurl,
-        raw_list_files_info=PackListFiles(plaintext, format_type),
+        raw_list_files_info=payload,
         packet_id=packet_id,
     )
 
+
+def customer_summary(customer_idurl):
+    """
+    Return ``CustomerSummary`` for given customer, folder is scanned if this is a first call.
+    """
+    summary = _Summaries.get(customer_idurl)
+    if summary is None:
+        summary = CustomerSummary(customer_idurl)
+        _Summaries[customer_idurl] = summary
+    if summary.stale:
+        summary.refresh()
+    return summary
+
+
+def update(customer_idurl, key_alias, path):
+    """
+    Called from ``service_supplier`` after a file or folder was written or removed.
+    """
+    summary = _Summaries.get(customer_idurl)
+    if summary is None or summary.stale:
+        return False
+    try:
+        summary.update(key_alias or 'master', path.strip('/'))
+    except:
+        lg.exc()
+        summary.stale = True
+        return False
+    return True
+
+
+def refresh_all():
+    """
+    Files were changed by another process, see ``main.bptester``.
+    All summaries will be checked again on next request.
+    """
+    for summary in _Summaries.values():
+        summary.stale = True
+
+
+def forget(customer_idurl):
+    _Summaries.pop(customer_idurl, None)
+
+
+def shutdown():
+    _Summaries.clear()
+
 #------------------------------------------------------------------------------
 
 def PackListFiles(plaintext, method):
@@ -94,91 +188,524 @@ def UnpackListFiles(payload, method):
 
 #------------------------------------------------------------------------------
 
-def TreeSummary(ownerdir, key_alias):
+def ReadRevision(src):
+    """
+    Return a tuple (epoch, revision, since revision) from the first line of
+    the "ListFiles" text or None if supplier did not send it.
+    Last item is None if that is a full list and not a delta.
+    """
+    if not src.startswith('R'):
+        return None
+    words = src.split('\n', 1)[0][1:].split(' ')
+    try:
+        if len(words) == 2:
+            return words[0], int(words[1]), None
+        if len(words) == 3:
+            return words[0], int(words[1]), int(words[2])
+    except:
+        lg.exc()
+    return None
+
+
+def IsDelta(src):
+    revision = ReadRevision(src)
+    return revision is not None and revision[2] is not None
+
+
+def RequestSince(src):
+    """
+    Return a string to be added to the "ListFiles" request if previous
+    list received from that supplier have a revision, otherwise None.
+    """
+    revision = ReadRevision(src or '')
+    if not revision or revision[2] is not None:
+        return None
+    return '%s %d' % (revision[0], revision[1])
+
+
+def MergeListFiles(src, delta):
+    """
+    Apply changes received from supplier to the previous full list,
+    return a new full list or None if the delta was made for another revision.
+    """
+    revision = ReadRevision(src or '')
+    delta_revision = ReadRevision(delta)
+    if not revision or not delta_revision or revision[2] is not None or delta_revision[2] is None:
+        return None
+    if revision[0] != delta_revision[0] or revision[1] != delta_revision[2]:
+        return None
+    key_aliases = {}
+    current_key_alias = None
+    for line in src.splitlines()[1:]:
+        if not line:
+            continue
+        if line[0] == 'K':
+            current_key_alias = line[1:]
+            key_aliases[current_key_alias] = []
+        elif current_key_alias is not None:
+            key_aliases[current_key_alias].append(line)
+    current_key_alias = None
+    for line in delta.splitlines()[1:]:
+        if not line:
+            continue
+        if line[0] == 'K':
+            current_key_alias = line[1:]
+            if current_key_alias not in key_aliases:
+                key_aliases[current_key_alias] = []
+        elif current_key_alias is None:
+            continue
+        elif line[0] == 'X':
+            key_aliases[current_key_alias] = [l for l in key_aliases[current_key_alias] if not _is_inside(_line_path(l), line[1:])]
+        else:
+            key_aliases[current_key_alias].append(line)
     out = cStringIO.StringIO()
-    out.write('K%s\n' % key_alias)
+    out.write('R%s %d\n' % (delta_revision[0], delta_revision[1]))
+    for key_alias in sorted(key_aliases.keys()):
+        lines = key_aliases[key_alias]
+        lines.sort(key=_line_sort_key)
+        _write_lines(out, key_alias, lines)
+    src = out.getvalue()
+    out.close()
+    return src
+
+#------------------------------------------------------------------------------
+
+def TreeSummary(ownerdir, key_alias, store=None):
+    """
+    Return a text with all files and folders stored for given key alias,
+    see ``storage.backup_matrix.ReadRawListFiles()``.
+
+    Pieces kept in the ``supplier.segment_store`` are listed as if they were
+    files on disk.
+    """
+    lines = SummaryLines(ScanKeyAlias(ownerdir, key_alias, store))
+    out = cStringIO.StringIO()
+    _write_lines(out, key_alias, lines)
+    src = out.getvalue()
+    out.close()
+    return src
+
+
+def ScanKeyAlias(ownerdir, key_alias, store=None):
+    """
+    Read all files and folders stored for given key alias and return a dictionary:
+
+        "folders" : set of folders
+        "files"   : dictionary of files which are not a part of any version with their sizes
+        "versions": version path -> {"entries": {file name: (size, is folder)}, "lines": list of lines}
+        "derived" : folders of all versions with a counter, to list versions
+                    which are only in the segment store
+    """
+    info = {'folders': set(), 'files': {}, 'versions': {}, 'derived': {}, }
+    _scan_folder(info, ownerdir, '', key_alias, store)
+    return info
+
+
+def SummaryLines(info):
+    """
+    Return sorted list of lines for the key alias scanned with ``ScanKeyAlias()``.
+    """
+    lines = ['D%s' % subpath for subpath in info['folders'].union(info['derived'].keys())]
+    lines.extend(['F%s %d' % (subpath, filesz) for subpath, filesz in info['files'].items()])
+    for version in info['versions'].values():
+        lines.extend(version['lines'])
+    lines.sort(key=_line_sort_key)
+    return lines
 
-    def cb(result, realpath, subpath, name):
+
+def VersionSummary(result, subpath, entries):
+    """
+    Write "V" line for every supplier which have pieces of that version,
+    ``entries`` is a list of tuples (file name, size, is folder).
+    """
+    maxBlock = -1
+    versionSize = {}
+    dataBlocks = {}
+    parityBlocks = {}
+    dataMissing = {}
+    parityMissing = {}
+    for filename, filesz, isdir in entries:
+        packetID = subpath + '/' + filename
+        if isdir:
+            result.write('D%s\n' % packetID)
+            continue
+        if not packetid.Valid(packetID):
+            result.write('F%s %d\n' % (packetID, filesz))
+            continue
+        customer, pathID, versionName, blockNum, supplierNum, dataORparity = packetid.SplitFull(packetID)
+        if None in [pathID, versionName, blockNum, supplierNum, dataORparity]:
+            result.write('F%s %d\n' % (packetID, filesz))
+            continue
+        if dataORparity != 'Data' and dataORparity != 'Parity':
+            result.write('F%s %d\n' % (packetID, filesz))
+            continue
+        if maxBlock < blockNum:
+            maxBlock = blockNum
+        if supplierNum not in versionSize:
+            versionSize[supplierNum] = 0
+        if supplierNum not in dataBlocks:
+            dataBlocks[supplierNum] = {}
+        if supplierNum not in parityBlocks:
+            parityBlocks[supplierNum] = {}
+        if dataORparity == 'Data':
+            dataBlocks[supplierNum][blockNum] = filesz
+        elif dataORparity == 'Parity':
+            parityBlocks[supplierNum][blockNum] = filesz
+    for supplierNum in versionSize.keys():
+        versionSize[supplierNum] = sum(dataBlocks[supplierNum].values()) + sum(parityBlocks[supplierNum].values())
+        dataMissing[supplierNum] = [b for b in xrange(maxBlock + 1) if b not in dataBlocks[supplierNum]]
+        parityMissing[supplierNum] = [b for b in xrange(maxBlock + 1) if b not in parityBlocks[supplierNum]]
+    for supplierNum in sorted(versionSize.keys()):
+        versionString = '%s %d 0-%d %d' % (
+            subpath, supplierNum, maxBlock, versionSize[supplierNum])
+        if len(dataMissing[supplierNum]) > 0 or len(parityMissing[supplierNum]) > 0:
+            versionString += ' missing'
+            if len(dataMissing[supplierNum]) > 0:
+                versionString += ' Data:' + (','.join(map(str, dataMissing[supplierNum])))
+            if len(parityMissing[supplierNum]) > 0:
+                versionString += ' Parity:' + (','.join(map(str, parityMissing[supplierNum])))
+        result.write('V%s\n' % versionString)
+
+#------------------------------------------------------------------------------
+
+class CustomerSummary(object):
+    """
+    Summary of all files stored for one customer, kept up to date with ``update()``.
+
+    Every change increase ``revision`` and is remembered in ``changes``,
+    so customer can receive only changed paths since the revision he already have.
+    """
+
+    def __init__(self, customer_idurl):
+        self.customer_idurl = customer_idurl
+        self.customer_id = global_id.UrlToGlobalID(customer_idurl)
+        self.ownerdir = settings.getCustomerFilesDir(customer_idurl)
+        self.epoch = '%x' % int(time.time() * 1000.0)
+        self.revision = 0
+        self.min_revision = 0
+        self.changes = []
+        self.key_aliases = None
+        self.stale = True
+        self.lines = {}
+        self.cache = {}
+
+    def __repr__(self):
+        return 'CustomerSummary(%s R%s %d)' % (self.customer_id, self.epoch, self.revision)
+
+    def store(self):
+        return segment_store.existing_store(self.customer_id)
+
+    def refresh(self):
+        """
+        Scan the whole customer folder, all differences with the previous scan
+        are remembered as changes.
+        """
+        key_aliases = {}
+        store = self.store()
+        if os.path.isdir(self.ownerdir):
+            for key_alias in os.listdir(self.ownerdir):
+                if key_alias == segment_store.STORE_DIR_NAME:
+                    continue
+                if not misc.ValidKeyAlias(str(key_alias)):
+                    continue
+                key_aliases[key_alias] = ScanKeyAlias(os.path.join(self.ownerdir, key_alias), key_alias, store)
+        if self.key_aliases is not None:
+            changes = []
+            for key_alias, info in self.key_aliases.items():
+                if key_alias not in key_aliases:
+                    # can not describe that with a delta
+                    changes = None
+                    break
+                changes.extend([(key_alias, path, ) for path in _compare(info, key_aliases[key_alias])])
+            if changes is None:
+                self._reset()
+            else:
+                for key_alias in key_aliases.keys():
+                    if key_alias not in self.key_aliases:
+                        changes.append((key_alias, '', ))
+                if changes:
+                    self.revision += 1
+                    for key_alias, path in changes:
+                        self.changes.append((self.revision, key_alias, path, ))
+                    self._truncate()
+        self.key_aliases = key_aliases
+        self.lines.clear()
+        self.cache.clear()
+        self.stale = False
+        if _Debug:
+            lg.out(_DebugLevel, 'list_files.refresh %r with %d key aliases' % (self, len(key_aliases)))
+
+    def update(self, key_alias, path):
+        """
+        Read again only given path, it can be a single piece, a version or a folder.
+        """
+        alias_dir = os.path.join(self.ownerdir, key_alias)
+        info = self.key_aliases.get(key_alias)
+        if info is None:
+            if not os.path.isdir(alias_dir) or not misc.ValidKeyAlias(str(key_alias)):
+                return
+            info = {'folders': set(), 'files': {}, 'versions': {}, 'derived': {}, }
+            self.key_aliases[key_alias] = info
+        parts = path.split('/')
+        unit = path
+        for pos in xrange(len(parts) - 1):
+            if packetid.IsCanonicalVersion(parts[pos]):
+                unit = '/'.join(parts[:pos + 1])
+                break
+        parents = _parent_folders(unit)
+        before = [(p in info['folders'] or p in info['derived']) for p in parents]
+        realpath = os.path.join(alias_dir, unit)
+        if unit != path and unit in info['versions'] and path.count('/') == unit.count('/') + 1:
+            # single piece was written or removed, no need to read the whole version
+            self._update_piece(info, key_alias, unit, parts[-1], os.path.join(alias_dir, path))
+        elif unit != path or (packetid.IsCanonicalVersion(parts[-1]) and not os.path.isfile(realpath)):
+            info['files'].pop(unit, None)
+            info['folders'].discard(unit)
+            self._update_version(info, key_alias, unit, realpath)
+        else:
+            info['files'].pop(unit, None)
+            if unit in info['folders'] or unit in info['derived']:
+                _remove_folder(info, unit)
+            if os.path.isfile(realpath):
+                info['files'][unit] = _file_size(realpath)
+            elif os.path.isdir(realpath):
+                info['folders'].add(unit)
+                _scan_folder(info, realpath, unit, key_alias, self.store())
+        for parent in parents:
+            if parent not in info['folders'] and os.path.isdir(os.path.join(alias_dir, parent)):
+                info['folders'].add(parent)
+        after = [(p in info['folders'] or p in info['derived']) for p in parents]
+        changed = unit
+        for pos in xrange(len(parents)):
+            if before[pos] != after[pos]:
+                changed = parents[pos]
+                break
+        self._changed(key_alias, changed)
+
+    def _update_piece(self, info, key_alias, version, filename, realpath):
+        entries = info['versions'][version]['entries']
+        if os.path.exists(realpath):
+            entries[filename] = (_file_size(realpath), os.path.isdir(realpath), )
+        else:
+            store = self.store()
+            pos = None
+            if store is not None:
+                pos = store.locate(segment_store.make_key(key_alias, version + '/' + filename))
+            if pos is not None:
+                entries[filename] = (pos[2], False, )
+            else:
+                entries.pop(filename, None)
+        if not entries and not os.path.isdir(os.path.dirname(realpath)):
+            _remove_version(info, version)
+        else:
+            _set_version(info, version, entries)
+
+    def _update_version(self, info, key_alias, version, realpath):
+        entries = {}
+        store = self.store()
+        if store is not None:
+            prefix = segment_store.make_key(key_alias, version + '/')
+            for key, filesz in store.items(prefix):
+                if key.count('/') == prefix.count('/'):
+                    entries[key[len(prefix):]] = (filesz, False, )
+        if os.path.isdir(realpath):
+            entries.update(_list_version(realpath))
+        elif not entries:
+            _remove_version(info, version)
+            return
+        _set_version(info, version, entries)
+
+    def _changed(self, key_alias, path):
+        self.revision += 1
+        self.changes.append((self.revision, key_alias, path, ))
+        self._truncate()
+        self.lines.pop(key_alias, None)
+        self.cache.clear()
+
+    def _truncate(self):
+        while len(self.changes) > MAX_DELTA_CHANGES:
+            self.min_revision = self.changes.pop(0)[0]
+
+    def _reset(self):
+        self.changes = []
+        self.min_revision = self.revision
+
+    def key_alias_lines(self, key_alias):
+        if key_alias not in self.lines:
+            self.lines[key_alias] = SummaryLines(self.key_aliases[key_alias])
+        return self.lines[key_alias]
+
+    def text(self, revision=False):
+        """
+        Return full summary of all key aliases, first line is a revision
+        if customer asked for it.
+        """
+        if ('text', revision, ) not in self.cache:
+            out = cStringIO.StringIO()
+            if revision:
+                out.write('R%s %d\n' % (self.epoch, self.revision))
+            for key_alias in sorted(self.key_aliases.keys()):
+                _write_lines(out, key_alias, self.key_alias_lines(key_alias))
+            self.cache[('text', revision, )] = out.getvalue()
+            out.close()
+        return self.cache[('text', revision, )]
+
+    def packed(self, format_type, revision=False):
+        if (format_type, revision, ) not in self.cache:
+            self.cache[(format_type, revision, )] = PackListFiles(self.text(revision), format_type)
+        return self.cache[(format_type, revision, )]
+
+    def delta(self, since):
+        """
+        Return only changes made after given revision or None if that is not possible.
+        """
+        try:
+            epoch, since_revision = since.split(' ')
+            since_revision = int(since_revision)
+        except:
+            lg.warn('wrong revision: %r' % since)
+            return None
+        if epoch != self.epoch or since_revision < self.min_revision or since_revision > self.revision:
+            return None
+        paths = {}
+        for revision, key_alias, path in self.changes:
+            if revision > since_revision:
+                paths.setdefault(key_alias, set()).add(path)
+        out = cStringIO.StringIO()
+        out.write('R%s %d %d\n' % (self.epoch, self.revision, since_revision))
+        for key_alias in sorted(paths.keys()):
+            tops = []
+            for path in sorted(paths[key_alias]):
+                if not tops or not _is_inside(path, tops[-1]):
+                    tops.append(path)
+            out.write('K%s\n' % key_alias)
+            for path in tops:
+                out.write('X%s\n' % path)
+            for line in self.key_alias_lines(key_alias):
+                path = _line_path(line)
+                for top in tops:
+                    if _is_inside(path, top):
+                        out.write(line + '\n')
+                        break
+        src = out.getvalue()
+        out.close()
+        return src
+
+#------------------------------------------------------------------------------
+
+def _file_size(realpath):
+    try:
+        return os.path.getsize(realpath)
+    except:
+        return -1
+
+
+def _list_version(realpath):
+    entries = {}
+    for filename in os.listdir(realpath):
+        pth = os.path.join(realpath, filename)
+        entries[filename] = (_file_size(pth), os.path.isdir(pth), )
+    return entries
+
+
+def _scan_folder(info, realdir, reldir, key_alias, store):
+    segments = {}
+    if store is not None:
+        for key, filesz in store.items(segment_store.make_key(key_alias, reldir + '/' if reldir else '')):
+            _, packetID = segment_store.split_key(key)
+            subpath, _, filename = packetID.rpartition('/')
+            if subpath not in segments:
+                segments[subpath] = {}
+            segments[subpath][filename] = filesz
+
+    def cb(realpath, subpath, name):
         if not os.access(realpath, os.R_OK):
             return False
         if os.path.isfile(realpath):
-            try:
-                filesz = os.path.getsize(realpath)
-            except:
-                filesz = -1
-            result.write('F%s %d\n' % (subpath, filesz))
+            info['files'][subpath] = _file_size(realpath)
             return False
         if not packetid.IsCanonicalVersion(name):
-            result.write('D%s\n' % subpath)
+            info['folders'].add(subpath)
             return True
-        maxBlock = -1
-        versionSize = {}
-        dataBlocks = {}
-        parityBlocks = {}
-        dataMissing = {}
-        parityMissing = {}
-        for filename in os.listdir(realpath):
-            packetID = subpath + '/' + filename
-            pth = os.path.join(realpath, filename)
-            try:
-                filesz = os.path.getsize(pth)
-            except:
-                filesz = -1
-            if os.path.isdir(pth):
-                result.write('D%s\n' % packetID)
-                continue
-            if not packetid.Valid(packetID):
-                result.write('F%s %d\n' % (packetID, filesz))
-                continue
-            customer, pathID, versionName, blockNum, supplierNum, dataORparity = packetid.SplitFull(packetID)
-            if None in [pathID, versionName, blockNum, supplierNum, dataORparity]:
-                result.write('F%s %d\n' % (packetID, filesz))
-                continue
-            if dataORparity != 'Data' and dataORparity != 'Parity':
-                result.write('F%s %d\n' % (packetID, filesz))
-                continue
-            if maxBlock < blockNum:
-                maxBlock = blockNum
-            if supplierNum not in versionSize:
-                versionSize[supplierNum] = 0
-            if supplierNum not in dataBlocks:
-                dataBlocks[supplierNum] = {}
-            if supplierNum not in parityBlocks:
-                parityBlocks[supplierNum] = {}
-            if dataORparity == 'Data':
-                dataBlocks[supplierNum][blockNum] = filesz
-            elif dataORparity == 'Parity':
-                parityBlocks[supplierNum][blockNum] = filesz
-        for supplierNum in versionSize.keys():
-            dataMissing[supplierNum] = set(range(maxBlock + 1))
-            parityMissing[supplierNum] = set(range(maxBlock + 1))
-            for blockNum in range(maxBlock + 1):
-                if blockNum in dataBlocks[supplierNum].keys():
-                    versionSize[supplierNum] += dataBlocks[supplierNum][blockNum]
-                    dataMissing[supplierNum].discard(blockNum)
-                if blockNum in parityBlocks[supplierNum].keys():
-                    versionSize[supplierNum] += parityBlocks[supplierNum][blockNum]
-                    parityMissing[supplierNum].discard(blockNum)
-        suppliers = set(dataBlocks.keys() + parityBlocks.keys())
-        for supplierNum in suppliers:
-            versionString = '%s %d 0-%d %d' % (
-                subpath, supplierNum, maxBlock, versionSize[supplierNum])
-            if len(dataMissing[supplierNum]) > 0 or len(parityMissing[supplierNum]) > 0:
-                versionString += ' missing'
-                if len(dataMissing[supplierNum]) > 0:
-                    versionString += ' Data:' + (','.join(map(str, dataMissing[supplierNum])))
-                if len(parityMissing[supplierNum]) > 0:
-                    versionString += ' Parity:' + (','.join(map(str, parityMissing[supplierNum])))
-            result.write('V%s\n' % versionString)
-        del dataBlocks
-        del parityBlocks
-        del dataMissing
-        del parityMissing
+        entries = dict([(piece_name, (piece_size, False, )) for piece_name, piece_size in segments.pop(subpath, {}).items()])
+        entries.update(_list_version(realpath))
+        _set_version(info, subpath, entries)
         return False
 
-    bpio.traverse_dir_recursive(lambda realpath, subpath, name: cb(out, realpath, subpath, name), ownerdir)
-    src = out.getvalue()
+    if os.path.isdir(realdir):
+        bpio.traverse_dir_recursive(cb, realdir, reldir)
+    for subpath, stored in segments.items():
+        # versions which are only in the segment store, do not have a folder on disk
+        _set_version(info, subpath, dict([(piece_name, (piece_size, False, )) for piece_name, piece_size in stored.items()]))
+
+
+def _set_version(info, subpath, entries):
+    out = cStringIO.StringIO()
+    VersionSummary(out, subpath, [(filename, filesz, isdir, ) for filename, (filesz, isdir) in entries.items()])
+    if subpath not in info['versions']:
+        for folder in _parent_folders(subpath):
+            info['derived'][folder] = info['derived'].get(folder, 0) + 1
+    info['versions'][subpath] = {'entries': entries, 'lines': sorted(out.getvalue().splitlines()), }
     out.close()
-    return src
+
+
+def _remove_version(info, subpath):
+    if info['versions'].pop(subpath, None) is None:
+        return
+    for folder in _parent_folders(subpath):
+        info['derived'][folder] -= 1
+        if info['derived'][folder] <= 0:
+            info['derived'].pop(folder)
+
+
+def _remove_folder(info, subpath):
+    info['folders'] = set([f for f in info['folders'] if not _is_inside(f, subpath)])
+    for path in info['files'].keys():
+        if _is_inside(path, subpath):
+            info['files'].pop(path)
+    for path in info['versions'].keys():
+        if _is_inside(path, subpath):
+            _remove_version(info, path)
+
+
+def _compare(old, new):
+    """
+    Return list of paths which are different in two results of ``ScanKeyAlias()``.
+    """
+    result = []
+    old_folders = old['folders'].union(old['derived'].keys())
+    new_folders = new['folders'].union(new['derived'].keys())
+    result.extend(old_folders.symmetric_difference(new_folders))
+    for path in set(old['files'].keys() + new['files'].keys()):
+        if old['files'].get(path) != new['files'].get(path):
+            result.append(path)
+    for path in set(old['versions'].keys() + new['versions'].keys()):
+        old_lines = old['versions'].get(path, {}).get('lines')
+        if old_lines != new['versions'].get(path, {}).get('lines'):
+            result.append(path)
+    return result
+
+
+def _parent_folders(subpath):
+    parts = subpath.split('/')
+    return ['/'.join(parts[:pos]) for pos in xrange(1, len(parts))]
+
+
+def _is_inside(path, folder):
+    return folder == '' or path == folder or path.startswith(folder + '/')
+
+
+def _line_path(line):
+    return line[1:].split(' ', 1)[0]
+
+
+def _line_sort_key(line):
+    return _line_path(line).split('/'), line
+
+
+def _write_lines(out, key_alias, lines):
+    out.write('K%s\n' % key_alias)
+    for line in lines:
+        out.write(line + '\n')
 
 #------------------------------------------------------------------------------
@@ -88,6 +88,7 @@ TesterSpaceTime = 'space_time'
 
 _TesterQueue = []
 _CurrentProcess = None
+_CurrentTester = None
 _Loop = None
 _LoopValidate = None
 _LoopUpdateCustomers = None
@@ -215,10 +216,17 @@ def alive():
 
 def loop():
     global _Loop
+    global _CurrentTester
     if not alive():
+        if _CurrentTester is not None:
+            # any of bptester commands can remove some of customers files
+            from supplier import list_files
+            list_files.refresh_all()
+        _CurrentTester = None
         Tester = _popTester()
         if Tester:
-            run(Tester)
+            if run(Tester):
+                _CurrentTester = Tester
     _Loop = reactor.callLater(settings.DefaultLocaltesterLoop(), loop)
 
 
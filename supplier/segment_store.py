@@ -0,0 +1,487 @@
+#!/usr/bin/python
+# segment_store.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (segment_store.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: segment_store.
+
+Log-structured storage of customer packets on supplier side, used instead of
+one file per packet if ``settings.getSupplierSegmentStoreEnabled()`` is True.
+
+Every customer have a ".segments" folder inside his customer folder with
+append-only pack files "00000001.pack", "00000002.pack", ... and the "index" file.
+
+Every record in a pack file is::
+
+    <kind:1 byte> <key length:2 bytes> <data length:4 bytes> <key> <data>
+
+Kind is "+" for stored packet and "-" for removed one, key is
+"<key alias>/<packet ID>". The "index" file keeps position of every packet
+and the size of every pack at that moment, so only records written after
+that need to be read again on start. If "index" file is lost all packs
+are scanned from the beginning.
+
+Removed packets are just marked, space is released by the compaction: live
+records from packs with a lot of garbage are copied to the current pack
+and old pack is removed. Compaction runs in small steps in the main
+thread some time after ``DeleteBackup()`` or ``DeleteFile()``.
+
+Only pieces of the backups are kept here, other files (index, backup info)
+are stored as before.
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import struct
+import marshal
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from system import bpio
+
+from main import settings
+
+#------------------------------------------------------------------------------
+
+STORE_DIR_NAME = '.segments'
+INDEX_FILE_NAME = 'index'
+INDEX_VERSION = 1
+
+PACK_MAX_SIZE = 64 * 1024 * 1024  # start a new pack after that size
+COMPACTION_RATIO = 0.5  # pack is compacted if more than half of it is garbage
+COMPACTION_DELAY = 10.0  # seconds after last delete before compaction starts
+COMPACTION_STEP_SIZE = 4 * 1024 * 1024  # bytes copied during one call
+SAVE_INDEX_EVERY = 1000  # records, to not read too much on start
+
+_HeaderFormat = '>cHI'
+_HeaderSize = struct.calcsize(_HeaderFormat)
+
+#------------------------------------------------------------------------------
+
+_Stores = {}
+
+#------------------------------------------------------------------------------
+
+
+def store_dir(customer_glob_id):
+    return os.path.join(settings.getCustomersFilesDir(), customer_glob_id, STORE_DIR_NAME)
+
+
+def make_key(key_alias, packet_id):
+    return '%s/%s' % (key_alias or 'master', packet_id)
+
+
+def split_key(key):
+    """
+    Return tuple (key_alias, packet_id).
+    """
+    key_alias, _, packet_id = key.partition('/')
+    return key_alias, packet_id
+
+
+def store(customer_glob_id):
+    """
+    Return opened ``SegmentStore`` for given customer, folder is created if not exist.
+    """
+    global _Stores
+    s = _Stores.get(customer_glob_id)
+    if s is not None and not os.path.isdir(s.path):
+        # customer folder was removed, see bptester.py
+        s.close(save_index=False)
+        s = None
+    if s is None:
+        s = SegmentStore(store_dir(customer_glob_id))
+        s.open()
+        _Stores[customer_glob_id] = s
+    return s
+
+
+def existing_store(customer_glob_id):
+    """
+    Same as ``store()`` but return None if customer do not have segments folder.
+    """
+    if customer_glob_id not in _Stores and not os.path.isdir(store_dir(customer_glob_id)):
+        return None
+    return store(customer_glob_id)
+
+
+def shutdown():
+    global _Stores
+    for s in _Stores.values():
+        s.close()
+    _Stores.clear()
+
+#------------------------------------------------------------------------------
+
+
+class SegmentStore(object):
+    """
+    Packs and index of a single customer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.index = {}  # key -> (pack number, data offset, data length)
+        self.packs = {}  # pack number -> size in bytes
+        self.garbage = {}  # pack number -> bytes of removed records
+        self.current = 0
+        self.fout = None
+        self.readers = {}
+        self.unsaved = 0
+        self.compaction_task = None
+        self.compacting = None
+
+    def __repr__(self):
+        return 'SegmentStore(%s, %d packets in %d packs)' % (self.path, len(self.index), len(self.packs))
+
+    def pack_path(self, pack):
+        return os.path.join(self.path, '%08d.pack' % pack)
+
+    #------------------------------------------------------------------------------
+
+    def open(self):
+        if not os.path.isdir(self.path):
+            bpio._dirs_make(self.path)
+        positions = self._load_index()
+        for filename in sorted(os.listdir(self.path)):
+            if not filename.endswith('.pack'):
+                continue
+            try:
+                pack = int(filename[:-5])
+            except:
+                continue
+            self._replay(pack, positions.get(pack, 0))
+        for pack in list(self.packs.keys()):
+            if not os.path.isfile(self.pack_path(pack)):
+                self._forget_pack(pack)
+        if self.packs:
+            self.current = max(self.packs.keys())
+        else:
+            self.current = 1
+            self.packs[self.current] = 0
+            self.garbage[self.current] = 0
+        self.fout = open(self.pack_path(self.current), 'ab')
+        if _Debug:
+            lg.out(_DebugLevel, 'segment_store.open %r' % self)
+
+    def close(self, save_index=True):
+        if self.compaction_task and self.compaction_task.active():
+            self.compaction_task.cancel()
+        self.compaction_task = None
+        self.compacting = None
+        if self.fout:
+            self.fout.close()
+            self.fout = None
+        for f in self.readers.values():
+            f.close()
+        self.readers.clear()
+        if save_index and os.path.isdir(self.path):
+            self._save_index()
+
+    def _load_index(self):
+        src = bpio.ReadBinaryFile(os.path.join(self.path, INDEX_FILE_NAME))
+        if not src:
+            return {}
+        try:
+            version, index, packs, garbage = marshal.loads(src)
+        except:
+            lg.exc()
+            return {}
+        if version != INDEX_VERSION:
+            lg.warn('unknown index version %r in %s' % (version, self.path))
+            return {}
+        self.index = index
+        self.packs = packs
+        self.garbage = garbage
+        return dict(packs)
+
+    def _save_index(self):
+        src = marshal.dumps((INDEX_VERSION, self.index, self.packs, self.garbage, ), 2)
+        self.unsaved = 0
+        return bpio.AtomicWriteFile(os.path.join(self.path, INDEX_FILE_NAME), src)
+
+    def _replay(self, pack, pos):
+        """
+        Read records written after the index was saved, broken record at the
+        end of the pack is cut off.
+        """
+        filepath = self.pack_path(pack)
+        size = os.path.getsize(filepath)
+        self.packs.setdefault(pack, 0)
+        self.garbage.setdefault(pack, 0)
+        if pos >= size:
+            self.packs[pack] = size
+            return
+        f = open(filepath, 'rb')
+        f.seek(pos)
+        while pos < size:
+            header = f.read(_HeaderSize)
+            if len(header) < _HeaderSize:
+                break
+            kind, key_length, data_length = struct.unpack(_HeaderFormat, header)
+            if kind not in ('+', '-', ) or pos + _HeaderSize + key_length + data_length > size:
+                break
+            key = f.read(key_length)
+            f.seek(data_length, 1)
+            record_size = _HeaderSize + key_length + data_length
+            self._unlink(key)
+            if kind == '+':
+                self.index[key] = (pack, pos + _HeaderSize + key_length, data_length, )
+            else:
+                self.garbage[pack] += record_size
+            pos += record_size
+        f.close()
+        if pos < size:
+            lg.warn('%d bytes of broken data at the end of %s' % (size - pos, filepath))
+            f = open(filepath, 'ab')
+            f.truncate(pos)
+            f.close()
+        self.packs[pack] = pos
+
+    def _forget_pack(self, pack):
+        for key, pos in self.index.items():
+            if pos[0] == pack:
+                self.index.pop(key)
+        self.packs.pop(pack, None)
+        self.garbage.pop(pack, None)
+        reader = self.readers.pop(pack, None)
+        if reader:
+            reader.close()
+
+    def _unlink(self, key):
+        """
+        Remove key from the index and count its record as garbage.
+        """
+        pos = self.index.pop(key, None)
+        if pos is None:
+            return False
+        pack, _, data_length = pos
+        if pack in self.garbage:
+            self.garbage[pack] += _HeaderSize + len(key) + data_length
+        return True
+
+    #------------------------------------------------------------------------------
+
+    def _append(self, kind, key, data):
+        if self.packs[self.current] >= PACK_MAX_SIZE:
+            self.fout.close()
+            self.current += 1
+            self.packs[self.current] = 0
+            self.garbage[self.current] = 0
+            self.fout = open(self.pack_path(self.current), 'ab')
+        pos = self.packs[self.current]
+        self.fout.write(struct.pack(_HeaderFormat, kind, len(key), len(data)) + key)
+        self.fout.write(data)
+        self.fout.flush()
+        os.fsync(self.fout.fileno())
+        self.packs[self.current] = pos + _HeaderSize + len(key) + len(data)
+        self.unsaved += 1
+        if self.unsaved >= SAVE_INDEX_EVERY:
+            self._save_index()
+        return pos + _HeaderSize + len(key)
+
+    def write(self, key, data):
+        """
+        Store the packet, previous copy with same key is replaced.
+        """
+        try:
+            offset = self._append('+', key, data)
+        except:
+            lg.exc()
+            return False
+        self._unlink(key)
+        self.index[key] = (self.current, offset, len(data), )
+        return True
+
+    def has(self, key):
+        return key in self.index
+
+    def locate(self, key):
+        """
+        Return tuple (pack file path, offset, length) or None,
+        so data can be read directly from the pack.
+        """
+        pos = self.index.get(key)
+        if pos is None:
+            return None
+        pack, offset, length = pos
+        return self.pack_path(pack), offset, length
+
+    def read(self, key):
+        """
+        Return stored data or None.
+        """
+        pos = self.index.get(key)
+        if pos is None:
+            return None
+        pack, offset, length = pos
+        f = self.readers.get(pack)
+        try:
+            if f is None:
+                f = open(self.pack_path(pack), 'rb')
+                self.readers[pack] = f
+            f.seek(offset)
+            data = f.read(length)
+        except:
+            lg.exc()
+            return None
+        if len(data) != length:
+            lg.warn('pack %s is truncated, can not read %s' % (self.pack_path(pack), key))
+            return None
+        return data
+
+    def delete(self, key):
+        """
+        Mark packet as removed, return True if it was stored.
+        """
+        if key not in self.index:
+            return False
+        self._remove(key)
+        self.schedule_compaction()
+        return True
+
+    def delete_prefix(self, prefix):
+        """
+        Remove all packets in the "folder", for example a whole backup:
+        "master/0/1/F20180101120000AM/". Return number of removed packets.
+        """
+        keys = [key for key in self.index.keys() if key.startswith(prefix)]
+        for key in keys:
+            self._remove(key)
+        if keys:
+            self.schedule_compaction()
+        return len(keys)
+
+    def _remove(self, key):
+        self._append('-', key, '')
+        # the "removed" record itself is garbage as well
+        self.garbage[self.current] += _HeaderSize + len(key)
+        self._unlink(key)
+
+    def items(self, prefix=''):
+        """
+        Return a list of tuples (key, data length) for all stored packets
+        with key started from ``prefix``.
+        """
+        return [(key, pos[2], ) for key, pos in self.index.iteritems() if key.startswith(prefix)]
+
+    def size(self):
+        """
+        Return number of bytes used on disk by all packs.
+        """
+        return sum(self.packs.values())
+
+    def garbage_size(self):
+        return sum(self.garbage.values())
+
+    #------------------------------------------------------------------------------
+
+    def schedule_compaction(self, delay=COMPACTION_DELAY):
+        from twisted.internet import reactor
+        if self.compacting is not None:
+            return
+        if self.compaction_task and self.compaction_task.active():
+            self.compaction_task.reset(delay)
+            return
+        self.compaction_task = reactor.callLater(delay, self._compaction_step)
+
+    def packs_to_compact(self):
+        result = []
+        for pack, size in self.packs.items():
+            if pack == self.current or size == 0:
+                continue
+            if self.garbage.get(pack, 0) >= size * COMPACTION_RATIO:
+                result.append(pack)
+        result.sort()
+        return result
+
+    def compact(self):
+        """
+        Compact all packs at once, used when reactor is not running.
+        """
+        while self._compact_step():
+            pass
+
+    def _compaction_step(self):
+        from twisted.internet import reactor
+        self.compaction_task = None
+        if self.fout is None:
+            return
+        try:
+            more = self._compact_step()
+        except:
+            lg.exc()
+            self.compacting = None
+            return
+        if more:
+            self.compaction_task = reactor.callLater(0, self._compaction_step)
+
+    def _compact_step(self):
+        """
+        Copy up to ``COMPACTION_STEP_SIZE`` bytes of live records from the pack
+        being compacted, return True if there is more work to do.
+        """
+        if self.compacting is None:
+            packs = self.packs_to_compact()
+            if not packs:
+                return False
+            pack = packs[0]
+            keys = sorted([key for key, pos in self.index.iteritems() if pos[0] == pack], key=lambda k: self.index[k][1])
+            self.compacting = (pack, keys, )
+            if _Debug:
+                lg.out(_DebugLevel, 'segment_store._compact_step start with pack %d, %d live records, %d bytes of garbage' % (
+                    pack, len(keys), self.garbage.get(pack, 0)))
+        pack, keys = self.compacting
+        copied = 0
+        while keys and copied < COMPACTION_STEP_SIZE:
+            key = keys.pop(0)
+            pos = self.index.get(key)
+            if pos is None or pos[0] != pack:
+                continue
+            data = self.read(key)
+            if data is None:
+                continue
+            self.write(key, data)
+            copied += len(data)
+        if keys:
+            return True
+        self.compacting = None
+        self._forget_pack(pack)
+        self._save_index()
+        try:
+            os.remove(self.pack_path(pack))
+        except:
+            lg.exc()
+        if _Debug:
+            lg.out(_DebugLevel, 'segment_store._compact_step pack %d removed, %r' % (pack, self))
+        return bool(self.packs_to_compact())
@@ -30,6 +30,10 @@
 Keep track of temporary files created in the program. The temp folder is
 placed in the BitDust data directory. All files are divided into several
 sub folders.
+
+On Linux the same sub folders can be also created in the shared memory
+(``/dev/shm``), such files never touch the disk and can be passed by name
+to another process to be memory mapped there.
 """
 
 #------------------------------------------------------------------------------
@@ -40,6 +44,7 @@ _DebugLevel = 10
 #------------------------------------------------------------------------------
 
 import os
+import stat
 import tempfile
 import time
 
@@ -54,6 +59,7 @@ from system import bpio
 #------------------------------------------------------------------------------
 
 _TempDirPath = None
+_SharedDirPath = None
 _FilesDict = {}
 _CollectorTask = None
 _SubDirs = {
@@ -114,6 +120,7 @@ def init(temp_dir_path=''):
     """
     lg.out(4, 'tmpfile.init')
     global _TempDirPath
+    global _SharedDirPath
     global _SubDirs
     global _FilesDict
     global _CollectorTask
@@ -140,6 +147,14 @@ def init(temp_dir_path=''):
             _TempDirPath = temp_dir
         lg.out(6, 'tmpfile.init  _TempDirPath=' + _TempDirPath)
 
+    if _SharedDirPath is None:
+        _SharedDirPath = ''
+        if bpio.Linux() and os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+            shared_dir = os.path.join('/dev/shm', 'bitdust-%d' % os.getuid())
+            if make_private_dir(shared_dir):
+                _SharedDirPath = shared_dir
+        lg.out(6, 'tmpfile.init  _SharedDirPath=' + _SharedDirPath)
+
     for name in _SubDirs.keys():
         if not os.path.exists(subdir(name)):
             try:
@@ -181,6 +196,59 @@ def subdir(name):
     return os.path.join(_TempDirPath, name)
 
 
+def shared_subdir(name):
+    """
+    Return a path to given sub folder in the shared memory or None if shared
+    memory is not available on that machine.
+    """
+    global _SharedDirPath
+    if _SharedDirPath is None:
+        init()
+    if not _SharedDirPath:
+        return None
+    path = os.path.join(_SharedDirPath, name)
+    if not make_private_dir(path):
+        return None
+    return path
+
+
+def is_private_dir(path):
+    """
+    Return True if ``path`` is a real folder (not a symlink) owned by current
+    user and not accessible by anyone else.
+    """
+    try:
+        st = os.lstat(path)
+    except:
+        return False
+    if stat.S_ISLNK(st.st_mode) or not stat.S_ISDIR(st.st_mode):
+        return False
+    if st.st_uid != os.getuid():
+        return False
+    return stat.S_IMODE(st.st_mode) == 0o700
+
+
+def make_private_dir(path):
+    """
+    Create a folder in the shared memory which only current user can access.
+    Another local user can create same path before us, so existing folder
+    is used only if ``is_private_dir()`` is True.
+    """
+    if not os.path.lexists(path):
+        try:
+            os.mkdir(path, 0o700)
+            # mode passed to mkdir() is masked by umask
+            os.chmod(path, 0o700)
+        except:
+            lg.out(2, 'tmpfile.make_private_dir ERROR can not create ' + path)
+            lg.exc()
+            return False
+    if not is_private_dir(path):
+        lg.warn('%s is not a private folder of current user, shared memory will not be used' % path)
+        return False
+    return True
+
+
 def register(filepath):
     """
     You can create a temp file in another place and call this method to be able
@@ -194,10 +262,11 @@ def register(filepath):
     _FilesDict[name][filepath] = time.time()
 
 
-def make(name, extension='', prefix=''):
+def make(name, extension='', prefix='', shared=False):
     """
     Make a new file under sub folder ``name`` and return a tuple of it's file
-    descriptor and path.
+    descriptor and path. If ``shared`` is True the file is created in the
+    shared memory if it is available.
 
     .. warning::    Remember you need to close the file descriptor by your own.
     The ``tmpfile`` module will remove it later - do not worry.
@@ -211,8 +280,13 @@ def make(name, extension='', prefix=''):
         init()
     if name not in _FilesDict.keys():
         name = 'all'
+    location = None
+    if shared:
+        location = shared_subdir(name)
+    if not location:
+        location = subdir(name)
     try:
-        fd, filename = tempfile.mkstemp(extension, prefix, subdir(name))
+        fd, filename = tempfile.mkstemp(extension, prefix, location)
         _FilesDict[name][filename] = time.time()
     except:
         lg.out(1, 'tmpfile.make ERROR creating file in sub folder ' + name)
@@ -334,20 +408,33 @@ def collect():
 
 
 def startup_clean():
-    """
-    At startup we want to scan all sub folders and remove the old files.
-
-    We will get creation time with built-in ``os.stat`` method.
+    """
+    At startup we want to scan all sub folders and remove the old files.
+
+    We will get creation time with built-in ``os.stat`` method.
+    Files left in the shared memory after a crash are removed same way.
     """
     global _TempDirPath
+    global _SharedDirPath
     global _SubDirs
     if _Debug:
-        lg.out(_DebugLevel - 4, 'tmpfile.startup_clean in %s' % _TempDirPath)
+        lg.out(_DebugLevel - 4, 'tmpfile.startup_clean in %s and %s' % (_TempDirPath, _SharedDirPath))
     if _TempDirPath is None:
         return
+    startup_clean_dir(_TempDirPath)
+    if _SharedDirPath and is_private_dir(_SharedDirPath):
+        startup_clean_dir(_SharedDirPath, private=True)
+
+
+def startup_clean_dir(base_dir, private=False):
+    """
+    Remove old files from all known sub folders of ``base_dir``.
+    If ``private`` is True only sub folders checked with ``is_private_dir()`` are cleaned.
+    """
+    global _SubDirs
     counter = 0
     limit_counts = 200
-    for name in os.listdir(_TempDirPath):
+    for name in os.listdir(base_dir):
         # we want to scan only our folders
         # do not want to be responsible of other files
         if name not in _SubDirs.keys():
@@ -363,8 +450,12 @@ def startup_clean():
             lifetime = _SubDirs.get(name, 0)
             if lifetime == 0:
                 continue
-            for filename in os.listdir(subdir(name)):
-                filepath = os.path.join(subdir(name), filename)
+            folder = os.path.join(base_dir, name)
+            if private and not is_private_dir(folder):
+                lg.warn('%s is not a private folder of current user, skip cleaning' % folder)
+                continue
+            for filename in os.listdir(folder):
+                filepath = os.path.join(folder, filename)
                 if os.path.isfile(filepath):
                     filetime = os.stat(filepath).st_ctime
                     if time.time() - filetime > lifetime:
@@ -108,6 +108,7 @@ from userid import my_id
 from contacts import identitycache
 
 from transport import callback
+from transport import memory_inbox
 from transport import packet_in
 from transport import packet_out
 
@@ -185,6 +186,8 @@ def init():
         lg.warn('local listener already exist')
     else:
         _LocalListener = TransportGateLocalProxy()
+    # transports are running in same process, so can pass small packets via memory
+    memory_inbox.enable(True)
 
 
 def shutdown():
@@ -201,6 +204,7 @@ def shutdown():
         _LocalListener = None
     else:
         lg.warn('local listener not exist')
+    memory_inbox.enable(False)
     close_transport_log()
 
 
@@ -365,8 +369,8 @@ def detach(transport_instance):
 
 def inbox(info):
     """
-    1) The protocol modules write to temporary files and gives us that filename
-    2) We unserialize 3) We check that it is for us 4) We check that it is from
+    1) The protocol modules write to temporary files and gives us that filename,
+    small packets are kept in memory, see ``memory_inbox`` 2) We unserialize 3) We check that it is for us 4) We check that it is from
     one of our contacts.
 
     5) We use signed.validate() to check signature and that number
@@ -384,11 +388,11 @@ def inbox(info):
 #         if _Debug:
 #             lg.out(_DebugLevel - 4, "gateway.inbox ignoring input since _DoingShutdown ")
 #         return None
-    if info.filename == "" or not os.path.exists(info.filename):
+    if info.filename == "" or not memory_inbox.exists(info.filename):
         lg.err("bad filename=" + info.filename)
         return None
     try:
-        data = bpio.ReadBinaryFile(info.filename)
+        data = memory_inbox.read(info.filename)
     except:
         lg.err("gateway.inbox ERROR reading file " + info.filename)
         return None
@@ -662,7 +666,7 @@ def packets_timeout_loop():
             if _Debug:
                 lg.out(_DebugLevel - 4, 'gateway.packets_timeout_loop %r is timed out: %s' % (pkt_in, pkt_in.timeout))
             pkt_in.automat('cancel', 'timeout')
-    for pkt_out in packet_out.queue():
+    for pkt_out in packet_out.timed_out_packets():
         if pkt_out.is_timed_out():
             if _Debug:
                 lg.out(_DebugLevel - 4, 'gateway.packets_timeout_loop %r is timed out: %s' % (pkt_out, pkt_out.timeout))
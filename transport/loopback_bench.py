@@ -0,0 +1,846 @@
+#!/usr/bin/env python
+# loopback_bench.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (loopback_bench.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+.. module:: loopback_bench.
+
+Benchmark of transport plug-ins on the local machine.
+
+Main process emulates network links and starts child processes with real
+transport code inside:
+
+    + "sender" creates files with random data and sends them to the next node
+    + "router" (only with ``--proxy``) receives files and forwards them
+      to the next node, like ``proxy_router`` does with routed packets
+    + "receiver" receives files and checks their content
+
+Every child is a separate process because ``tcp_node`` and ``udp_session``
+modules keep their state globally. Child processes do not start DHT and
+STUN, ``LoopbackNode`` replaces ``udp_node`` and ``BenchGate`` replaces
+``gateway`` so sessions, streams and connections work as usual.
+
+Nodes are not connected directly: every hop goes through ``UDPRelay`` or
+``TCPRelay`` in the main process which pass packets via two ``LinkEmulator``
+objects, one per direction. Link adds delay, limits bandwidth with a
+"tail drop" queue and randomly drops datagrams. TCP connections are never
+losing data, so only delay and bandwidth are applied to them.
+
+Result is printed as a single JSON object:
+
+    mb_per_sec     : delivered megabytes per second, from first sent
+                     to last received file
+    packets_per_sec: datagrams (UDP) or socket reads (TCP) passed
+                     through all links in both directions
+    cpu_per_mb     : CPU seconds of all child processes per delivered megabyte
+    latency_p99    : time from the moment file was passed to transport
+                     until it was received by the last node
+
+Example::
+
+    python transport/loopback_bench.py --proto=udp --files=20 --size=1048576 \\
+        --delay=0.025 --loss=0.01 --rate=1250000 --output=udp.json
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 10
+
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import hashlib
+import random
+import socket
+import shutil
+import tempfile
+import optparse
+import collections
+
+try:
+    from logs import lg
+except:
+    dirpath = os.path.dirname(os.path.abspath(sys.argv[0]))
+    sys.path.insert(0, os.path.abspath(os.path.join(dirpath, '..')))
+    from logs import lg
+
+from twisted.internet import reactor
+from twisted.internet import protocol
+from twisted.internet.defer import Deferred
+
+#------------------------------------------------------------------------------
+
+MARKER = 'BENCH '  # child processes report to the main process with lines started with that
+FILE_HEADER = 'BitDustBench %08d\n'
+MB = 1024.0 * 1024.0
+DEFAULT_QUEUE_SIZE = 256 * 1024  # bytes, link buffer if bandwidth is limited
+HOST = '127.0.0.1'
+
+#------------------------------------------------------------------------------
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile, ``p`` is from 0 to 100.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    pos = int(round(p / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(len(values) - 1, pos))]
+
+
+def free_port(udp=False):
+    """
+    Ask OS for a port which is not used right now.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM if udp else socket.SOCK_STREAM)
+    s.bind((HOST, 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def make_idurl(role):
+    return 'http://%s/bench_%s.xml' % (HOST, role)
+
+
+def report(event, **kwargs):
+    """
+    Child process sends an event to the main process.
+    """
+    kwargs['event'] = event
+    sys.stdout.write(MARKER + json.dumps(kwargs) + '\n')
+    sys.stdout.flush()
+
+#------------------------------------------------------------------------------
+
+
+class LinkEmulator(object):
+    """
+    One direction of the emulated link: packets are delayed, queued
+    if ``rate`` (bytes per second) is limited and randomly lost.
+    """
+
+    def __init__(self, delay=0.0, loss=0.0, rate=0, queue=DEFAULT_QUEUE_SIZE):
+        self.delay = delay
+        self.loss = loss
+        self.rate = rate
+        self.queue = queue
+        self.busy_until = 0.0
+        self.pending = collections.deque()
+        self.timer = None
+        self.drain_callbacks = []
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+
+    def backlog(self):
+        """
+        Number of bytes waiting in the queue to be transmitted.
+        """
+        if not self.rate:
+            return 0
+        return max(0.0, self.busy_until - time.time()) * self.rate
+
+    def send(self, data, callback, *args, **kwargs):
+        """
+        Call ``callback(data, *args)`` when packet reach the other side,
+        return False if packet was dropped.
+        """
+        lossy = kwargs.get('lossy', True)
+        now = time.time()
+        if lossy:
+            if self.loss and random.random() < self.loss:
+                self.dropped += 1
+                return False
+            if self.rate and self.backlog() + len(data) > self.queue:
+                self.dropped += 1
+                return False
+        start = max(now, self.busy_until)
+        if self.rate:
+            self.busy_until = start + len(data) / float(self.rate)
+        else:
+            self.busy_until = start
+        # delivery time is never decreasing, so order of packets is kept
+        self.pending.append((self.busy_until + self.delay, data, callback, args, ))
+        if self.timer is None:
+            self.timer = reactor.callLater(max(0, self.pending[0][0] - now), self._deliver)
+        return True
+
+    def on_drain(self, callback):
+        """
+        Call once when queue is half empty, used to pause TCP producers.
+        """
+        self.drain_callbacks.append(callback)
+
+    def _deliver(self):
+        self.timer = None
+        now = time.time()
+        while self.pending and self.pending[0][0] <= now:
+            _, data, callback, args = self.pending.popleft()
+            self.packets += 1
+            self.bytes += len(data)
+            try:
+                callback(data, *args)
+            except:
+                lg.exc()
+        if self.drain_callbacks and self.backlog() < self.queue / 2:
+            callbacks = self.drain_callbacks
+            self.drain_callbacks = []
+            for cb in callbacks:
+                cb()
+        if self.pending:
+            self.timer = reactor.callLater(max(0, self.pending[0][0] - now), self._deliver)
+
+    def stop(self):
+        if self.timer and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        self.pending.clear()
+
+    def info(self):
+        return {'packets': self.packets, 'bytes': self.bytes, 'dropped': self.dropped, }
+
+#------------------------------------------------------------------------------
+
+
+class _DatagramSocket(protocol.DatagramProtocol):
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def datagramReceived(self, datagram, address):
+        self.handler(datagram, address)
+
+    def write(self, datagram, address):
+        if self.transport:
+            self.transport.write(datagram, address)
+
+
+class UDPRelay(object):
+    """
+    Remote side see all datagrams coming from "back" socket and
+    local side must send datagrams to "front" socket.
+    """
+
+    def __init__(self, target, forward, backward):
+        self.target = target
+        self.forward = forward
+        self.backward = backward
+        self.client = None
+        self.front = _DatagramSocket(self._from_front)
+        self.back = _DatagramSocket(self._from_back)
+        self.listeners = []
+
+    def start(self):
+        self.listeners.append(reactor.listenUDP(0, self.front, interface=HOST))
+        self.listeners.append(reactor.listenUDP(0, self.back, interface=HOST))
+
+    def stop(self):
+        for l in self.listeners:
+            l.stopListening()
+        self.listeners = []
+
+    def address(self):
+        return (HOST, self.listeners[0].getHost().port, )
+
+    def _from_front(self, datagram, address):
+        self.client = address
+        self.forward.send(datagram, self.back.write, self.target)
+
+    def _from_back(self, datagram, address):
+        if self.client:
+            self.backward.send(datagram, self.front.write, self.client)
+
+
+class _RelayProtocol(protocol.Protocol):
+
+    def __init__(self, link):
+        self.link = link
+        self.peer = None
+        self.buffer = []
+
+    def connectionMade(self):
+        self.transport.setTcpNoDelay(True)
+
+    def attach(self, peer):
+        self.peer = peer
+        for data in self.buffer:
+            self.link.send(data, peer.transport.write, lossy=False)
+        self.buffer = []
+
+    def dataReceived(self, data):
+        if not self.peer:
+            self.buffer.append(data)
+            return
+        self.link.send(data, self.peer.transport.write, lossy=False)
+        if self.link.backlog() > self.link.queue:
+            # slow down the sender, so it see same bandwidth as we emulate
+            self.transport.pauseProducing()
+            self.link.on_drain(self.transport.resumeProducing)
+
+    def connectionLost(self, reason):
+        if self.peer:
+            self.link.send('', lambda data, peer: peer.transport.loseConnection(), self.peer, lossy=False)
+
+
+class TCPRelay(protocol.ServerFactory):
+    """
+    Accept connection and open a new one to the ``target``.
+    """
+
+    def __init__(self, target, forward, backward):
+        self.target = target
+        self.forward = forward
+        self.backward = backward
+        self.listener = None
+
+    def start(self):
+        self.listener = reactor.listenTCP(0, self, interface=HOST)
+
+    def stop(self):
+        if self.listener:
+            self.listener.stopListening()
+        self.listener = None
+
+    def address(self):
+        return (HOST, self.listener.getHost().port, )
+
+    def buildProtocol(self, addr):
+        front = _RelayProtocol(self.forward)
+        d = protocol.ClientCreator(reactor, _RelayProtocol, self.backward).connectTCP(self.target[0], self.target[1])
+        d.addCallback(self._connected, front)
+        d.addErrback(self._failed, front)
+        return front
+
+    def _connected(self, back, front):
+        front.attach(back)
+        back.attach(front)
+
+    def _failed(self, err, front):
+        lg.warn('can not connect to %s : %s' % (self.target, err.getErrorMessage()))
+        if front.transport:
+            front.transport.loseConnection()
+
+#------------------------------------------------------------------------------
+
+
+class BenchGate(object):
+    """
+    Replacement of ``gateway.TransportGateLocalProxy`` in child processes,
+    plug-ins call it same way.
+    """
+
+    def __init__(self, on_sent, on_received):
+        self.on_sent = on_sent
+        self.on_received = on_received
+        self.transfers = {}
+        self.last_transfer_id = 0
+
+    def callRemote(self, method, *args):
+        d = Deferred()
+        reactor.callLater(0, self._call, d, method, args)
+        return d
+
+    def _call(self, d, method, args):
+        m = getattr(self, 'do_' + method, None)
+        result = None
+        if m:
+            try:
+                result = m(*args)
+            except:
+                lg.exc()
+        d.callback(result)
+
+    def _register(self, filename):
+        self.last_transfer_id += 1
+        self.transfers[self.last_transfer_id] = filename
+        return self.last_transfer_id
+
+    def do_register_file_sending(self, proto, host, receiver_idurl, filename, size=0, description=''):
+        return self._register(filename)
+
+    def do_register_file_receiving(self, proto, host, sender_idurl, filename, size=0):
+        return self._register(filename)
+
+    def do_unregister_file_sending(self, transfer_id, status, bytes_sent, error_message=None):
+        filename = self.transfers.pop(transfer_id, None)
+        if filename:
+            self.on_sent(filename, status, error_message)
+        return True
+
+    def do_unregister_file_receiving(self, transfer_id, status, bytes_received, error_message=None):
+        filename = self.transfers.pop(transfer_id, None)
+        if filename:
+            self.on_received(filename, status, error_message)
+        return True
+
+    def do_cancelled_file_sending(self, proto, host, filename, size=0, description=None, error_message=None):
+        self.on_sent(filename, 'failed', error_message)
+        return True
+
+#------------------------------------------------------------------------------
+
+
+class LoopbackNode(object):
+    """
+    Replacement of ``udp_node`` without STUN and DHT: peers addresses
+    are known from command line.
+    """
+
+    def __init__(self, role, port):
+        from transport.udp import udp_interface
+        self.my_idurl = make_idurl(role)
+        self.my_id = udp_interface.idurl_to_id(self.my_idurl)
+        self.listen_port = port
+
+    def start(self):
+        from lib import udp
+        from transport.udp import udp_session
+        from transport.udp import udp_stream
+        udp.listen(self.listen_port)
+        udp.proto(self.listen_port).add_callback(self._datagram_received)
+        reactor.callLater(0, udp_session.process_sessions)
+        reactor.callLater(0, udp_stream.process_streams)
+
+    def send(self, filename, address, peer_id, description):
+        from transport.udp import udp_session
+        result_defer = Deferred()
+        active_sessions = udp_session.get_by_peer_id(peer_id)
+        if active_sessions:
+            active_sessions[0].file_queue.append_outbox_file(
+                filename, description, result_defer, keep_alive=True)
+            return result_defer
+        udp_session.add_pending_outbox_file(filename, peer_id, description, result_defer, keep_alive=True)
+        if not udp_session.get(address):
+            s = udp_session.create(self, address, peer_id)
+            s.automat('init')
+        return result_defer
+
+    def _datagram_received(self, datagram, address):
+        from lib import udp
+        from transport.udp import udp_session
+        active_sessions = udp_session.get(address)
+        if active_sessions:
+            for s in active_sessions:
+                s.automat('datagram-received', (datagram, address))
+            return False
+        if datagram[0] in (udp.CMD_PING, udp.CMD_GREETING, ):
+            s = udp_session.create(self, address)
+            s.automat('init')
+            s.automat('datagram-received', (datagram, address))
+        return False
+
+#------------------------------------------------------------------------------
+
+
+class BenchChild(object):
+    """
+    Code running inside of the child process, ``options.role`` is one of
+    "sender", "router" or "receiver".
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.files = {}
+        self.sending = set()
+        self.queue = []
+        self.done = 0
+        self.node = None
+        self.cpu_start = None
+
+    def init(self):
+        from system import bpio
+        from system import tmpfile
+        from main import settings
+        lg.set_debug_level(0)
+        bpio.init()
+        settings.init(base_dir=os.path.join(self.options.basedir, self.options.role))
+        settings.enableUDPcongestionControl(self.options.profile == 'adaptive')
+        settings.enableTCPmultiplexing(self.options.profile == 'adaptive')
+        tmpfile.init(os.path.join(self.options.basedir, self.options.role, 'temp'))
+        gate = BenchGate(self._on_sent, self._on_received)
+        if self.options.proto == 'udp':
+            from transport.udp import udp_interface
+            udp_interface.GateInterface().init(gate)
+            self.node = LoopbackNode(self.options.role, self.options.port)
+            self.node.start()
+        else:
+            from transport.tcp import tcp_interface
+            tcp_interface.GateInterface().init(gate)
+            tcp_interface.GateInterface().connect({
+                'idurl': make_idurl(self.options.role),
+                'tcp_port': self.options.port,
+                'host': HOST,
+            })
+        reactor.addSystemEventTrigger('before', 'shutdown', self._report_cpu)
+        self.cpu_start = cpu_time()
+        report('ready', role=self.options.role, port=self.options.port)
+        if self.options.role == 'sender':
+            self._create_files()
+            reactor.callLater(0, self._send_next)
+
+    def _report_cpu(self):
+        report('cpu', role=self.options.role, seconds=cpu_time() - self.cpu_start)
+
+    def _create_files(self):
+        from system import tmpfile
+        for index in xrange(self.options.files):
+            fd, filename = tmpfile.make('outbox', extension='.bench')
+            header = FILE_HEADER % index
+            data = header + os.urandom(max(0, self.options.size - len(header)))
+            os.write(fd, data)
+            os.close(fd)
+            self.files[filename] = index
+            self.queue.append((index, filename, hashlib.md5(data).hexdigest(), len(data), ))
+        self.queue.reverse()
+        self.cpu_start = cpu_time()
+
+    def _send(self, filename, description):
+        peer_host, peer_port = self.options.peer.split(':')
+        if self.options.proto == 'udp':
+            self.node.send(filename, (peer_host, int(peer_port)), self.options.peer_id, description)
+        else:
+            from transport.tcp import tcp_interface
+            tcp_interface.GateInterface().send_file(
+                make_idurl('next'), filename, self.options.peer, description)
+
+    def _send_next(self):
+        while self.queue and len(self.sending) < self.options.concurrency:
+            index, filename, digest, size = self.queue.pop()
+            self.sending.add(filename)
+            report('started', index=index, time=time.time(), md5=digest, size=size)
+            self._send(filename, 'Data(bench_%d)' % index)
+
+    def _on_sent(self, filename, status, error_message):
+        if filename not in self.files:
+            return
+        index = self.files.pop(filename)
+        self.sending.discard(filename)
+        if status != 'finished':
+            lg.warn('file %d was not sent: %s %s' % (index, status, error_message))
+        try:
+            os.remove(filename)
+        except:
+            pass
+        if self.options.role == 'sender':
+            report('sent', index=index, time=time.time(), status=status)
+            if not self.files:
+                reactor.stop()
+                return
+            self._send_next()
+
+    def _on_received(self, filename, status, error_message):
+        if status != 'finished':
+            lg.warn('file was not received: %s %s' % (status, error_message))
+            return
+        try:
+            data = open(filename, 'rb').read()
+            index = int(data[:len(FILE_HEADER % 0)].split()[1])
+        except:
+            lg.exc()
+            return
+        if self.options.role == 'router':
+            self.files[filename] = index
+            self._send(filename, 'Data(bench_%d)' % index)
+            return
+        report('received', index=index, time=time.time(), md5=hashlib.md5(data).hexdigest(), size=len(data))
+        try:
+            os.remove(filename)
+        except:
+            pass
+
+#------------------------------------------------------------------------------
+
+
+class ChildProcess(protocol.ProcessProtocol):
+
+    def __init__(self, bench, role):
+        self.bench = bench
+        self.role = role
+        self.buffer = ''
+        self.finished = Deferred()
+
+    def outReceived(self, data):
+        self.buffer += data
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            if not line.startswith(MARKER):
+                if _Debug:
+                    lg.out(_DebugLevel, '[%s] %s' % (self.role, line))
+                continue
+            try:
+                event = json.loads(line[len(MARKER):])
+            except:
+                lg.exc()
+                continue
+            self.bench.on_event(self.role, event)
+
+    def errReceived(self, data):
+        if _Debug:
+            lg.out(_DebugLevel, '[%s] %s' % (self.role, data.rstrip()))
+
+    def processEnded(self, reason):
+        self.bench.on_event(self.role, {'event': 'exit', })
+        self.finished.callback(self.role)
+
+
+class Bench(object):
+    """
+    Main process: starts links and child processes and collect results.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.basedir = tempfile.mkdtemp(prefix='bitdust-bench-')
+        self.links = []
+        self.relays = []
+        self.children = {}
+        self.ready = set()
+        self.started = {}
+        self.sent = {}
+        self.received = {}
+        self.cpu = {}
+        self.timeout_task = None
+        self.result = None
+
+    def _link(self):
+        forward = LinkEmulator(self.options.delay, self.options.loss, self.options.rate, self.options.queue)
+        backward = LinkEmulator(self.options.delay, self.options.loss, self.options.rate, self.options.queue)
+        self.links.extend([forward, backward, ])
+        return forward, backward
+
+    def _relay(self, target):
+        forward, backward = self._link()
+        if self.options.proto == 'udp':
+            r = UDPRelay(target, forward, backward)
+        else:
+            r = TCPRelay(target, forward, backward)
+        r.start()
+        self.relays.append(r)
+        return r.address()
+
+    def _spawn(self, role, port, peer=None, peer_role=None):
+        from transport.udp import udp_interface
+        args = [
+            sys.executable, os.path.abspath(__file__),
+            '--role=%s' % role,
+            '--proto=%s' % self.options.proto,
+            '--profile=%s' % self.options.profile,
+            '--port=%d' % port,
+            '--basedir=%s' % self.basedir,
+            '--files=%d' % self.options.files,
+            '--size=%d' % self.options.size,
+            '--concurrency=%d' % self.options.concurrency,
+        ]
+        if peer:
+            args.append('--peer=%s:%d' % peer)
+            args.append('--peer-id=%s' % udp_interface.idurl_to_id(make_idurl(peer_role)))
+        p = ChildProcess(self, role)
+        self.children[role] = p
+        reactor.spawnProcess(p, sys.executable, args, env=os.environ, path=os.getcwd())
+        return p
+
+    def start(self):
+        udp = self.options.proto == 'udp'
+        receiver_port = free_port(udp)
+        self._spawn('receiver', receiver_port)
+        next_address = self._relay((HOST, receiver_port, ))
+        next_role = 'receiver'
+        if self.options.proxy:
+            router_port = free_port(udp)
+            self._spawn('router', router_port, next_address, next_role)
+            next_address = self._relay((HOST, router_port, ))
+            next_role = 'router'
+        self.sender_args = (free_port(udp), next_address, next_role, )
+        self.timeout_task = reactor.callLater(self.options.timeout, self.finish)
+
+    def on_event(self, role, event):
+        name = event.get('event')
+        if name == 'ready':
+            self.ready.add(role)
+            if role != 'sender' and len(self.ready) == len(self.children):
+                self._spawn('sender', *self.sender_args)
+        elif name == 'started':
+            self.started[event['index']] = event
+        elif name == 'sent':
+            self.sent[event['index']] = event
+        elif name == 'received':
+            self.received[event['index']] = event
+            if len(self.received) == self.options.files:
+                reactor.callLater(0, self.finish)
+        elif name == 'cpu':
+            self.cpu[role] = event['seconds']
+        elif name == 'exit':
+            if role == 'sender' and len(self.received) < self.options.files:
+                # some files failed, give a moment to the last reports
+                reactor.callLater(max(1.0, self.options.delay * 10), self.finish)
+
+    def finish(self):
+        if self.result is not None:
+            return
+        if self.timeout_task and self.timeout_task.active():
+            self.timeout_task.cancel()
+        self.timeout_task = None
+        self.result = self.calculate()
+        for p in self.children.values():
+            if not p.finished.called:
+                try:
+                    p.transport.signalProcess('TERM')
+                except:
+                    pass
+        waiting = [p.finished for p in self.children.values() if not p.finished.called]
+        if not waiting:
+            self.stop()
+            return
+        from twisted.internet.defer import DeferredList
+        DeferredList(waiting).addBoth(lambda _: self.stop())
+
+    def calculate(self):
+        latencies = []
+        delivered = 0
+        corrupted = 0
+        first = None
+        last = None
+        for index, started in self.started.items():
+            if first is None or started['time'] < first:
+                first = started['time']
+            received = self.received.get(index)
+            if not received:
+                continue
+            if received['md5'] != started['md5']:
+                corrupted += 1
+                continue
+            delivered += received['size']
+            latencies.append(received['time'] - started['time'])
+            if last is None or received['time'] > last:
+                last = received['time']
+        duration = (last - first) if (first is not None and last is not None) else 0.0
+        packets = sum([l.packets for l in self.links])
+        return {
+            'proto': self.options.proto,
+            'profile': self.options.profile,
+            'proxy': bool(self.options.proxy),
+            'link': {
+                'delay': self.options.delay,
+                'loss': self.options.loss if self.options.proto == 'udp' else 0.0,
+                'rate': self.options.rate,
+                'queue': self.options.queue,
+            },
+            'files': self.options.files,
+            'file_size': self.options.size,
+            'concurrency': self.options.concurrency,
+            'delivered_files': len(latencies),
+            'failed_files': self.options.files - len(latencies),
+            'corrupted_files': corrupted,
+            'delivered_bytes': delivered,
+            'seconds': round(duration, 4),
+            'mb_per_sec': round(delivered / MB / duration, 4) if duration else 0.0,
+            'packets': packets,
+            'packets_dropped': sum([l.dropped for l in self.links]),
+            'packets_per_sec': round(packets / duration, 2) if duration else 0.0,
+            'cpu_seconds': dict(self.cpu),
+            'cpu_per_mb': None,
+            'latency_p50': percentile(latencies, 50),
+            'latency_p99': percentile(latencies, 99),
+            'latency_max': max(latencies) if latencies else None,
+            'links': [l.info() for l in self.links],
+        }
+
+    def stop(self):
+        for r in self.relays:
+            r.stop()
+        for l in self.links:
+            l.stop()
+        if self.result is not None and self.cpu and self.result['delivered_bytes']:
+            self.result['cpu_seconds'] = dict(self.cpu)
+            self.result['cpu_per_mb'] = round(sum(self.cpu.values()) / (self.result['delivered_bytes'] / MB), 4)
+        shutil.rmtree(self.basedir, ignore_errors=True)
+        if reactor.running:
+            reactor.stop()
+
+#------------------------------------------------------------------------------
+
+
+def parseCommandLine():
+    oparser = optparse.OptionParser()
+    oparser.add_option("--proto", dest="proto", help="transport to test: udp or tcp")
+    oparser.add_option("--profile", dest="profile", help="adaptive (congestion control and multiplexing) or legacy")
+    oparser.add_option("--proxy", dest="proxy", action="store_true", help="send files through a router node")
+    oparser.add_option("--files", dest="files", type="int", help="number of files to send")
+    oparser.add_option("--size", dest="size", type="int", help="size of every file in bytes")
+    oparser.add_option("--concurrency", dest="concurrency", type="int", help="number of files sent at same time")
+    oparser.add_option("--delay", dest="delay", type="float", help="one way delay of the link in seconds")
+    oparser.add_option("--loss", dest="loss", type="float", help="part of datagrams to be lost, from 0 to 1")
+    oparser.add_option("--rate", dest="rate", type="int", help="link bandwidth in bytes per second, 0 is unlimited")
+    oparser.add_option("--queue", dest="queue", type="int", help="link buffer in bytes")
+    oparser.add_option("--timeout", dest="timeout", type="float", help="stop after that many seconds")
+    oparser.add_option("--output", dest="output", help="write JSON result to the file")
+    oparser.add_option("--debug", dest="debug", action="store_true", help="print output of child processes")
+    # used by child processes
+    oparser.add_option("--role", dest="role", help=optparse.SUPPRESS_HELP)
+    oparser.add_option("--port", dest="port", type="int", help=optparse.SUPPRESS_HELP)
+    oparser.add_option("--peer", dest="peer", help=optparse.SUPPRESS_HELP)
+    oparser.add_option("--peer-id", dest="peer_id", help=optparse.SUPPRESS_HELP)
+    oparser.add_option("--basedir", dest="basedir", help=optparse.SUPPRESS_HELP)
+    oparser.set_defaults(
+        proto='udp', profile='adaptive', proxy=False, files=10, size=1024 * 1024, concurrency=4,
+        delay=0.0, loss=0.0, rate=0, queue=DEFAULT_QUEUE_SIZE, timeout=300.0, output='', debug=False,
+        role='', port=0, peer='', peer_id='', basedir='',
+    )
+    (options, args) = oparser.parse_args()
+    return options, args
+
+
+def main():
+    global _Debug
+    options, args = parseCommandLine()
+    if options.role:
+        child = BenchChild(options)
+        reactor.callWhenRunning(child.init)
+        reactor.run()
+        return
+    _Debug = options.debug
+    lg.set_debug_level(_DebugLevel if _Debug else 0)
+    bench = Bench(options)
+    reactor.callWhenRunning(bench.start)
+    reactor.run()
+    if bench.result is None:
+        return
+    result = json.dumps(bench.result, indent=2, sort_keys=True)
+    if options.output:
+        open(options.output, 'w').write(result + '\n')
+    print result
+
+#------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    main()
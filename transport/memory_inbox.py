@@ -0,0 +1,179 @@
+#!/usr/bin/python
+# memory_inbox.py
+#
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (memory_inbox.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+#
+#
+#
+#
+
+"""
+.. module:: memory_inbox.
+
+Small incoming packets are not written to a temporary file: transport
+plug-in keeps received data in memory and ``gateway.inbox()`` takes it from here.
+
+This works only if transports are running in the main process, so
+``gateway`` enables that when it starts local listener for transports.
+Transport plug-in calls ``accept()`` when new file is started and if it
+returns True uses a "memory://" name instead of a real file name:
+
+    + ``put()`` is called when all data was received
+    + ``read()`` returns data for given name, from memory or from disk
+    + ``erase()`` removes data from memory or temporary file from disk
+
+Bigger files still go to disk, see ``settings.getMemoryInboxMaxSize()``.
+"""
+
+#------------------------------------------------------------------------------
+
+_Debug = False
+_DebugLevel = 14
+
+#------------------------------------------------------------------------------
+
+import itertools
+
+#------------------------------------------------------------------------------
+
+from logs import lg
+
+from system import bpio
+from system import tmpfile
+
+from main import settings
+
+#------------------------------------------------------------------------------
+
+PREFIX = 'memory://'
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024  # incoming data kept in memory for all transfers together
+
+#------------------------------------------------------------------------------
+
+_Enabled = False
+_Buffers = {}
+_Reserved = {}
+_NamesCounter = itertools.count(1)
+_Counters = {
+    'memory_packets': 0,
+    'memory_bytes': 0,
+    'disk_packets': 0,
+    'disk_bytes': 0,
+}
+
+#------------------------------------------------------------------------------
+
+
+def enable(flag=True):
+    """
+    Called from ``gateway`` if transports are running in the main process.
+    """
+    global _Enabled
+    _Enabled = flag
+    if not flag:
+        _Buffers.clear()
+        _Reserved.clear()
+    if _Debug:
+        lg.out(_DebugLevel, 'memory_inbox.enable %r' % flag)
+
+
+def is_enabled():
+    return _Enabled
+
+
+def is_memory(filename):
+    return filename.startswith(PREFIX)
+
+
+def buffered_bytes():
+    return sum(_Reserved.values())
+
+
+def counters():
+    """
+    Return number of packets and bytes received through memory and through
+    temporary files.
+    """
+    return dict(_Counters)
+
+#------------------------------------------------------------------------------
+
+
+def accept(typ, size):
+    """
+    Return a new "memory://" name if incoming file of given size can be kept
+    in memory, otherwise None - caller must write data to a temporary file.
+    """
+    if not _Enabled:
+        return None
+    if not size or size > settings.getMemoryInboxMaxSize():
+        return None
+    if buffered_bytes() + size > MAX_BUFFERED_BYTES:
+        lg.warn('too much data in memory, %d bytes will be written to disk' % size)
+        return None
+    filename = '%s%s/%d' % (PREFIX, typ, next(_NamesCounter))
+    _Reserved[filename] = size
+    return filename
+
+
+def put(filename, data):
+    """
+    All data of the incoming file was received.
+    """
+    if filename not in _Reserved:
+        lg.warn('%s was not accepted or already erased' % filename)
+        return False
+    _Buffers[filename] = data
+    return True
+
+
+def read(filename):
+    """
+    Return received data, file on disk is read if data is not in memory.
+    """
+    if is_memory(filename):
+        data = _Buffers.get(filename)
+        if data is None:
+            raise IOError('no data in memory for %s' % filename)
+        _Counters['memory_packets'] += 1
+        _Counters['memory_bytes'] += len(data)
+        return data
+    data = bpio.ReadBinaryFile(filename)
+    _Counters['disk_packets'] += 1
+    _Counters['disk_bytes'] += len(data)
+    return data
+
+
+def exists(filename):
+    if is_memory(filename):
+        return filename in _Buffers
+    return bpio.pathExist(filename)
+
+
+def erase(filename, why='dont know'):
+    """
+    Remove data from memory, temporary file is removed by ``tmpfile`` module.
+    """
+    if is_memory(filename):
+        _Reserved.pop(filename, None)
+        _Buffers.pop(filename, None)
+        return
+    tmpfile.throw_out(filename, why)
@@ -63,7 +63,6 @@ from main import events
 
 from automats import automat
 
-from system import bpio
 from system import tmpfile
 
 from userid import my_id
@@ -76,6 +75,7 @@ from services import driver
 import gateway
 import stats
 import callback
+import memory_inbox
 import packet_out
 
 #------------------------------------------------------------------------------
@@ -331,7 +331,10 @@ class PacketIn(automat.Automat):
         """
         Action method.
         """
-        reactor.callLater(1, tmpfile.throw_out, self.filename, 'received')
+        if memory_inbox.is_memory(self.filename):
+            memory_inbox.erase(self.filename)
+        else:
+            reactor.callLater(1, tmpfile.throw_out, self.filename, 'received')
 
     def doCancelItem(self, arg):
         """
@@ -364,16 +367,17 @@ class PacketIn(automat.Automat):
             # net_misc.ConnectionFailed(None, proto, 'receiveStatusReport %s' % host)
             try:
                 fd, _ = tmpfile.make('error', '.inbox')
-                data = bpio.ReadBinaryFile(self.filename)
+                data = memory_inbox.read(self.filename)
                 os.write(fd, 'from %s:%s %s\n' % (self.proto, self.host, self.status))
                 os.write(fd, str(data))
                 os.close(fd)
             except:
                 lg.exc()
-            try:
-                os.remove(self.filename)
-            except:
-                lg.exc()
+            if not memory_inbox.is_memory(self.filename):
+                try:
+                    os.remove(self.filename)
+                except:
+                    lg.exc()
             self.automat('unserialize-failed', None)
             return
         self.label += '_%s[%s]' % (newpacket.Command, newpacket.PacketID)
@@ -48,6 +48,11 @@ EVENTS:
     * :red:`timer-30sec`
     * :red:`unregister-item`
     * :red:`write-error`
+
+All live packets are indexed by filename, PacketID, remote IDURL, backup ID,
+command and transfer ID, so lookups do not need to scan whole outbox queue.
+Deadlines are kept in a heap and ``timed_out_packets()`` only checks packets
+which deadline already passed.
 """
 
 #------------------------------------------------------------------------------
@@ -59,6 +64,7 @@ _DebugLevel = 12
 
 import os
 import time
+import heapq
 
 #------------------------------------------------------------------------------
 
@@ -87,6 +93,15 @@ import stats
 
 _OutboxQueue = []
 _PacketsCounter = 0
+_Index = {
+    'filename': {},
+    'packet_id': {},
+    'remote_idurl': {},
+    'command': {},
+    'backup_id': {},
+}
+_TransferIDs = {}
+_TimeOuts = []
 
 #------------------------------------------------------------------------------
 
@@ -117,16 +132,105 @@ def create(outpacket, wide, callbacks, target=None, route=None, response_timeout
         lg.out(_DebugLevel, 'packet_out.create  %s' % str(outpacket))
     p = PacketOut(outpacket, wide, callbacks, target, route, response_timeout, keep_alive)
     queue().append(p)
+    register(p)
     p.automat('run')
     return p
 
 #------------------------------------------------------------------------------
 
 
-def search(proto, host, filename, remote_idurl=None):
-    for p in queue():
-        if p.filename != filename:
+def backup_id_prefixes(packet_id):
+    """
+    Return all path prefixes of given PacketID, every backup ID or path
+    which this packet belongs to is one of them.
+    """
+    result = [packet_id, ]
+    pos = packet_id.rfind('/')
+    while pos > 0:
+        result.append(packet_id[:pos])
+        pos = packet_id.rfind('/', 0, pos)
+    return result
+
+
+def index_add(key, value, p):
+    if value is None:
+        return
+    _Index[key].setdefault(value, []).append(p)
+
+
+def index_remove(key, value, p):
+    if value is None:
+        return
+    bucket = _Index[key].get(value)
+    if not bucket:
+        return
+    try:
+        bucket.remove(p)
+    except ValueError:
+        pass
+    if not bucket:
+        _Index[key].pop(value)
+
+
+def index_get(key, value):
+    return _Index[key].get(value, [])
+
+
+def register(p):
+    """
+    Put a new packet_out() object into the indexes.
+    """
+    index_add('packet_id', p.outpacket.PacketID, p)
+    index_add('remote_idurl', p.remote_idurl, p)
+    index_add('command', p.outpacket.Command, p)
+    for backup_id in backup_id_prefixes(p.outpacket.PacketID):
+        index_add('backup_id', backup_id, p)
+
+
+def unregister(p):
+    """
+    Remove packet_out() object from all indexes.
+    """
+    index_remove('packet_id', p.outpacket.PacketID, p)
+    index_remove('remote_idurl', p.remote_idurl, p)
+    index_remove('command', p.outpacket.Command, p)
+    index_remove('filename', p.filename, p)
+    for backup_id in backup_id_prefixes(p.outpacket.PacketID):
+        index_remove('backup_id', backup_id, p)
+    for i in p.items + p.results:
+        if i.transfer_id and _TransferIDs.get(i.transfer_id, (None, None))[0] is p:
+            _TransferIDs.pop(i.transfer_id)
+
+
+def schedule_timeout(p):
+    """
+    Remember when that packet must be checked for time out.
+    """
+    if p.time is None or p.timeout is None:
+        return
+    heapq.heappush(_TimeOuts, (p.time + p.timeout, p.label, p, ))
+
+
+def timed_out_packets():
+    """
+    Return a list of packets which are timed out at the moment.
+    """
+    result = []
+    now = time.time()
+    while _TimeOuts and _TimeOuts[0][0] < now:
+        _, _, p = heapq.heappop(_TimeOuts)
+        if p.outpacket is None:
+            # already destroyed
             continue
+        if p.is_timed_out():
+            result.append(p)
+    return result
+
+#------------------------------------------------------------------------------
+
+
+def search(proto, host, filename, remote_idurl=None):
+    for p in index_get('filename', filename):
         for i in p.items:
             if i.proto == proto:
                 if not remote_idurl:
@@ -147,10 +251,14 @@ def search(proto, host, filename, remote_idurl=None):
 
 
 def search_by_backup_id(backup_id):
-    result = []
-    for p in queue():
-        if p.outpacket.PacketID.count(backup_id):
-            result.append(p)
+    if not backup_id:
+        # empty string matches all packets
+        result = list(queue())
+    elif backup_id in _Index['backup_id']:
+        result = list(index_get('backup_id', backup_id))
+    else:
+        # not a path prefix, for example "<backup ID>/<block number>-" from ``restore``
+        result = [p for p in queue() if p.outpacket.PacketID.count(backup_id)]
     if _Debug:
         lg.out(_DebugLevel, 'packet_out.search_by_backup_id %s:' % backup_id)
         lg.out(_DebugLevel, '%s' % ('        \n'.join(map(str, result))))
@@ -165,7 +273,17 @@ def search_many(proto=None,
                 packet_id=None,
                 ):
     result = []
-    for p in queue():
+    if packet_id:
+        candidates = index_get('packet_id', packet_id)
+    elif filename:
+        candidates = index_get('filename', filename)
+    elif remote_idurl:
+        candidates = index_get('remote_idurl', remote_idurl)
+    elif command:
+        candidates = index_get('command', command)
+    else:
+        candidates = queue()
+    for p in candidates:
         if remote_idurl and p.remote_idurl != remote_idurl:
             continue
         if filename and p.filename != filename:
@@ -188,11 +306,13 @@ def search_many(proto=None,
 
 
 def search_by_transfer_id(transfer_id):
-    for p in queue():
-        for i in p.items:
-            if i.transfer_id and i.transfer_id == transfer_id:
-                return p, i
-    return None, None
+    p, i = _TransferIDs.get(transfer_id, (None, None, ))
+    if p is None:
+        return None, None
+    if p.outpacket is None or i not in p.items or i.transfer_id != transfer_id:
+        _TransferIDs.pop(transfer_id)
+        return None, None
+    return p, i
 
 
 def search_by_response_packet(newpacket, proto=None, host=None):
@@ -206,9 +326,7 @@ def search_by_response_packet(newpacket, proto=None, host=None):
         target_idurl = newpacket.RemoteID
     elif newpacket.OwnerID != newpacket.CreatorID and newpacket.RemoteID == my_id.getLocalID():
         target_idurl = newpacket.RemoteID
-    for p in queue():
-        if p.outpacket.PacketID != newpacket.PacketID:
-            continue
+    for p in index_get('packet_id', newpacket.PacketID):
         if p.outpacket.RemoteID != p.remote_idurl:
             if target_idurl != p.remote_idurl:
                 # ????
@@ -557,7 +675,9 @@ class PacketOut(automat.Automat):
         if self.route:
             a_packet = self.route['packet']
         try:
+            index_remove('filename', self.filename, self)
             fileno, self.filename = tmpfile.make('outbox')
+            index_add('filename', self.filename, self)
             self.packetdata = a_packet.Serialize()
             os.write(fileno, self.packetdata)
             os.close(fileno)
@@ -568,6 +688,7 @@ class PacketOut(automat.Automat):
                 self.timeout = int(self.filesize / float(settings.SendingSpeedLimit()))
             else:
                 self.timeout = 300
+            schedule_timeout(self)
 #             self.timeout = min(
 #                 settings.SendTimeOut() * 3,
 #                 max(int(self.filesize/(settings.SendingSpeedLimit()/len(queue()))),
@@ -604,6 +725,7 @@ class PacketOut(automat.Automat):
         for i in xrange(len(self.items)):
             if self.items[i].proto == proto:  # and self.items[i].host == host:
                 self.items[i].transfer_id = transfer_id
+                _TransferIDs[transfer_id] = (self, self.items[i], )
                 if _Debug:
                     lg.out(_DebugLevel, 'packet_out.doSetTransferID  %r:%r = %r' % (proto, host, transfer_id))
                 ok = True
@@ -729,6 +851,7 @@ class PacketOut(automat.Automat):
             size=len(self.outpacket.Payload),
             remote_id=self.outpacket.RemoteID,
         ))
+        unregister(self)
         if self not in self.outpacket.Packets:
             lg.warn('packet_out not connected to the packet')
         else:
@@ -426,7 +426,7 @@ class ProxyReceiver(automat.Automat):
             return
         try:
             session_key = key.DecryptLocalPrivateKey(block.EncryptedSessionKey)
-            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData)
+            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData, block.SessionKeyType)
             inpt = cStringIO.StringIO(padded_data[:int(block.Length)])
             data = inpt.read()
         except:
@@ -349,7 +349,7 @@ class ProxyRouter(automat.Automat):
             return
         try:
             session_key = key.DecryptLocalPrivateKey(block.EncryptedSessionKey)
-            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData)
+            padded_data = key.DecryptWithSessionKey(session_key, block.EncryptedData, block.SessionKeyType)
             inpt = cStringIO.StringIO(padded_data[:int(block.Length)])
             sender_idurl = inpt.readline().rstrip('\n')
             receiver_idurl = inpt.readline().rstrip('\n')
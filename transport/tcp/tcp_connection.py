@@ -54,6 +54,8 @@ from logs import lg
 
 from automats import automat
 
+from main import settings
+
 #------------------------------------------------------------------------------
 
 MAX_SIMULTANEOUS_CONNECTIONS = 250
@@ -64,6 +66,10 @@ CMD_DATA = 'd'
 CMD_OK = 'o'
 CMD_ABORT = 'a'
 
+# first byte of every string is a software version of the sender,
+# starting from this version peer is able to receive many files at once
+MULTIPLEXED_VERSION = '2'
+
 #------------------------------------------------------------------------------
 
 
@@ -83,6 +89,8 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
         self.total_bytes_sent = 0
         self.outboxQueue = []
         self.last_wazap_received = 0
+        self.peer_software_version = None
+        self.multiplexed = False
 
     def connectionMade(self):
         if _Debug:
@@ -218,6 +226,8 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
         self.peer_address = self.getTransportAddress()
         self.peer_external_address = self.peer_address
         self.connected = time.time()
+        if settings.enableTCPmultiplexing():
+            self.SoftwareVersion = MULTIPLEXED_VERSION
         if self.peer_address not in tcp_node.opened_connections():
             tcp_node.opened_connections()[self.peer_address] = []
         tcp_node.opened_connections()[self.peer_address].append(self)
@@ -259,6 +269,7 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
             tcp_node.opened_connections()[self.peer_address].append(self)
             lg.out(6, '%s : external peer address changed to %s' % (
                 self, self.peer_address))
+        self.multiplexed = self.isMultiplexingSupported()
         # lg.out(18, 'tcp_connection.doReadHello from %s' % (self.peer_idurl))
 
     def doReadWazap(self, arg):
@@ -270,6 +281,7 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
         except:
             return
         self.peer_idurl = payload
+        self.multiplexed = self.isMultiplexingSupported()
         # lg.out(18, 'tcp_connection.doReadWazap from %s' % (self.peer_idurl))
 
     def doReceiveData(self, arg):
@@ -328,7 +340,7 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
         Action method.
         """
         from transport.tcp import tcp_stream
-        self.stream = tcp_stream.TCPFileStream(self)
+        self.stream = tcp_stream.TCPFileStream(self, multiplexed=self.multiplexed)
 
     def doCloseStream(self, arg):
         """
@@ -385,6 +397,17 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
             addr = self.getTransportAddress()
         return addr
 
+    def isMultiplexingSupported(self):
+        """
+        Both sides must be at least of ``MULTIPLEXED_VERSION``, old peers just
+        ignore the version byte so they will keep sending one file at once.
+        """
+        if self.SoftwareVersion < MULTIPLEXED_VERSION:
+            return False
+        if not self.peer_software_version:
+            return False
+        return self.peer_software_version >= MULTIPLEXED_VERSION
+
     def sendData(self, command, payload):
         try:
             data = self.SoftwareVersion + str(command.lower())[0] + payload
@@ -409,6 +432,8 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
                 except:
                     lg.exc()
             return
+        if command in (CMD_HELLO, CMD_WAZAP, ):
+            self.peer_software_version = version
         # print '>>>>>> [%s] %d bytes' % (command, len(payload))
         self.automat('data-received', (command, payload))
 
@@ -420,9 +445,8 @@ class TCPConnection(automat.Automat, basic.Int32StringReceiver):
             return False
         if self.stream is None:
             return False
-        from transport.tcp import tcp_stream
         has_reads = False
-        while len(self.outboxQueue) > 0 and len(self.stream.outboxFiles) < tcp_stream.MAX_SIMULTANEOUS_OUTGOING_FILES:
+        while len(self.outboxQueue) > 0 and len(self.stream.outboxFiles) < self.stream.max_outgoing_files():
             filename, description, result_defer, keep_alive = self.outboxQueue.pop(0)
             has_reads = True
             # we have a queue of files to be sent
@@ -23,7 +23,18 @@
 
 """
 ..module:: tcp_stream
-"""
+
+Files are sent as a sequence of CMD_DATA strings, every string starts with
+a file ID and total file size, receiver puts data into a temp file and
+replies with CMD_OK when all bytes arrived.
+
+Old peers send only one file at once per connection. If both sides support
+multiplexing (see ``tcp_connection.MULTIPLEXED_VERSION``) many files are
+sent at once: ``MultiplexSender`` interleaves chunks of all opened files,
+small files (Ack, Identity, ListFiles, etc.) goes first, bigger files are
+served in round-robin. In that mode headers are in network byte order and
+file size is 64-bit.
+"""
 
 #------------------------------------------------------------------------------
 
@@ -37,6 +48,7 @@ import time
 import cStringIO
 import struct
 import random
+import collections
 
 from twisted.internet import reactor
 from twisted.protocols import basic
@@ -49,16 +61,21 @@ from system import tmpfile
 
 from main import settings
 
+from transport import memory_inbox
+
 from lib import misc
 
 #------------------------------------------------------------------------------
 
 MIN_PROCESS_STREAMS_DELAY = 0.1
 MAX_PROCESS_STREAMS_DELAY = 1
-# TODO: at the moment for TCP - only one file per connection at once
-# need to switch from basic.FileSender to something more advanced
-# consider using Twisted AMP
+# only one file per connection at once for old peers,
+# see MultiplexSender for peers which support multiplexing
 MAX_SIMULTANEOUS_OUTGOING_FILES = 1
+MAX_SIMULTANEOUS_MULTIPLEXED_FILES = 16
+# files up to that size are sent before any bigger file
+SMALL_FILE_SIZE = 64 * 1024
+MULTIPLEXED_CHUNK_SIZE = 16 * 1024
 
 #------------------------------------------------------------------------------
 
@@ -164,9 +181,10 @@ def make_file_id():
     """
     global _LastFileID
     newid = int(str(int(time.time() * 100.0))[4:])
-    if _LastFileID is None:
+    if _LastFileID is None or newid > _LastFileID:
         _LastFileID = newid
-    elif _LastFileID >= newid:
+    else:
+        # many files can be sent at same time, ID must be unique
         _LastFileID += 1
     return _LastFileID
 
@@ -175,18 +193,53 @@ def make_file_id():
 
 class TCPFileStream():
 
-    def __init__(self, connection):
+    def __init__(self, connection, multiplexed=False):
         self.stream_id = make_stream_id()  # not used at the moment, use file_id instead
         self.connection = connection
+        self.multiplexed = multiplexed
+        self.sender = MultiplexSender(self) if multiplexed else None
         self.outboxFiles = {}
         self.inboxFiles = {}
         self.started = time.time()
 
     def close(self):
-        """
         """
+        """
+        if self.sender:
+            self.sender.close()
+            self.sender = None
         self.connection = None
 
+    def max_outgoing_files(self):
+        if self.multiplexed:
+            return MAX_SIMULTANEOUS_MULTIPLEXED_FILES
+        return MAX_SIMULTANEOUS_OUTGOING_FILES
+
+    def pack_file_id(self, file_id):
+        if self.multiplexed:
+            return struct.pack('!I', file_id)
+        return struct.pack('i', file_id)
+
+    def unpack_file_id(self, inp):
+        if self.multiplexed:
+            return struct.unpack('!I', inp.read(4))[0]
+        return struct.unpack('i', inp.read(4))[0]
+
+    def pack_data_header(self, file_id, file_size):
+        if self.multiplexed:
+            return struct.pack('!IQ', file_id, file_size)
+        return struct.pack('i', file_id) + struct.pack('i', file_size)
+
+    def unpack_data_header(self, inp):
+        """
+        Return a tuple (file_id, file_size) from the beginning of CMD_DATA payload.
+        """
+        if self.multiplexed:
+            return struct.unpack('!IQ', inp.read(12))
+        file_id = struct.unpack('i', inp.read(4))[0]
+        file_size = struct.unpack('i', inp.read(4))[0]
+        return file_id, file_size
+
     def abort_files(self, reason='connection closed'):
         from transport.tcp import tcp_connection
         file_ids_to_remove = self.inboxFiles.keys()
@@ -195,9 +248,7 @@ class TCPFileStream():
             self.inbox_file_done(file_id, 'failed', reason)
         file_ids_to_remove = self.outboxFiles.keys()
         for file_id in file_ids_to_remove:
-            self.send_data(
-                tcp_connection.CMD_ABORT, struct.pack(
-                    'i', file_id) + ' ' + reason)
+            self.send_data(tcp_connection.CMD_ABORT, self.pack_file_id(file_id) + ' ' + reason)
             self.outbox_file_done(file_id, 'failed', reason)
 
     def data_received(self, payload):
@@ -206,8 +257,7 @@ class TCPFileStream():
         from transport.tcp import tcp_connection
         inp = cStringIO.StringIO(payload)
         try:
-            file_id = struct.unpack('i', inp.read(4))[0]
-            file_size = struct.unpack('i', inp.read(4))[0]
+            file_id, file_size = self.unpack_data_header(inp)
         except:
             inp.close()
             lg.exc()
@@ -215,7 +265,7 @@ class TCPFileStream():
         inp_data = inp.read()
         inp.close()
         if file_id not in self.inboxFiles:
-            if len(self.inboxFiles) >= 2 * MAX_SIMULTANEOUS_OUTGOING_FILES:
+            if len(self.inboxFiles) >= 2 * self.max_outgoing_files():
                 # too many incoming files, seems remote guy is cheating - drop
                 # that session!
                 lg.warn('too many incoming files, close connection %s' %
@@ -225,13 +275,13 @@ class TCPFileStream():
             self.create_inbox_file(file_id, file_size)
         self.inboxFiles[file_id].input_data(inp_data)
         if self.inboxFiles[file_id].is_done():
-            self.send_data(tcp_connection.CMD_OK, struct.pack('i', file_id))
+            self.send_data(tcp_connection.CMD_OK, self.pack_file_id(file_id))
             self.inbox_file_done(file_id, 'finished')
 
     def ok_received(self, payload):
         inp = cStringIO.StringIO(payload)
         try:
-            file_id = struct.unpack('i', inp.read(4))[0]
+            file_id = self.unpack_file_id(inp)
         except:
             inp.close()
             lg.exc()
@@ -244,7 +294,7 @@ class TCPFileStream():
     def abort_received(self, payload):
         inp = cStringIO.StringIO(payload)
         try:
-            file_id = struct.unpack('i', inp.read(4))[0]
+            file_id = self.unpack_file_id(inp)
         except:
             inp.close()
             lg.exc()
@@ -292,6 +342,7 @@ class TCPFileStream():
     def create_outbox_file(self, filename, filesize, description, result_defer, keep_alive,):
         from transport.tcp import tcp_interface
         file_id = make_file_id()
+        assert file_id not in self.outboxFiles, 'file_id %d is already in use' % file_id
         outfile = OutboxFile(self, filename, file_id, filesize, description, result_defer, keep_alive)
         if keep_alive:
             d = tcp_interface.interface_register_file_sending(
@@ -397,7 +448,13 @@ class InboxFile():
         self.stream = stream
         self.file_id = file_id
         self.size = file_size
-        self.fin, self.filename = tmpfile.make("tcp-in")
+        self.buffer = None
+        self.filename = memory_inbox.accept('tcp-in', self.size)
+        if self.filename:
+            self.fin = None
+            self.buffer = []
+        else:
+            self.fin, self.filename = tmpfile.make("tcp-in")
         self.bytes_received = 0
         self.started = time.time()
         self.last_block_time = time.time()
@@ -410,10 +467,15 @@ class InboxFile():
         if _Debug:
             lg.out(_DebugLevel, '<<<TCP-IN %s CLOSED with %s | %s' % (
                 self.file_id, self.stream.connection.peer_address, self.stream.connection.peer_external_address))
-        try:
-            os.close(self.fin)
-        except:
-            lg.exc()
+        if self.buffer is not None:
+            if not self.is_done() or self.transfer_id is None:
+                memory_inbox.erase(self.filename)
+            self.buffer = None
+        else:
+            try:
+                os.close(self.fin)
+            except:
+                lg.exc()
         self.fin = None
         self.stream = None
 
@@ -421,8 +483,14 @@ class InboxFile():
         return self.bytes_received
 
     def input_data(self, data):
-        os.write(self.fin, data)
+        if self.buffer is not None:
+            self.buffer.append(data)
+        else:
+            os.write(self.fin, data)
         self.bytes_received += len(data)
+        if self.buffer is not None and self.is_done():
+            memory_inbox.put(self.filename, ''.join(self.buffer))
+            self.buffer = []
         self.stream.connection.total_bytes_received += len(data)
         self.last_block_time = time.time()
 
@@ -451,6 +519,7 @@ class OutboxFile():
         self.ok_received = False
         self.bytes_sent = 0
         self.bytes_out = 0
+        self.chunks_sent = 0
         self.started = time.time()
         self.timeout = max(int(self.size / settings.SendingSpeedLimit()), 6)
         self.fout = open(self.filename, 'rb')
@@ -474,6 +543,9 @@ class OutboxFile():
         self.result_defer = None
 
     def start(self):
+        if self.stream.multiplexed:
+            self.stream.sender.add_file(self)
+            return
         self.sender = FileSender(self)
         d = self.sender.beginFileTransfer(
             self.fout,
@@ -483,6 +555,9 @@ class OutboxFile():
         d.addErrback(self.transfer_failed)
 
     def stop(self):
+        if self.stream and self.stream.sender:
+            self.stream.sender.remove_file(self)
+            return
         if not self.sender:
             return
         if not self.sender.deferred:
@@ -504,6 +579,25 @@ class OutboxFile():
     def is_timed_out(self):
         return time.time() - self.started > self.timeout
 
+    def is_sent(self):
+        return self.chunks_sent > 0 and self.bytes_sent >= self.size
+
+    def read_chunk(self, size):
+        """
+        Used by ``MultiplexSender`` to get next piece of CMD_DATA payload,
+        returns None when all bytes were sent.
+        """
+        if self.is_sent():
+            return None
+        data = self.fout.read(size)
+        if not data and self.bytes_sent < self.size:
+            return None
+        # empty file is sent as a single empty chunk
+        self.chunks_sent += 1
+        self.bytes_sent += len(data)
+        self.stream.connection.total_bytes_sent += len(data)
+        return self.stream.pack_data_header(self.file_id, self.size) + data
+
     def transfer_finished(self, last_byte):
         if not self.sender:
             return
@@ -577,3 +671,90 @@ class FileSender(basic.FileSender):
             chunk = self.transform(chunk)
         self.parent.stream.connection.sendData(self.CMD_DATA, chunk)
         self.lastSent = chunk[-1:]
+
+#------------------------------------------------------------------------------
+
+
+class MultiplexSender(object):
+    """
+    Pull producer registered on the connection transport, sends chunks of all
+    outgoing files of the stream. Small files are sent one by one before
+    others, bigger files share the connection in round-robin.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.small_files = collections.deque()
+        self.large_files = collections.deque()
+        self.registered = False
+
+    def close(self):
+        self.unregister()
+        self.small_files.clear()
+        self.large_files.clear()
+        self.stream = None
+
+    def register(self):
+        if self.registered:
+            return
+        try:
+            self.stream.connection.transport.registerProducer(self, False)
+        except:
+            lg.exc()
+            return
+        self.registered = True
+
+    def unregister(self):
+        if not self.registered:
+            return
+        self.registered = False
+        try:
+            self.stream.connection.transport.unregisterProducer()
+        except:
+            lg.exc()
+
+    def add_file(self, outfile):
+        if outfile.size <= SMALL_FILE_SIZE:
+            self.small_files.append(outfile)
+        else:
+            self.large_files.append(outfile)
+        self.register()
+
+    def remove_file(self, outfile):
+        for queue in (self.small_files, self.large_files, ):
+            if outfile in queue:
+                queue.remove(outfile)
+
+    def next_file(self):
+        """
+        Return a file to send next chunk from.
+        """
+        if self.small_files:
+            return self.small_files[0]
+        if self.large_files:
+            self.large_files.rotate(-1)
+            return self.large_files[-1]
+        return None
+
+    def resumeProducing(self):
+        from transport.tcp import tcp_connection
+        outfile = self.next_file()
+        if outfile is None:
+            self.unregister()
+            return
+        chunk = outfile.read_chunk(MULTIPLEXED_CHUNK_SIZE)
+        if chunk is not None:
+            self.stream.connection.sendData(tcp_connection.CMD_DATA, chunk)
+        if chunk is None or outfile.is_sent():
+            self.remove_file(outfile)
+        if chunk is None and not outfile.is_sent():
+            # file was changed while we were sending it, CMD_OK will never come
+            self.stream.outbox_file_done(outfile.file_id, 'failed', 'file size changed')
+
+    def pauseProducing(self):
+        pass
+
+    def stopProducing(self):
+        self.registered = False
+        self.small_files.clear()
+        self.large_files.clear()
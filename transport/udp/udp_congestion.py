@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+# udp_congestion.py
+#
+# Copyright (C) 2008-2018 Veselin Penev, https://bitdust.io
+#
+# This file (udp_congestion.py) is part of BitDust Software.
+#
+# BitDust is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BitDust Software is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with BitDust Software.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Please contact us if you have any questions at bitdust.io@gmail.com
+
+"""
+.. module:: udp_congestion.
+
+Congestion control and path MTU probing for the "adaptive" profile of
+``udp_stream``, both peers must agree to use it during GREETING,
+see ``udp_session``.
+
+``CongestionWindow`` keeps number of blocks which can be "in flight"
+(sent but not acked yet):
+
+    + starts with ``INITIAL_WINDOW`` blocks and doubles every RTT (slow-start)
+    + slow-start ends when RTT grows because of queues on the path
+    + after that window grows by one block per RTT
+    + window is reduced by ``LOSS_BACKOFF`` once per RTT if blocks were lost
+      and by ``DELAY_BACKOFF`` if queuing delay is too big
+    + after retransmission timeout window goes back to ``MIN_WINDOW``
+
+Blocks are not sent in bursts: ``pacing_interval()`` spreads the window over RTT.
+
+``MTUProbe`` tries to send bigger datagrams, the biggest size confirmed
+by remote peer is used for the next blocks of that session.
+"""
+
+#------------------------------------------------------------------------------
+
+PROFILE = 'cc1'  # sent in GREETING to remote peer if "adaptive" profile is enabled
+
+INITIAL_WINDOW = 10  # blocks
+MIN_WINDOW = 2
+MAX_WINDOW = 4096
+
+LOSS_BACKOFF = 0.7  # window reduction factor after a loss
+DELAY_BACKOFF = 0.9  # window reduction factor when queues are growing
+DELAY_THRESHOLD = 0.5  # queuing delay allowed, relative to min RTT
+MIN_QUEUING_DELAY = 0.025  # seconds, do not react on a smaller jitter
+
+RTO_MIN = 0.2
+RTO_MAX = 3.0
+RTT_GAIN = 0.125
+RTT_VAR_GAIN = 0.25
+MIN_RTT_LIFETIME = 30.0  # forget min RTT after that time, path can change
+
+PACING_GAIN_SLOW_START = 2.0
+PACING_GAIN = 1.25
+PACING_QUANTUM = 0.002  # seconds, blocks scheduled within that time are sent at once
+
+DATAGRAM_SIZES = (508, 1200, 1472, )  # 1472 = 1500 Ethernet MTU - IP and UDP headers
+PROBE_ATTEMPTS = 3
+PROBE_TIMEOUT_MIN = 1.0
+PROBE_RETRY_INTERVAL = 600.0  # try failed size again after 10 minutes
+
+#------------------------------------------------------------------------------
+
+
+class CongestionWindow(object):
+    """
+    Window and RTT estimation for a single stream, all times are in seconds
+    and counted by the caller.
+    """
+
+    def __init__(self, initial_rtt=None):
+        self.window = float(INITIAL_WINDOW)
+        self.threshold = float(MAX_WINDOW)
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None
+        self.min_rtt_time = 0
+        self.rto = RTO_MAX
+        self.last_reduction_time = None
+        self.losses = 0
+        self.timeouts = 0
+        self.measured = False
+        if initial_rtt:
+            # only a guess from the session, replaced by the first measurement
+            self.srtt = initial_rtt
+            self.rttvar = initial_rtt / 2.0
+            self.rto = self._calculate_rto()
+
+    def __repr__(self):
+        return 'CongestionWindow(window=%r threshold=%r srtt=%r min_rtt=%r rto=%r)' % (
+            round(self.window, 2), round(self.threshold, 2), self.srtt, self.min_rtt, round(self.rto, 3))
+
+    def size(self):
+        return max(MIN_WINDOW, int(self.window))
+
+    def in_slow_start(self):
+        return self.window < self.threshold
+
+    def rtt(self):
+        if self.srtt is None:
+            return RTO_MAX / 2.0
+        return self.srtt
+
+    def _calculate_rto(self):
+        return min(RTO_MAX, max(RTO_MIN, self.srtt + 4.0 * self.rttvar))
+
+    def _reduction_allowed(self, now):
+        """
+        Window is reduced not more than once per RTT.
+        """
+        if self.last_reduction_time is None:
+            return True
+        return now - self.last_reduction_time > self.rtt()
+
+    def on_rtt_sample(self, rtt, now):
+        """
+        Update smoothed RTT with a new measurement, see RFC 6298.
+        """
+        if rtt <= 0:
+            return
+        if not self.measured:
+            self.measured = True
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = (1.0 - RTT_VAR_GAIN) * self.rttvar + RTT_VAR_GAIN * abs(self.srtt - rtt)
+            self.srtt = (1.0 - RTT_GAIN) * self.srtt + RTT_GAIN * rtt
+        if self.min_rtt is None or rtt < self.min_rtt or now - self.min_rtt_time > MIN_RTT_LIFETIME:
+            self.min_rtt = rtt
+            self.min_rtt_time = now
+        self.rto = self._calculate_rto()
+
+    def queuing_delay(self):
+        if self.srtt is None or self.min_rtt is None:
+            return 0.0
+        return self.srtt - self.min_rtt
+
+    def is_delay_growing(self):
+        if self.min_rtt is None:
+            return False
+        return self.queuing_delay() > max(MIN_QUEUING_DELAY, self.min_rtt * DELAY_THRESHOLD)
+
+    def on_ack(self, acked_blocks, now):
+        """
+        Some blocks were delivered, grow the window.
+        """
+        if acked_blocks <= 0:
+            return
+        self.timeouts = 0
+        if self.is_delay_growing():
+            if self.in_slow_start():
+                # queue starts to build up, leave slow-start before any loss
+                self.threshold = self.window
+            elif self._reduction_allowed(now):
+                self.window = max(float(MIN_WINDOW), self.window * DELAY_BACKOFF)
+                self.threshold = self.window
+                self.last_reduction_time = now
+            return
+        if self.in_slow_start():
+            self.window = min(self.window + acked_blocks, float(MAX_WINDOW))
+        else:
+            self.window = min(self.window + float(acked_blocks) / self.window, float(MAX_WINDOW))
+
+    def on_loss(self, now):
+        """
+        Block was lost, but next blocks are delivered.
+        """
+        self.losses += 1
+        if not self._reduction_allowed(now):
+            return False
+        self.window = max(float(MIN_WINDOW), self.window * LOSS_BACKOFF)
+        self.threshold = self.window
+        self.last_reduction_time = now
+        return True
+
+    def on_timeout(self, now):
+        """
+        Nothing was acked during RTO, start again from the minimal window.
+        """
+        self.timeouts += 1
+        self.threshold = max(float(MIN_WINDOW), self.window / 2.0)
+        self.window = float(MIN_WINDOW)
+        self.rto = min(RTO_MAX, self.rto * 2.0)
+        self.last_reduction_time = now
+
+    def pacing_interval(self):
+        """
+        Time between two blocks to spread the whole window over one RTT.
+        """
+        if self.srtt is None:
+            return 0.0
+        gain = PACING_GAIN_SLOW_START if self.in_slow_start() else PACING_GAIN
+        return self.srtt / (self.window * gain)
+
+#------------------------------------------------------------------------------
+
+
+class MTUProbe(object):
+    """
+    Path MTU discovery for a session: bigger datagram is sent with padding and
+    its size is used only if remote peer confirmed it.
+    """
+
+    def __init__(self):
+        self.datagram_size = DATAGRAM_SIZES[0]
+        self.probe_size = None
+        self.probe_time = None
+        self.attempts = {}
+        self.failed = {}
+
+    def next_size(self, now):
+        """
+        Return next datagram size to try or None.
+        """
+        for size in DATAGRAM_SIZES:
+            if size <= self.datagram_size:
+                continue
+            failed_time = self.failed.get(size)
+            if failed_time is not None and now - failed_time < PROBE_RETRY_INTERVAL:
+                return None
+            return size
+        return None
+
+    def start(self, now):
+        """
+        Return a size of probe datagram to be sent now or None.
+        """
+        if self.probe_size is not None:
+            return None
+        size = self.next_size(now)
+        if size is None:
+            return None
+        self.probe_size = size
+        self.probe_time = now
+        self.attempts[size] = self.attempts.get(size, 0) + 1
+        return size
+
+    def check_timeout(self, now, rtt):
+        """
+        Forget about the probe if remote peer did not confirm it in time.
+        """
+        if self.probe_size is None:
+            return False
+        if now - self.probe_time < max(PROBE_TIMEOUT_MIN, 3.0 * rtt):
+            return False
+        if self.attempts.get(self.probe_size, 0) >= PROBE_ATTEMPTS:
+            self.failed[self.probe_size] = now
+            self.attempts.pop(self.probe_size)
+        self.probe_size = None
+        self.probe_time = None
+        return True
+
+    def confirmed(self, size):
+        """
+        Remote peer received a probe of that size.
+        """
+        if size > self.datagram_size and size in DATAGRAM_SIZES:
+            self.datagram_size = size
+        if size == self.probe_size:
+            self.probe_size = None
+            self.probe_time = None
+        self.attempts.pop(size, None)
+        self.failed.pop(size, None)
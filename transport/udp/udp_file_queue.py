@@ -37,6 +37,7 @@ from logs import lg
 from lib import udp
 from system import tmpfile
 from contacts import contactsdb
+from transport import memory_inbox
 
 #------------------------------------------------------------------------------
 
@@ -459,7 +460,13 @@ class InboxFile():
         self.queue = queue
         self.stream_callback = None
         self.stream_id = stream_id
-        self.fd, self.filename = tmpfile.make("udp-in")
+        self.buffer = None
+        self.filename = memory_inbox.accept('udp-in', size)
+        if self.filename:
+            self.fd = None
+            self.buffer = []
+        else:
+            self.fd, self.filename = tmpfile.make("udp-in")
         self.size = size
         self.bytes_received = 0
         self.started = time.time()
@@ -497,10 +504,22 @@ class InboxFile():
         self.stream_callback = None
 
     def close_file(self):
+        if self.buffer is not None:
+            if not self.is_done() or self.transfer_id is None:
+                memory_inbox.erase(self.filename)
+            self.buffer = None
+            return
         os.close(self.fd)
         self.fd = None
 
     def process(self, newdata):
+        if self.buffer is not None:
+            self.buffer.append(newdata)
+            self.bytes_received += len(newdata)
+            if self.is_done():
+                memory_inbox.put(self.filename, ''.join(self.buffer))
+                self.buffer = []
+            return
         os.write(self.fd, newdata)
         self.bytes_received += len(newdata)
 
@@ -536,6 +555,7 @@ class OutboxFile():
         self.bytes_sent = 0
         self.bytes_delivered = 0
         self.buffer = ''
+        self.chunk_size = 0
         self.eof = False
         self.cancelled = False
         self.timeout = False
@@ -607,7 +627,7 @@ class OutboxFile():
             if not self.buffer:
                 if not self.fileobj:
                     return False
-                self.buffer = self.fileobj.read(udp_stream.CHUNK_SIZE)
+                self.buffer = self.fileobj.read(self.chunk_size or udp_stream.CHUNK_SIZE)
                 if not self.buffer:
                     if _Debug:
                         lg.out(18, 'udp_file_queue.OutboxFile.process reach EOF state %d' % self.stream_id)
@@ -57,6 +57,10 @@ from lib import misc
 from automats import automat
 from lib import udp
 
+from main import settings
+
+from transport.udp import udp_congestion
+
 #------------------------------------------------------------------------------
 
 MIN_PROCESS_SESSIONS_DELAY = 0.001
@@ -285,6 +289,9 @@ class UDPSession(automat.Automat):
         self.peer_rtt_id = '0'  # in
         self.rtts = {}
         self.min_rtt = None
+        self.srtt = None
+        self.congestion_control = False
+        self.mtu = udp_congestion.MTUProbe()
 
     def send_packet(self, command, payload):
         self.bytes_sent += len(payload)
@@ -445,6 +452,9 @@ class UDPSession(automat.Automat):
         payload = "%s %s %s %s" % (
             str(self.node.my_id), str(self.node.my_idurl),
             str(self.peer_rtt_id), str(self.my_rtt_id),)
+        if settings.enableUDPcongestionControl():
+            # old peers just ignore that
+            payload += ' ' + udp_congestion.PROFILE
         udp.send_command(
             self.node.listen_port,
             udp.CMD_GREETING,
@@ -491,9 +501,11 @@ class UDPSession(automat.Automat):
                 self.my_rtt_id = parts[2]
             else:
                 self.my_rtt_id = '0'
+            peer_profile = parts[4] if len(parts) >= 5 else None
         except:
             lg.exc()
             return
+        self.congestion_control = (peer_profile == udp_congestion.PROFILE and settings.enableUDPcongestionControl())
         # print 'doAcceptGreeting', self.peer_rtt_id, self.my_rtt_id
         # self._rtt_finish(rtt_id_in)
         # rtt_id_out = self._rtt_start('ALIVE')
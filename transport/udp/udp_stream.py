@@ -74,7 +74,24 @@ Datagrams format:
           14-17    block_id3
           ...
 
+    Negative block_id in ACK is a marker followed by some values:
 
+          -1, pause time (float), receiving limit (float)
+          -2, size of received probe datagram            : "adaptive" only
+          -3, all blocks up to that block_id were received : "adaptive" only
+          -4, first block_id, last block_id of received range : "adaptive" only
+
+
+Two profiles are supported, both peers agree about that during GREETING:
+
+    "legacy" : fixed 508 bytes datagrams, blocks are sent in groups
+               by ``BLOCKS_PER_ACK`` from the global ``process_streams()`` loop
+
+    "adaptive" : every stream has own congestion window and paces blocks
+                 over RTT, sending is driven by ACKs and timers,
+                 bigger datagrams are used if path allows,
+                 DATA packet with block_id -2 is a padded MTU probe,
+                 see ``udp_congestion`` module
 """
 
 #------------------------------------------------------------------------------
@@ -88,6 +105,7 @@ import time
 import cStringIO
 import struct
 import bisect
+import collections
 
 from twisted.internet import reactor
 
@@ -95,6 +113,8 @@ from logs import lg
 
 from automats import automat
 
+from transport.udp import udp_congestion
+
 #------------------------------------------------------------------------------
 
 POOLING_INTERVAL = 0.1   # smaller pooling size will increase CPU load
@@ -125,6 +145,21 @@ SENDING_LIMIT_FACTOR_ON_START = 1.0  # idea was to decrease sending speed with f
 RECEIVING_TIMEOUT = RTT_MAX_LIMIT * (MAX_ACK_TIMEOUTS + 1)
 SENDING_TIMEOUT = RTT_MAX_LIMIT * (MAX_ACK_TIMEOUTS + 1)
 
+# "adaptive" profile
+HEADER_SIZE = UDP_DATAGRAM_SIZE - BLOCK_SIZE
+ACK_EVERY_BLOCKS = 2  # like "delayed ACK" in TCP
+DELAYED_ACK_TIMEOUT = 0.02  # send ACK for a single block after that time
+MAX_ACK_RANGES = 32  # to fit into smallest datagram
+PROBE_AFTER_ACKS = 10  # start MTU probing when stream is working for a while
+OUTPUT_BURST_INTERVAL = POOLING_INTERVAL  # global limit allows such bursts
+
+BLOCK_ID_EMPTY = -1
+BLOCK_ID_PROBE = -2
+ACK_PAUSE = -1
+ACK_PROBE = -2
+ACK_CUMULATIVE = -3
+ACK_RANGE = -4
+
 #------------------------------------------------------------------------------
 
 _Streams = {}
@@ -134,6 +169,8 @@ _ProcessStreamsIterations = 0
 _GlobalLimitReceiveBytesPerSec = 1000.0 * 125000  # default receiveing limit bps
 _GlobalLimitSendBytesPerSec = 1000.0 * 125000  # default sending limit bps
 _CurrentSendingAvarageRate = 0.0
+_OutputBudget = 0.0
+_OutputBudgetTime = 0.0
 
 #------------------------------------------------------------------------------
 
@@ -193,6 +230,43 @@ def set_global_output_limit_bytes_per_sec(bps):
 
 #------------------------------------------------------------------------------
 
+def take_output_budget(nbytes):
+    """
+    Global sending limit for "adaptive" streams: all of them share same
+    bandwidth, so a single fast stream can use all of it.
+    Return 0 if ``nbytes`` can be sent now or number of seconds to wait.
+    """
+    global _OutputBudget
+    global _OutputBudgetTime
+    limit = float(get_global_output_limit_bytes_per_sec())
+    if limit <= 0:
+        return 0
+    now = time.time()
+    _OutputBudget = min(
+        limit * OUTPUT_BURST_INTERVAL,
+        _OutputBudget + max(0.0, now - _OutputBudgetTime) * limit)
+    _OutputBudgetTime = now
+    if _OutputBudget >= nbytes:
+        _OutputBudget -= nbytes
+        return 0
+    return (nbytes - _OutputBudget) / limit
+
+
+def make_ranges(block_ids):
+    """
+    Convert sorted list of block IDs into a list of (first, last) tuples.
+    """
+    ranges = []
+    for block_id in block_ids:
+        if ranges and block_id <= ranges[-1][1] + 1:
+            if block_id > ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], block_id, )
+            continue
+        ranges.append((block_id, block_id, ))
+    return ranges
+
+#------------------------------------------------------------------------------
+
 def balance_streams_limits():
     global _CurrentSendingAvarageRate
     receive_limit_per_stream = float(get_global_input_limit_bytes_per_sec())
@@ -232,6 +306,9 @@ def process_streams():
     for s in sorted(streams().values(), key=lambda s: s.output_blocks_last_delta):
         if s.state != 'SENDING':
             continue
+        if s.adaptive:
+            # driven by ACKs and own timer
+            continue
         s.event('iterate')
         if s.get_output_limit_from_remote() > 0:
             continue
@@ -346,6 +423,18 @@ class UDPStream(automat.Automat):
         self.input_limit_iteration_last_time = 0
         self.last_progress_report = 0
         self.eof = False
+        self.adaptive = False
+        self.cwnd = None
+        self.block_size = BLOCK_SIZE
+        self.output_in_flight = 0
+        self.output_unsent = collections.deque()
+        self.output_lost = collections.deque()
+        self.output_sent_order = collections.deque()
+        self.output_rack_time = -1
+        self.output_next_send_time = 0
+        self.output_timer = None
+        self.input_ack_timer = None
+        self.input_probe_size = 0
 
     def A(self, event, arg):
         newstate = self.state
@@ -482,6 +571,13 @@ class UDPStream(automat.Automat):
             self.output_rtt_avarage = self.producer.session.min_rtt
         else:
             self.output_rtt_avarage = (RTT_MIN_LIMIT + RTT_MAX_LIMIT) / 2.0
+        self.adaptive = self.producer.session.congestion_control
+        if self.adaptive:
+            initial_rtt = self.producer.session.srtt
+            if not initial_rtt and self.producer.session.min_rtt < RTT_MAX_LIMIT:
+                initial_rtt = self.producer.session.min_rtt
+            self.cwnd = udp_congestion.CongestionWindow(initial_rtt)
+            self._update_block_size()
         if _Debug:
             lg.out(self.debug_level, 'udp_stream.doInit %d with %s limits: (in=%r|out=%r)  rtt=%r' % (
                 self.stream_id,
@@ -626,11 +722,19 @@ class UDPStream(automat.Automat):
                 int(ratein), int(rateout),
             ))
             lg.out(self.debug_level, '    ACK REASONS: %r' % self.output_acks_reasons)
+            if self.adaptive:
+                lg.out(self.debug_level, '    %r losses:%d' % (self.cwnd, self.cwnd.losses))
             del pir_id
+        self._cancel_timers()
+        if self.adaptive and self.cwnd.srtt:
+            self.producer.session.srtt = self.cwnd.srtt
         self.input_blocks.clear()
         self.input_blocks_to_ack = []
         self.output_blocks.clear()
         self.output_blocks_ids = []
+        self.output_unsent.clear()
+        self.output_lost.clear()
+        self.output_sent_order.clear()
 
     def doUpdateLimits(self, arg):
         """
@@ -651,6 +755,7 @@ class UDPStream(automat.Automat):
         Action method.
         Remove all references to the state machine object to destroy it.
         """
+        self._cancel_timers()
         self.consumer.clear_stream_callback()
         self.producer.on_close_consumer(self.consumer)
         self.consumer = None
@@ -674,9 +779,15 @@ class UDPStream(automat.Automat):
             return
             #--- read block data
         data = inpt.read()
+        if block_id == BLOCK_ID_PROBE:
+            #--- MTU probe received, confirm its size
+            if self.adaptive:
+                self.input_probe_size = len(data) + HEADER_SIZE
+                self._send_ack(self.input_blocks_to_ack, why=7)
+            return
         self.input_block_last_time = time.time() - self.creation_time
         self.input_blocks_counter += 1
-        if block_id != -1:
+        if block_id != BLOCK_ID_EMPTY:
             #--- not empty block received
             self.input_bytes_received += len(data)
             self.input_block_id_last = block_id
@@ -743,6 +854,9 @@ class UDPStream(automat.Automat):
         eof = False
         eof_flag = None
         acks = []
+        ranges = []
+        cumulative_ack = 0
+        probe_size = 0
         pause_time = 0.0
         remote_side_limit_receiving = -1
         self.input_ack_last_time = time.time() - self.creation_time
@@ -772,9 +886,30 @@ class UDPStream(automat.Automat):
                         lg.warn('wrong ack: not found remote bandwith limit')
                         break
                     remote_side_limit_receiving = struct.unpack('f', raw_bytes)[0]
+                elif block_id == ACK_PROBE:
+            #--- read size of received MTU probe
+                    raw_bytes = inpt.read(4)
+                    if len(raw_bytes) != 4:
+                        lg.warn('wrong ack: not found probe size')
+                        break
+                    probe_size = struct.unpack('i', raw_bytes)[0]
+                elif block_id == ACK_CUMULATIVE:
+            #--- read last block id received in order
+                    raw_bytes = inpt.read(4)
+                    if len(raw_bytes) != 4:
+                        lg.warn('wrong ack: not found cumulative block id')
+                        break
+                    cumulative_ack = struct.unpack('i', raw_bytes)[0]
+                elif block_id == ACK_RANGE:
+            #--- read range of received blocks
+                    raw_bytes = inpt.read(8)
+                    if len(raw_bytes) != 8:
+                        lg.warn('wrong ack: not found blocks range')
+                        break
+                    ranges.append(struct.unpack('ii', raw_bytes))
                 else:
                     lg.warn('incorrect block_id received: %r' % block_id)
-        if len(acks) > 0:
+        if len(acks) > 0 or len(ranges) > 0 or cumulative_ack > self.output_acked_block_id_current:
             #--- some blocks was received fine
             self.input_acks_counter += 1
         if pause_time == 0.0 and eof_flag:
@@ -788,6 +923,10 @@ class UDPStream(automat.Automat):
                     sz = -1
                 lg.out(self.debug_level, '    EOF state found in ACK %d acked:%d not acked:%d total:%d' % (
                     self.stream_id, self.output_bytes_acked, sum_not_acked_blocks, sz))
+        if self.adaptive:
+            #--- mark blocks as acked and update congestion window
+            eof = self._on_acks_adaptive(acks, ranges, cumulative_ack, probe_size)
+            acks = []
         for block_id in acks:
             #--- mark this block as acked
             if block_id >= self.output_acked_block_id_current:
@@ -823,7 +962,7 @@ class UDPStream(automat.Automat):
         for block_id in self.output_blocks_ids:
             #--- mark blocks was not acked at this time
             self.output_blocks[block_id][2] += 1
-        while True:
+        while not self.adaptive:
             next_block_id = self.output_acked_block_id_current + 1
             try:
                 self.output_acked_blocks_ids.remove(next_block_id)
@@ -860,9 +999,9 @@ class UDPStream(automat.Automat):
 
     def on_consume(self, data):
         if self.consumer:
-            if self.output_buffer_size + len(data) > OUTPUT_BUFFER_SIZE:
+            if self.output_buffer_size + len(data) > self._output_buffer_limit():
                 raise BufferOverflow(self.output_buffer_size)
-            if self.output_quality_counter > BLOCKS_PER_ACK * WINDOW_SIZE:
+            if not self.adaptive and self.output_quality_counter > BLOCKS_PER_ACK * WINDOW_SIZE:
                 error_rate = float(self.output_blocks_errors_counter) / (self.output_quality_counter)
                 if error_rate > ACCEPTABLE_ERRORS_RATE:
                     current_window = self.output_block_id_current - self.output_acked_block_id_current
@@ -880,12 +1019,15 @@ class UDPStream(automat.Automat):
     def _push_blocks(self, data):
         outp = cStringIO.StringIO(data)
         while True:
-            piece = outp.read(BLOCK_SIZE)
+            piece = outp.read(self.block_size)
             if not piece:
                 break
             self.output_block_id_current += 1
             #--- prepare block to be send
-            bisect.insort(self.output_blocks_ids, self.output_block_id_current)
+            if self.adaptive:
+                self.output_unsent.append(self.output_block_id_current)
+            else:
+                bisect.insort(self.output_blocks_ids, self.output_block_id_current)
             # data, time_sent, acks missed, number of attempts
             self.output_blocks[self.output_block_id_current] = [piece, -1, 0, 0]
             self.output_buffer_size += len(piece)
@@ -972,6 +1114,9 @@ class UDPStream(automat.Automat):
                 self.output_iterations_results[result] += 1
 
     def _resend_blocks(self):
+        if self.adaptive:
+            self._send_window()
+            return
         if len(self.output_blocks) == 0:
             #--- nothing to send right now
             return
@@ -1252,10 +1397,14 @@ class UDPStream(automat.Automat):
                     relative_time, self.eof, len(self.input_blocks_to_ack),))
             reactor.callLater(0, self.automat, 'timeout')
             return
-        if len(self.input_blocks_to_ack) >= BLOCKS_PER_ACK:
+        if len(self.input_blocks_to_ack) >= (ACK_EVERY_BLOCKS if self.adaptive else BLOCKS_PER_ACK):
             #--- received enough blocks to make a group, send ACK
             self._send_ack(self.input_blocks_to_ack, pause_time, why=1)
             return
+        if self.adaptive and self.input_blocks and self.input_blocks_to_ack:
+            #--- some blocks are missing, let sender know immediately
+            self._send_ack(self.input_blocks_to_ack, pause_time, why=2)
+            return
         if self.eof:
             #--- at EOF state, send ACK
             self._send_ack(self.input_blocks_to_ack, pause_time, why=3)
@@ -1264,6 +1413,10 @@ class UDPStream(automat.Automat):
             #--- last ack has been long time ago, send ACK
             self._send_ack(self.input_blocks_to_ack, pause_time, why=4)
             return
+        if self.adaptive and len(self.input_blocks_to_ack) > 0:
+            #--- do not wait for the next block too long
+            if not self.input_ack_timer or not self.input_ack_timer.active():
+                self.input_ack_timer = reactor.callLater(DELAYED_ACK_TIMEOUT, self._on_delayed_ack)
         if _Debug and lg.is_debug(self.debug_level):
             why = 6
             if why not in self.output_acks_reasons:
@@ -1277,16 +1430,26 @@ class UDPStream(automat.Automat):
                 self.output_acks_reasons[why] = 1
             else:
                 self.output_acks_reasons[why] += 1
-        if len(acks) == 0 and pause_time == 0.0 and not self.eof:
-        #--- SKIP: no pending ACKS, no PAUSE, no EOF
+        if len(acks) == 0 and pause_time == 0.0 and not self.eof and not self.input_probe_size:
+        #--- SKIP: no pending ACKS, no PAUSE, no EOF, no MTU probe
             return
         #--- prepare EOF state in ACK
         ack_data = struct.pack('?', self.eof)
+        if self.adaptive:
+        #--- prepare cumulative ACK and ranges of blocks received out of order
+            ack_data += struct.pack('ii', ACK_CUMULATIVE, self.input_block_id_current)
+            ranges = [r for r in make_ranges(acks) if r[1] > self.input_block_id_current]
+            for first, last in ranges[-MAX_ACK_RANGES:]:
+                ack_data += struct.pack('iii', ACK_RANGE, first, last)
+            if self.input_probe_size:
+                ack_data += struct.pack('ii', ACK_PROBE, self.input_probe_size)
+                self.input_probe_size = 0
+        else:
         #--- prepare ACKS
-        ack_data += ''.join(map(lambda bid: struct.pack('i', bid), acks))
+            ack_data += ''.join(map(lambda bid: struct.pack('i', bid), acks))
         if pause_time > 0:
         #--- add extra "PAUSE REQUIRED" ACK
-            ack_data += struct.pack('i', -1)
+            ack_data += struct.pack('i', ACK_PAUSE)
             ack_data += struct.pack('f', pause_time)
             ack_data += struct.pack('f', self.input_limit_bytes_per_sec)
         ack_len = len(ack_data)
@@ -1294,6 +1457,10 @@ class UDPStream(automat.Automat):
         self.output_acks_counter += 1
         self.input_blocks_to_ack = []
         self.output_ack_last_time = time.time()
+        if self.input_ack_timer:
+            if self.input_ack_timer.active():
+                self.input_ack_timer.cancel()
+            self.input_ack_timer = None
         if _Debug:
             if pause_time <= 0.0:
                 lg.out(self.debug_level + 8, '<-out ACK %d %r %r %d/%d' % (
@@ -1306,6 +1473,216 @@ class UDPStream(automat.Automat):
         self.producer.do_send_ack(self.stream_id, self.consumer, ack_data)
         return ack_len > 0
 
+    def _update_block_size(self):
+        self.block_size = self.producer.session.mtu.datagram_size - HEADER_SIZE
+        if getattr(self.consumer, 'chunk_size', None) is not None:
+            self.consumer.chunk_size = self.block_size * BLOCKS_PER_ACK
+
+    def _output_buffer_limit(self):
+        if not self.adaptive:
+            return OUTPUT_BUFFER_SIZE
+        return max(OUTPUT_BUFFER_SIZE, 2 * self.cwnd.size() * self.block_size)
+
+    def _cancel_timers(self):
+        for timer in (self.output_timer, self.input_ack_timer, ):
+            if timer and timer.active():
+                timer.cancel()
+        self.output_timer = None
+        self.input_ack_timer = None
+
+    def _on_delayed_ack(self):
+        self.input_ack_timer = None
+        if self.state != 'RECEIVING' or not self.input_blocks_to_ack:
+            return
+        self._send_ack(self.input_blocks_to_ack, why=5)
+
+    def _on_output_timer(self):
+        self.output_timer = None
+        if self.state == 'SENDING':
+            self.automat('iterate')
+
+    def _schedule_output_timer(self, delay):
+        if self.output_timer and self.output_timer.active():
+            if self.output_timer.getTime() <= time.time() + delay:
+                return
+            self.output_timer.cancel()
+        self.output_timer = reactor.callLater(max(0.0, delay), self._on_output_timer)
+
+    def _on_acks_adaptive(self, acks, ranges, cumulative_ack, probe_size):
+        """
+        Process ACK in "adaptive" profile, return EOF state.
+        """
+        relative_time = time.time() - self.creation_time
+        eof = False
+        acked = 0
+        first_not_acked = self.output_acked_block_id_current + 1
+        block_ids = list(acks)
+        if cumulative_ack >= first_not_acked:
+            block_ids.extend(xrange(first_not_acked, min(cumulative_ack, self.output_block_id_current) + 1))
+        for first, last in ranges:
+            block_ids.extend(xrange(max(first, first_not_acked), min(last, self.output_block_id_current) + 1))
+        for block_id in block_ids:
+            outblock = self.output_blocks.pop(block_id, None)
+            if outblock is None:
+            #--- was acked already
+                continue
+            time_sent = outblock[1]
+            if time_sent >= 0:
+                self.output_in_flight -= 1
+                self.output_rack_time = max(self.output_rack_time, time_sent)
+                if outblock[3] == 1:
+            #--- measure RTT only for blocks sent once
+                    self.cwnd.on_rtt_sample(relative_time - time_sent, relative_time)
+            block_size = len(outblock[0])
+            self.output_bytes_acked += block_size
+            self.output_buffer_size -= block_size
+            self.output_blocks_success_counter += 1.0
+            self.output_quality_counter += 1.0
+            acked += 1
+            #--- process delivered data
+            eof = self.consumer.on_sent_raw_data(block_size)
+            if not self.consumer:
+                return eof
+        while self.output_acked_block_id_current < self.output_block_id_current:
+            if self.output_acked_block_id_current + 1 in self.output_blocks:
+                break
+            self.output_acked_block_id_current += 1
+            self.output_blocks_acked += 1
+        self.cwnd.on_ack(acked, relative_time)
+        if probe_size > 0:
+            #--- remote peer received bigger datagram, use it for next blocks
+            self.producer.session.mtu.confirmed(probe_size)
+            self._update_block_size()
+        return eof
+
+    def _detect_losses(self, relative_time):
+        """
+        Block is lost if a block sent later was already acked or if it was
+        not acked during RTO.
+        """
+        reordering_window = self.cwnd.rtt() / 4.0
+        lost = 0
+        timed_out = 0
+        while self.output_sent_order:
+            time_sent, block_id = self.output_sent_order[0]
+            outblock = self.output_blocks.get(block_id)
+            if outblock is None or outblock[1] != time_sent:
+            #--- acked or sent again after that
+                self.output_sent_order.popleft()
+                continue
+            if time_sent + reordering_window < self.output_rack_time:
+                lost += 1
+            elif relative_time - time_sent > self.cwnd.rto:
+                timed_out += 1
+            else:
+                break
+            self.output_sent_order.popleft()
+            outblock[1] = -1
+            self.output_in_flight -= 1
+            self.output_lost.append(block_id)
+            self.output_blocks_errors_counter += 1
+            self.output_quality_counter += 1.0
+            self.output_error_last_time = relative_time
+        if timed_out:
+            self.cwnd.on_timeout(relative_time)
+        elif lost:
+            self.cwnd.on_loss(relative_time)
+
+    def _send_window(self):
+        """
+        Send lost and new blocks while congestion window is not full,
+        blocks are paced over RTT.
+        """
+        relative_time = time.time() - self.creation_time
+        if self.state == 'SENDING' and (self.output_in_flight > 0 or self.output_lost):
+            sending_was_limited = relative_time - self.output_limit_iteration_last_time < SENDING_TIMEOUT
+            if not sending_was_limited and relative_time - self.input_ack_last_time > SENDING_TIMEOUT:
+            #--- no responding activity at all - TIMEOUT
+                if _Debug:
+                    lg.out(self.debug_level, 'TIMEOUT SENDING %d, %r last ack:%r, reltime:%r' % (
+                        self.stream_id, self.cwnd, round(self.input_ack_last_time, 4), relative_time))
+                reactor.callLater(0, self.automat, 'timeout')
+                return
+        self._detect_losses(relative_time)
+        window = self.cwnd.size()
+        pacing_interval = self.cwnd.pacing_interval()
+        wait = None
+        while self.output_in_flight < window:
+            if self.output_lost:
+                queue = self.output_lost
+            elif self.output_unsent:
+                queue = self.output_unsent
+            else:
+                break
+            block_id = queue[0]
+            outblock = self.output_blocks.get(block_id)
+            if outblock is None or outblock[1] >= 0:
+            #--- acked or resent already
+                queue.popleft()
+                continue
+            if self.output_next_send_time > relative_time + udp_congestion.PACING_QUANTUM:
+            #--- pacing, wait a bit
+                wait = self.output_next_send_time - relative_time
+                self._add_iteration_result('pacing')
+                break
+            limit_delay = take_output_budget(len(outblock[0]) + HEADER_SIZE)
+            if limit_delay > 0:
+            #--- global bandwidth limit reached
+                self.output_limit_iteration_last_time = relative_time
+                wait = limit_delay
+                self._add_iteration_result('limit')
+                break
+            if not self._send_block(block_id, relative_time):
+                self._add_iteration_result('limit4')
+                wait = POOLING_INTERVAL
+                break
+            queue.popleft()
+            self.output_next_send_time = max(self.output_next_send_time, relative_time) + pacing_interval
+        self._probe_mtu()
+        if wait is None and self.output_sent_order:
+            #--- check for losses later
+            wait = self.output_sent_order[0][0] + self.cwnd.rto - relative_time
+        if wait is not None:
+            self._schedule_output_timer(max(wait, udp_congestion.PACING_QUANTUM))
+        if relative_time > 0:
+            #--- recalculate current sending speed
+            self.output_bytes_per_sec_current = self.output_bytes_sent / relative_time
+
+    def _send_block(self, block_id, relative_time):
+        outblock = self.output_blocks[block_id]
+        output = ''.join((struct.pack('i', block_id), outblock[0]))
+        #--- SEND DATA HERE!
+        if not self.producer.do_send_data(self.stream_id, self.consumer, output):
+            return False
+        outblock[1] = relative_time
+        outblock[2] = 0
+        outblock[3] += 1
+        self.output_in_flight += 1
+        self.output_sent_order.append((relative_time, block_id, ))
+        self.output_bytes_sent += len(outblock[0])
+        self.output_bytes_sent_period += len(outblock[0])
+        self.output_blocks_counter += 1
+        self.output_block_last_time = relative_time
+        if _Debug:
+            lg.out(self.debug_level + 8, '<-out BLOCK %d %r %r %d/%d window:%d' % (
+                self.stream_id, self.eof, block_id,
+                self.output_bytes_sent, self.output_bytes_acked, self.cwnd.size()))
+        return True
+
+    def _probe_mtu(self):
+        if self.eof or self.input_acks_counter < PROBE_AFTER_ACKS:
+            return
+        now = time.time()
+        mtu = self.producer.session.mtu
+        mtu.check_timeout(now, self.cwnd.rtt())
+        probe_size = mtu.start(now)
+        if not probe_size:
+            return
+        if _Debug:
+            lg.out(self.debug_level, 'udp_stream[%d] send MTU probe of %d bytes' % (self.stream_id, probe_size))
+        output = struct.pack('i', BLOCK_ID_PROBE) + '\x00' * (probe_size - HEADER_SIZE)
+        self.producer.do_send_data(self.stream_id, self.consumer, output)
+
     def _rtt_current(self):
         rtt_current = self.output_rtt_avarage / self.output_rtt_counter
         return rtt_current